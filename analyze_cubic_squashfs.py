@@ -11,6 +11,9 @@ import shutil
 from pathlib import Path
 import hashlib
 
+from squashfs_space_analyzer import analyze, print_comparison
+from parallel_unsquashfs import extract_images
+
 def run_cmd(cmd, description):
     print(f"🔧 {description}...")
     result = subprocess.run(cmd, capture_output=True, text=True, shell=True)
@@ -19,15 +22,38 @@ def run_cmd(cmd, description):
         return False
     return True
 
-def get_dir_info(path):
-    """Get directory size and file count"""
-    result = subprocess.run(['du', '-sb', str(path)], capture_output=True, text=True)
-    size = int(result.stdout.split()[0]) if result.returncode == 0 else 0
-    
-    result = subprocess.run(['find', str(path), '-type', 'f'], capture_output=True, text=True)
-    file_count = len(result.stdout.strip().split('\n')) if result.stdout.strip() else 0
-    
-    return size, file_count
+def walk_tree(path):
+    """One scandir pass: (apparent size like du -sb, set of relative file paths)"""
+    size = os.lstat(path).st_size
+    files = set()
+    seen_inodes = set()
+    stack = [(str(path), "")]
+    while stack:
+        directory, rel_dir = stack.pop()
+        with os.scandir(directory) as scan:
+            for item in scan:
+                st = item.stat(follow_symlinks=False)
+                rel_path = f"{rel_dir}/{item.name}" if rel_dir else item.name
+                # du counts hard-linked files once
+                if (st.st_dev, st.st_ino) not in seen_inodes:
+                    seen_inodes.add((st.st_dev, st.st_ino))
+                    size += st.st_size
+                if item.is_dir(follow_symlinks=False):
+                    stack.append((item.path, rel_path))
+                elif item.is_file(follow_symlinks=False):
+                    files.add(rel_path)
+    return size, files
+
+def write_set_diff(base, other, output):
+    """diff-style listing of two sets ('<' only in base, '>' only in other)"""
+    lines = [f"< {item}" for item in sorted(base - other)] + [f"> {item}" for item in sorted(other - base)]
+    Path(output).write_text("".join(f"{line}\n" for line in lines))
+    return lines
+
+def read_packages(status_file):
+    """Package names from a dpkg status file"""
+    return {line.split(":", 1)[1].strip() for line in status_file.read_text(errors="replace").splitlines()
+            if line.startswith("Package:")}
 
 def main():
     print("🔍 CUBIC SQUASHFS CONTENT ANALYZER")
@@ -88,22 +114,23 @@ def main():
     print(f"   Cubic:  {cubic_size:,} bytes")
     print(f"   Diff:   {cubic_size - ubuntu_size:,} bytes ({((cubic_size/ubuntu_size)-1)*100:.1f}% larger)")
     
+    # Per-directory/type breakdown straight from the image tables (cached by image hash)
+    print("\n🔬 SPACE BREAKDOWN (no extraction)...")
+    print_comparison(analyze(ubuntu_squashfs), analyze(cubic_squashfs), top=15)
+    
     # Extract both squashfs filesystems
     print("\n🗂️ EXTRACTING SQUASHFS CONTENTS...")
-    ubuntu_squashfs_extract.mkdir()
-    cubic_squashfs_extract.mkdir()
-    
-    if not run_cmd(f"sudo unsquashfs -f -d {ubuntu_squashfs_extract} {ubuntu_squashfs}", "Ubuntu squashfs"):
-        return
-        
-    if not run_cmd(f"sudo unsquashfs -f -d {cubic_squashfs_extract} {cubic_squashfs}", "Cubic squashfs"):
+    # Both images at once, each split into subtree shards, under one CPU/IO budget
+    if not extract_images([(ubuntu_squashfs, ubuntu_squashfs_extract),
+                           (cubic_squashfs, cubic_squashfs_extract)], sudo=True):
         return
     
     # Analyze extracted content
     print("\n📈 CONTENT ANALYSIS:")
     
-    ubuntu_content_size, ubuntu_files = get_dir_info(ubuntu_squashfs_extract)
-    cubic_content_size, cubic_files = get_dir_info(cubic_squashfs_extract)
+    ubuntu_content_size, ubuntu_file_set = walk_tree(ubuntu_squashfs_extract)
+    cubic_content_size, cubic_file_set = walk_tree(cubic_squashfs_extract)
+    ubuntu_files, cubic_files = len(ubuntu_file_set), len(cubic_file_set)
     
     print(f"   Ubuntu content: {ubuntu_content_size:,} bytes, {ubuntu_files:,} files")
     print(f"   Cubic content:  {cubic_content_size:,} bytes, {cubic_files:,} files")
@@ -112,21 +139,15 @@ def main():
     # Find differences in directory structure
     print("\n🔍 FINDING CONTENT DIFFERENCES...")
     
-    # Get file lists
-    run_cmd(f"find {ubuntu_squashfs_extract} -type f | sort > ubuntu_files.txt", "Ubuntu file list")
-    run_cmd(f"find {cubic_squashfs_extract} -type f | sort > cubic_files.txt", "Cubic file list")
+    Path("ubuntu_files.txt").write_text("".join(f"{path}\n" for path in sorted(ubuntu_file_set)))
+    Path("cubic_files.txt").write_text("".join(f"{path}\n" for path in sorted(cubic_file_set)))
+    differences = write_set_diff(ubuntu_file_set, cubic_file_set, "file_differences.txt")
     
-    # Compare file lists
-    run_cmd("diff ubuntu_files.txt cubic_files.txt > file_differences.txt", "File differences")
-    
-    # Check for added/removed files
-    result = subprocess.run(['wc', '-l', 'file_differences.txt'], capture_output=True, text=True)
-    diff_lines = int(result.stdout.split()[0]) if result.returncode == 0 else 0
-    
-    if diff_lines > 0:
-        print(f"✅ Found {diff_lines} file differences")
+    if differences:
+        print(f"✅ Found {len(differences)} file differences")
         print("📄 Showing first 20 differences:")
-        subprocess.run(['head', '-20', 'file_differences.txt'])
+        for line in differences[:20]:
+            print(line)
     else:
         print("⚠️ No file differences found")
     
@@ -137,17 +158,14 @@ def main():
     cubic_packages = cubic_squashfs_extract / "var/lib/dpkg/status"
     
     if ubuntu_packages.exists() and cubic_packages.exists():
-        run_cmd(f"grep '^Package:' {ubuntu_packages} | sort > ubuntu_packages.txt", "Ubuntu packages")
-        run_cmd(f"grep '^Package:' {cubic_packages} | sort > cubic_packages.txt", "Cubic packages")
-        run_cmd("diff ubuntu_packages.txt cubic_packages.txt > package_differences.txt", "Package differences")
-        
-        result = subprocess.run(['wc', '-l', 'package_differences.txt'], capture_output=True, text=True)
-        pkg_diff_lines = int(result.stdout.split()[0]) if result.returncode == 0 else 0
+        package_differences = write_set_diff(read_packages(ubuntu_packages), read_packages(cubic_packages),
+                                             "package_differences.txt")
         
-        if pkg_diff_lines > 0:
-            print(f"✅ Found {pkg_diff_lines} package differences")
+        if package_differences:
+            print(f"✅ Found {len(package_differences)} package differences")
             print("📦 Showing package differences:")
-            subprocess.run(['head', '-20', 'package_differences.txt'])
+            for line in package_differences[:20]:
+                print(line)
         else:
             print("⚠️ No package differences found")
     
@@ -26,6 +26,13 @@ import signal
 import atexit
 from pathlib import Path
 
+# Shared build tools live in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from boot_config import AddArgs, BootConfigSet
+from build_recipe import BuildRecipe
+
+AUTOINSTALL_ARGS = ["autoinstall", "ds=nocloud-net\\;s=cd:/"]
+
 # Moved sudo check to after header display
 
 def install_python_dependencies():
@@ -275,52 +282,15 @@ class ISOBuilder:
         shutil.copy("autoinstall.yaml", yaml_dest)
         print("✅ Added autoinstall.yaml to ISO")
         
-        # Modify grub.cfg to enable autoinstall
-        grub_cfg = os.path.join(extract_dir, "boot", "grub", "grub.cfg")
-        
-        if os.path.exists(grub_cfg):
-            print("🔧 Modifying GRUB configuration...")
-            
-            with open(grub_cfg, 'r') as f:
-                content = f.read()
-            
-            # Add autoinstall to kernel parameters (try multiple patterns)
-            original_content = content
-            
-            # Pattern 1: Standard casper boot
-            content = content.replace(
-                'linux /casper/vmlinuz',
-                'linux /casper/vmlinuz autoinstall ds=nocloud-net\\;s=cd:/'
-            )
-            
-            # Pattern 2: Alternative patterns
-            if content == original_content:
-                content = content.replace(
-                    'linux\t/casper/vmlinuz',
-                    'linux\t/casper/vmlinuz autoinstall ds=nocloud-net\\;s=cd:/'
-                )
-            
-            # Pattern 3: Any vmlinuz reference
-            if content == original_content:
-                import re
-                content = re.sub(
-                    r'(linux\s+/casper/vmlinuz\S*)',
-                    r'\1 autoinstall ds=nocloud-net\;s=cd:/',
-                    content
-                )
-            
-            with open(grub_cfg, 'w') as f:
-                f.write(content)
-            
-            if content != original_content:
-                print("✅ Modified GRUB configuration")
-            else:
-                print("⚠️ GRUB configuration unchanged - pattern not found")
-                # Debug: show what patterns exist
-                if 'vmlinuz' in original_content:
-                    print("🔍 Found vmlinuz references in GRUB config")
-                else:
-                    print("🔍 No vmlinuz references found in GRUB config")
+        # Add autoinstall to the kernel command line of every boot menu entry
+        # (grub.cfg, loopback.cfg, isolinux); entries that have it are left alone
+        print("🔧 Modifying boot configuration...")
+        configs = BootConfigSet(extract_dir)
+        if not any(entry.kernel and "vmlinuz" in entry.kernel for _path, entry in configs.entries()):
+            print("❌ No boot menu entry with a casper kernel found")
+            return False
+        if not configs.write([AddArgs(AUTOINSTALL_ARGS)]):
+            print("✅ Boot configuration already has autoinstall arguments")
         
         return True
     
@@ -433,63 +403,9 @@ class ISOBuilder:
         try:
             if self.is_windows:
                 if "xorriso" in tool:
-                    cmd = [
-                        "xorriso.exe",
-                        "-as", "mkisofs",
-                        "-r", "-V", "Ubuntu 24.04.2 INSTYAML",
-                        "-J", "-joliet-long",
-                        "-cache-inodes",  # Ubuntu parameter for efficiency
-                        "-b", "boot/grub/i386-pc/eltorito.img",
-                        "-c", "boot.catalog",  # Boot catalog location (Ubuntu 24.04.2)
-                        "-no-emul-boot",
-                        "-boot-load-size", "4",
-                        "-boot-info-table"
-                    ]
-                    
-                    # Ubuntu 24.04.2 EFI Boot Fix - Enhanced GPT Parameters (Windows)
-                    # Based on research: Ubuntu uses both MBR and GPT (hybrid) for maximum compatibility  
-                    if has_efi_support:
-                        # Choose EFI boot method based on what Ubuntu provides
-                        efi_img_path = os.path.join(extract_dir, "boot", "grub", "efi.img")
-                        bootx64_path = os.path.join(extract_dir, "EFI", "boot", "bootx64.efi")
-                        
-                        if os.path.exists(efi_img_path):
-                            # Method 1: Use Ubuntu's efi.img (preferred - exact Ubuntu method)
-                            print("🔧 Using Ubuntu's efi.img for EFI boot")
-                            cmd.extend([
-                                "-eltorito-alt-boot",
-                                "-e", "boot/grub/efi.img",
-                                "-no-emul-boot"
-                            ])
-                        else:
-                            # Method 2: Use direct bootx64.efi (fallback)
-                            print("🔧 Using direct bootx64.efi for EFI boot")
-                            cmd.extend([
-                                "-eltorito-alt-boot",
-                                "-e", "EFI/boot/bootx64.efi",
-                                "-no-emul-boot"
-                            ])
-                        
-                        # Add GPT partition table support (critical for UEFI)
-                        cmd.extend([
-                            "-isohybrid-gpt-basdat",        # Create GPT partition table
-                            "-partition_offset", "16"       # Ubuntu partition parameters
-                        ])
-                        
-                        # Add EFI system partition (Type 0xEF) - Critical for UEFI firmware recognition
-                        if os.path.exists(bootx64_path):
-                            # Use full path for append_partition
-                            cmd.extend([
-                                "-append_partition", "2", "0xef", bootx64_path
-                            ])
-                            print("🔧 Added EFI system partition for UEFI recognition")
-                        
-                    
-                    # Add output file and source directory
-                    cmd.extend([
-                        "-o", self.output_iso,
-                        extract_dir
-                    ])
+                    cmd = BuildRecipe(self.iso_filename, self.output_iso, source_dir=extract_dir,
+                                      volume_id="Ubuntu 24.04.2 INSTYAML", xorriso="xorriso.exe",
+                                      esp_image=os.path.join(os.path.dirname(extract_dir), "esp.img")).compile()
                 elif "oscdimg" in tool:
                     cmd = [
                         "oscdimg.exe",
@@ -501,93 +417,9 @@ class ISOBuilder:
             else:
                 # Linux - use xorriso in mkisofs compatibility mode (Ubuntu-compatible)
                 if "xorriso" in tool:
-                    cmd = [
-                        tool, "-as", "mkisofs",
-                        "-r", "-V", "Ubuntu 24.04.2 INSTYAML",
-                        "-J", "-joliet-long",
-                        "-cache-inodes",  # Ubuntu parameter for efficiency
-                        "-b", "boot/grub/i386-pc/eltorito.img",
-                        "-c", "boot.catalog",  # Boot catalog location (Ubuntu 24.04.2)
-                        "-no-emul-boot",
-                        "-boot-load-size", "4",
-                        "-boot-info-table"
-                    ]
-                    
-                    # Ubuntu 24.04.2 EFI Boot Fix - Enhanced GPT Parameters
-                    # Based on research: Ubuntu uses both MBR and GPT (hybrid) for maximum compatibility
-                    if has_efi_support:
-                        # First check if we can find Ubuntu's boot structure
-                        efi_img_path = os.path.join(extract_dir, "boot", "grub", "efi.img")
-                        bootx64_path = os.path.join(extract_dir, "EFI", "boot", "bootx64.efi")
-                        isohdpfx_paths = [
-                            "/usr/lib/ISOLINUX/isohdpfx.bin",
-                            "/usr/share/syslinux/isohdpfx.bin",
-                            "/usr/lib/syslinux/isohdpfx.bin"
-                        ]
-                        
-                        # Find the correct hybrid MBR path
-                        isohdpfx_bin = None
-                        for path in isohdpfx_paths:
-                            if os.path.exists(path):
-                                isohdpfx_bin = path
-                                break
-                        
-                        # Choose EFI boot method based on what Ubuntu provides
-                        if os.path.exists(efi_img_path):
-                            # Method 1: Use Ubuntu's efi.img (preferred - exact Ubuntu method)
-                            print("🔧 Using Ubuntu's efi.img for EFI boot")
-                            cmd.extend([
-                                "-eltorito-alt-boot",
-                                "-e", "boot/grub/efi.img",
-                                "-no-emul-boot"
-                            ])
-                        else:
-                            # Method 2: Use direct bootx64.efi (fallback)
-                            print("🔧 Using direct bootx64.efi for EFI boot")
-                            cmd.extend([
-                                "-eltorito-alt-boot",
-                                "-e", "EFI/boot/bootx64.efi", 
-                                "-no-emul-boot"
-                            ])
-                        
-                        # Add GPT partition table support (critical for UEFI)
-                        cmd.extend([
-                            "-isohybrid-gpt-basdat"  # Create GPT partition table
-                        ])
-                        
-                        # Add hybrid MBR if available (for legacy compatibility)
-                        if isohdpfx_bin:
-                            print(f"🔧 Adding hybrid MBR: {isohdpfx_bin}")
-                            cmd.extend([
-                                "-isohybrid-mbr", isohdpfx_bin
-                            ])
-                        else:
-                            print("⚠️ Warning: isohdpfx.bin not found - skipping hybrid MBR")
-                            print("💡 For optimal compatibility: sudo apt install syslinux-common")
-                        
-                        # Add Ubuntu-compatible partition parameters for hybrid boot
-                        # Note: xorriso limits partition_hd_cyl to 255 max
-                        cmd.extend([
-                            "-partition_offset", "16",
-                            "-partition_hd_cyl", "255",     # Max allowed by xorriso
-                            "-partition_sec_hd", "32",
-                            "-partition_cyl_align", "off"
-                        ])
-                        
-                        # Add EFI system partition (Type 0xEF) - Critical for UEFI firmware recognition
-                        if os.path.exists(bootx64_path):
-                            # Use full path for append_partition
-                            cmd.extend([
-                                "-append_partition", "2", "0xef", bootx64_path
-                            ])
-                            print("🔧 Added EFI system partition for UEFI recognition")
-                        
-                    
-                    # Add output file and source directory
-                    cmd.extend([
-                        "-o", self.output_iso, 
-                        extract_dir
-                    ])
+                    cmd = BuildRecipe(self.iso_filename, self.output_iso, source_dir=extract_dir,
+                                      volume_id="Ubuntu 24.04.2 INSTYAML", xorriso=tool,
+                                      esp_image=os.path.join(os.path.dirname(extract_dir), "esp.img")).compile()
                     
                 else:
                     # genisoimage or mkisofs (fallback - limited EFI support)
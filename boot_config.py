@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+BOOT CONFIG v1.0
+Structured model of GRUB and isolinux/syslinux boot menus.
+
+grub.cfg / loopback.cfg are parsed into menu entries (and submenus) whose
+linux/initrd lines are split into kernel path, command line arguments and
+initrd paths; isolinux configs map LABEL blocks onto the same interface
+(KERNEL path, APPEND arguments, initrd= argument).  Every line that is not
+changed renders back byte for byte.
+
+Edits are batch transforms (add/remove arguments, retarget kernel and
+initrd, add/remove entries) applied to a copy of the parsed base, which is
+cached, so producing many variants parses each config only once.
+"""
+
+import re
+import sys
+import copy
+import functools
+from pathlib import Path
+
+from boot_config_rewriter import discover_configs, index_from_md5sums
+
+VERSION = "1.0"
+
+GRUB_KERNEL = ("linux", "linuxefi", "linux16")
+GRUB_INITRD = ("initrd", "initrdefi", "initrd16")
+LINE_PATTERN = re.compile(r"^(\s*)(\S+)(\s*)(.*?)(\s*)$")
+TITLE_PATTERN = re.compile(r"""^\s*(?:menuentry|submenu)\s+(?:(['"])(.*?)\1|(\S+))""")
+# isolinux directives that end the current LABEL block
+ISOLINUX_GLOBAL = ("default", "timeout", "prompt", "ui", "include", "say", "display", "implicit", "ontimeout")
+# Arguments after this go to the installed system's command line too
+ARG_SEPARATOR = "---"
+
+
+class Directive:
+    """One `command value...` line; renders unchanged unless edited"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        match = LINE_PATTERN.match(raw)
+        self.indent, self.command, self.gap, rest, _trailing = match.groups()
+        self.values = rest.split()
+        self.dirty = False
+
+    def set(self, values):
+        if values != self.values:
+            self.values = list(values)
+            self.dirty = True
+
+    def render(self):
+        if not self.dirty:
+            return self.raw
+        return f"{self.indent}{self.command}{self.gap or ' '}{' '.join(self.values)}".rstrip()
+
+
+class MenuEntry:
+    """A GRUB menuentry or an isolinux LABEL with uniform kernel/args/initrd access"""
+
+    def __init__(self, kind, header, title, lines=None, footer=None):
+        self.kind = kind
+        self.header = header
+        self.title = title
+        self.lines = lines or []
+        self.footer = footer
+
+    def _find(self, commands):
+        return next((line for line in self.lines if isinstance(line, Directive)
+                     and line.command.lower() in commands), None)
+
+    def _kernel_line(self):
+        return self._find(GRUB_KERNEL if self.kind == "grub" else ("kernel", "linux"))
+
+    def _append_line(self, create=False):
+        line = self._find(("append",))
+        if line is None and create:
+            indent = self._kernel_line().indent if self._kernel_line() else "  "
+            line = Directive(f"{indent}append ")
+            self.lines.append(line)
+        return line
+
+    @property
+    def kernel(self):
+        line = self._kernel_line()
+        return line.values[0] if line and line.values else None
+
+    @kernel.setter
+    def kernel(self, path):
+        line = self._kernel_line()
+        line.set([path] + line.values[1:])
+
+    @property
+    def args(self):
+        if self.kind == "grub":
+            line = self._kernel_line()
+            return line.values[1:] if line else []
+        line = self._append_line()
+        return [arg for arg in line.values if not arg.startswith("initrd=")] if line else []
+
+    @args.setter
+    def args(self, args):
+        if self.kind == "grub":
+            line = self._kernel_line()
+            line.set(line.values[:1] + list(args))
+        else:
+            initrd = [f"initrd={','.join(self.initrds)}"] if self.initrds else []
+            self._append_line(create=True).set(initrd + list(args))
+
+    @property
+    def initrds(self):
+        if self.kind == "grub":
+            line = self._find(GRUB_INITRD)
+            return line.values if line else []
+        append = self._append_line()
+        for arg in append.values if append else []:
+            if arg.startswith("initrd="):
+                return arg[len("initrd="):].split(",")
+        line = self._find(("initrd",))
+        return line.values if line else []
+
+    @initrds.setter
+    def initrds(self, paths):
+        if self.kind == "grub" or self._find(("initrd",)):
+            self._find(GRUB_INITRD if self.kind == "grub" else ("initrd",)).set(paths)
+        else:
+            self._append_line(create=True).set([f"initrd={','.join(paths)}"] + self.args)
+
+    def retitle(self, title):
+        if self.kind == "grub":
+            self.header = re.sub(r"""(['"]).*?\1""", lambda m: f"{m.group(1)}{title}{m.group(1)}",
+                                 self.header, count=1)
+        else:
+            # LABEL names must stay unique; the menu shows MENU LABEL
+            slug = re.sub(r"\W+", "-", title).strip("-").lower()
+            self.header = re.sub(r"(?i)^(\s*label\s+).*", lambda m: m.group(1) + slug, self.header)
+            label = self._find(("menu",))
+            if label is not None and label.values[:1] == ["label"]:
+                label.set(["label", title])
+        self.title = title
+
+    def render(self):
+        lines = [self.header] + [line.render() if isinstance(line, Directive) else line for line in self.lines]
+        return lines + ([self.footer] if self.footer is not None else [])
+
+
+class Submenu:
+    """A GRUB submenu: header, nested items, closing brace"""
+
+    def __init__(self, header, title, items, footer):
+        self.header = header
+        self.title = title
+        self.items = items
+        self.footer = footer
+
+    def render(self):
+        return [self.header] + _render_items(self.items) + [self.footer]
+
+
+def _render_items(items):
+    lines = []
+    for item in items:
+        lines.extend(item.render() if isinstance(item, (MenuEntry, Submenu)) else [item])
+    return lines
+
+
+def _title(header):
+    match = TITLE_PATTERN.match(header)
+    return (match.group(2) if match.group(2) is not None else match.group(3)) if match else ""
+
+
+def _parse_grub(lines, index=0, nested=False):
+    """(items, next index) for GRUB lines; stops at the closing brace when nested"""
+    items = []
+    while index < len(lines):
+        line = lines[index]
+        stripped = line.strip()
+        if nested and stripped == "}":
+            return items, index
+        if stripped.startswith(("menuentry ", "menuentry\t")) and stripped.endswith("{"):
+            body, depth = [], 1
+            index += 1
+            while index < len(lines):
+                inner = lines[index].strip()
+                depth += inner.endswith("{") - (inner == "}")
+                if depth == 0:
+                    break
+                command = inner.split(None, 1)[0] if inner else ""
+                body.append(Directive(lines[index]) if command in GRUB_KERNEL + GRUB_INITRD else lines[index])
+                index += 1
+            footer = lines[index] if index < len(lines) else None
+            items.append(MenuEntry("grub", line, _title(line), body, footer))
+        elif stripped.startswith("submenu") and stripped.endswith("{"):
+            children, index = _parse_grub(lines, index + 1, nested=True)
+            items.append(Submenu(line, _title(line), children, lines[index] if index < len(lines) else "}"))
+        else:
+            items.append(line)
+        index += 1
+    return items, index
+
+
+def _parse_isolinux(lines):
+    items, entry = [], None
+    for line in lines:
+        words = line.split()
+        command = words[0].lower() if words else ""
+        if command == "label":
+            entry = MenuEntry("isolinux", line, " ".join(words[1:]))
+            items.append(entry)
+            continue
+        if command in ISOLINUX_GLOBAL:
+            entry = None
+        if entry is None:
+            items.append(line)
+        elif command in ("kernel", "linux", "append", "initrd", "menu"):
+            entry.lines.append(Directive(line))
+        else:
+            entry.lines.append(line)
+    for item in items:
+        if isinstance(item, MenuEntry):
+            # Titles are what the menu shows: MENU LABEL without its hotkey marker
+            label = item._find(("menu",))
+            if label is not None and label.values[:1] == ["label"]:
+                item.title = " ".join(label.values[1:]).replace("^", "")
+    return items
+
+
+class BootConfig:
+    """Parsed menu file: items are raw lines, MenuEntry or Submenu"""
+
+    def __init__(self, kind, items, trailing_newline=True):
+        self.kind = kind
+        self.items = items
+        self.trailing_newline = trailing_newline
+
+    @classmethod
+    def parse(cls, text, kind=None):
+        lines = text.splitlines()
+        if kind is None:
+            isolinux = re.search(r"(?mi)^\s*label\s", text) and not re.search(r"(?m)^\s*menuentry\s", text)
+            kind = "isolinux" if isolinux else "grub"
+        items = _parse_grub(lines)[0] if kind == "grub" else _parse_isolinux(lines)
+        return cls(kind, items, text.endswith("\n"))
+
+    def entries(self, items=None):
+        """All menu entries, submenus included, in file order"""
+        for item in self.items if items is None else items:
+            if isinstance(item, MenuEntry):
+                yield item
+            elif isinstance(item, Submenu):
+                yield from self.entries(item.items)
+
+    def containers(self, items=None):
+        """(list, index) of every entry, for insertion and removal"""
+        items = self.items if items is None else items
+        for index, item in enumerate(items):
+            if isinstance(item, MenuEntry):
+                yield items, index
+            elif isinstance(item, Submenu):
+                yield from self.containers(item.items)
+
+    def render(self):
+        return "\n".join(_render_items(self.items)) + ("\n" if self.trailing_newline else "")
+
+
+def _matches(entry, titles):
+    return titles is None or re.search(titles, entry.title) is not None
+
+
+def _linux_entries(config, titles, kernels):
+    """Entries booting a kernel whose path matches `kernels` (memtest etc. are skipped)"""
+    return [entry for entry in config.entries() if entry.kernel is not None
+            and re.search(kernels, entry.kernel) and _matches(entry, titles)]
+
+
+class AddArgs:
+    """Add kernel arguments (before `---`), replacing same-named key=value ones"""
+
+    def __init__(self, args, titles=None, kernels="vmlinuz"):
+        self.args = args.split() if isinstance(args, str) else list(args)
+        self.titles = titles
+        self.kernels = kernels
+
+    def apply(self, config):
+        changed = 0
+        for entry in _linux_entries(config, self.titles, self.kernels):
+            args = list(entry.args)
+            for arg in self.args:
+                key = arg.split("=", 1)[0]
+                args = [a for a in args if a.split("=", 1)[0] != key or a == arg]
+                if arg not in args:
+                    position = args.index(ARG_SEPARATOR) if ARG_SEPARATOR in args else len(args)
+                    args.insert(position, arg)
+            if args != entry.args:
+                entry.args = args
+                changed += 1
+        return changed
+
+
+class RemoveArgs:
+    """Drop kernel arguments by name (`quiet`, `splash`, `ds`...)"""
+
+    def __init__(self, names, titles=None, kernels="vmlinuz"):
+        self.names = set(names.split() if isinstance(names, str) else names)
+        self.titles = titles
+        self.kernels = kernels
+
+    def apply(self, config):
+        changed = 0
+        for entry in _linux_entries(config, self.titles, self.kernels):
+            args = [arg for arg in entry.args if arg.split("=", 1)[0] not in self.names]
+            if args != entry.args:
+                entry.args = args
+                changed += 1
+        return changed
+
+
+class RetargetKernel:
+    """Point entries at another kernel/initrd ({old path: new path} maps)"""
+
+    def __init__(self, kernels=None, initrds=None, titles=None):
+        self.kernels = kernels or {}
+        self.initrds = initrds or {}
+        self.titles = titles
+
+    def apply(self, config):
+        changed = 0
+        for entry in config.entries():
+            if entry.kernel is None or not _matches(entry, self.titles):
+                continue
+            before = (entry.kernel, entry.initrds)
+            if entry.kernel in self.kernels:
+                entry.kernel = self.kernels[entry.kernel]
+            if any(path in self.initrds for path in entry.initrds):
+                entry.initrds = [self.initrds.get(path, path) for path in entry.initrds]
+            changed += before != (entry.kernel, entry.initrds)
+        return changed
+
+
+class AddEntry:
+    """Copy the first entry matching `based_on` under a new title, with its own transforms"""
+
+    def __init__(self, title, based_on=None, transforms=(), first=False):
+        self.title = title
+        self.based_on = based_on
+        self.transforms = list(transforms)
+        self.first = first
+
+    def apply(self, config):
+        if any(entry.title == self.title for entry in config.entries()):
+            return 0
+        for container, index in config.containers():
+            template = container[index]
+            if template.kernel is None or not _matches(template, self.based_on):
+                continue
+            entry = copy.deepcopy(template)
+            entry.retitle(self.title)
+            single = BootConfig(config.kind, [entry])
+            for transform in self.transforms:
+                transform.apply(single)
+            container.insert(index if self.first else index + 1, entry)
+            return 1
+        return 0
+
+
+class RemoveEntries:
+    """Remove every entry whose title matches"""
+
+    def __init__(self, titles):
+        self.titles = titles
+
+    def apply(self, config):
+        doomed = [(container, index) for container, index in config.containers()
+                  if _matches(container[index], self.titles)]
+        for container, index in reversed(doomed):
+            del container[index]
+        return len(doomed)
+
+
+class DropDuplicates:
+    """Remove entries that boot exactly what an earlier entry boots (e.g. after a retarget)"""
+
+    def apply(self, config):
+        seen, doomed = set(), []
+        for container, index in config.containers():
+            entry = container[index]
+            if entry.kernel is None:
+                continue
+            key = (entry.kernel, tuple(entry.initrds), tuple(entry.args))
+            if key in seen:
+                doomed.append((container, index))
+            seen.add(key)
+        for container, index in reversed(doomed):
+            del container[index]
+        return len(doomed)
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_file(path, _mtime_ns, _size):
+    return BootConfig.parse(Path(path).read_text(errors="surrogateescape"))
+
+
+def load_config(path):
+    """Parsed config, cached until the file changes; callers get their own copy"""
+    info = Path(path).stat()
+    return copy.deepcopy(_parse_file(str(path), info.st_mtime_ns, info.st_size))
+
+
+class BootConfigSet:
+    """Every boot config of an extracted ISO, parsed once, rendered per variant"""
+
+    def __init__(self, iso_root, log=None):
+        self.iso_root = Path(iso_root)
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.paths = discover_configs(self.iso_root, index_from_md5sums(self.iso_root))
+
+    def entries(self):
+        """(relative path, MenuEntry) across all configs, from the cached parse"""
+        for path in self.paths:
+            for entry in load_config(path).entries():
+                yield str(path.relative_to(self.iso_root)), entry
+
+    def variant(self, transforms):
+        """({relative path: text}, {relative path: entries changed}) for one transform list"""
+        texts, report = {}, {}
+        for path in self.paths:
+            config = load_config(path)
+            if not any(True for _ in config.entries()):
+                continue
+            changed = sum(transform.apply(config) for transform in transforms)
+            relative = str(path.relative_to(self.iso_root))
+            texts[relative] = config.render()
+            if changed:
+                report[relative] = changed
+        return texts, report
+
+    def write(self, transforms, dest_root=None):
+        """Apply to the tree (or a copy at `dest_root`); writes changed files only"""
+        dest_root = Path(dest_root) if dest_root else self.iso_root
+        texts, report = self.variant(transforms)
+        for relative in report:
+            target = dest_root / relative
+            if not target.exists() or target.read_text(errors="surrogateescape") != texts[relative]:
+                target.write_text(texts[relative], errors="surrogateescape")
+            self.log(f"Updated {relative}: {report[relative]} entry changes", "✅")
+        return report
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: boot_config.py <grub.cfg|isolinux.cfg>            (show parsed entries)")
+        print("       boot_config.py <cfg> --add-args='autoinstall ...' [--remove-args='quiet splash'] [--render]")
+        return 1
+    config = load_config(sys.argv[1])
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    transforms = []
+    if "add-args" in options:
+        transforms.append(AddArgs(options["add-args"]))
+    if "remove-args" in options:
+        transforms.append(RemoveArgs(options["remove-args"]))
+    for transform in transforms:
+        transform.apply(config)
+    if "--render" in sys.argv:
+        print(config.render(), end="")
+        return 0
+    for entry in config.entries():
+        print(f"📋 {entry.title}")
+        print(f"   kernel: {entry.kernel}  initrd: {' '.join(entry.initrds)}")
+        print(f"   args:   {' '.join(entry.args)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
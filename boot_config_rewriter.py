@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+BOOT CONFIG REWRITER v1.0
+Applies literal substitutions to an extracted ISO's boot configs in one pass.
+
+Boot configs are found from the known boot layout (boot/grub, EFI/*,
+isolinux/syslinux, loopback.cfg) or from an index such as md5sum.txt, never
+by walking pool/.  All substitutions are compiled into a single regex, so
+each file is scanned once; per-file, per-rule match counts are reported and
+only files whose text changed are written.
+
+A rule whose text ends in a path or word character only matches when the
+next character does not continue the path, so `/casper/initrd` does not
+match inside `/casper/initrd.gz` and rewriting is idempotent.
+"""
+
+import re
+import sys
+from pathlib import Path
+
+VERSION = "1.0"
+
+BOOT_LAYOUT = [
+    "boot/grub/*.cfg",
+    "boot/grub/*/*.cfg",
+    "EFI/*/*.cfg",
+    "EFI/*/*/*.cfg",
+    "isolinux/*.cfg",
+    "syslinux/*.cfg",
+]
+# Index entries under these never hold boot configs
+SKIP_PREFIXES = ("pool/", "dists/", "casper/")
+
+# What cubic_replica_cli_FINAL does to every config: one kernel, initrd.gz
+CASPER_REDIRECTS = [
+    ("initrd  /casper/initrd", "initrd  /casper/initrd.gz"),
+    ("initrd=/casper/initrd", "initrd=/casper/initrd.gz"),
+    ("/casper/initrd ", "/casper/initrd.gz "),
+    ("linux   /casper/hwe-vmlinuz", "linux   /casper/vmlinuz"),
+    ("linux=/casper/hwe-vmlinuz", "linux=/casper/vmlinuz"),
+    ("initrd  /casper/hwe-initrd", "initrd  /casper/initrd.gz"),
+    ("initrd=/casper/hwe-initrd", "initrd=/casper/initrd.gz"),
+]
+
+
+def index_from_md5sums(iso_root):
+    """Relative paths listed in an extracted ISO's md5sum.txt ([] when missing)"""
+    md5sums = Path(iso_root) / "md5sum.txt"
+    if not md5sums.exists():
+        return []
+    paths = []
+    for line in md5sums.read_text(errors="replace").splitlines():
+        parts = line.split(None, 1)
+        if len(parts) == 2:
+            path = parts[1].strip()
+            paths.append(path[2:] if path.startswith("./") else path)
+    return paths
+
+
+def discover_configs(iso_root, index=None):
+    """Boot config paths under `iso_root`, from `index` entries or the boot layout"""
+    iso_root = Path(iso_root)
+    if index:
+        found = {iso_root / path for path in index
+                 if path.endswith(".cfg") and not path.startswith(SKIP_PREFIXES)}
+    else:
+        found = {path for pattern in BOOT_LAYOUT for path in iso_root.glob(pattern)}
+    # The two GRUB entry points are always checked, whatever the index says
+    found |= {iso_root / "boot/grub/grub.cfg", iso_root / "boot/grub/loopback.cfg"}
+    return sorted(path for path in found if path.is_file())
+
+
+class BootConfigRewriter:
+    """All (old, new) literal substitutions as one compiled pattern"""
+
+    def __init__(self, rules):
+        self.rules = dict(rules)
+        alternatives = []
+        # Longest first, so a rule never loses to one of its own prefixes
+        for old in sorted(self.rules, key=len, reverse=True):
+            boundary = r"(?![\w.\-])" if re.match(r"[\w.\-]", old[-1]) else ""
+            alternatives.append(f"({re.escape(old)}){boundary}")
+        self.pattern = re.compile("|".join(alternatives))
+        self.groups = sorted(self.rules, key=len, reverse=True)
+
+    def apply(self, text):
+        """(new text, {old: count})"""
+        counts = {}
+
+        def replace(match):
+            old = self.groups[match.lastindex - 1]
+            counts[old] = counts.get(old, 0) + 1
+            return self.rules[old]
+
+        return self.pattern.sub(replace, text), counts
+
+    def rewrite(self, paths, dry_run=False):
+        """{path: {old: count}} for files with matches; only changed files are written"""
+        report = {}
+        for path in paths:
+            text = Path(path).read_text(errors="surrogateescape")
+            new_text, counts = self.apply(text)
+            if counts:
+                report[Path(path)] = counts
+            if new_text != text and not dry_run:
+                Path(path).write_text(new_text, errors="surrogateescape")
+        return report
+
+
+def rewrite_boot_configs(iso_root, rules, index=None, dry_run=False, log=None):
+    """Discover and rewrite; logs one line per changed file; returns the report"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    iso_root = Path(iso_root)
+    configs = discover_configs(iso_root, index if index is not None else index_from_md5sums(iso_root))
+    report = BootConfigRewriter(rules).rewrite(configs, dry_run)
+    for path, counts in report.items():
+        details = ", ".join(f"{old.strip()!r}×{count}" for old, count in counts.items())
+        log(f"{'Would update' if dry_run else 'Updated'} {path.relative_to(iso_root)}: {details}", "✅")
+    log(f"{len(report)} of {len(configs)} boot configs matched, "
+        f"{sum(sum(c.values()) for c in report.values())} substitutions", "📊")
+    return report
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: boot_config_rewriter.py <extracted_iso_dir> [--dry-run] [--list]")
+        print("       applies the casper kernel/initrd redirects used by cubic_replica_cli_FINAL.py")
+        return 1
+    if "--list" in sys.argv:
+        root = Path(sys.argv[1])
+        for path in discover_configs(root, index_from_md5sums(root)):
+            print(path.relative_to(root))
+        return 0
+    rewrite_boot_configs(sys.argv[1], CASPER_REDIRECTS, dry_run="--dry-run" in sys.argv)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+BOOT LAYOUT v1.0
+Places boot-critical files contiguously at the front of the ISO, in the
+order the firmware, GRUB and casper read them.
+
+On a USB 2 stick or a virtual CD-ROM every seek between the boot images,
+boot/grub, the kernel, the initrd and the squashfs layers costs visible
+boot time, and xorriso (like the native writer) otherwise places file data
+in path order, with pool/ and friends in between.  A BootLayout is an
+ordered list of path patterns; it turns into
+
+  - a mkisofs -sort weights file for xorriso builds (build_recipe.py),
+  - -sort_weight commands for replay builds (iso_replay.py),
+  - a sort key for the native writer's data order (iso_writer.py),
+
+and report() shows where the boot-critical files ended up in a built ISO.
+compare() builds a recipe with the default and the boot-ordered layout and
+boots both headless (headless_boot.py, optionally throttled like a USB 2
+stick), side by side: time to ready, CD-ROM reads, seeks and seek distance.
+
+A recipe selects it with "layout": "boot" (these defaults) or a list of
+patterns of its own; "default" leaves placement to the writer.
+"""
+
+import sys
+import json
+import shutil
+import fnmatch
+import tempfile
+from pathlib import Path
+
+from headless_boot import HeadlessBoot
+from iso_reader import IsoImage
+
+VERSION = "1.0"
+
+# ISO paths (no leading slash) in read order; within one pattern, fewer dots
+# first, which puts squashfs layers below the layers stacked on them
+BOOT_ORDER = [
+    # Firmware: the El Torito BIOS image, the EFI loaders (shim, then GRUB)
+    "boot/grub/i386-pc/eltorito.img",
+    "boot/grub/eltorito.img",
+    "isolinux/isolinux.bin",
+    "EFI/boot/bootx64.efi",
+    "EFI/boot/mmx64.efi",
+    "EFI/boot/grubx64.efi",
+    # GRUB: finds the medium by .disk/info, then its config, modules and fonts
+    ".disk/info",
+    "boot/grub/grub.cfg",
+    "boot/grub/x86_64-efi/*",
+    "boot/grub/i386-pc/*",
+    "boot/grub/fonts/*",
+    "boot/grub/*",
+    "isolinux/*",
+    # The kernel and initrd of the menu entries, GA then HWE
+    "casper/vmlinuz",
+    "casper/initrd",
+    "casper/initrd.gz",
+    "casper/hwe-vmlinuz",
+    "casper/hwe-initrd",
+    "casper/hwe-initrd.gz",
+    # casper: identifies the medium, then mounts the layers bottom-up
+    ".disk/*",
+    "casper/install-sources.yaml",
+    "casper/*.squashfs",
+]
+LAYOUTS = ("default", "boot")
+# mkisofs/xorriso: heavier files are placed first; unlisted files weigh 0
+MAX_WEIGHT = 1000000
+USB2_THROTTLE = "throttling.bps-total=31457280,throttling.iops-total=300"
+
+
+class BootLayout:
+    """Ordered path patterns -> where file data goes in the image"""
+
+    def __init__(self, patterns=None):
+        self.patterns = [pattern.strip("/") for pattern in (patterns or BOOT_ORDER)]
+
+    @classmethod
+    def from_spec(cls, spec):
+        """A recipe's "layout": "default" (None), "boot", a pattern list or a file of patterns"""
+        if spec in (None, "default"):
+            return None
+        if spec == "boot":
+            return cls()
+        if isinstance(spec, (list, tuple)):
+            return cls(spec)
+        path = Path(spec)
+        if path.exists():
+            return cls([line.strip() for line in path.read_text().splitlines()
+                        if line.strip() and not line.startswith("#")])
+        raise ValueError(f"Unknown layout '{spec}' (known: {', '.join(LAYOUTS)}, a pattern list or file)")
+
+    def rank(self, path):
+        """Index of the first pattern matching `path`, None if it is not boot-critical"""
+        path = str(path).strip("/")
+        return next((index for index, pattern in enumerate(self.patterns) if fnmatch.fnmatchcase(path, pattern)),
+                    None)
+
+    def sort_key(self, path):
+        """Boot-critical files first, in pattern order; everything else after, by path"""
+        path = str(path).strip("/")
+        rank = self.rank(path)
+        if rank is None:
+            return (1, 0, 0, path)
+        return (0, rank, path.rsplit("/", 1)[-1].count("."), path)
+
+    def order(self, paths):
+        """The boot-critical subset of `paths`, in placement order"""
+        return sorted((str(path).strip("/") for path in paths if self.rank(path) is not None), key=self.sort_key)
+
+    def weights(self, paths):
+        """{path: weight} for the boot-critical files; heavier is placed earlier"""
+        return {path: MAX_WEIGHT - index for index, path in enumerate(self.order(paths))}
+
+    def write_sort_file(self, source_dir, path):
+        """mkisofs -sort file ("disk_path weight" per line) for the files under `source_dir`"""
+        source_dir = Path(source_dir)
+        files = [file.relative_to(source_dir).as_posix() for file in source_dir.rglob("*") if file.is_file()]
+        lines = [f"{source_dir / name} {weight}\n" for name, weight in self.weights(files).items()]
+        Path(path).write_text("".join(lines))
+        return Path(path)
+
+    def report(self, iso):
+        """Where the boot-critical files of a built ISO are: extents, span and interleaved bytes"""
+        with IsoImage(iso) as image:
+            files = {entry.path: entry for entry in image.entries() if not entry.is_dir and not entry.is_symlink}
+            volume_bytes = image.volume_blocks * 2048
+        wanted = self.order(files)
+        placed = sorted((files[path] for path in wanted if files[path].size), key=lambda entry: entry.offset)
+        if not placed:
+            return {"files": [], "span": 0, "bytes": 0, "foreign": 0, "in_order": True, "volume_bytes": volume_bytes}
+        start, end = placed[0].offset, max(entry.offset + entry.size for entry in placed)
+        critical = sum(entry.size for entry in placed)
+        # Data of other files lying between boot-critical ones
+        boot_files = set(wanted)
+        foreign = sum(entry.size for entry in files.values()
+                      if entry.size and entry.path not in boot_files and start <= entry.offset < end)
+        return {
+            "files": [(entry.path, entry.offset, entry.size) for entry in placed],
+            "start": start, "span": end - start, "bytes": critical, "foreign": foreign,
+            "in_order": [entry.path for entry in placed] == [path for path in wanted if files[path].size],
+            "volume_bytes": volume_bytes,
+        }
+
+
+def read_stats(reads):
+    """Read count, bytes, seeks (a read not starting where the last one ended) and total seek distance"""
+    seeks = distance = total = 0
+    position = None
+    for offset, length in reads:
+        if position is not None and offset != position:
+            seeks += 1
+            distance += abs(offset - position)
+        position = offset + length
+        total += length
+    return {"reads": len(reads), "bytes": total, "seeks": seeks, "seek_distance": distance}
+
+
+def log_report(report, log):
+    log(f"{len(report['files'])} boot-critical files, {report['bytes']:,} bytes in a {report['span']:,}-byte span "
+        f"from byte {report.get('start', 0):,} ({report['foreign']:,} bytes of other files in between, "
+        f"{'in' if report['in_order'] else 'NOT in'} boot order)", "📐")
+
+
+def compare(recipe, runs=1, boot_mode="kernel", uefi=False, throttle=USB2_THROTTLE, timeout=900, work_dir=None,
+            log=None):
+    """Build `recipe` with the default and the boot layout and boot both; returns {layout: stats}"""
+    log = log or recipe.log
+    if not HeadlessBoot.available():
+        log("qemu-system-x86_64 not found, cannot measure boot time", "❌")
+        return None
+    # A given work_dir keeps both ISOs, the serial logs and layout_compare.json
+    temporary = work_dir is None
+    work_dir = Path(work_dir or tempfile.mkdtemp(prefix="boot_layout_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    layout_spec = recipe.layout if recipe.layout not in (None, "default") else "boot"
+    original = recipe.output, recipe.layout
+    results = {}
+    try:
+        for name, spec in (("default", "default"), ("boot", layout_spec)):
+            recipe.output, recipe.layout = work_dir / f"layout-{name}.iso", spec
+            if not recipe.build():
+                return None
+            if spec != "default":
+                log_report(BootLayout.from_spec(spec).report(recipe.output), log)
+            samples = []
+            for run in range(runs):
+                trace = work_dir / f"layout-{name}-{run}.trace"
+                boot = HeadlessBoot(recipe.output, timeout=timeout, boot_mode=boot_mode, uefi=uefi,
+                                    drive_options=throttle, log=log)
+                result = boot.run(trace_file=str(trace), serial_log=work_dir / f"layout-{name}-{run}.serial")
+                if not result.ready:
+                    log(f"{name} layout did not boot: {result.reason} (serial log: {result.serial_log})", "❌")
+                    return None
+                samples.append({"seconds": result.seconds, **read_stats(result.reads())})
+                trace.unlink(missing_ok=True)
+            results[name] = {key: sorted(sample[key] for sample in samples)[len(samples) // 2]
+                             for key in samples[0]}
+    finally:
+        recipe.output, recipe.layout = original
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    log(f"Boot with the default → boot-ordered layout (median of {runs}, "
+        f"{boot_mode} boot{', UEFI' if uefi else ''}{', USB 2 throttle' if throttle else ''}):", "📊")
+    for key in ("seconds", "reads", "bytes", "seeks", "seek_distance"):
+        a, b = results["default"][key], results["boot"][key]
+        change = f"{(b - a) / a:+.1%}" if a else "n/a"
+        value = (lambda v: f"{v:,.1f}s") if key == "seconds" else (lambda v: f"{v:,}")
+        log(f"{key:<15} {value(a):>16} → {value(b):>16}  ({change})", "📊")
+    if not temporary:
+        (work_dir / "layout_compare.json").write_text(json.dumps(results, indent=1))
+    return results
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: boot_layout.py report <iso> [--layout=boot|FILE]")
+        print("       boot_layout.py sortfile <source_dir> <out.sort> [--layout=boot|FILE]")
+        print("       boot_layout.py compare <recipe.json> [--runs=N] [--iso-boot] [--uefi] [--no-throttle]")
+        print("                              [--timeout=SECONDS] [--keep=DIR]")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    command, args = sys.argv[1], [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    layout = BootLayout.from_spec(options.get("layout", "boot"))
+    log = lambda message, emoji="📝": print(f"{emoji} {message}")
+    if command == "report":
+        report = layout.report(args[0])
+        for path, offset, size in report["files"]:
+            print(f"  {offset:>14,}  {size:>14,}  {path}")
+        log_report(report, log)
+        return 0
+    if command == "sortfile":
+        layout.write_sort_file(args[0], args[1])
+        return 0
+    if command == "compare":
+        from build_recipe import BuildRecipe
+        recipe = BuildRecipe.load(args[0], log=log)
+        results = compare(recipe, runs=int(options.get("runs", 1)),
+                          boot_mode="iso" if "--iso-boot" in sys.argv else "kernel", uefi="--uefi" in sys.argv,
+                          throttle=None if "--no-throttle" in sys.argv else USB2_THROTTLE,
+                          timeout=int(options.get("timeout", 900)), work_dir=options.get("keep"), log=log)
+        return 0 if results is not None else 1
+    print(f"Unknown command: {command}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+BOOT TRACE v1.0
+Profile-guided file ordering for the live squashfs.
+
+A headless boot (headless_boot.py) records every CD-ROM read.  Reads are
+mapped to the squashfs images inside the ISO and from there to the files
+whose data blocks or fragments they touched, giving the order in which the
+boot needs files.  That order is handed back to the squashfs build
+(mksquashfs -sort file, tar stream order, writer data order) so hot files
+sit together at the front, and two traces can be compared to measure the
+effect on boot-phase reads and time.
+"""
+
+import re
+import sys
+import json
+import bisect
+import subprocess
+from pathlib import Path
+
+from headless_boot import HeadlessBoot
+from squashfs_reader import SquashfsImage, BLOCK_SIZE_MASK
+
+VERSION = "1.0"
+
+ISO_BLOCK = 2048
+LBA_PATTERN = re.compile(r"File data lba:\s*\d+\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*,\s*'(.+)'")
+MAX_PRIORITY = 32767
+
+
+def squashfs_extents(iso):
+    """{ISO path: (byte offset, size)} of every casper squashfs in the ISO"""
+    result = subprocess.run(["xorriso", "-indev", str(iso), "-find", "/casper", "-name", "*.squashfs",
+                             "-exec", "report_lba", "--"], capture_output=True, text=True)
+    extents = {}
+    for line in (result.stdout + result.stderr).splitlines():
+        match = LBA_PATTERN.search(line)
+        if match:
+            lba, _blocks, size, path = match.groups()
+            extents[path] = (int(lba) * ISO_BLOCK, int(size))
+    return extents
+
+
+class SquashfsFileMap:
+    """Maps image-relative byte ranges to the files stored there"""
+
+    def __init__(self, image):
+        intervals = []
+        fragment_members = {}
+        for entry in image.entries(include_root=False):
+            inode = entry.inode
+            if not inode.is_file:
+                continue
+            if inode.compressed_size:
+                intervals.append((inode.blocks_start, inode.blocks_start + inode.compressed_size, [entry.path]))
+            if inode.has_fragment:
+                fragment_members.setdefault(inode.fragment_index, []).append(entry.path)
+        for index, members in fragment_members.items():
+            start, size_word = image.fragments[index]
+            intervals.append((start, start + (size_word & BLOCK_SIZE_MASK), members))
+        intervals.sort(key=lambda interval: interval[0])
+        self.starts = [interval[0] for interval in intervals]
+        self.intervals = intervals
+        self.metadata_start = image.inode_table_start
+
+    def files(self, offset, length):
+        """Paths whose data overlaps [offset, offset + length)"""
+        end = offset + length
+        index = max(0, bisect.bisect_right(self.starts, offset) - 1)
+        # Deduplicated files share a start; step back to the first of them
+        while index > 0 and self.starts[index - 1] == self.starts[index]:
+            index -= 1
+        found = []
+        while index < len(self.intervals) and self.intervals[index][0] < end:
+            start, stop, paths = self.intervals[index]
+            if stop > offset:
+                found.extend(paths)
+            index += 1
+        return found
+
+
+class BootTrace:
+    """First-touch file order per squashfs layer plus boot-phase read statistics"""
+
+    def __init__(self, layers=None, stats=None):
+        self.layers = layers or {}
+        self.stats = stats or {}
+
+    @classmethod
+    def from_reads(cls, iso, reads, seconds, log=None):
+        log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        layers = {}
+        stats = {"seconds": seconds, "reads": 0, "bytes": 0, "seeks": 0, "metadata_reads": 0}
+        for iso_path, (base, size) in squashfs_extents(iso).items():
+            name = Path(iso_path).name
+            with SquashfsImage(iso, offset=base) as image:
+                file_map = SquashfsFileMap(image)
+            order, seen = [], set()
+            last_end = None
+            for offset, length in reads:
+                if offset + length <= base or offset >= base + size:
+                    continue
+                relative = offset - base
+                stats["reads"] += 1
+                stats["bytes"] += length
+                if last_end is not None and relative != last_end:
+                    stats["seeks"] += 1
+                last_end = relative + length
+                if relative >= file_map.metadata_start:
+                    stats["metadata_reads"] += 1
+                for path in file_map.files(relative, length):
+                    if path not in seen:
+                        seen.add(path)
+                        order.append(path)
+            layers[name] = order
+            log(f"{name}: {len(order):,} files read during boot", "🔥")
+        return cls(layers, stats)
+
+    @classmethod
+    def load(cls, path):
+        data = json.loads(Path(path).read_text())
+        return cls(data["layers"], data["stats"])
+
+    def save(self, path):
+        Path(path).write_text(json.dumps({"version": VERSION, "layers": self.layers, "stats": self.stats},
+                                         indent=1))
+        return Path(path)
+
+    def order(self, layer="ubuntu-server-minimal.squashfs"):
+        return self.layers.get(layer, [])
+
+    def write_sort_file(self, path, layer="ubuntu-server-minimal.squashfs", prefix=""):
+        """mksquashfs -sort file: earlier boot reads get higher priority"""
+        lines = []
+        for rank, file_path in enumerate(self.order(layer)):
+            full_path = f"{prefix.rstrip('/')}/{file_path}" if prefix else file_path
+            lines.append(f"{full_path} {max(1, MAX_PRIORITY - rank)}\n")
+        Path(path).write_text("".join(lines))
+        return Path(path)
+
+
+def profile_boot(iso, trace_json=None, timeout=900, log=None):
+    """Boot `iso` headless with read tracing; returns (BootTrace, BootResult)"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    trace_file = Path(iso).with_suffix(".blktrace")
+    trace_file.unlink(missing_ok=True)
+    result = HeadlessBoot(iso, timeout=timeout, log=log).run(trace_file=str(trace_file))
+    trace = BootTrace.from_reads(iso, result.reads(), result.seconds, log)
+    trace.stats["ready"] = result.ready
+    trace_file.unlink(missing_ok=True)
+    if trace_json:
+        trace.save(trace_json)
+    return trace, result
+
+
+def compare(before, after, log=None):
+    """Log the boot-phase read counts and time of two traces side by side"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    for key in ("reads", "bytes", "seeks", "metadata_reads", "seconds"):
+        a, b = before.stats.get(key, 0), after.stats.get(key, 0)
+        change = f"{(b - a) / a:+.1%}" if a else "n/a"
+        value = (lambda v: f"{v:,.1f}s") if key == "seconds" else (lambda v: f"{v:,}")
+        log(f"{key:<15} {value(a):>14} → {value(b):>14}  ({change})", "📊")
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: boot_trace.py profile <iso> [trace.json] [--timeout=SECONDS]")
+        print("       boot_trace.py sortfile <trace.json> <out.sort> [layer] [prefix]")
+        print("       boot_trace.py compare <before.json> <after.json>")
+        return 1
+    command, args = sys.argv[1], [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    if command == "profile":
+        timeout = next((int(a.split("=", 1)[1]) for a in sys.argv if a.startswith("--timeout=")), 900)
+        trace, result = profile_boot(args[0], args[1] if len(args) > 1 else "boot_trace.json", timeout)
+        return 0 if result.ready else 1
+    if command == "sortfile":
+        layer = args[2] if len(args) > 2 else "ubuntu-server-minimal.squashfs"
+        BootTrace.load(args[0]).write_sort_file(args[1], layer, args[3] if len(args) > 3 else "")
+        return 0
+    if command == "compare":
+        compare(BootTrace.load(args[0]), BootTrace.load(args[1]))
+        return 0
+    print(f"Unknown command: {command}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+BUILD CACHE v1.0
+Shared on-disk cache for the ISO build tools.
+
+Everything lives under one directory (INSTYAML_CACHE_DIR, default
+~/.cache/instyaml), split into namespaces such as "space-analysis" or
+"efi-images".  The whole cache shares one size budget (INSTYAML_CACHE_BUDGET,
+e.g. "20G"); when a store pushes it over budget the least recently used
+entries are evicted across all namespaces.
+
+Cached files are placed into a workspace as a reflink where the filesystem
+supports it, else as a hardlink (same filesystem), else as a copy; either
+way the target is a fresh inode or a new name, never written through.
+"""
+
+import os
+import sys
+import json
+import errno
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+
+VERSION = "1.0"
+
+DEFAULT_BUDGET = 10 << 30
+UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+FICLONE = 0x40049409
+
+
+def parse_size(text):
+    """'512M', '20G', '1048576' -> bytes"""
+    text = str(text).strip().upper().rstrip("B").rstrip("I")
+    unit = text[-1] if text and text[-1] in UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def cache_root():
+    return Path(os.environ.get("INSTYAML_CACHE_DIR", Path.home() / ".cache" / "instyaml"))
+
+
+def cache_budget():
+    value = os.environ.get("INSTYAML_CACHE_BUDGET")
+    return parse_size(value) if value else DEFAULT_BUDGET
+
+
+def cache_key(*parts):
+    """Stable key from strings, numbers, paths and nested lists/dicts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_digest(path, algorithm="sha256"):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def place_file(source, target, hardlink=True):
+    """Put `source` at `target` by reflink, hardlink or copy; returns the method used
+
+    Pass hardlink=False when `target` will be modified in place.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Never write through an existing name: it may itself be a hardlink into the cache
+    target.unlink(missing_ok=True)
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError as error:
+            if error.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                raise
+    target.unlink()
+    try:
+        if hardlink:
+            os.link(source, target)
+            return "hardlink"
+    except OSError:
+        pass
+    shutil.copyfile(source, target)
+    return "copy"
+
+
+class BuildCache:
+    """One namespace of the shared build cache"""
+
+    def __init__(self, namespace, root=None, budget=None):
+        self.root = Path(root) if root else cache_root()
+        self.budget = cache_budget() if budget is None else budget
+        self.directory = self.root / namespace
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key, suffix=""):
+        return self.directory / key[:2] / f"{key}{suffix}"
+
+    def _touch(self, path):
+        # Access time is the LRU clock; set it explicitly since noatime mounts are common
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def lookup(self, key, suffix=""):
+        """Path of a cached entry (marked as used) or None"""
+        path = self.path(key, suffix)
+        if path.exists():
+            self._touch(path)
+            return path
+        return None
+
+    def get_json(self, key):
+        path = self.lookup(key, ".json")
+        if path is None:
+            return None
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def put_json(self, key, value):
+        return self._store(key, ".json", lambda handle: handle.write(json.dumps(value).encode()))
+
+    def materialize(self, key, target, suffix=""):
+        """Place a cached entry at `target`; returns the method used or None on a miss"""
+        path = self.lookup(key, suffix)
+        return place_file(path, target) if path else None
+
+    def put_file(self, key, source, suffix=""):
+        """Copy a file into the cache and return its cached path"""
+        def copy(handle):
+            with open(source, "rb") as src:
+                shutil.copyfileobj(src, handle, 8 << 20)
+        return self._store(key, suffix, copy)
+
+    def _store(self, key, suffix, writer):
+        target = self.path(key, suffix)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary name and rename, so readers never see partial entries
+        fd, temp = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                writer(handle)
+            os.replace(temp, target)
+        except BaseException:
+            Path(temp).unlink(missing_ok=True)
+            raise
+        self.evict(keep=target)
+        return target
+
+    def evict(self, keep=None):
+        """Drop least recently used entries (all namespaces) until under budget"""
+        entries = []
+        total = 0
+        for path in self.root.rglob("*"):
+            if path.is_file() and not path.name.startswith(".tmp-"):
+                st = path.stat()
+                entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        removed = 0
+        for _used, size, path in entries:
+            if total <= self.budget:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+
+def main():
+    root = cache_root()
+    if len(sys.argv) > 1 and sys.argv[1] == "clear":
+        shutil.rmtree(root, ignore_errors=True)
+        print(f"🧹 Cleared {root}")
+        return 0
+    print(f"📁 Cache: {root} (budget {cache_budget() / (1 << 30):.1f} GiB)")
+    if root.exists():
+        for namespace in sorted(p for p in root.iterdir() if p.is_dir()):
+            files = [p for p in namespace.rglob("*") if p.is_file()]
+            print(f"   {namespace.name}: {len(files)} entries, {sum(p.stat().st_size for p in files):,} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+BUILD RECIPE v1.0
+One declarative description of an ISO build, compiled into the xorriso
+invocation every builder script uses.
+
+A recipe names the base ISO, the output, the tree to write (or none, to
+replay the base ISO in place), overlay directories, the boot mode, the
+volume label and checksum options:
+
+    {"base_iso": "ubuntu-24.04.2-live-server-amd64.iso",
+     "output": "custom.iso", "source_dir": "work/extracted",
+     "overlays": ["overlay"], "boot": "derived",
+     "volume_id": "Custom-Ubuntu", "checksums": ["md5", "sha1"],
+     "layout": "boot"}
+
+Boot modes:
+  derived  boot options come from the base ISO's own El Torito/partition
+           report (xorriso -report_el_torito as_mkisofs): MBR, GPT, catalog,
+           both boot images and the appended ESP exactly as Ubuntu made them
+  replay   no source tree; the base ISO is the input (iso_replay.py)
+  hybrid   the generic isohybrid command, for bases without a usable report
+
+"layout": "boot" places the boot-critical files (boot images, boot/grub,
+kernel, initrd, squashfs layers) first and contiguously, in boot read order
+(boot_layout.py); a list of patterns gives an order of its own.
+
+With "writer": "native" the image is written in-process by iso_writer.py
+instead: unchanged files are copied from the base ISO's extents, the source
+tree and overlays are added on top and the base ISO's boot setup is reused,
+with no xorriso needed.
+
+Every build is hashed as it is written (xorriso, replaying or not, writes
+to a pipe read by output_sinks.HashingTee), and SHA256SUMS, MD5SUMS and a chunk
+manifest land next to it; build() leaves the digests and the first sector
+on the recipe, so checking or publishing the build never reads it back.
+
+The report is cached by the base ISO's SHA-256 (itself cached by path, size,
+mtime and inode, so an ISO is hashed once) and host tools are probed once,
+so compiling a recipe costs milliseconds and every script gets the same
+command for the same inputs.
+"""
+
+import os
+import sys
+import json
+import shlex
+import shutil
+import tempfile
+import functools
+import contextlib
+import subprocess
+from pathlib import Path
+
+from boot_layout import LAYOUTS, BootLayout
+from build_cache import BuildCache, cache_key, file_digest, place_file
+from iso_partitions import extract_esp
+from iso_replay import ReplayBuild
+from iso_reader import IsoError, IsoImage
+from iso_writer import BootSpec, IsoWriter, Manifest
+from output_sinks import COALESCE, SinkError, open_sink
+
+VERSION = "1.0"
+
+ISOHDPFX_PATHS = [
+    "/usr/lib/ISOLINUX/isohdpfx.bin",
+    "/usr/share/syslinux/isohdpfx.bin",
+    "/usr/lib/syslinux/isohdpfx.bin",
+]
+BOOT_MODES = ("derived", "replay", "hybrid")
+WRITERS = ("xorriso", "native")
+# Report options the recipe itself decides
+RECIPE_OWNED = {"-V", "-volid"}
+RECIPE_OWNED_PREFIXES = ("--modification-date=",)
+BASE_ISO_MARK = "{base_iso}"
+
+
+@functools.lru_cache(maxsize=None)
+def host_tools():
+    """Tool paths and the xorriso version, probed once per process"""
+    tools = {name: shutil.which(name) for name in ("xorriso", "7z", "mksquashfs", "unsquashfs")}
+    tools["isohdpfx"] = next((path for path in ISOHDPFX_PATHS if os.path.exists(path)), None)
+    tools["xorriso_version"] = None
+    if tools["xorriso"]:
+        # Same binary, same version: the probe is cached on disk by path, size and mtime
+        st = os.stat(tools["xorriso"])
+        cache = BuildCache("host-tools")
+        key = cache_key("xorriso-version", tools["xorriso"], st.st_size, st.st_mtime_ns)
+        version = cache.get_json(key)
+        if version is None:
+            result = subprocess.run([tools["xorriso"], "-version"], capture_output=True, text=True)
+            version = next((line for line in result.stdout.splitlines() if line.startswith("xorriso")), "")
+            cache.put_json(key, version)
+        tools["xorriso_version"] = version
+    return tools
+
+
+def iso_digest(path, cache=None):
+    """SHA-256 of a (large) file, hashed once per path, size, mtime and inode"""
+    path = Path(path).resolve()
+    st = path.stat()
+    cache = cache or BuildCache("iso-digests")
+    key = cache_key("iso-digest", str(path), st.st_size, st.st_mtime_ns, st.st_ino)
+    digest = cache.get_json(key)
+    if digest is None:
+        digest = file_digest(path)
+        cache.put_json(key, digest)
+    return digest
+
+
+def boot_report(base_iso, xorriso=None, log=None):
+    """Boot options of `base_iso` as mkisofs arguments ([] when it has none)"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    base_iso = Path(base_iso).resolve()
+    cache = BuildCache("boot-reports")
+    key = cache_key("boot-report", VERSION, iso_digest(base_iso))
+    tokens = cache.get_json(key)
+    if tokens is None:
+        xorriso = xorriso or host_tools()["xorriso"] or "xorriso"
+        try:
+            result = subprocess.run([xorriso, "-indev", str(base_iso), "-report_el_torito", "as_mkisofs"],
+                                    capture_output=True, text=True)
+        except OSError as e:
+            log(f"No boot report for {base_iso.name}: {e}", "⚠️")
+            return []
+        if result.returncode != 0:
+            log(f"No boot report for {base_iso.name}: {result.stderr.strip()[-200:]}", "⚠️")
+            return []
+        tokens = []
+        for line in result.stdout.splitlines():
+            words = shlex.split(line)
+            if not words or words[0] in RECIPE_OWNED or words[0].startswith(RECIPE_OWNED_PREFIXES):
+                continue
+            # The report names the ISO it read; keep it as a placeholder so moved copies still hit
+            tokens += [word.replace(str(base_iso), BASE_ISO_MARK) for word in words]
+        cache.put_json(key, tokens)
+    else:
+        log(f"Boot parameters for {base_iso.name} loaded from cache", "⚡")
+    return [token.replace(BASE_ISO_MARK, str(base_iso)) for token in tokens]
+
+
+class BuildRecipe:
+    """Base ISO + tree/overlays + boot mode -> one xorriso command"""
+
+    def __init__(self, base_iso, output, source_dir=None, overlays=(), boot="derived", volume_id=None,
+                 checksums=(), joliet=True, md5sums=True, esp_image=None, xorriso=None, writer="xorriso",
+                 verify=False, write_behind=4, layout="default", log=None):
+        if boot not in BOOT_MODES:
+            raise ValueError(f"Unknown boot mode '{boot}' (known: {', '.join(BOOT_MODES)})")
+        if writer not in WRITERS:
+            raise ValueError(f"Unknown writer '{writer}' (known: {', '.join(WRITERS)})")
+        if source_dir is None and boot != "replay":
+            raise ValueError(f"Boot mode '{boot}' needs a source_dir")
+        self.base_iso = Path(base_iso)
+        self.output = Path(output) if str(output) != "-" and "://" not in str(output) else output
+        self.source_dir = Path(source_dir) if source_dir else None
+        self.overlays = [Path(path) for path in overlays]
+        self.boot = boot
+        self.volume_id = volume_id
+        self.checksums = list(checksums)
+        self.joliet = joliet
+        self.md5sums = md5sums
+        self.esp_image = Path(esp_image) if esp_image else None
+        self.xorriso = xorriso
+        self.writer = writer
+        # The output may be a file, block device, "-" or http:// URL (output_sinks.py)
+        self.verify = verify
+        self.write_behind = write_behind
+        # File data placement: "default", "boot" or boot-critical patterns of its own (boot_layout.py)
+        BootLayout.from_spec(layout)
+        self.layout = layout
+        # Filled in by build(): whole-image/chunk hashes and the first sector, taken as the image was written
+        self.digests = None
+        self.head = None
+        # With the image on stdout ("-"), progress goes to stderr
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}",
+                                                            file=sys.stderr if str(output) == "-" else sys.stdout))
+
+    @classmethod
+    def load(cls, path, log=None):
+        """Recipe from a JSON file; relative paths are taken from the file's directory"""
+        path = Path(path)
+        spec = json.loads(path.read_text())
+        for field in ("base_iso", "output", "source_dir", "esp_image"):
+            # "-" and URLs are output sinks, not paths
+            if spec.get(field) and spec[field] != "-" and "://" not in spec[field]:
+                spec[field] = path.parent / spec[field]
+        spec["overlays"] = [path.parent / overlay for overlay in spec.get("overlays", [])]
+        if isinstance(spec.get("layout"), str) and spec["layout"] not in LAYOUTS:
+            spec["layout"] = path.parent / spec["layout"]
+        return cls(**spec, log=log)
+
+    def _xorriso(self):
+        return self.xorriso or host_tools()["xorriso"] or "xorriso"
+
+    def replay_build(self):
+        build = ReplayBuild(self.base_iso, self.output, volume_id=self.volume_id,
+                            update_md5sums=self.md5sums, log=self.log)
+        for overlay in self.overlays:
+            build.map_tree(overlay)
+        layout = BootLayout.from_spec(self.layout)
+        if layout:
+            with IsoImage(self.base_iso) as image:
+                paths = {entry.path for entry in image.entries() if not entry.is_dir and not entry.is_symlink}
+            paths |= {path.strip("/") for path in build.mapped}
+            build.sort_weights = {f"/{path}": weight for path, weight in layout.weights(paths).items()}
+        return build
+
+    def apply_overlays(self):
+        """Place overlay files into the source tree (reflink/hardlink where possible)"""
+        placed = 0
+        for overlay in self.overlays:
+            for path in sorted(overlay.rglob("*")):
+                if path.is_file():
+                    place_file(path, self.source_dir / path.relative_to(overlay))
+                    placed += 1
+        return placed
+
+    def native_writer(self):
+        """IsoWriter for this recipe: base ISO extents (or the source tree), overlays, the base's boot setup"""
+        if self.source_dir is not None:
+            manifest = Manifest.from_tree(self.source_dir, self.base_iso)
+        else:
+            manifest = Manifest.from_base_iso(self.base_iso)
+        for overlay in self.overlays:
+            manifest.add_tree(overlay)
+        if self.md5sums:
+            manifest.refresh_md5sums()
+        boot = BootSpec.from_base_iso(self.base_iso)
+        layout = BootLayout.from_spec(self.layout)
+        volume_id = self.volume_id
+        if volume_id is None:
+            with IsoImage(self.base_iso) as image:
+                volume_id = image.volume_id
+        return IsoWriter(manifest, boot, volume_id=volume_id, joliet=self.joliet,
+                         file_order=layout.sort_key if layout else None, log=self.log)
+
+    def hybrid_boot_args(self):
+        """The generic isohybrid setup, for base ISOs without a boot report"""
+        args = []
+        isohdpfx = host_tools()["isohdpfx"]
+        if isohdpfx:
+            args += ["-isohybrid-mbr", isohdpfx]
+        args += [
+            "-c", "boot.catalog",
+            "-b", "boot/grub/i386-pc/eltorito.img",
+            "-no-emul-boot", "-boot-load-size", "4", "-boot-info-table",
+        ]
+        if not (self.source_dir / "EFI" / "boot" / "bootx64.efi").exists():
+            return args
+        args += [
+            "-eltorito-alt-boot",
+            "-e", "EFI/boot/bootx64.efi",
+            "-no-emul-boot",
+            "-isohybrid-gpt-basdat",
+        ]
+        # A given ESP image is used as is; otherwise the base ISO's own is extracted (to esp_image if named)
+        if self.esp_image and self.esp_image.exists():
+            esp = self.esp_image
+        else:
+            beside = self.output if isinstance(self.output, Path) else self.base_iso
+            esp = extract_esp(self.base_iso, self.esp_image or beside.with_name(f"{beside.name}.esp"), log=self.log)
+        if esp:
+            args += ["-append_partition", "2", "0xef", str(esp)]
+        return args
+
+    def compile(self, output=None):
+        """The xorriso argv for this recipe (writing to `output`, default the recipe's)"""
+        if self.boot == "replay":
+            return self.replay_build().command(str(output) if output else None)
+        boot_args = boot_report(self.base_iso, self._xorriso(), self.log) \
+            if self.boot == "derived" and self.base_iso.exists() else []
+        if not boot_args:
+            if self.boot == "derived":
+                self.log("Falling back to the generic hybrid boot setup", "⚠️")
+            boot_args = self.hybrid_boot_args()
+        cmd = [self._xorriso(), "-as", "mkisofs", "-r"]
+        if self.volume_id:
+            cmd += ["-V", self.volume_id]
+        if self.joliet:
+            cmd += ["-J", "-joliet-long"]
+        if self.checksums:
+            cmd += ["-checksum_algorithm_iso", ",".join(self.checksums)]
+        layout = BootLayout.from_spec(self.layout)
+        if layout:
+            sort_file = self.source_dir.with_name(f"{self.source_dir.name}.sort")
+            cmd += ["-sort", str(layout.write_sort_file(self.source_dir, sort_file))]
+        return cmd + boot_args + ["-o", str(output or self.output), str(self.source_dir)]
+
+    def _stream_xorriso(self, sink):
+        """Run xorriso with the image going to its stdout, and copy that into `sink`"""
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(self.compile(output="/dev/fd/1"), stdout=subprocess.PIPE, stderr=errors)
+            try:
+                for chunk in iter(lambda: process.stdout.read(COALESCE * 4), b""):
+                    sink.write(chunk)
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            if returncode != 0:
+                errors.seek(0)
+                raise SinkError(f"xorriso failed: {errors.read().decode(errors='replace').strip()[-500:]}")
+
+    def _logs_to_stderr(self):
+        """While the image goes to stdout, anything printed (any module's log) goes to stderr"""
+        return contextlib.redirect_stdout(sys.stderr) if str(self.output) == "-" else contextlib.nullcontext()
+
+    def build(self):
+        """Compile and run; returns True on success
+
+        The image is hashed on its way to the output, and SHA256SUMS, MD5SUMS
+        and a chunk manifest are written next to a file output.
+        """
+        stdout = sys.stdout
+        with self._logs_to_stderr():
+            try:
+                if self.writer == "native":
+                    writer = self.native_writer()
+                    self.log(f"Native writer, boot setup: {writer.boot.describe()}", "🥾")
+                elif self.boot == "replay":
+                    replay = self.replay_build()
+                elif self.overlays:
+                    self.log(f"Placed {self.apply_overlays()} overlay files into {self.source_dir}", "📎")
+                # A stdout sink takes the real standard output, not the redirected one
+                with contextlib.redirect_stdout(stdout):
+                    sink = open_sink(self.output, write_behind=self.write_behind, hashes=True, log=self.log)
+                with sink:
+                    if self.writer == "native":
+                        layout = writer.write(sink)
+                    elif self.boot == "replay":
+                        if not replay.run(sink):
+                            raise SinkError("replaying the base ISO failed")
+                    else:
+                        self._stream_xorriso(sink)
+                self.digests, self.head = sink.digests, bytes(sink.head)
+                seconds = f" in {layout['seconds']:.1f}s" if self.writer == "native" else ""
+                self.log(f"{sink.name} written: {self.digests['size']:,} bytes{seconds}", "✅")
+                if self.verify and sink.verify() is False:
+                    return False
+                sink.publish()
+            except (IsoError, SinkError, OSError) as e:
+                self.log(f"{'Native ISO writer' if self.writer == 'native' else 'ISO build'} failed: {e}", "❌")
+                return False
+        return True
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: build_recipe.py <recipe.json> [--print]")
+        print("       build_recipe.py --report <base.iso>")
+        return 1
+    if sys.argv[1] == "--report":
+        print(shlex.join(boot_report(sys.argv[2])))
+        return 0
+    recipe = BuildRecipe.load(sys.argv[1])
+    if "--print" in sys.argv and recipe.writer == "native":
+        print(recipe.native_writer().boot.describe())
+        return 0
+    if "--print" in sys.argv:
+        print(shlex.join(recipe.compile()))
+        return 0
+    return 0 if recipe.build() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+CASPER METADATA v1.0
+Regenerates casper/*.size, install-sources.yaml sizes and *.manifest files
+straight from the squashfs layers, without extracting anything.
+
+Layers follow the livecd-rootfs naming: `a.b.squashfs` is stacked on top of
+`a.squashfs` with overlayfs semantics (whiteouts are 0/0 character devices,
+opaque directories carry an overlay.opaque xattr).  Each layer's .size is the
+installed size of the merged stack, counted like `du -B1 -s` on ext4:
+allocated 4 KiB blocks per file and directory, hard links once.
+"""
+
+import re
+import sys
+import stat
+from pathlib import Path
+
+from squashfs_reader import SquashfsImage, decode_device
+
+VERSION = "1.0"
+
+FS_BLOCK = 4096
+DPKG_STATUS = "var/lib/dpkg/status"
+OPAQUE_XATTRS = ("trusted.overlay.opaque", "user.overlay.opaque")
+
+
+def allocated(size):
+    """Bytes a file of `size` occupies on a 4 KiB block filesystem"""
+    return -(-size // FS_BLOCK) * FS_BLOCK
+
+
+def parse_dpkg_status(text):
+    """[(binary package, version)] for installed packages, like dpkg-query -W"""
+    packages = []
+    for stanza in text.split("\n\n"):
+        fields = {}
+        for line in stanza.splitlines():
+            if line and not line[0].isspace() and ":" in line:
+                key, value = line.split(":", 1)
+                fields[key] = value.strip()
+        if "Package" not in fields or not fields.get("Status", "").endswith(" installed"):
+            continue
+        name = fields["Package"]
+        if fields.get("Multi-Arch") == "same" and fields.get("Architecture"):
+            name = f"{name}:{fields['Architecture']}"
+        packages.append((name, fields.get("Version", "")))
+    return sorted(packages)
+
+
+class CasperLayer:
+    """One squashfs layer and the merged view of it stacked on its parents"""
+
+    def __init__(self, path, parent=None):
+        self.path = Path(path)
+        self.name = self.path.name[:-len(".squashfs")]
+        self.parent = parent
+        self.entries = None
+        self.status_text = None
+
+    def merge(self):
+        """{path: (allocated bytes, inode key)} for the merged stack; read once"""
+        if self.entries is not None:
+            return self.entries
+        entries = dict(self.parent.merge()) if self.parent else {}
+        self.status_text = self.parent.status_text if self.parent else None
+        with SquashfsImage(self.path) as image:
+            for entry in image.entries(include_root=False):
+                inode = entry.inode
+                if stat.S_ISCHR(inode.mode) and decode_device(inode.rdev) == (0, 0):
+                    self._remove_subtree(entries, entry.path, keep_self=False)
+                    continue
+                if inode.is_dir:
+                    xattrs = image.read_xattrs(inode.xattr_index)
+                    if any(xattrs.get(name) == b"y" for name in OPAQUE_XATTRS):
+                        self._remove_subtree(entries, entry.path, keep_self=True)
+                    entries[entry.path] = (FS_BLOCK, None)
+                elif inode.is_file:
+                    key = (self.name, inode.inode_number) if inode.nlink > 1 else None
+                    entries[entry.path] = (allocated(inode.file_size), key)
+                    if entry.path == DPKG_STATUS:
+                        self.status_text = image.read_file(inode).decode("utf-8", "replace")
+                else:
+                    # Fast symlinks and device nodes take no data blocks
+                    entries[entry.path] = (0, None)
+        self.entries = entries
+        return entries
+
+    @staticmethod
+    def _remove_subtree(entries, path, keep_self):
+        prefix = path + "/"
+        for existing in [p for p in entries if p.startswith(prefix)]:
+            del entries[existing]
+        if not keep_self:
+            entries.pop(path, None)
+
+    def installed_size(self):
+        seen = set()
+        total = FS_BLOCK  # the root directory
+        for size, key in self.merge().values():
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            total += size
+        return total
+
+    def packages(self):
+        self.merge()
+        return parse_dpkg_status(self.status_text) if self.status_text else []
+
+
+class CasperMetadata:
+    """All layers of one casper directory"""
+
+    def __init__(self, casper_dir, log=None):
+        self.casper_dir = Path(casper_dir)
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.layers = self._discover()
+
+    def _discover(self):
+        layers = {}
+        for path in sorted(self.casper_dir.glob("*.squashfs"), key=lambda p: p.name.count(".")):
+            name = path.name[:-len(".squashfs")]
+            parent = layers.get(name.rpartition(".")[0]) if "." in name else None
+            layers[name] = CasperLayer(path, parent)
+        return layers
+
+    def sizes(self):
+        return {name: layer.installed_size() for name, layer in self.layers.items()}
+
+    def _layer_for_manifest(self, name):
+        if name in self.layers:
+            return self.layers[name]
+        if name == "filesystem" and self.layers:
+            # Single-image casper trees describe the deepest stack as "filesystem"
+            return max(self.layers.values(), key=lambda layer: layer.name.count("."))
+        return None
+
+    def update_install_sources(self, sizes):
+        """Rewrite only the size: line of each source whose path is a known layer"""
+        install_sources = self.casper_dir / "install-sources.yaml"
+        if not install_sources.exists():
+            return 0
+        items = re.split(r"(?m)^(?=- )", install_sources.read_text())
+        updated = 0
+        for index, item in enumerate(items):
+            match = re.search(r"(?m)^\s+path:\s*(\S+)\.squashfs\s*$", item)
+            if match and match.group(1) in sizes:
+                new_item = re.sub(r"(?m)^(\s+size:\s*)\d+", rf"\g<1>{sizes[match.group(1)]}", item)
+                if new_item != item:
+                    items[index] = new_item
+                    updated += 1
+        install_sources.write_text("".join(items))
+        return updated
+
+    def regenerate(self, write_filesystem_size=True):
+        """Write every .size file, install-sources.yaml sizes and existing manifests"""
+        sizes = self.sizes()
+        for name, size in sizes.items():
+            (self.casper_dir / f"{name}.size").write_text(f"{size}\n")
+            self.log(f"{name}.size: {size:,} bytes installed", "📏")
+        if write_filesystem_size and sizes:
+            deepest = self._layer_for_manifest("filesystem")
+            (self.casper_dir / "filesystem.size").write_text(f"{sizes[deepest.name]}\n")
+
+        updated = self.update_install_sources(sizes)
+        if updated:
+            self.log(f"install-sources.yaml: {updated} size entries updated", "📏")
+
+        for manifest in sorted(self.casper_dir.glob("*.manifest")):
+            layer = self._layer_for_manifest(manifest.name[:-len(".manifest")])
+            packages = layer.packages() if layer else []
+            if packages:
+                manifest.write_text("".join(f"{name}\t{version}\n" for name, version in packages))
+                self.log(f"{manifest.name}: {len(packages)} packages", "📦")
+        return sizes
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: casper_metadata.py <casper_dir> [--dry-run]")
+        return 1
+    metadata = CasperMetadata(sys.argv[1])
+    if "--dry-run" in sys.argv:
+        for name, size in metadata.sizes().items():
+            print(f"{name}: {size:,} bytes")
+        return 0
+    metadata.regenerate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+CHROOT CUSTOMIZE v1.0
+Runs customization commands inside an unpacked root filesystem.
+
+Commands run through systemd-nspawn (as root) or, without root, through an
+unprivileged user+mount namespace and chroot.  apt inside the root sees:
+
+  /var/cache/apt/archives  - persistent .deb cache (shared build cache)
+  /var/lib/apt/lists       - persistent package lists
+  /etc/apt/sources.list.d  - only the configured mirror / local repository
+
+so repeat builds install from cache and nothing about the build host's apt
+state ends up in the image.  A flat directory of .debs can stand in for the
+mirror (LocalRepository writes its Packages index, no network needed).
+"""
+
+import io
+import os
+import sys
+import gzip
+import lzma
+import shlex
+import shutil
+import hashlib
+import tarfile
+import subprocess
+from pathlib import Path
+
+from build_cache import cache_root
+
+VERSION = "1.0"
+
+DEFAULT_MIRROR = "http://archive.ubuntu.com/ubuntu"
+DEFAULT_SUITES = ["noble", "noble-updates", "noble-security"]
+DEFAULT_COMPONENTS = ["main", "restricted", "universe"]
+REPO_MOUNT = "/srv/instyaml-repo"
+
+APT_CONFIG = """// Written by chroot_customize.py for the duration of the run
+APT::Keep-Downloaded-Packages "true";
+Binary::apt::APT::Keep-Downloaded-Packages "true";
+APT::Install-Recommends "false";
+APT::Sandbox::User "root";
+Dpkg::Use-Pty "false";
+"""
+
+
+def _deb_control(path):
+    """Return the control file text of a .deb (ar archive with control.tar.*)"""
+    with open(path, "rb") as handle:
+        if handle.read(8) != b"!<arch>\n":
+            raise ValueError(f"{path}: not a .deb archive")
+        while True:
+            header = handle.read(60)
+            if len(header) < 60:
+                raise ValueError(f"{path}: no control archive")
+            name = header[:16].decode().strip().rstrip("/")
+            size = int(header[48:58])
+            data = handle.read(size)
+            if size % 2:
+                handle.read(1)
+            if name.startswith("control.tar"):
+                break
+    if name.endswith(".zst"):
+        data = subprocess.run(["zstd", "-dc"], input=data, capture_output=True, check=True).stdout
+    elif name.endswith(".xz"):
+        data = lzma.decompress(data)
+    elif name.endswith(".gz"):
+        data = gzip.decompress(data)
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        for member in tar:
+            if member.name.lstrip("./") == "control":
+                return tar.extractfile(member).read().decode("utf-8", "replace")
+    raise ValueError(f"{path}: control file missing")
+
+
+class LocalRepository:
+    """Flat directory of .debs served to apt as `deb [trusted=yes] file:... ./`"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def build_index(self):
+        """(Re)write Packages and Packages.gz; returns the package count"""
+        stanzas = []
+        for deb in sorted(self.directory.glob("*.deb")):
+            control = _deb_control(deb).strip("\n")
+            content = deb.read_bytes()
+            stanzas.append(f"{control}\nFilename: ./{deb.name}\nSize: {len(content)}\n"
+                           f"MD5sum: {hashlib.md5(content).hexdigest()}\n"
+                           f"SHA256: {hashlib.sha256(content).hexdigest()}\n")
+        index = "\n".join(stanzas)
+        (self.directory / "Packages").write_text(index)
+        with gzip.open(self.directory / "Packages.gz", "wt") as handle:
+            handle.write(index)
+        return len(stanzas)
+
+    def add_from_cache(self, archives):
+        """Seed the stand-in from an apt archive cache (hard links when possible)"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        added = 0
+        for deb in Path(archives).glob("*.deb"):
+            target = self.directory / deb.name
+            if target.exists():
+                continue
+            try:
+                os.link(deb, target)
+            except OSError:
+                shutil.copy2(deb, target)
+            added += 1
+        return added
+
+
+class ChrootCustomizer:
+    """Runs shell commands inside `root` with cached, redirected apt"""
+
+    def __init__(self, root, mirror=None, suites=None, components=None, local_repo=None,
+                 cache_dir=None, backend="auto", sudo=False, log=None):
+        self.root = Path(root).resolve()
+        self.mirror = mirror if mirror is not None else os.environ.get("INSTYAML_APT_MIRROR", DEFAULT_MIRROR)
+        self.suites = suites or DEFAULT_SUITES
+        self.components = components or DEFAULT_COMPONENTS
+        self.local_repo = Path(local_repo).resolve() if local_repo else None
+        self.cache_dir = Path(cache_dir) if cache_dir else cache_root() / "apt"
+        self.sudo = sudo
+        self.backend = self._pick_backend(backend)
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.archives = self.cache_dir / "archives"
+        self.lists = self.cache_dir / "lists"
+        self.sources_dir = self.cache_dir / "sources.list.d"
+
+    def _pick_backend(self, backend):
+        if backend != "auto":
+            return backend
+        privileged = self.sudo or os.geteuid() == 0
+        return "nspawn" if privileged and shutil.which("systemd-nspawn") else "unshare"
+
+    def _sources(self):
+        """deb822 sources: the local stand-in first, then the mirror (if any)"""
+        entries = []
+        if self.local_repo:
+            entries.append(f"Types: deb\nURIs: file:{REPO_MOUNT}\nSuites: ./\nTrusted: yes\n")
+        if self.mirror:
+            entries.append(f"Types: deb\nURIs: {self.mirror}\nSuites: {' '.join(self.suites)}\n"
+                           f"Components: {' '.join(self.components)}\n"
+                           "Signed-By: /usr/share/keyrings/ubuntu-archive-keyring.gpg\n")
+        return "\n".join(entries)
+
+    def _prepare(self):
+        for directory in (self.archives / "partial", self.lists / "partial", self.sources_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        (self.sources_dir / "instyaml.sources").write_text(self._sources())
+        if self.local_repo:
+            count = LocalRepository(self.local_repo).build_index()
+            self.log(f"Local repository {self.local_repo}: {count} packages", "📦")
+        # Temporary files inside the root; removed again in _finish
+        self._root_write("etc/apt/apt.conf.d/99instyaml-customize", APT_CONFIG)
+        self._root_write("usr/sbin/policy-rc.d", "#!/bin/sh\n# no service starts while customizing\nexit 101\n",
+                         mode=0o755)
+
+    def _root_write(self, rel_path, content, mode=0o644):
+        target = self.root / rel_path
+        if self.sudo:
+            subprocess.run(["sudo", "tee", str(target)], input=content, text=True,
+                           stdout=subprocess.DEVNULL, check=True)
+            subprocess.run(["sudo", "chmod", f"{mode:o}", str(target)], check=True)
+        else:
+            target.write_text(content)
+            target.chmod(mode)
+
+    def _finish(self):
+        command = ["rm", "-f", str(self.root / "etc/apt/apt.conf.d/99instyaml-customize"),
+                   str(self.root / "usr/sbin/policy-rc.d")]
+        subprocess.run(["sudo"] + command if self.sudo else command)
+        if self.sudo:
+            # apt ran as root inside; hand the cache back to the build user
+            subprocess.run(["sudo", "chown", "-R", f"{os.getuid()}:{os.getgid()}", str(self.cache_dir)])
+
+    def _binds(self):
+        binds = [(self.archives, "/var/cache/apt/archives", False),
+                 (self.lists, "/var/lib/apt/lists", False),
+                 (self.sources_dir, "/etc/apt/sources.list.d", True)]
+        if self.local_repo:
+            binds.append((self.local_repo, REPO_MOUNT, True))
+        return binds
+
+    def _nspawn_command(self, command):
+        args = ["systemd-nspawn", "--quiet", "--register=no", "--resolv-conf=copy-host", "-D", str(self.root),
+                "--setenv=DEBIAN_FRONTEND=noninteractive"]
+        for source, target, read_only in self._binds():
+            args.append(f"--bind{'-ro' if read_only else ''}={source}:{target}")
+        args += ["/bin/sh", "-c", command]
+        return ["sudo"] + args if self.sudo else args
+
+    def _unshare_command(self, command):
+        mounts = [f"mount -t proc proc {shlex.quote(str(self.root / 'proc'))}",
+                  f"mount --rbind /dev {shlex.quote(str(self.root / 'dev'))}",
+                  f"mount --rbind /sys {shlex.quote(str(self.root / 'sys'))}",
+                  f"{{ mount --bind /etc/resolv.conf {shlex.quote(str(self.root / 'etc/resolv.conf'))} || true; }}"]
+        for source, target, read_only in self._binds():
+            mountpoint = self.root / target.lstrip("/")
+            mounts.append(f"mkdir -p {shlex.quote(str(mountpoint))}")
+            mounts.append(f"mount --bind {shlex.quote(str(source))} {shlex.quote(str(mountpoint))}")
+            if read_only:
+                mounts.append(f"mount -o remount,bind,ro {shlex.quote(str(mountpoint))}")
+        script = " && ".join(mounts) + (f" && exec chroot {shlex.quote(str(self.root))} /usr/bin/env "
+                                        f"DEBIAN_FRONTEND=noninteractive /bin/sh -c {shlex.quote(command)}")
+        args = ["unshare", "--mount", "--pid", "--fork", "--kill-child"]
+        if not (self.sudo or os.geteuid() == 0):
+            # Map our uid to root and subordinate ids for the package users dpkg creates
+            args += ["--map-root-user", "--map-auto"]
+        args += ["/bin/sh", "-c", script]
+        return ["sudo"] + args if self.sudo else args
+
+    def run(self, commands):
+        """Run each command in order; stops at the first failure"""
+        self._prepare()
+        try:
+            for command in commands:
+                self.log(f"[{self.backend}] {command}", "🔧")
+                build = self._nspawn_command if self.backend == "nspawn" else self._unshare_command
+                result = subprocess.run(build(command))
+                if result.returncode != 0:
+                    self.log(f"Command failed ({result.returncode}): {command}", "❌")
+                    return False
+        finally:
+            self._finish()
+        cached = list(self.archives.glob("*.deb"))
+        self.log(f"apt cache: {len(cached)} packages, {sum(p.stat().st_size for p in cached) / 1e6:,.1f} MB", "💾")
+        return True
+
+    def install(self, packages, refresh_lists=False):
+        """apt-get install from cache; lists are only fetched when missing or requested"""
+        commands = []
+        if refresh_lists or not any(self.lists.glob("*Packages*")):
+            commands.append("apt-get update")
+        commands.append("apt-get install -y " + " ".join(shlex.quote(p) for p in packages))
+        return self.run(commands)
+
+
+def load_commands(path):
+    """One shell command per line; blank lines and # comments skipped"""
+    return [line.strip() for line in Path(path).read_text().splitlines()
+            if line.strip() and not line.lstrip().startswith("#")]
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: chroot_customize.py <rootfs> <commands.txt|--install=pkg,pkg> "
+              "[--mirror=URL] [--local-repo=DIR] [--sudo] [--backend=nspawn|unshare]")
+        print("       chroot_customize.py --seed-repo <DIR>   (copy cached .debs into a local repository)")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if sys.argv[1] == "--seed-repo":
+        repo = LocalRepository(sys.argv[2])
+        added = repo.add_from_cache(cache_root() / "apt" / "archives")
+        print(f"📦 Added {added} packages, index has {repo.build_index()}")
+        return 0
+    customizer = ChrootCustomizer(sys.argv[1], mirror=options.get("mirror"), local_repo=options.get("local-repo"),
+                                  backend=options.get("backend", "auto"), sudo="--sudo" in sys.argv)
+    if "install" in options:
+        ok = customizer.install(options["install"].split(","))
+    else:
+        ok = customizer.run(load_commands(sys.argv[2]))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
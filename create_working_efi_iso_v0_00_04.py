@@ -22,6 +22,9 @@ import time
 from datetime import datetime
 from pathlib import Path
 
+from build_recipe import BuildRecipe
+from fat_image import FatImageBuilder
+
 VERSION = "0.00.04"
 
 class WorkingEFIISOCreator:
@@ -45,7 +48,7 @@ class WorkingEFIISOCreator:
         print("🔍 CHECKING DEPENDENCIES v" + self.version)
         print("-" * 40)
         
-        required_tools = ['xorriso', '7z', 'wget', 'dd', 'mkfs.fat']
+        required_tools = ['xorriso', '7z', 'wget']
         missing_tools = []
         
         for tool in required_tools:
@@ -64,7 +67,7 @@ class WorkingEFIISOCreator:
             print(f"\n🔧 Installing: {', '.join(missing_tools)}")
             try:
                 subprocess.run(['sudo', 'apt', 'update'], check=True)
-                subprocess.run(['sudo', 'apt', 'install', '-y', 'xorriso', 'p7zip-full', 'wget', 'dosfstools'], check=True)
+                subprocess.run(['sudo', 'apt', 'install', '-y', 'xorriso', 'p7zip-full', 'wget'], check=True)
                 print("✅ Dependencies installed")
             except subprocess.CalledProcessError as e:
                 print(f"❌ Installation failed: {e}")
@@ -194,65 +197,33 @@ the fix worked perfectly! 🎉
         efi_boot_dir = extract_dir / "EFI" / "boot"
         efiboot_img = efi_boot_dir / "efiboot.img"
         
-        # Create EFI boot image (FAT16 filesystem)
+        # FAT image holding exactly the EFI bootloaders, built in-process
+        # (no dd/mkfs.fat/loop mount, no sudo)
         try:
-            print("📝 Creating 2.88MB EFI boot image...")
-            # Create 2.88MB file (2880 * 1024 bytes)
-            subprocess.run([
-                'dd', 'if=/dev/zero', f'of={efiboot_img}', 
-                'bs=1024', 'count=2880'
-            ], check=True, capture_output=True)
-            
-            print("💾 Formatting as FAT16 filesystem...")
-            subprocess.run([
-                'mkfs.fat', '-F', '16', '-n', 'EFIBOOT', str(efiboot_img)
-            ], check=True, capture_output=True)
-            
-            print("📁 Creating EFI directory structure in image...")
-            # Create mount point
-            mount_point = self.work_dir / "efi_mount"
-            mount_point.mkdir(exist_ok=True)
-            
-            # Mount the image
-            subprocess.run([
-                'sudo', 'mount', '-o', 'loop', str(efiboot_img), str(mount_point)
-            ], check=True)
-            
-            try:
-                # Create EFI/boot directory in image
-                efi_dir = mount_point / "EFI" / "boot"
-                efi_dir.mkdir(parents=True, exist_ok=True)
-                
-                # Copy EFI bootloaders into image
-                bootloaders = [
-                    "bootx64.efi",
-                    "grubx64.efi", 
-                    "mmx64.efi"
-                ]
-                
-                for bootloader in bootloaders:
-                    src = efi_boot_dir / bootloader
-                    dst = efi_dir / bootloader
-                    if src.exists():
-                        subprocess.run(['sudo', 'cp', str(src), str(dst)], check=True)
-                        print(f"✅ Copied {bootloader} to efiboot.img")
-                    else:
-                        print(f"❌ WARNING: {bootloader} not found")
-                        
-            finally:
-                # Always unmount
-                subprocess.run(['sudo', 'umount', str(mount_point)], check=True)
-                mount_point.rmdir()
+            bootloaders = [
+                "bootx64.efi",
+                "grubx64.efi", 
+                "mmx64.efi"
+            ]
             
-            print(f"✅ efiboot.img created: {efiboot_img.stat().st_size:,} bytes")
+            builder = FatImageBuilder(label="EFIBOOT")
+            builder.add_directory("EFI/boot")
+            for bootloader in bootloaders:
+                src = efi_boot_dir / bootloader
+                if src.exists():
+                    builder.add_file(f"EFI/boot/{bootloader}", source=src)
+                    print(f"✅ Added {bootloader} to efiboot.img")
+                else:
+                    print(f"❌ WARNING: {bootloader} not found")
+                    
+            layout = builder.build_cached(efiboot_img)
+            print(f"✅ efiboot.img created: FAT{layout['fat_type']}, {efiboot_img.stat().st_size:,} bytes "
+                  f"{'from cache (' + layout['cached'] + ') ' if layout['cached'] else ''}in {layout['seconds'] * 1000:.0f} ms")
             return True
             
-        except subprocess.CalledProcessError as e:
+        except (OSError, ValueError) as e:
             print(f"❌ efiboot.img creation failed: {e}")
             return False
-        except Exception as e:
-            print(f"❌ efiboot.img error: {e}")
-            return False
 
     def build_hybrid_iso(self):
         print("\n🏗️ HYBRID ISO BUILD v" + self.version)
@@ -262,38 +233,12 @@ the fix worked perfectly! 🎉
         extract_dir = self.work_dir / "extracted"
         output_iso = f"working_efi_ubuntu_v{self.version.replace('.', '_')}.iso"
         
-        # Ubuntu's COMPLETE hybrid xorriso command (fixed version)
-        xorriso_cmd = [
-            'xorriso', '-as', 'mkisofs',
-            '-r',
-            '-checksum_algorithm_iso', 'md5,sha1',
-            '-V', f'Working-Ubuntu-EFI-v{self.version}',
-            '-o', output_iso,
-            '-J', '-joliet-long',
-            '-cache-inodes',
-            # BIOS boot support
-            '-b', 'boot/grub/i386-pc/eltorito.img',
-            '-c', 'boot.catalog',
-            '-no-emul-boot',
-            '-boot-load-size', '4',
-            '-boot-info-table',
-            # EFI boot support (THE FIX!)
-            '-eltorito-alt-boot',
-            '-e', 'EFI/boot/efiboot.img',  # This was missing!
-            '-no-emul-boot',
-            # HYBRID BOOT STRUCTURE (THE KEY FIX!)
-            '-isohybrid-gpt-basdat',  # Create hybrid GPT structure
-            '-isohybrid-apm-hfsplus', # Apple partition support  
-            '-partition_offset', '16', # Proper partition alignment
-            str(extract_dir)
-        ]
+        # Our efiboot.img is only used by the generic fallback
+        xorriso_cmd = BuildRecipe(self.ubuntu_iso, output_iso, source_dir=extract_dir,
+                                  volume_id=f'Working-Ubuntu-EFI-v{self.version}', checksums=['md5', 'sha1'],
+                                  esp_image=extract_dir / 'EFI' / 'boot' / 'efiboot.img').compile()
         
-        print(f"🔨 Running Ubuntu's COMPLETE hybrid xorriso ({len(xorriso_cmd)} parameters)")
-        print("🎯 Key fixes added:")
-        print("   ✅ -e EFI/boot/efiboot.img (was missing)")
-        print("   ✅ -isohybrid-gpt-basdat (hybrid GPT)")
-        print("   ✅ -isohybrid-apm-hfsplus (Apple support)")
-        print("   ✅ -partition_offset 16 (proper alignment)")
+        print(f"🔨 Running hybrid xorriso ({len(xorriso_cmd)} parameters)")
         
         try:
             result = subprocess.run(xorriso_cmd, capture_output=True, text=True, timeout=600)
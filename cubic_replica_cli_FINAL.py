@@ -9,11 +9,31 @@ import os
 import sys
 import subprocess
 import shutil
+import importlib.util
 import requests
 from pathlib import Path
 from datetime import datetime
 import tempfile
 
+from squashfs_estimator import SquashfsEstimator
+from squashfs_stream import stream_repack
+from squashfs_inject import FileInjection, add_to_edits, injections_from_edits, load_injections, rebuild_unprivileged
+from squashfs_incremental import IncrementalSquashfsBuilder
+from squashfs_reader import SquashfsError
+from casper_metadata import CasperMetadata
+from headless_boot import HeadlessBoot
+from slimming_profiles import SlimmingPlan, SlimmingProfile
+from boot_trace import BootTrace, profile_boot, compare as compare_boot_traces
+from chroot_customize import ChrootCustomizer, load_commands
+from parallel_unsquashfs import extract_images
+from initrd_overlay import Initrd
+from kernel_flavour import KernelSelection
+from build_recipe import BuildRecipe, host_tools
+
+# Python module -> distribution package, and the pip package as a fallback
+PYTHON_MODULES = {"lzo": "python3-lzo"}
+PIP_PACKAGES = {"lzo": "python-lzo"}
+
 class CubicReplicaCLI:
     def __init__(self):
         self.version = "1.2-FINAL"
@@ -22,6 +42,23 @@ class CubicReplicaCLI:
         self.ubuntu_iso = "ubuntu-24.04.2-live-server-amd64.iso"
         self.ubuntu_url = "https://mirror.pilotfiber.com/ubuntu-iso/24.04.2/ubuntu-24.04.2-live-server-amd64.iso"
         self.output_iso = f"cubic_replica_custom_{datetime.now().strftime('%Y%m%d_%H%M')}.iso"
+        # Boot trace from a previous --profile-boot run orders the squashfs
+        self.boot_trace_file = Path("boot_trace.json")
+        self.profile_boot = "--profile-boot" in sys.argv
+        self.boot_order = None
+        self.slim_profile = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--slim=")), None)
+        # Commands run in the unpacked root (apt uses the persistent build cache)
+        self.customize_file = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--customize=")), None)
+        self.apt_mirror = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--mirror=")), None)
+        self.local_repo = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--local-repo=")), None)
+        # initrd changes: additions are appended as a cpio segment, removals repack
+        self.initrd_add = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--initrd-add=")), None)
+        self.initrd_remove = next((arg.split("=", 1)[1].split(",") for arg in sys.argv
+                                   if arg.startswith("--initrd-remove=")), [])
+        self.initrd_modified = False
+        self.kernel_flavour = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--kernel=")), "ga")
+        # ISO file placement: --layout=boot puts boot-critical files first, in read order (boot_layout.py)
+        self.layout = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--layout=")), "default")
         
     def log(self, message, emoji="📝"):
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -67,13 +104,12 @@ class CubicReplicaCLI:
         print()
         
         # Show what sudo commands will be needed
-        print("⚠️  SUDO COMMANDS REQUIRED:")
-        print("   1. sudo apt update && sudo apt install (dependencies)")
-        print("   2. sudo rm -rf (cleanup work directories)")  
-        print("   3. sudo unsquashfs (extract live filesystem)")
-        print("   4. sudo tee (add files to live filesystem)")
-        print("   5. sudo mksquashfs (recompress live filesystem)")
-        print("   6. sudo rm -rf (final cleanup)")
+        print("⚠️  SUDO COMMANDS (only when needed):")
+        print("   1. sudo apt update && sudo apt install (missing dependencies)")
+        print("   2. sudo rm -rf (root-owned work directories from older runs)")
+        if self.customize_file:
+            print("   3. sudo unsquashfs/systemd-nspawn/mksquashfs (--customize chroot stage)")
+        print("   Live filesystem is modified without sudo (streamed or pseudo-file injection)")
         print()
         
         if sys.stdin.isatty():
@@ -90,6 +126,9 @@ class CubicReplicaCLI:
         print("-" * 40)
         
         required_tools = ['7z', 'unsquashfs', 'mksquashfs', 'xorriso', 'wget']
+        # Ubuntu's initrds are zstd compressed; reading and repacking them needs the CLI
+        if self.initrd_add or self.initrd_remove:
+            required_tools.append('zstd')
         missing_tools = []
         
         for tool in required_tools:
@@ -99,23 +138,43 @@ class CubicReplicaCLI:
                 print(f"❌ {tool}: Missing")
                 missing_tools.append(tool)
                 
-        # Check for isolinux MBR file
-        mbr_file = Path("/usr/lib/ISOLINUX/isohdpfx.bin")
-        if mbr_file.exists():
+        # Check for isolinux MBR file (only the generic hybrid fallback needs it)
+        mbr_file = host_tools()["isohdpfx"]
+        if mbr_file:
             print(f"✅ MBR boot file: {mbr_file}")
         else:
             print(f"❌ MBR boot file missing")
             missing_tools.append("isolinux")
+        
+        # The lzo live filesystem is read back in-process (sizes, incremental
+        # rebuilds, boot traces), which needs the lzo bindings
+        missing_modules = []
+        for module in PYTHON_MODULES:
+            if importlib.util.find_spec(module):
+                print(f"✅ python {module}: Available")
+            else:
+                print(f"❌ python {module}: Missing")
+                missing_modules.append(module)
                 
-        if missing_tools:
+        if missing_tools or missing_modules:
             self.log("Installing missing dependencies...", "🔧")
             try:
                 subprocess.run(['sudo', 'apt', 'update'], check=True)
-                subprocess.run(['sudo', 'apt', 'install', '-y', 'p7zip-full', 'squashfs-tools', 'xorriso', 'isolinux', 'wget'], check=True)
-                self.log("Dependencies installed successfully", "✅")
+                subprocess.run(['sudo', 'apt', 'install', '-y', 'p7zip-full', 'squashfs-tools', 'xorriso', 'isolinux', 'wget',
+                                *(['zstd'] if 'zstd' in required_tools else []),
+                                *(PYTHON_MODULES[module] for module in missing_modules)], check=True)
+                host_tools.cache_clear()
+                importlib.invalidate_caches()
             except subprocess.CalledProcessError as e:
                 self.log(f"Failed to install dependencies: {e}", "❌")
                 return False
+            # A virtualenv does not see the distribution's python3-* packages
+            still_missing = [module for module in missing_modules if not importlib.util.find_spec(module)]
+            if still_missing:
+                self.log(f"Python module(s) {', '.join(still_missing)} still not importable "
+                         f"(pip install {' '.join(PIP_PACKAGES[module] for module in still_missing)})", "❌")
+                return False
+            self.log("Dependencies installed successfully", "✅")
                 
         return True
         
@@ -158,8 +217,7 @@ class CubicReplicaCLI:
         print("-" * 40)
         
         if self.work_dir.exists():
-            success, error = self.run_sudo(['rm', '-rf', str(self.work_dir)], "cleanup old work directory")
-            if not success:
+            if not self.remove_tree(self.work_dir, "cleanup old work directory"):
                 return False
         self.work_dir.mkdir()
         
@@ -184,7 +242,8 @@ class CubicReplicaCLI:
         extract_dir = self.work_dir / "extracted"
         casper_dir = extract_dir / "casper"
         
-        # Keep HWE files but update ALL boot configs to redirect them
+        # Boot configs are pointed at one kernel flavour in step 3, which also
+        # drops the unused kernel and initrd
         
         # Rename initrd to initrd.gz (Cubic does this)
         initrd_path = casper_dir / "initrd"
@@ -194,9 +253,38 @@ class CubicReplicaCLI:
             initrd_path.rename(initrd_gz_path)
             self.log("Renamed initrd to initrd.gz", "✅")
             
+        if (self.initrd_add or self.initrd_remove) and not self.modify_initrds(casper_dir):
+            return False
+            
         self.log("Kernel structure simplified", "✅")
         return True
         
+    def modify_initrds(self, casper_dir):
+        """Apply --initrd-add/--initrd-remove to every initrd in casper/"""
+        injections = load_injections(self.initrd_add) if self.initrd_add else []
+        for name in ("initrd.gz", "initrd", "hwe-initrd"):
+            path = casper_dir / name
+            if not path.exists():
+                continue
+            initrd = Initrd(path, log=self.log)
+            initrd.apply(injections, self.initrd_remove)
+            if not initrd.verify(injections, self.initrd_remove):
+                return False
+            self.initrd_modified = True
+        if not self.initrd_modified:
+            self.log("No initrd found to modify", "❌")
+        return self.initrd_modified
+        
+    def verify_boot(self):
+        """Modified initrds must still reach the live system"""
+        if not HeadlessBoot.available():
+            self.log("qemu-system-x86_64 not found, initrd changes not boot-tested", "⚠️")
+            return True
+        result = HeadlessBoot(self.output_iso, log=self.log).run()
+        if not result.ready:
+            self.log(f"Modified initrd does not boot: {result.reason} (serial log: {result.serial_log})", "❌")
+        return result.ready
+        
     def cubic_step2_modify_squashfs(self):
         self.log("STEP 2: MODIFY LIVE FILESYSTEM (FIXED SQUASHFS HANDLING)", "🗂️")
         print("-" * 50)
@@ -209,35 +297,24 @@ class CubicReplicaCLI:
             self.log("Squashfs file not found", "❌")
             return False
             
+        if self.customize_file and not self.customize_rootfs(squashfs_file):
+            return False
+            
         original_size = squashfs_file.stat().st_size
         self.log(f"Original squashfs size: {original_size:,} bytes", "📊")
         
-        modified_dir = self.work_dir / "squashfs_modified"
-        
-        self.log("Extracting squashfs filesystem WITH SUDO...", "⚙️")
-        
-        # FIXED: Use sudo to properly extract all files including device files
-        success, error = self.run_sudo([
-            "unsquashfs", "-f", "-d", str(modified_dir), str(squashfs_file)
-        ], "squashfs extraction")
-        
-        if not success:
-            self.log(f"Failed to extract squashfs: {error}", "❌")
-            return False
-            
-        # Check extracted content size to ensure we got everything
-        try:
-            result = subprocess.run(['du', '-sb', str(modified_dir)], capture_output=True, text=True)
-            extracted_size = int(result.stdout.split()[0])
-            self.log(f"Extracted content size: {extracted_size:,} bytes", "📊")
-        except:
-            self.log("Could not measure extracted size", "⚠️")
-            
-        self.log("Squashfs extracted successfully with sudo", "✅")
+        # Predict the recompressed size straight from the original image, so the
+        # size comparison happens before the multi-minute mksquashfs run
+        target_size = 419_594_240  # Cubic's exact size
+        self.log("Estimating recompressed size from squashfs samples...", "🔮")
+        estimate = SquashfsEstimator(
+            squashfs_file, codecs=["lzo"], block_size=1048576, log=self.log
+        ).estimate().get("lzo")
+        if estimate:
+            self.log(f"Prediction: {estimate.summary()}", "🔮")
+            self.report_size_comparison(estimate.predicted_bytes, target_size, "Predicted")
         
         # Add custom content to live filesystem (like Cubic does)
-        self.log("Adding custom content to live filesystem...", "📝")
-        
         custom_content = f"""Hello from Cubic Replica CLI v{self.version}!
 
 Created: {self.start_time}
@@ -257,47 +334,137 @@ Original squashfs: {original_size:,} bytes
 Target size: ~419MB (like Cubic)
 """
         
-        # Add HelloWorld.txt to root of live filesystem
-        hello_file = modified_dir / "HelloWorld.txt"
-        result = subprocess.run(['sudo', 'tee', str(hello_file)], input=custom_content, text=True, capture_output=True)
-        if result.returncode == 0:
-            self.log(f"Added HelloWorld.txt to live filesystem", "✅")
-        
-        # Add to home directory as well
-        home_dir = modified_dir / "home"
-        if home_dir.exists():
-            home_hello = home_dir / "HelloWorld.txt"
-            result = subprocess.run(['sudo', 'tee', str(home_hello)], input=custom_content, text=True, capture_output=True)
-            if result.returncode == 0:
-                self.log(f"Added HelloWorld.txt to /home", "✅")
-        
-        # Try different compression to match Cubic's 419MB size
+        # Stream the image through sqfstar: no extracted tree, no sudo
         self.log("Recompressing squashfs filesystem with Cubic-like settings...", "🔧")
+        new_squashfs = casper_dir / "ubuntu-server-minimal.squashfs.new"
+        injections = [
+            FileInjection("HelloWorld.txt", content=custom_content),
+            FileInjection("home/HelloWorld.txt", content=custom_content),
+        ]
+        edits = add_to_edits(injections)
+        
+        # Optional slimming (--slim=docs+locales, or a profile JSON) rides on the same edits
+        image_bytes_saved = 0
+        if self.slim_profile:
+            plan = SlimmingPlan(squashfs_file, SlimmingProfile.load(self.slim_profile), log=self.log)
+            plan.apply(edits)
+            image_bytes_saved = plan.report(estimate)["image_bytes_saved"]
+        
+        # An image already in the target format only needs the changed files
+        # compressed; everything else is copied block for block
+        if self.boot_trace_file.exists():
+            self.boot_order = BootTrace.load(self.boot_trace_file).order(squashfs_file.name)
+            self.log(f"Placing {len(self.boot_order):,} boot-time files first ({self.boot_trace_file})", "🔥")
+        
+        if self.incremental_repack_squashfs(squashfs_file, new_squashfs, edits):
+            os.replace(new_squashfs, squashfs_file)
+            self.log("Added HelloWorld.txt to / and /home in live filesystem", "✅")
+        else:
+            stats = stream_repack(
+                squashfs_file, new_squashfs, edits,
+                compressor="lzo",    # LZO compression is faster and less aggressive
+                block_size=1048576,  # 1MB block size
+                log=self.log,
+                order=self.boot_order
+            )
+            if stats:
+                os.replace(new_squashfs, squashfs_file)
+                self.log(f"Streamed content size: {stats['bytes']:,} bytes", "📊")
+                self.log("Added HelloWorld.txt to / and /home in live filesystem", "✅")
+            else:
+                new_squashfs.unlink(missing_ok=True)
+                self.log("Streaming repack unavailable, falling back to full extraction", "⚠️")
+                if not self.extract_and_repack_squashfs(squashfs_file, edits):
+                    return False
+            
+        new_size = squashfs_file.stat().st_size
+        self.log(f"New squashfs created: {new_size:,} bytes", "✅")
+        
+        if estimate:
+            low, high = (bound - image_bytes_saved for bound in estimate.size_band)
+            predicted = estimate.predicted_bytes - image_bytes_saved
+            inside = "inside" if low <= new_size <= high else "outside"
+            self.log(f"Actual size {inside} predicted band ({new_size / predicted:.2%} of estimate)", "📊")
+        else:
+            self.report_size_comparison(new_size, target_size, "Actual")
+        
+        # Casper wants installed (uncompressed) sizes: read them from the
+        # inode tables of every layer, no extraction or du needed
+        self.casper_metadata = CasperMetadata(casper_dir, log=self.log)
+        self.installed_sizes = self.casper_metadata.regenerate()
         
-        # Remove old squashfs
-        squashfs_file.unlink()
+        self.log("Filesystem sizes updated", "✅")
         
-        # Try with minimal compression to get larger size like Cubic
-        success, error = self.run_sudo([
-            "mksquashfs", str(modified_dir), str(squashfs_file),
-            "-comp", "lzo",    # LZO compression is faster and less aggressive
-            "-b", "1048576",   # 1MB block size
-            "-noappend",
-            "-no-recovery"
-        ], "squashfs compression")
+        return True
         
+    def customize_rootfs(self, squashfs_file):
+        """Run --customize commands in the unpacked root and pack it back in the target format"""
+        self.log(f"Customizing live filesystem ({self.customize_file})", "🔧")
+        rootfs = self.work_dir / "customize_root"
+        if not extract_images([(squashfs_file, rootfs)], sudo=True, log=self.log):
+            return False
+        customizer = ChrootCustomizer(rootfs, mirror=self.apt_mirror, local_repo=self.local_repo,
+                                      sudo=True, log=self.log)
+        if not customizer.run(load_commands(self.customize_file)):
+            return False
+        # lzo/1M matches the final format, so the edits below take the incremental path
+        customized = squashfs_file.with_name(squashfs_file.name + ".custom")
+        success, _output = self.run_sudo(['mksquashfs', str(rootfs), str(customized), '-comp', 'lzo',
+                                          '-b', '1048576', '-noappend', '-no-progress'], "packing customized root")
         if not success:
-            self.log(f"Failed to compress squashfs: {error}", "❌")
             return False
-            
-        new_size = squashfs_file.stat().st_size
-        self.log(f"New squashfs created: {new_size:,} bytes", "✅")
+        self.run_sudo(['chown', f"{os.getuid()}:{os.getgid()}", str(customized)], "taking ownership of image")
+        os.replace(customized, squashfs_file)
+        return self.remove_tree(rootfs, "removing customized root")
         
-        # Check if we're closer to Cubic's 419MB target
-        target_size = 419_594_240  # Cubic's exact size
-        size_ratio = new_size / target_size
+    def incremental_repack_squashfs(self, squashfs_file, new_squashfs, edits):
+        """Rebuild reusing the base image's compressed blocks (same codec/block size only)"""
+        try:
+            with IncrementalSquashfsBuilder(squashfs_file, new_squashfs, "lzo", 1048576, log=self.log) as builder:
+                if not builder.reusable:
+                    self.log("Base image uses a different codec/block size, full recompression needed", "ℹ️")
+                    return False
+                builder.build(edits, self.boot_order)
+            return True
+        except SquashfsError as e:
+            self.log(f"Incremental rebuild unavailable: {e}", "⚠️")
+            new_squashfs.unlink(missing_ok=True)
+            return False
+        
+    def extract_and_repack_squashfs(self, squashfs_file, edits):
+        """Fallback for squashfs-tools without tar input: extract, modify, recompress.
+        
+        The extraction runs unprivileged; ownership, device nodes and xattrs are
+        restored by mksquashfs pseudo-file definitions generated from the image.
+        The edits' deletions (--slim) are left out of the extraction.
+        """
+        new_squashfs = squashfs_file.with_name(squashfs_file.name + ".new")
+        if not rebuild_unprivileged(
+            squashfs_file, new_squashfs, injections_from_edits(edits), self.work_dir / "squashfs_modified",
+            compressor="lzo",    # LZO compression is faster and less aggressive
+            block_size=1048576,  # 1MB block size
+            log=self.log,
+            order=self.boot_order,
+            deletions=edits.deletions
+        ):
+            new_squashfs.unlink(missing_ok=True)
+            return False
+        os.replace(new_squashfs, squashfs_file)
+        return True
+        
+    def remove_tree(self, path, description):
+        """Remove a work directory; sudo only for root-owned leftovers of older runs"""
+        try:
+            shutil.rmtree(path)
+            return True
+        except PermissionError:
+            success, _error = self.run_sudo(['rm', '-rf', str(path)], description)
+            return success
         
-        self.log(f"Size comparison: {size_ratio:.2%} of Cubic target", "📊")
+    def report_size_comparison(self, size, target_size, label):
+        """Log how a squashfs size compares with Cubic's and warn when far off"""
+        size_ratio = size / target_size
+        self.log(f"{label} size comparison: {size_ratio:.2%} of Cubic target", "📊")
         
         if size_ratio < 0.5:
             self.log("WARNING: Squashfs much smaller than expected", "⚠️")
@@ -306,23 +473,6 @@ Target size: ~419MB (like Cubic)
         else:
             self.log("Squashfs size within reasonable range", "✅")
         
-        # Update filesystem.size
-        size_file = casper_dir / "filesystem.size"
-        size_file.write_text(str(new_size))
-        
-        # Update ubuntu-server-minimal.size
-        minimal_size_file = casper_dir / "ubuntu-server-minimal.size"
-        minimal_size_file.write_text(str(new_size))
-        
-        self.log("Filesystem sizes updated", "✅")
-        
-        # FIXED: Cleanup with sudo since files may have root ownership
-        success, error = self.run_sudo(['rm', '-rf', str(modified_dir)], "cleanup extracted squashfs")
-        if not success:
-            self.log("Warning: Could not cleanup extracted files", "⚠️")
-        
-        return True
-        
     def cubic_step3_update_boot_configs(self):
         self.log("STEP 3: UPDATE ALL BOOT CONFIGURATIONS (FINAL FIX)", "⚙️")
         print("-" * 50)
@@ -330,56 +480,10 @@ Target size: ~419MB (like Cubic)
         extract_dir = self.work_dir / "extracted"
         
         # FIXED: Update ALL configuration files to fix legacy BIOS boot
-        configs_updated = 0
-        
-        # Find all .cfg files that might reference casper files
-        config_files = list(extract_dir.rglob("*.cfg"))
-        
-        for config_file in config_files:
-            try:
-                content = config_file.read_text()
-                original_content = content
-                
-                # Apply ALL the initrd/kernel redirections
-                content = content.replace(
-                    "initrd  /casper/initrd",
-                    "initrd  /casper/initrd.gz"
-                )
-                content = content.replace(
-                    "initrd=/casper/initrd",
-                    "initrd=/casper/initrd.gz"
-                )
-                content = content.replace(
-                    "/casper/initrd ",
-                    "/casper/initrd.gz "
-                )
-                content = content.replace(
-                    "linux   /casper/hwe-vmlinuz",
-                    "linux   /casper/vmlinuz"
-                )
-                content = content.replace(
-                    "linux=/casper/hwe-vmlinuz",
-                    "linux=/casper/vmlinuz"
-                )
-                content = content.replace(
-                    "initrd  /casper/hwe-initrd", 
-                    "initrd  /casper/initrd.gz"
-                )
-                content = content.replace(
-                    "initrd=/casper/hwe-initrd",
-                    "initrd=/casper/initrd.gz"
-                )
-                
-                # If content changed, write it back
-                if content != original_content:
-                    config_file.write_text(content)
-                    configs_updated += 1
-                    self.log(f"Updated config: {config_file.relative_to(extract_dir)}", "✅")
-                    
-            except Exception as e:
-                self.log(f"Could not update {config_file}: {e}", "⚠️")
-        
-        self.log(f"Updated {configs_updated} configuration files", "✅")
+        # Every menu entry boots the chosen kernel flavour (--kernel=ga|hwe); the
+        # other kernel and initrd are dropped from the ISO and md5sum.txt
+        report = KernelSelection(extract_dir, self.kernel_flavour, log=self.log).apply()
+        self.log(f"Updated {len(report['configs'])} configuration files", "✅")
         
         # Update install-sources.yaml (Cubic modifies this)
         casper_dir = extract_dir / "casper"
@@ -395,7 +499,7 @@ Target size: ~419MB (like Cubic)
   name:
     en: Cubic-Replica-Server 24.04.2 {datetime.now().strftime('%Y.%m.%d')}
   path: ubuntu-server-minimal.squashfs
-  size: {(casper_dir / 'ubuntu-server-minimal.squashfs').stat().st_size}
+  size: {self.installed_sizes['ubuntu-server-minimal']}
   type: fsimage
 """
             install_sources.write_text(cubic_sources)
@@ -443,65 +547,54 @@ Target size: ~419MB (like Cubic)
         
         extract_dir = self.work_dir / "extracted"
         
-        # Use exact xorriso command that works (from our previous investigation)
-        xorriso_cmd = [
-            "xorriso", "-as", "mkisofs",
-            "-r",
-            "-V", f"Cubic-Replica-v{self.version}",
-            "-J", "-joliet-long",
-            "-isohybrid-mbr", "/usr/lib/ISOLINUX/isohdpfx.bin",
-            "-c", "boot.catalog",
-            "-b", "boot/grub/i386-pc/eltorito.img",
-            "-no-emul-boot",
-            "-boot-load-size", "4",
-            "-boot-info-table",
-            "-eltorito-alt-boot",
-            "-e", "EFI/boot/bootx64.efi",
-            "-no-emul-boot",
-            "-isohybrid-gpt-basdat",
-            "-o", self.output_iso,
-            str(extract_dir)
-        ]
+        # The image is hashed as xorriso writes it, so the checks below never read it back
+        recipe = BuildRecipe(self.ubuntu_iso, self.output_iso, source_dir=extract_dir,
+                             volume_id=f"Cubic-Replica-v{self.version}", layout=self.layout, log=self.log)
         
         self.log("Building EFI-bootable ISO...", "⚙️")
-        result = subprocess.run(xorriso_cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            self.log(f"ISO creation failed: {result.stderr}", "❌")
+        if not recipe.build():
+            self.log("ISO creation failed", "❌")
             return False
             
-        if Path(self.output_iso).exists():
-            size = Path(self.output_iso).stat().st_size
-            self.log(f"ISO created: {self.output_iso} ({size:,} bytes)", "✅")
+        self.log(f"ISO created: {self.output_iso} ({recipe.digests['size']:,} bytes)", "✅")
+        
+        # Verify hybrid boot structure from the first sector, as it was written
+        self.log("Verifying EFI boot structure...", "🔍")
+        if recipe.head[:2] != b'\x00\x00':
+            self.log("MBR boot sector present", "✅")
+        else:
+            self.log("MBR boot sector missing", "❌")
             
-            # Verify hybrid boot structure
-            self.log("Verifying EFI boot structure...", "🔍")
-            mbr_check = subprocess.run([
-                "dd", f"if={self.output_iso}", "bs=512", "count=1"
-            ], capture_output=True)
+        # The DOS/MBR boot signature
+        if recipe.head[510:512] == b'\x55\xaa':
+            self.log("Hybrid boot structure confirmed", "✅")
+        else:
+            self.log("Hybrid boot structure missing", "❌")
             
-            if mbr_check.stdout[:2] != b'\x00\x00':
-                self.log("MBR boot sector present", "✅")
-            else:
-                self.log("MBR boot sector missing", "❌")
-                
-            # Check file type
-            file_check = subprocess.run(["file", self.output_iso], capture_output=True, text=True)
+        self.log(f"SHA-256 {recipe.digests['sha256']} recorded in SHA256SUMS", "🔏")
+        return True
             
-            if "(DOS/MBR boot sector)" in file_check.stdout:
-                self.log("Hybrid boot structure confirmed", "✅")
-            else:
-                self.log("Hybrid boot structure missing", "❌")
-                
-            return True
-        else:
-            self.log("ISO file not created", "❌")
+    def profile_boot_order(self):
+        """Boot the new ISO headless, record its squashfs reads and save the order"""
+        self.log("PROFILING BOOT (headless QEMU)", "🔥")
+        if not HeadlessBoot.available():
+            self.log("qemu-system-x86_64 not found, skipping boot profile", "⚠️")
             return False
-            
+        previous = BootTrace.load(self.boot_trace_file) if self.boot_trace_file.exists() else None
+        trace, result = profile_boot(self.output_iso, log=self.log)
+        if not result.ready:
+            self.log(f"Boot did not complete: {result.reason} (serial log: {result.serial_log})", "❌")
+            return False
+        if previous:
+            self.log("Boot-phase reads, previous build → this build:", "📊")
+            compare_boot_traces(previous, trace, log=self.log)
+        trace.save(self.boot_trace_file)
+        self.log(f"Boot trace saved to {self.boot_trace_file}; the next build uses it", "✅")
+        return True
+        
     def cleanup(self):
         if self.work_dir.exists():
-            success, error = self.run_sudo(['rm', '-rf', str(self.work_dir)], "final cleanup")
-            if success:
+            if self.remove_tree(self.work_dir, "final cleanup"):
                 self.log("Cleanup completed", "🧹")
             else:
                 self.log("Warning: Cleanup failed", "⚠️")
@@ -536,6 +629,13 @@ Target size: ~419MB (like Cubic)
             if not self.cubic_step5_create_iso():
                 return False
                 
+            # The profiling boot doubles as the boot test for initrd changes
+            if self.profile_boot:
+                if not self.profile_boot_order() and self.initrd_modified and HeadlessBoot.available():
+                    return False
+            elif self.initrd_modified and not self.verify_boot():
+                return False
+                
             duration = datetime.now() - self.start_time
             
             print("\n" + "=" * 50)
@@ -14,6 +14,8 @@ from pathlib import Path
 from datetime import datetime
 import tempfile
 
+from build_recipe import BuildRecipe, host_tools
+
 class CubicReplicaCLIFixed:
     def __init__(self):
         self.version = "1.1-FIXED"
@@ -41,9 +43,9 @@ class CubicReplicaCLIFixed:
                 print(f"❌ {tool}: Missing")
                 missing_tools.append(tool)
                 
-        # Check for isolinux MBR file
-        mbr_file = Path("/usr/lib/ISOLINUX/isohdpfx.bin")
-        if mbr_file.exists():
+        # Check for isolinux MBR file (only the generic hybrid fallback needs it)
+        mbr_file = host_tools()["isohdpfx"]
+        if mbr_file:
             print(f"✅ MBR boot file: {mbr_file}")
         else:
             print(f"❌ MBR boot file missing")
@@ -54,6 +56,7 @@ class CubicReplicaCLIFixed:
             try:
                 subprocess.run(['sudo', 'apt', 'update'], check=True)
                 subprocess.run(['sudo', 'apt', 'install', '-y', 'p7zip-full', 'squashfs-tools', 'xorriso', 'isolinux', 'wget'], check=True)
+                host_tools.cache_clear()
                 self.log("Dependencies installed successfully", "✅")
             except subprocess.CalledProcessError as e:
                 self.log(f"Failed to install dependencies: {e}", "❌")
@@ -343,60 +346,32 @@ Boot test: Cubic Replica should now work with EFI.
         
         extract_dir = self.work_dir / "extracted"
         
-        # Use exact xorriso command that works (from our previous investigation)
-        xorriso_cmd = [
-            "xorriso", "-as", "mkisofs",
-            "-r",
-            "-V", f"Cubic-Replica-Fixed-v{self.version}",
-            "-J", "-joliet-long",
-            "-isohybrid-mbr", "/usr/lib/ISOLINUX/isohdpfx.bin",
-            "-c", "boot.catalog",
-            "-b", "boot/grub/i386-pc/eltorito.img",
-            "-no-emul-boot",
-            "-boot-load-size", "4",
-            "-boot-info-table",
-            "-eltorito-alt-boot",
-            "-e", "EFI/boot/bootx64.efi",
-            "-no-emul-boot",
-            "-isohybrid-gpt-basdat",
-            "-o", self.output_iso,
-            str(extract_dir)
-        ]
+        # The image is hashed as xorriso writes it, so the checks below never read it back
+        recipe = BuildRecipe(self.ubuntu_iso, self.output_iso, source_dir=extract_dir,
+                             volume_id=f"Cubic-Replica-Fixed-v{self.version}", log=self.log)
         
         self.log("Building CORRECTED EFI-bootable ISO...", "⚙️")
-        result = subprocess.run(xorriso_cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            self.log(f"ISO creation failed: {result.stderr}", "❌")
+        if not recipe.build():
+            self.log("ISO creation failed", "❌")
             return False
             
-        if Path(self.output_iso).exists():
-            size = Path(self.output_iso).stat().st_size
-            self.log(f"CORRECTED ISO created: {self.output_iso} ({size:,} bytes)", "✅")
-            
-            # Verify hybrid boot structure
-            self.log("Verifying EFI boot structure...", "🔍")
-            mbr_check = subprocess.run([
-                "dd", f"if={self.output_iso}", "bs=512", "count=1"
-            ], capture_output=True)
-            
-            if mbr_check.stdout[:2] != b'\x00\x00':
-                self.log("MBR boot sector present", "✅")
-            else:
-                self.log("MBR boot sector missing", "❌")
-                
-            # Check file type
-            file_check = subprocess.run(["file", self.output_iso], capture_output=True, text=True)
+        self.log(f"CORRECTED ISO created: {self.output_iso} ({recipe.digests['size']:,} bytes)", "✅")
+        
+        # Verify hybrid boot structure from the first sector, as it was written
+        self.log("Verifying EFI boot structure...", "🔍")
+        if recipe.head[:2] != b'\x00\x00':
+            self.log("MBR boot sector present", "✅")
+        else:
+            self.log("MBR boot sector missing", "❌")
             
-            if "(DOS/MBR boot sector)" in file_check.stdout:
-                self.log("Hybrid boot structure confirmed", "✅")
-            else:
-                self.log("Hybrid boot structure missing", "❌")
-                
-            return True
+        # The DOS/MBR boot signature
+        if recipe.head[510:512] == b'\x55\xaa':
+            self.log("Hybrid boot structure confirmed", "✅")
         else:
-            self.log("ISO file not created", "❌")
-            return False
+            self.log("Hybrid boot structure missing", "❌")
+            
+        self.log(f"SHA-256 {recipe.digests['sha256']} recorded in SHA256SUMS", "🔏")
+        return True
             
     def cleanup(self):
         if self.work_dir.exists():
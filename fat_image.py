@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+FAT IMAGE v1.0
+Builds FAT12/16/32 images (efiboot.img) in-process: no mkfs, no loop mount,
+no sudo.
+
+The image is sized to its contents: every file and directory gets exactly
+the clusters it needs, the FAT type follows from the resulting cluster
+count (as the FAT spec defines it), and nothing else is reserved unless
+`slack` asks for free space.  The layout is planned first, so boot sector,
+FATs, root directory and data clusters are then written in one sequential
+pass with every chain contiguous.
+
+Timestamps come from SOURCE_DATE_EPOCH (default 1980-01-01) and the volume
+serial from the contents, so identical inputs give identical images.
+That makes images cacheable: `build_cached` keys them by the hashes of the
+input files plus every layout parameter and, on a hit, places the cached
+image into the workspace (reflink, hardlink or copy) instead of writing it.
+"""
+
+import os
+import sys
+import time
+import struct
+import hashlib
+from pathlib import Path
+
+from build_cache import BuildCache, cache_key, file_digest
+
+VERSION = "1.0"
+
+SECTOR = 512
+FAT12_MAX = 4084
+FAT16_MAX = 65524
+# Drivers disagree right at the type boundaries; stay clear of them
+BOUNDARY_MARGIN = 16
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_VOLUME = 0x08
+ATTR_LFN = 0x0F
+SHORT_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789$%'-_@~`!(){}^#&")
+
+
+def _fat_datetime(epoch):
+    tm = time.gmtime(max(epoch, 315532800))
+    date = (tm.tm_year - 1980) << 9 | tm.tm_mon << 5 | tm.tm_mday
+    clock = tm.tm_hour << 11 | tm.tm_min << 5 | tm.tm_sec // 2
+    return date, clock
+
+
+def _lfn_checksum(short_name):
+    total = 0
+    for byte in short_name:
+        total = ((total & 1) << 7) + (total >> 1) + byte & 0xFF
+    return total
+
+
+class FatNode:
+    """A file or directory in the planned image"""
+
+    def __init__(self, name, is_dir=False, source=None, data=None):
+        self.name = name
+        self.is_dir = is_dir
+        self.source = source
+        self.data = data
+        self.children = {}
+        self.cluster = 0
+        self.clusters = 0
+        self.short_name = None
+        self.case_flags = 0
+        self.lfn = False
+
+    @property
+    def size(self):
+        if self.is_dir:
+            return 0
+        return len(self.data) if self.data is not None else Path(self.source).stat().st_size
+
+    def entry_slots(self):
+        """32-byte directory entries this node takes in its parent"""
+        return 1 + (-(-len(self.name) // 13) if self.lfn else 0)
+
+
+def _short_names(children):
+    """Assign 8.3 names; names that fit use NT case flags, others get LFN + BASIS~N"""
+    used = set()
+    for node in children:
+        base, dot, ext = node.name.rpartition(".") if "." in node.name[1:] else (node.name, "", "")
+        fits = (0 < len(base) <= 8 and len(ext) <= 3 and set(base.upper()) <= SHORT_CHARS
+                and set(ext.upper()) <= SHORT_CHARS and base not in (".", ".."))
+        flags = 0
+        if fits:
+            for part, lower_flag in ((base, 0x08), (ext, 0x10)):
+                if part != part.upper():
+                    if part != part.lower():
+                        fits = False
+                    flags |= lower_flag
+        if fits:
+            short = base.upper().ljust(8) + ext.upper().ljust(3)
+            if short not in used:
+                node.short_name, node.case_flags = short.encode("ascii"), flags
+                used.add(short)
+                continue
+        clean = lambda text: "".join(c for c in text.upper() if c in SHORT_CHARS)
+        stem, extension = clean(base) or "FILE", clean(ext)[:3]
+        for number in range(1, 1000000):
+            tail = f"~{number}"
+            short = (stem[:8 - len(tail)] + tail).ljust(8) + extension.ljust(3)
+            if short not in used:
+                break
+        node.short_name, node.lfn = short.encode("ascii"), True
+        used.add(short)
+
+
+class FatImageBuilder:
+    """Collects files, plans a minimal FAT layout and writes it in one pass"""
+
+    def __init__(self, label="EFIBOOT", fat_type=None, cluster_size=None, slack=0, epoch=None):
+        self.label = label.upper()[:11].ljust(11).encode("ascii")
+        self.fat_type = fat_type
+        self.cluster_size = cluster_size
+        self.slack = slack
+        epoch = epoch if epoch is not None else int(os.environ.get("SOURCE_DATE_EPOCH", 315532800))
+        self.date, self.clock = _fat_datetime(epoch)
+        self.root = FatNode("", is_dir=True)
+
+    def _node(self, path, create_dirs=True):
+        node = self.root
+        for part in [p for p in str(path).split("/") if p]:
+            if part not in node.children:
+                if not create_dirs:
+                    raise KeyError(path)
+                node.children[part] = FatNode(part, is_dir=True)
+            node = node.children[part]
+            if not node.is_dir:
+                raise ValueError(f"{path}: {part} is a file")
+        return node
+
+    def add_directory(self, path):
+        return self._node(path)
+
+    def add_file(self, path, source=None, data=None):
+        """Add `path` from a local file or bytes"""
+        parent, _, name = str(path).strip("/").rpartition("/")
+        node = FatNode(name, source=source, data=data)
+        if node.size >= 1 << 32:
+            raise ValueError(f"{path}: FAT files must be smaller than 4 GiB")
+        self._node(parent).children[name] = node
+        return node
+
+    def add_tree(self, source_dir, dest="", exclude=()):
+        """Add a directory tree (files and subdirectories) under `dest`"""
+        source_dir = Path(source_dir)
+        self.add_directory(dest)
+        for path in sorted(source_dir.rglob("*")):
+            relative = path.relative_to(source_dir).as_posix()
+            if path.name in exclude:
+                continue
+            target = f"{dest.strip('/')}/{relative}".strip("/")
+            if path.is_dir():
+                self.add_directory(target)
+            elif path.is_file():
+                self.add_file(target, source=path)
+
+    # -- layout ------------------------------------------------------------
+
+    def _walk(self, node=None):
+        node = node or self.root
+        yield node
+        for child in node.children.values():
+            if child.is_dir:
+                yield from self._walk(child)
+            else:
+                yield child
+
+    def _plan(self):
+        for node in self._walk():
+            if node.is_dir:
+                _short_names(node.children.values())
+        if self.cluster_size or self.fat_type is None:
+            return self._plan_with(self.cluster_size or SECTOR)
+        # A forced FAT type gets the smallest cluster size its cluster limit allows
+        for shift in range(9, 16):
+            try:
+                return self._plan_with(1 << shift)
+            except ValueError:
+                continue
+        raise ValueError(f"Contents do not fit FAT{self.fat_type}")
+
+    def _plan_with(self, cluster_size):
+        root_slots = 1 + sum(child.entry_slots() for child in self.root.children.values())
+
+        def data_clusters(root_in_data):
+            total = 0
+            for node in self._walk():
+                if node.is_dir:
+                    if node is self.root and not root_in_data:
+                        continue
+                    slots = sum(child.entry_slots() for child in node.children.values())
+                    slots += 1 if node is self.root else 2
+                    node.clusters = -(-slots * 32 // cluster_size)
+                else:
+                    node.clusters = -(-node.size // cluster_size)
+                total += node.clusters
+            return total + -(-self.slack // cluster_size)
+
+        count = data_clusters(root_in_data=False)
+        fat_type = self.fat_type or (12 if count <= FAT12_MAX else 16 if count <= FAT16_MAX else 32)
+        if fat_type == 32:
+            count = data_clusters(root_in_data=True)
+        minimum = {12: 1, 16: FAT12_MAX + 1, 32: FAT16_MAX + 1}[fat_type]
+        maximum = {12: FAT12_MAX, 16: FAT16_MAX, 32: 0x0FFFFFF5}[fat_type]
+        padded = max(count, minimum + (BOUNDARY_MARGIN if fat_type != 12 else 0))
+        if fat_type != 32 and padded > maximum - BOUNDARY_MARGIN:
+            raise ValueError(f"Contents need {count} clusters, too many for FAT{fat_type}")
+        self.layout = {
+            "fat_type": fat_type,
+            "cluster_size": cluster_size,
+            "clusters": padded,
+            "used_clusters": count - -(-self.slack // cluster_size),
+            "root_entries": 0 if fat_type == 32 else -(-root_slots // 16) * 16,
+            "reserved": 32 if fat_type == 32 else 1,
+            "fat_sectors": -(-((padded + 2) * fat_type // 8 + 1) // SECTOR),
+        }
+        # Clusters in walk order: each directory, then its files, then subdirectories
+        next_cluster = 2
+        for node in self._walk():
+            if node.clusters and (node is not self.root or fat_type == 32):
+                node.cluster = next_cluster
+                next_cluster += node.clusters
+        return self.layout
+
+    # -- writing -----------------------------------------------------------
+
+    def _boot_sector(self, total_sectors, serial):
+        layout = self.layout
+        fat32 = layout["fat_type"] == 32
+        spc = layout["cluster_size"] // SECTOR
+        sector = bytearray(SECTOR)
+        sector[0:3] = b"\xeb\x58\x90" if fat32 else b"\xeb\x3c\x90"
+        sector[3:11] = b"INSTYAML"
+        struct.pack_into("<HBHBHHBHHHI", sector, 11, SECTOR, spc, layout["reserved"], 2,
+                         layout["root_entries"], total_sectors if total_sectors < 65536 else 0, 0xF8,
+                         0 if fat32 else layout["fat_sectors"], 32, 64, 0)
+        struct.pack_into("<I", sector, 32, total_sectors if total_sectors >= 65536 else 0)
+        if fat32:
+            struct.pack_into("<IHHIHH", sector, 36, layout["fat_sectors"], 0, 0, self.root.cluster, 1, 6)
+            offset = 64
+        else:
+            offset = 36
+        struct.pack_into("<BBBI", sector, offset, 0x80, 0, 0x29, serial)
+        sector[offset + 7:offset + 18] = self.label
+        sector[offset + 18:offset + 26] = f"FAT{layout['fat_type']}".ljust(8).encode()
+        sector[510:512] = b"\x55\xaa"
+        return bytes(sector)
+
+    def _fsinfo(self):
+        free = self.layout["clusters"] - self.layout["used_clusters"]
+        sector = bytearray(SECTOR)
+        struct.pack_into("<I", sector, 0, 0x41615252)
+        struct.pack_into("<III", sector, 484, 0x61417272, free, 2 + self.layout["used_clusters"])
+        struct.pack_into("<I", sector, 508, 0xAA550000)
+        return bytes(sector)
+
+    def _fat(self):
+        fat_type, clusters = self.layout["fat_type"], self.layout["clusters"]
+        end = {12: 0xFFF, 16: 0xFFFF, 32: 0x0FFFFFFF}[fat_type]
+        entries = [0] * (clusters + 2)
+        entries[0], entries[1] = end & ~0xFF | 0xF8, end
+        for node in self._walk():
+            for index in range(node.cluster, node.cluster + node.clusters if node.cluster else 0):
+                entries[index] = index + 1
+            if node.cluster:
+                entries[node.cluster + node.clusters - 1] = end
+        if fat_type == 12:
+            entries.append(0)
+            table = bytearray()
+            for index in range(0, len(entries) - 1, 2):
+                pair = entries[index] | entries[index + 1] << 12
+                table += pair.to_bytes(3, "little")
+        else:
+            table = b"".join(entry.to_bytes(fat_type // 8, "little") for entry in entries)
+        return bytes(table).ljust(self.layout["fat_sectors"] * SECTOR, b"\0")
+
+    def _entry(self, short_name, attr, cluster=0, size=0, case_flags=0):
+        return struct.pack("<11sBBBHHHHHHHI", short_name, attr, case_flags, 0, self.clock, self.date, self.date,
+                           cluster >> 16, self.clock, self.date, cluster & 0xFFFF, size)
+
+    def _directory(self, node, parent):
+        entries = []
+        if node is self.root:
+            entries.append(self._entry(self.label, ATTR_VOLUME))
+        else:
+            entries.append(self._entry(b".          ", ATTR_DIRECTORY, node.cluster))
+            entries.append(self._entry(b"..         ", ATTR_DIRECTORY, 0 if parent is self.root else parent.cluster))
+        for child in node.children.values():
+            if child.lfn:
+                checksum = _lfn_checksum(child.short_name)
+                units = list(struct.unpack(f"<{len(child.name)}H", child.name.encode("utf-16-le")))
+                units += [0] if len(units) % 13 else []
+                units += [0xFFFF] * (-len(units) % 13)
+                pieces = [units[i:i + 13] for i in range(0, len(units), 13)]
+                for order in range(len(pieces), 0, -1):
+                    piece = pieces[order - 1]
+                    sequence = order | (0x40 if order == len(pieces) else 0)
+                    entries.append(struct.pack("<B5HBBB6HH2H", sequence, *piece[:5], ATTR_LFN, 0, checksum,
+                                               *piece[5:11], 0, *piece[11:13]))
+            attr = ATTR_DIRECTORY if child.is_dir else ATTR_ARCHIVE
+            entries.append(self._entry(child.short_name, attr, child.cluster, child.size, child.case_flags))
+        return b"".join(entries)
+
+    def build(self, output):
+        """Write the image; returns the layout dict (plus 'bytes' and 'seconds')"""
+        started = time.time()
+        layout = self._plan()
+        cluster_size = layout["cluster_size"]
+        root_sectors = layout["root_entries"] * 32 // SECTOR
+        total_sectors = (layout["reserved"] + 2 * layout["fat_sectors"] + root_sectors
+                         + layout["clusters"] * cluster_size // SECTOR)
+        fingerprint = hashlib.sha256()
+        for node in self._walk():
+            fingerprint.update(f"{node.name}:{node.size}:{node.cluster}".encode())
+        serial = int.from_bytes(fingerprint.digest()[:4], "little")
+
+        parents = {id(child): node for node in self._walk() if node.is_dir for child in node.children.values()}
+        # `output` may be a hardlink to a cached image; replace the name instead of writing through it
+        Path(output).unlink(missing_ok=True)
+        with open(output, "wb") as image:
+            boot = self._boot_sector(total_sectors, serial)
+            image.write(boot)
+            if layout["fat_type"] == 32:
+                image.write(self._fsinfo())
+                image.write(b"\0" * SECTOR * 4)
+                image.write(boot)
+                image.write(self._fsinfo())
+                image.write(b"\0" * SECTOR * (layout["reserved"] - 8))
+            fat = self._fat()
+            image.write(fat)
+            image.write(fat)
+            if root_sectors:
+                image.write(self._directory(self.root, None).ljust(root_sectors * SECTOR, b"\0"))
+            # Data region: nodes were given clusters in walk order, so this is sequential
+            for node in self._walk():
+                if not node.cluster:
+                    continue
+                span = node.clusters * cluster_size
+                if node.is_dir:
+                    image.write(self._directory(node, parents.get(id(node))).ljust(span, b"\0"))
+                elif node.data is not None:
+                    image.write(node.data.ljust(span, b"\0"))
+                else:
+                    with open(node.source, "rb") as source:
+                        written = 0
+                        for chunk in iter(lambda: source.read(1 << 20), b""):
+                            image.write(chunk)
+                            written += len(chunk)
+                    image.write(b"\0" * (span - written))
+            image.truncate(total_sectors * SECTOR)
+        layout["bytes"] = total_sectors * SECTOR
+        layout["seconds"] = time.time() - started
+        return layout
+
+    def content_key(self):
+        """Cache key: every path with its content hash, plus all layout parameters"""
+        def entries(node, prefix):
+            for name, child in sorted(node.children.items()):
+                path = f"{prefix}/{name}"
+                if child.is_dir:
+                    yield path, "dir"
+                    yield from entries(child, path)
+                elif child.data is not None:
+                    yield path, hashlib.sha256(child.data).hexdigest()
+                else:
+                    yield path, file_digest(child.source)
+        return cache_key("fat-image", VERSION, list(entries(self.root, "")), self.label.decode(),
+                         self.fat_type, self.cluster_size, self.slack, self.date, self.clock)
+
+    def build_cached(self, output, cache=None):
+        """`build` through the "efi-images" cache; the layout gains 'cached' (placement method or None)"""
+        started = time.time()
+        cache = cache or BuildCache("efi-images")
+        key = self.content_key()
+        layout = cache.get_json(key)
+        method = cache.materialize(key, output, ".img") if layout else None
+        if method:
+            layout.update(cached=method, seconds=time.time() - started)
+            return layout
+        layout = self.build(output)
+        cache.put_file(key, output, ".img")
+        cache.put_json(key, layout)
+        layout["cached"] = None
+        return layout
+
+
+def build_efi_image(iso_root, output, include_ubuntu=False, grub_cfg=None, label="EFIBOOT", use_cache=True, log=None):
+    """efiboot.img from an extracted ISO: EFI/boot (+ EFI/ubuntu, + a grub.cfg)"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    iso_root = Path(iso_root)
+    builder = FatImageBuilder(label=label)
+    # The image may be written into EFI/boot itself; never pack an old copy
+    builder.add_tree(iso_root / "EFI" / "boot", "EFI/boot", exclude={Path(output).name, "efiboot.img"})
+    if include_ubuntu and (iso_root / "EFI" / "ubuntu").is_dir():
+        builder.add_tree(iso_root / "EFI" / "ubuntu", "EFI/ubuntu")
+    if grub_cfg is not None:
+        builder.add_file("EFI/ubuntu/grub.cfg", source=grub_cfg)
+    layout = builder.build_cached(output) if use_cache else builder.build(output)
+    source = f"from cache ({layout['cached']})" if layout.get("cached") else "built"
+    log(f"{Path(output).name}: FAT{layout['fat_type']}, {layout['bytes']:,} bytes "
+        f"({layout['used_clusters']:,} clusters) {source} in {layout['seconds'] * 1000:.0f} ms", "💾")
+    return layout
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: fat_image.py <extracted_iso_dir> <efiboot.img> [--ubuntu] [--grub-cfg=FILE] [--label=NAME] [--no-cache]")
+        print("       fat_image.py --tree <dir> <image> [--fat=12|16|32] [--slack=BYTES]")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if "--tree" in sys.argv:
+        builder = FatImageBuilder(label=options.get("label", "NO NAME"),
+                                  fat_type=int(options["fat"]) if "fat" in options else None,
+                                  slack=int(options.get("slack", 0)))
+        builder.add_tree(args[0])
+        layout = builder.build(args[1])
+        print(f"💾 FAT{layout['fat_type']}: {layout['bytes']:,} bytes in {layout['seconds'] * 1000:.0f} ms")
+        return 0
+    build_efi_image(args[0], args[1], include_ubuntu="--ubuntu" in sys.argv, grub_cfg=options.get("grub-cfg"),
+                    label=options.get("label", "EFIBOOT"), use_cache="--no-cache" not in sys.argv)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+HEADLESS BOOT v1.0
+Boots an ISO in QEMU without a display and waits for the live system.
+
+The kernel and initrd are taken out of the ISO and booted directly with
+console=ttyS0, so the serial log shows the whole boot regardless of the
+ISO's GRUB/isolinux console settings; the ISO itself is attached as the
+CD-ROM casper boots from.  `boot_mode="iso"` boots through the ISO's own
+boot loader instead (BIOS or UEFI) to check the boot chain itself.
+
+Optionally records every guest read of the CD-ROM through QEMU's
+blk_co_preadv trace event, which boot_trace.py maps to squashfs files.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from pathlib import Path
+
+VERSION = "1.0"
+
+# Serial console lines that mean the live system is up
+READY_PATTERNS = [
+    r"subiquity",
+    r"login:",
+    r"Reached target .*Multi-User System",
+]
+PANIC_PATTERNS = [
+    r"Kernel panic",
+    r"\(initramfs\)",
+    r"Unable to find a medium containing a live file system",
+]
+OVMF_PATHS = [
+    "/usr/share/OVMF/OVMF_CODE.fd", "/usr/share/OVMF/OVMF_CODE_4M.fd",
+    "/usr/share/ovmf/OVMF.fd", "/usr/share/qemu/OVMF.fd",
+]
+TRACE_PATTERN = re.compile(r"blk_co_preadv .*?offset (\d+) bytes (\d+)")
+
+
+class BootResult:
+    """Outcome of one headless boot"""
+
+    def __init__(self, ready, seconds, reason, serial_log, trace_file=None):
+        self.ready = ready
+        self.seconds = seconds
+        self.reason = reason
+        self.serial_log = serial_log
+        self.trace_file = trace_file
+
+    def reads(self):
+        """[(offset, bytes)] of guest CD-ROM reads in issue order"""
+        if not self.trace_file or not Path(self.trace_file).exists():
+            return []
+        reads = []
+        with open(self.trace_file, errors="replace") as handle:
+            for line in handle:
+                match = TRACE_PATTERN.search(line)
+                if match:
+                    reads.append((int(match.group(1)), int(match.group(2))))
+        return reads
+
+    def summary(self):
+        state = "ready" if self.ready else "FAILED"
+        return f"{state} after {self.seconds:.1f}s ({self.reason})"
+
+
+def find_ovmf():
+    return next((path for path in OVMF_PATHS if Path(path).exists()), None)
+
+
+def extract_from_iso(iso, iso_path, dest):
+    """Copy one file out of an ISO with xorriso (no mount, no sudo)"""
+    result = subprocess.run(["xorriso", "-osirrox", "on", "-indev", str(iso),
+                             "-extract", iso_path, str(dest)], capture_output=True, text=True)
+    return result.returncode == 0 and Path(dest).exists()
+
+
+class HeadlessBoot:
+    """QEMU boot of an ISO with a serial console and optional read tracing"""
+
+    def __init__(self, iso, memory=4096, cpus=2, timeout=900, boot_mode="kernel", uefi=False,
+                 kernel=("/casper/vmlinuz", "/casper/hwe-vmlinuz"),
+                 initrd=("/casper/initrd", "/casper/initrd.gz", "/casper/hwe-initrd"), append="boot=casper",
+                 ready_patterns=None, drive_options=None, log=None):
+        self.iso = Path(iso)
+        self.memory = memory
+        self.cpus = cpus
+        self.timeout = timeout
+        self.boot_mode = boot_mode
+        self.uefi = uefi
+        self.kernel = kernel
+        self.initrd = initrd
+        self.append = append
+        # Extra -drive options for the CD-ROM, e.g. throttling.* to behave like a slow stick
+        self.drive_options = drive_options
+        self.ready = re.compile("|".join(ready_patterns or READY_PATTERNS))
+        self.panic = re.compile("|".join(PANIC_PATTERNS))
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+
+    @staticmethod
+    def available():
+        return shutil.which("qemu-system-x86_64") is not None
+
+    def _command(self, work_dir, trace_file):
+        command = ["qemu-system-x86_64", "-m", str(self.memory), "-smp", str(self.cpus),
+                   "-display", "none", "-serial", "stdio", "-monitor", "none", "-no-reboot",
+                   "-drive", f"file={self.iso},media=cdrom,readonly=on,if=ide,index=1"
+                             f"{f',{self.drive_options}' if self.drive_options else ''}",
+                   "-netdev", "user,id=net0", "-device", "virtio-net-pci,netdev=net0"]
+        if os.access("/dev/kvm", os.R_OK | os.W_OK):
+            command += ["-enable-kvm", "-cpu", "host"]
+        if self.boot_mode == "kernel":
+            kernel, initrd = Path(work_dir) / "vmlinuz", Path(work_dir) / "initrd"
+            for candidates, dest in ((self.kernel, kernel), (self.initrd, initrd)):
+                # The build renames initrd -> initrd.gz, so accept any known name
+                if not any(extract_from_iso(self.iso, iso_path, dest) for iso_path in candidates):
+                    raise RuntimeError(f"Could not extract any of {', '.join(candidates)} from {self.iso}")
+            command += ["-kernel", str(kernel), "-initrd", str(initrd),
+                        "-append", f"{self.append} console=ttyS0,115200"]
+        else:
+            command += ["-boot", "d"]
+            if self.uefi:
+                ovmf = find_ovmf()
+                if ovmf is None:
+                    raise RuntimeError("UEFI boot requested but no OVMF firmware found")
+                command += ["-bios", ovmf]
+        if trace_file:
+            command += ["-trace", f"enable=blk_co_preadv,file={trace_file}"]
+        return command
+
+    def run(self, trace_file=None, serial_log=None):
+        """Boot until a ready/panic line or the timeout; returns a BootResult"""
+        work_dir = tempfile.mkdtemp(prefix="headless_boot_")
+        serial_log = Path(serial_log or Path(work_dir) / "serial.log")
+        try:
+            command = self._command(work_dir, trace_file)
+            self.log(f"Booting {self.iso.name} headless ({self.boot_mode}"
+                     f"{', UEFI' if self.uefi else ''}, timeout {self.timeout}s)", "🖥️")
+            started = time.time()
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       stdin=subprocess.DEVNULL)
+            os.set_blocking(process.stdout.fileno(), False)
+            ready, reason = False, "timeout"
+            pending = b""
+            with open(serial_log, "wb") as log_file:
+                while time.time() - started < self.timeout:
+                    chunk = process.stdout.read()
+                    if chunk:
+                        log_file.write(chunk)
+                        lines = (pending + chunk).split(b"\n")
+                        pending = lines.pop()
+                        text = b"\n".join(lines + [pending]).decode(errors="replace")
+                        if self.ready.search(text):
+                            ready, reason = True, self.ready.search(text).group(0)
+                            break
+                        if self.panic.search(text):
+                            reason = self.panic.search(text).group(0)
+                            break
+                    elif process.poll() is not None:
+                        reason = f"qemu exited with {process.returncode}"
+                        break
+                    else:
+                        time.sleep(0.2)
+            seconds = time.time() - started
+            process.kill()
+            process.wait()
+            result = BootResult(ready, seconds, reason, serial_log, trace_file)
+            self.log(f"Headless boot {result.summary()}", "✅" if ready else "❌")
+            return result
+        finally:
+            for name in ("vmlinuz", "initrd"):
+                (Path(work_dir) / name).unlink(missing_ok=True)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: headless_boot.py <iso> [--iso-boot] [--uefi] [--timeout=SECONDS] [--trace=FILE]")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    if not HeadlessBoot.available():
+        print("❌ qemu-system-x86_64 not found (sudo apt install qemu-system-x86)")
+        return 1
+    boot = HeadlessBoot(sys.argv[1], timeout=int(options.get("timeout", 900)),
+                        boot_mode="iso" if "--iso-boot" in sys.argv else "kernel", uefi="--uefi" in sys.argv)
+    result = boot.run(trace_file=options.get("trace"))
+    print(f"📄 Serial log: {result.serial_log}")
+    return 0 if result.ready else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
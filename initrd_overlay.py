@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+INITRD OVERLAY v1.0
+Adds files to a casper initrd without unpacking it.
+
+The kernel unpacks an initramfs as a sequence of cpio segments, each either
+plain or compressed on its own, with later entries replacing earlier ones.
+New files therefore go into a small newc cpio that is compressed separately
+and appended: the existing (microcode + main) segments stay byte for byte.
+
+Removing files is the only change that needs a repack: the compressed
+segments are decompressed, merged, filtered and written back as one segment
+with multi-threaded zstd.  Plain (early microcode) segments are kept as-is
+unless a removed path lives in them.
+"""
+
+import bz2
+import sys
+import lzma
+import stat
+import time
+import zlib
+import shutil
+import subprocess
+from pathlib import Path
+
+from squashfs_inject import load_injections
+from squashfs_stream import normalize
+
+VERSION = "1.0"
+
+NEWC_MAGIC = (b"070701", b"070702")
+TRAILER = "TRAILER!!!"
+HEADER_SIZE = 110
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+MAGICS = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (ZSTD_MAGIC, "zstd"),
+    (b"BZh", "bzip2"),
+    (b"\x02\x21\x4c\x18", "lz4"),
+    (b"\x5d\x00\x00", "lzma"),
+]
+# As initramfs-tools runs it: a low level, all cores (-T0)
+ZSTD_LEVEL = 1
+
+
+def _pad(length, alignment=4):
+    return -length % alignment
+
+
+def _zstd_frames_end(data, pos):
+    """End offset of the zstd frames starting at `pos`, found from block headers only"""
+    while data[pos:pos + 4] == ZSTD_MAGIC or (data[pos + 1:pos + 4] == b"\x2a\x4d\x18" and 0x50 <= data[pos] <= 0x5f):
+        if data[pos:pos + 4] != ZSTD_MAGIC:
+            # Skippable frame: 4-byte magic, 4-byte length
+            pos += 8 + int.from_bytes(data[pos + 4:pos + 8], "little")
+            continue
+        descriptor = data[pos + 4]
+        single_segment = descriptor >> 5 & 1
+        pos += 5 + (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 3]
+        pos += (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+        while True:
+            header = int.from_bytes(data[pos:pos + 3], "little")
+            block_type, size = header >> 1 & 3, header >> 3
+            pos += 3 + (1 if block_type == 1 else size)
+            if header & 1:
+                break
+        if descriptor & 4:
+            pos += 4
+    return pos
+
+
+def compression_of(data, pos=0):
+    return next((name for magic, name in MAGICS if data[pos:pos + len(magic)] == magic), None)
+
+
+def decompress_segment(data, pos, compression):
+    """(decompressed cpio bytes, end offset) of the compressed segment at `pos`"""
+    if compression == "zstd":
+        if shutil.which("zstd") is None:
+            raise ValueError("zstd initrd segments need the zstd tool (sudo apt install zstd)")
+        end = _zstd_frames_end(data, pos)
+        output = subprocess.run(["zstd", "-dc"], input=data[pos:end], capture_output=True, check=True).stdout
+        return output, end
+    if compression == "gzip":
+        decompressor = zlib.decompressobj(31)
+    elif compression in ("xz", "lzma"):
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_XZ if compression == "xz" else lzma.FORMAT_ALONE)
+    elif compression == "bzip2":
+        decompressor = bz2.BZ2Decompressor()
+    else:
+        raise ValueError(f"{compression} initrd segments cannot be repacked (appending still works)")
+    output = decompressor.decompress(data[pos:])
+    return output, len(data) - len(decompressor.unused_data)
+
+
+def compress_segment(data, compression):
+    """Compress one cpio segment; zstd runs multi-threaded, gzip is the fallback"""
+    if compression == "zstd" and shutil.which("zstd"):
+        return subprocess.run(["zstd", "-q", f"-{ZSTD_LEVEL}", "-T0", "-c"], input=data,
+                              capture_output=True, check=True).stdout
+    if compression == "xz":
+        # The kernel's xz decoder only handles CRC32 checks
+        return lzma.compress(data, check=lzma.CHECK_CRC32)
+    return zlib.compress(data, 9, wbits=31)
+
+
+class CpioEntry:
+    """One newc record"""
+
+    def __init__(self, name, mode, uid=0, gid=0, mtime=0, data=b"", nlink=1, ino=0, rdev=(0, 0), dev=(0, 0)):
+        self.name = name
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.data = data
+        self.nlink = nlink
+        self.ino = ino
+        self.rdev = rdev
+        self.dev = dev
+
+    def encode(self, ino=None):
+        name = self.name.encode() + b"\0"
+        fields = (ino if ino is not None else self.ino, self.mode, self.uid, self.gid, self.nlink, self.mtime,
+                  len(self.data), self.dev[0], self.dev[1], self.rdev[0], self.rdev[1], len(name), 0)
+        header = b"070701" + b"".join(b"%08X" % field for field in fields)
+        return (header + name + b"\0" * _pad(HEADER_SIZE + len(name))
+                + self.data + b"\0" * _pad(len(self.data)))
+
+
+def read_cpio(data, pos=0):
+    """Yield CpioEntry records of the newc archive at `pos`; returns the end offset"""
+    while True:
+        if data[pos:pos + 6] not in NEWC_MAGIC:
+            raise ValueError(f"Bad cpio header at offset {pos}")
+        fields = [int(data[pos + 6 + 8 * i:pos + 14 + 8 * i], 16) for i in range(13)]
+        ino, mode, uid, gid, nlink, mtime, size, dev_major, dev_minor, rdev_major, rdev_minor, name_size, _ = fields
+        name_start = pos + HEADER_SIZE
+        name = data[name_start:name_start + name_size - 1].decode("utf-8", "surrogateescape")
+        data_start = name_start + name_size + _pad(HEADER_SIZE + name_size)
+        pos = data_start + size + _pad(size)
+        if name == TRAILER:
+            return pos
+        yield CpioEntry(name, mode, uid, gid, mtime, data[data_start:data_start + size], nlink, ino,
+                        (rdev_major, rdev_minor), (dev_major, dev_minor))
+
+
+def read_archives(data):
+    """Yield CpioEntry records of every newc archive concatenated in `data`, skipping the zero padding
+
+    Concatenated zstd frames decompress as one stream, so a segment appended
+    right after a zstd main segment shows up here as a second archive.
+    """
+    pos = 0
+    while pos < len(data):
+        if data[pos] == 0:
+            pos += 1
+            continue
+        pos = yield from read_cpio(data, pos)
+
+
+def write_cpio(entries):
+    """newc archive bytes for `entries` (inode numbers renumbered, hard links kept)"""
+    inodes = {}
+    chunks = []
+    for entry in entries:
+        key = (entry.dev, entry.ino) if entry.nlink > 1 and not stat.S_ISDIR(entry.mode) else id(entry)
+        chunks.append(entry.encode(inodes.setdefault(key, len(inodes) + 1)))
+    chunks.append(CpioEntry(TRAILER, 0, nlink=1).encode(0))
+    archive = b"".join(chunks)
+    return archive + b"\0" * _pad(len(archive), 512)
+
+
+def overlay_entries(injections, mtime=None):
+    """Directories (parents first) and files for a list of FileInjection"""
+    mtime = int(mtime if mtime is not None else time.time())
+    entries, directories = [], set()
+    for injection in injections:
+        parts = injection.path.split("/")[:-1]
+        for depth in range(1, len(parts) + 1):
+            directory = "/".join(parts[:depth])
+            if directory not in directories:
+                directories.add(directory)
+                entries.append(CpioEntry(directory, stat.S_IFDIR | 0o755, mtime=mtime, nlink=2))
+        entries.append(CpioEntry(injection.path, stat.S_IFREG | injection.mode, injection.uid, injection.gid,
+                                 int(injection.mtime if injection.mtime is not None else mtime), injection.read()))
+    return entries
+
+
+class Initrd:
+    """A (possibly multi-segment) initramfs image"""
+
+    def __init__(self, path, log=None):
+        self.path = Path(path)
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+
+    def segments(self):
+        """[(start, end, compression or None)] in file order"""
+        data = self.path.read_bytes()
+        segments = []
+        pos = 0
+        while pos < len(data):
+            if data[pos] == 0:
+                pos += 1
+                continue
+            if data[pos:pos + 6] in NEWC_MAGIC:
+                reader = read_cpio(data, pos)
+                try:
+                    while True:
+                        next(reader)
+                except StopIteration as stop:
+                    end = stop.value
+                segments.append((pos, end, None))
+            else:
+                compression = compression_of(data, pos)
+                if compression is None:
+                    raise ValueError(f"{self.path}: unknown data at offset {pos}")
+                _cpio, end = decompress_segment(data, pos, compression)
+                segments.append((pos, end, compression))
+            pos = end
+        return segments
+
+    def main_compression(self):
+        return next((c for _s, _e, c in reversed(self.segments()) if c), "zstd")
+
+    def entries(self):
+        """{name: CpioEntry} of the unpacked view (later segments win)"""
+        data = self.path.read_bytes()
+        merged = {}
+        for start, end, compression in self.segments():
+            cpio = decompress_segment(data, start, compression)[0] if compression else data[start:end]
+            for entry in read_archives(cpio):
+                merged[normalize(entry.name) or "."] = entry
+        return merged
+
+    def append(self, injections, compression=None):
+        """Append one compressed segment with the injected files; returns its size"""
+        started = time.time()
+        compression = compression or self.main_compression()
+        segment = compress_segment(write_cpio(overlay_entries(injections)), compression)
+        with open(self.path, "ab") as handle:
+            handle.write(b"\0" * _pad(handle.tell()))
+            handle.write(segment)
+        self.log(f"Appended {len(injections)} files to {self.path.name} as a {len(segment):,}-byte "
+                 f"{compression} segment ({time.time() - started:.2f}s)", "📎")
+        return len(segment)
+
+    def repack(self, remove, injections=()):
+        """Rewrite without `remove` (paths or subtrees), adding `injections`; zstd -T0"""
+        started = time.time()
+        remove = [normalize(path) for path in remove]
+        doomed = lambda name: any(name == path or name.startswith(path + "/") for path in remove)
+        data = self.path.read_bytes()
+        early, merged, removed = [], {}, 0
+        for start, end, compression in self.segments():
+            if compression is None:
+                entries = list(read_cpio(data, start))
+                kept = [entry for entry in entries if not doomed(normalize(entry.name))]
+                removed += len(entries) - len(kept)
+                # Untouched early segments (microcode) stay byte-identical
+                early.append(data[start:end] if len(kept) == len(entries) else write_cpio(kept))
+                continue
+            for entry in read_archives(decompress_segment(data, start, compression)[0]):
+                merged[normalize(entry.name) or "."] = entry
+        main = {name: entry for name, entry in merged.items() if not doomed(name)}
+        removed += len(merged) - len(main)
+        self._keep_link_data(merged, main)
+        for entry in overlay_entries(injections):
+            # Existing directories keep their entry; files are replaced in place
+            if not (stat.S_ISDIR(entry.mode) and entry.name in main):
+                main[entry.name] = entry
+        segment = compress_segment(write_cpio(main.values()), "zstd")
+        output = self.path.with_name(self.path.name + ".new")
+        output.write_bytes(b"".join(part + b"\0" * _pad(len(part)) for part in early) + segment)
+        output.replace(self.path)
+        self.log(f"Repacked {self.path.name}: {removed} entries removed, {len(injections)} added "
+                 f"({len(data):,} → {self.path.stat().st_size:,} bytes, {time.time() - started:.1f}s)", "🗜️")
+        return removed
+
+    @staticmethod
+    def _keep_link_data(merged, kept):
+        """newc stores hard link data once; move it when the carrying name is removed"""
+        carriers = {(e.dev, e.ino): e.data for e in merged.values() if e.nlink > 1 and e.data}
+        survivors = {}
+        for entry in kept.values():
+            if entry.nlink > 1 and not stat.S_ISDIR(entry.mode):
+                survivors.setdefault((entry.dev, entry.ino), []).append(entry)
+        for key, entries in survivors.items():
+            if key in carriers and not any(entry.data for entry in entries):
+                entries[-1].data = carriers[key]
+
+    def apply(self, injections=(), remove=()):
+        """Append when only adding; repack only when something must go"""
+        if remove:
+            return self.repack(remove, injections)
+        if injections:
+            self.append(injections)
+        return 0
+
+    def verify(self, injections=(), remove=()):
+        """True when the unpacked view has the injected content and none of the removed paths"""
+        entries = self.entries()
+        for injection in injections:
+            entry = entries.get(injection.path)
+            if entry is None or entry.data != injection.read():
+                self.log(f"{self.path.name}: /{injection.path} missing or different", "❌")
+                return False
+        for path in remove:
+            path = normalize(path)
+            if any(name == path or name.startswith(path + "/") for name in entries):
+                self.log(f"{self.path.name}: /{path} still present", "❌")
+                return False
+        return True
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: initrd_overlay.py <initrd> list")
+        print("       initrd_overlay.py <initrd> add <injections.json>")
+        print("       initrd_overlay.py <initrd> remove <path> [path...] [--add=injections.json]")
+        return 1
+    initrd, command = Initrd(sys.argv[1]), sys.argv[2]
+    if command == "list":
+        for start, end, compression in initrd.segments():
+            print(f"📦 segment {start:>10,}-{end:<10,} {compression or 'plain'}")
+        for name, entry in sorted(initrd.entries().items()):
+            print(f"   {entry.mode:06o} {len(entry.data):>10,} {name}")
+        return 0
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[3:] if arg.startswith("--") and "=" in arg)
+    if command == "add":
+        injections = load_injections(sys.argv[3])
+        initrd.apply(injections)
+        return 0 if initrd.verify(injections) else 1
+    if command == "remove":
+        paths = [arg for arg in sys.argv[3:] if not arg.startswith("--")]
+        injections = load_injections(options["add"]) if "add" in options else []
+        initrd.apply(injections, paths)
+        return 0 if initrd.verify(injections, paths) else 1
+    print(f"Unknown command: {command}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+ISO PARTITIONS v1.0
+Reads the MBR/GPT partition tables of a hybrid ISO and extracts partitions.
+
+Ubuntu's 24.04 ISOs append a ready-made EFI system partition (a FAT image)
+after the ISO9660 data and describe it in both GPT and MBR.  Extracting it
+byte for byte gives a known-good ESP for the rebuilt ISO without building
+one.  Extraction uses copy_file_range, so the kernel copies (or, on btrfs
+and XFS, shares) the extents without passing the data through Python.
+"""
+
+import os
+import sys
+import struct
+import uuid
+from pathlib import Path
+
+VERSION = "1.0"
+
+SECTOR = 512
+MBR_ESP = 0xEF
+MBR_PROTECTIVE = 0xEE
+GPT_ESP = uuid.UUID("c12a7328-f81f-11d2-ba4b-00a0c93ec93b")
+GPT_BASIC_DATA = uuid.UUID("ebd0a0a2-b9e5-4433-87c0-68b6b72699c7")
+COPY_CHUNK = 1 << 30
+
+
+class Partition:
+    """One partition table entry, in bytes from the start of the image"""
+
+    def __init__(self, number, scheme, type_id, start, size, name=""):
+        self.number = number
+        self.scheme = scheme
+        self.type_id = type_id
+        self.start = start
+        self.size = size
+        self.name = name
+
+    @property
+    def is_esp(self):
+        return self.type_id in (MBR_ESP, GPT_ESP)
+
+    def describe(self):
+        kind = f"0x{self.type_id:02x}" if self.scheme == "mbr" else str(self.type_id)
+        esp = " (EFI system partition)" if self.is_esp else ""
+        label = f" '{self.name}'" if self.name else ""
+        return (f"{self.scheme.upper()} #{self.number}: type {kind}{label}, "
+                f"offset {self.start:,}, {self.size:,} bytes{esp}")
+
+
+def read_mbr(image):
+    """Primary MBR partitions (protective 0xEE entries included)"""
+    with open(image, "rb") as handle:
+        sector = handle.read(SECTOR)
+    if len(sector) < SECTOR or sector[510:512] != b"\x55\xaa":
+        return []
+    partitions = []
+    for number in range(4):
+        entry = sector[446 + number * 16:462 + number * 16]
+        type_id = entry[4]
+        start, count = struct.unpack_from("<II", entry, 8)
+        if type_id and count:
+            partitions.append(Partition(number + 1, "mbr", type_id, start * SECTOR, count * SECTOR))
+    return partitions
+
+
+def read_gpt(image):
+    """GPT partitions from the primary header at LBA 1 ([] when there is none)"""
+    with open(image, "rb") as handle:
+        handle.seek(SECTOR)
+        header = handle.read(92)
+        if len(header) < 92 or header[:8] != b"EFI PART":
+            return []
+        entries_lba, count, entry_size = struct.unpack_from("<QII", header, 72)
+        handle.seek(entries_lba * SECTOR)
+        table = handle.read(count * entry_size)
+    partitions = []
+    for number in range(count):
+        entry = table[number * entry_size:(number + 1) * entry_size]
+        if len(entry) < 128 or not entry[:16].strip(b"\0"):
+            continue
+        first, last = struct.unpack_from("<QQ", entry, 32)
+        name = entry[56:128].decode("utf-16-le", errors="replace").rstrip("\0")
+        partitions.append(Partition(number + 1, "gpt", uuid.UUID(bytes_le=entry[:16]),
+                                    first * SECTOR, (last - first + 1) * SECTOR, name))
+    return partitions
+
+
+def read_partitions(image):
+    """GPT entries when a GPT exists, else the MBR's"""
+    return read_gpt(image) or [part for part in read_mbr(image) if part.type_id != MBR_PROTECTIVE]
+
+
+def find_esp(image):
+    """The EFI system partition (GPT first, then MBR) or None"""
+    for partition in read_gpt(image) + read_mbr(image):
+        if partition.is_esp:
+            return partition
+    return None
+
+
+def copy_range(source, target, offset, size):
+    """Copy `size` bytes at `offset` of `source` into a new file `target`"""
+    Path(target).unlink(missing_ok=True)
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        copied = 0
+        try:
+            while copied < size:
+                count = os.copy_file_range(src.fileno(), dst.fileno(), min(COPY_CHUNK, size - copied),
+                                           offset + copied)
+                if count == 0:
+                    break
+                copied += count
+        except (AttributeError, OSError):
+            # Older Python/kernels or cross-filesystem limits: plain reads from where it stopped
+            src.seek(offset + copied)
+            dst.seek(copied)
+            while copied < size:
+                block = src.read(min(8 << 20, size - copied))
+                if not block:
+                    break
+                dst.write(block)
+                copied += len(block)
+    if copied != size:
+        raise ValueError(f"{source}: partition runs past the end of the image ({copied:,} of {size:,} bytes)")
+    return copied
+
+
+def extract_partition(image, partition, output):
+    copy_range(image, output, partition.start, partition.size)
+    return Path(output)
+
+
+def extract_esp(image, output, log=None):
+    """Write the image's EFI system partition to `output`; returns the path or None"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    if not Path(image).is_file():
+        log(f"{image} not found - no ESP to reuse", "⚠️")
+        return None
+    esp = find_esp(image)
+    if esp is None:
+        log(f"{Path(image).name} has no EFI system partition", "⚠️")
+        return None
+    with open(image, "rb") as handle:
+        handle.seek(esp.start)
+        boot = handle.read(SECTOR)
+    # FAT boot sector: jump instruction and 0x55AA signature
+    if boot[510:512] != b"\x55\xaa" or boot[0] not in (0xEB, 0xE9):
+        log(f"{esp.describe()} does not hold a FAT file system", "⚠️")
+        return None
+    extract_partition(image, esp, output)
+    log(f"Reused ESP from {Path(image).name}: {esp.size:,} bytes ({esp.scheme.upper()} #{esp.number})", "💽")
+    return Path(output)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: iso_partitions.py <image.iso> [--extract-esp=efi.img] [--extract=N:out.img]")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    image = sys.argv[1]
+    for partition in read_gpt(image) + read_mbr(image):
+        print(f"💽 {partition.describe()}")
+    if "extract-esp" in options:
+        return 0 if extract_esp(image, options["extract-esp"]) else 1
+    if "extract" in options:
+        number, output = options["extract"].split(":", 1)
+        partition = next((part for part in read_partitions(image) if part.number == int(number)), None)
+        if partition is None:
+            print(f"❌ No partition {number}")
+            return 1
+        extract_partition(image, partition, output)
+        print(f"✅ Partition {number} written to {output} ({partition.size:,} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+ISO PATCH v1.0
+Edits a few files of an existing ISO in place instead of rebuilding it.
+
+The output starts as a reflink (or plain copy) of the base ISO.  A
+replacement that fits in the file's old blocks is written over them; a
+larger one goes to space appended after the ISO9660 volume, and the
+appended EFI partition and backup GPT move behind it.  Every directory
+record of the file (primary/Rock Ridge, Joliet and the -partition_offset
+copies) gets the new extent and size.  New files can be added to
+directories that still have room in their allocated blocks.
+
+Afterwards the volume sizes, both GPT headers and tables (with their
+CRCs), the MBR entries, El Torito entries that point behind the volume
+and md5sum.txt are brought up to date.  Directories never move, so the
+path tables stay valid.  Editing grub.cfg or .disk/info of a 3 GB ISO
+takes well under a second.
+"""
+
+import os
+import sys
+import time
+import zlib
+import struct
+import hashlib
+from pathlib import Path
+
+from build_cache import place_file
+from iso_partitions import MBR_PROTECTIVE, SECTOR
+from iso_reader import BLOCK, FLAG_DIRECTORY, FLAG_MULTI_EXTENT, VD_PRIMARY, VD_SUPPLEMENTARY, IsoError, IsoImage
+from iso_writer import directory_record, iso_identifier, joliet_identifier, rock_ridge_entries
+
+VERSION = "1.0"
+
+CHUNK = 8 << 20
+GPT_HEADER = "<8sIIIIQQQQ16sQIII"
+
+
+def _both32(value):
+    return struct.pack("<I", value) + struct.pack(">I", value)
+
+
+def _blocks(size):
+    return -(-size // BLOCK)
+
+
+def _normalize(path):
+    return "/".join(part for part in str(path).split("/") if part not in ("", "."))
+
+
+class _Tree:
+    """One directory tree of the image: its descriptor, block bias and records by path"""
+
+    def __init__(self, block, bias, joliet, records):
+        self.block = block
+        self.bias = bias
+        self.joliet = joliet
+        self.records = records
+
+    def extent(self, record):
+        return struct.unpack_from("<I", record, 2)[0] + self.bias
+
+
+class IsoPatcher:
+    """Replace or add files of an ISO image file in place"""
+
+    def __init__(self, iso, update_md5sums=True, log=None):
+        self.iso = Path(iso)
+        self.update_md5sums = update_md5sums
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.changes = {}
+        self.mtime = int(os.environ.get("SOURCE_DATE_EPOCH", time.time()))
+
+    def replace(self, iso_path, data):
+        """Queue new content for `iso_path` (added when the ISO does not have it)"""
+        self.changes[_normalize(iso_path)] = bytes(data)
+
+    def replace_text(self, iso_path, text):
+        self.replace(iso_path, text.encode())
+
+    def replace_file(self, iso_path, local):
+        self.replace(iso_path, Path(local).read_bytes())
+
+    def replace_tree(self, overlay_dir, iso_root=""):
+        overlay_dir = Path(overlay_dir)
+        for path in sorted(overlay_dir.rglob("*")):
+            if path.is_file():
+                self.replace_file(f"{iso_root}/{path.relative_to(overlay_dir).as_posix()}", path)
+
+    # ------------------------------------------------------------------
+    # Planning
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _trees(image):
+        trees = []
+        starts = [16] + ([32] if image.has_partition_copy(16) else [])
+        for start in starts:
+            for block in range(start, start + 16):
+                descriptor = image.pread(block * BLOCK, BLOCK)
+                if descriptor[1:6] != b"CD001" or descriptor[0] == 255:
+                    break
+                joliet = descriptor[0] == VD_SUPPLEMENTARY and descriptor[88:90] == b"%/"
+                if descriptor[0] == VD_PRIMARY or joliet:
+                    trees.append(_Tree(block, start - 16, joliet, image.record_tree(descriptor, start - 16)))
+        return trees
+
+    def _md5sums(self, image):
+        """New md5sum.txt content covering the queued changes (None when there is nothing to do)"""
+        entry = image.lookup("md5sum.txt")
+        if entry is None or "md5sum.txt" in self.changes:
+            return None
+        lines, listed = [], set()
+        for line in image.read_file(entry).decode(errors="surrogateescape").splitlines():
+            parts = line.split(None, 1)
+            path = _normalize(parts[1].strip()) if len(parts) == 2 else ""
+            if path in self.changes:
+                line = f"{hashlib.md5(self.changes[path]).hexdigest()}  {parts[1].strip()}"
+                listed.add(path)
+            lines.append(line)
+        for path in sorted(set(self.changes) - listed):
+            lines.append(f"{hashlib.md5(self.changes[path]).hexdigest()}  ./{path}")
+        return ("\n".join(lines) + "\n").encode(errors="surrogateescape")
+
+    def _references(self, tree, path, extent):
+        """Records of `path` in one tree; trees with truncated names are matched by extent"""
+        found = tree.records.get(path)
+        if found is None:
+            found = [item for name, items in tree.records.items() for item in items
+                     if item[0] is not None and not item[1][25] & FLAG_DIRECTORY and tree.extent(item[1]) == extent]
+        return found or []
+
+    def _directory(self, image, tree, path):
+        """(extent, allocated size, records) of a directory in one tree"""
+        found = tree.records.get(path)
+        if not found or not found[0][1][25] & FLAG_DIRECTORY:
+            raise IsoError(f"/{path}: no such directory in the ISO")
+        record = found[0][1]
+        extent, size = tree.extent(record), struct.unpack_from("<I", record, 10)[0]
+        data = image.pread(extent * BLOCK, size)
+        records, position = [], 0
+        while position < len(data):
+            if data[position] == 0:
+                position = (position // BLOCK + 1) * BLOCK
+                continue
+            records.append(data[position:position + data[position]])
+            position += data[position]
+        return extent, size, records
+
+    @staticmethod
+    def _pack(records, size):
+        out = bytearray()
+        for record in records:
+            if len(out) % BLOCK + len(record) > BLOCK:
+                out += b"\0" * (-len(out) % BLOCK)
+            out += record
+        if len(out) > size:
+            return None
+        return bytes(out) + b"\0" * (size - len(out))
+
+    def _insert(self, image, tree, path, extent, size, pending):
+        """Add the record of a new file to its directory's (planned) record list"""
+        parent, _, name = path.rpartition("/")
+        dir_extent, dir_size, records = pending.get((tree.block, parent)) or self._directory(image, tree, parent)
+        used = {record[33:33 + record[32]] for record in records}
+        if tree.joliet:
+            ident, susp = joliet_identifier(name, used), b""
+        else:
+            ident = iso_identifier(name, False, used)
+            susp = b"".join(rock_ridge_entries(name, 0o100444, self.mtime)) if image.rock_ridge else b""
+            if 33 + len(ident) + 1 + len(susp) > 255:
+                raise IsoError(f"/{path}: name too long to add in place")
+        record = directory_record(extent - tree.bias, size, 0, ident, self.mtime, susp)
+        index = 2 + sum(1 for existing in records[2:] if existing[33:33 + existing[32]] < ident)
+        records = records[:index] + [record] + records[index:]
+        if self._pack(records, dir_size) is None:
+            raise IsoError(f"/{parent} has no room for another record; rebuild the ISO instead")
+        pending[(tree.block, parent)] = (dir_extent, dir_size, records)
+
+    def plan(self, image):
+        """Decide where every change goes; nothing is written yet"""
+        trees = self._trees(image)
+        primary = trees[0]
+        if self.update_md5sums:
+            md5sums = self._md5sums(image)
+            if md5sums is not None:
+                self.changes["md5sum.txt"] = md5sums
+        boot_extents = {entry["extent"] for entry in image.boot_entries()}
+        cursor = image.volume_blocks
+        writes, updates, added, in_place = [], [], {}, 0
+        for path, data in sorted(self.changes.items()):
+            found = primary.records.get(path)
+            if found is None:
+                # New file: always appended
+                extent = cursor
+                cursor += _blocks(len(data))
+                writes.append((extent, data))
+                for tree in trees:
+                    self._insert(image, tree, path, extent, len(data), added)
+                continue
+            record = found[0][1]
+            if record[25] & FLAG_DIRECTORY:
+                raise IsoError(f"/{path} is a directory")
+            if len(found) > 1 or record[25] & FLAG_MULTI_EXTENT:
+                raise IsoError(f"/{path}: multi-extent files are not patched; rebuild the ISO instead")
+            extent, size = primary.extent(record), struct.unpack_from("<I", record, 10)[0]
+            if extent in boot_extents:
+                raise IsoError(f"/{path} is an El Torito boot image; rebuild the ISO instead")
+            shared = any(other != path and items[0][0] is not None and not items[0][1][25] & FLAG_DIRECTORY
+                         and primary.extent(items[0][1]) == extent for other, items in primary.records.items())
+            if size and not shared and len(data) <= _blocks(size) * BLOCK:
+                target = extent
+                in_place += 1
+            else:
+                target = cursor
+                cursor += _blocks(len(data))
+            writes.append((target, data))
+            for tree in trees:
+                for position, _record in self._references(tree, path, extent):
+                    updates.append((position, target - tree.bias, len(data)))
+        return {"trees": trees, "writes": writes, "updates": updates, "added": added, "in_place": in_place,
+                "volume_blocks": image.volume_blocks, "new_volume_blocks": cursor,
+                "catalog": image.boot_catalog_extent()}
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def _shift_tail(self, fd, start, shift):
+        """Move everything after the ISO9660 volume (appended partitions, backup GPT) back by `shift` bytes"""
+        end = os.fstat(fd).st_size
+        position = end
+        while position > start:
+            size = min(CHUNK, position - start)
+            position -= size
+            os.pwrite(fd, os.pread(fd, size, position), position + shift)
+        return end - start
+
+    @staticmethod
+    def _fix_gpt_table(fd, table_lba, count, entry_size, volume_end, sectors):
+        table = bytearray(os.pread(fd, count * entry_size, table_lba * SECTOR))
+        for index in range(count):
+            offset = index * entry_size
+            if not table[offset:offset + 16].strip(b"\0"):
+                continue
+            first, last = struct.unpack_from("<QQ", table, offset + 32)
+            if first >= volume_end:
+                first, last = first + sectors, last + sectors
+            elif first < volume_end <= last + 1:
+                last += sectors
+            struct.pack_into("<QQ", table, offset + 32, first, last)
+        return bytes(table)
+
+    def _fix_partitions(self, fd, volume_end, sectors, total_sectors):
+        """Shift GPT/MBR entries behind the volume, grow the one holding it; rewrite both GPTs"""
+        header = os.pread(fd, 92, SECTOR)
+        if header[:8] == b"EFI PART":
+            fields = list(struct.unpack(GPT_HEADER, header))
+            old_backup = fields[6]
+            table = self._fix_gpt_table(fd, fields[10], fields[11], fields[12], volume_end, sectors)
+            for lba, table_lba in ((1, fields[10]), (old_backup + sectors, None)):
+                if table_lba is None:
+                    moved = os.pread(fd, 92, lba * SECTOR)
+                    if moved[:8] != b"EFI PART":
+                        self.log("Backup GPT header not found behind the volume; rewriting it", "⚠️")
+                    table_lba = lba - len(table) // SECTOR
+                fields[5], fields[6] = lba, (total_sectors - 1 if lba == 1 else 1)
+                fields[8] += sectors if lba == 1 else 0
+                fields[10], fields[13], fields[3] = table_lba, zlib.crc32(table), 0
+                fields[3] = zlib.crc32(struct.pack(GPT_HEADER, *fields))
+                os.pwrite(fd, table, table_lba * SECTOR)
+                os.pwrite(fd, struct.pack(GPT_HEADER, *fields), lba * SECTOR)
+        mbr = bytearray(os.pread(fd, SECTOR, 0))
+        if mbr[510:512] == b"\x55\xaa":
+            for offset in range(446, 510, 16):
+                type_id = mbr[offset + 4]
+                first, count = struct.unpack_from("<II", mbr, offset + 8)
+                if not type_id or not count:
+                    continue
+                if type_id == MBR_PROTECTIVE:
+                    count = min(total_sectors - 1, 0xFFFFFFFF)
+                elif first >= volume_end:
+                    first += sectors
+                elif first < volume_end <= first + count:
+                    count += sectors
+                struct.pack_into("<II", mbr, offset + 8, first, min(count, 0xFFFFFFFF))
+            os.pwrite(fd, bytes(mbr), 0)
+
+    @staticmethod
+    def _fix_catalog(fd, catalog, volume_blocks, delta):
+        """El Torito entries pointing behind the volume (the appended ESP) move with it"""
+        data = bytearray(os.pread(fd, BLOCK, catalog * BLOCK))
+        positions, position = [32], 64
+        while position + 32 <= BLOCK and data[position] in (0x90, 0x91):
+            count = struct.unpack_from("<H", data, position + 2)[0]
+            positions += [position + 32 * (index + 1) for index in range(count)]
+            final = data[position] == 0x91
+            position += 32 * (count + 1)
+            if final:
+                break
+        moved = 0
+        for position in positions:
+            extent = struct.unpack_from("<I", data, position + 8)[0]
+            if data[position] in (0x88, 0x00) and extent >= volume_blocks:
+                struct.pack_into("<I", data, position + 8, extent + delta)
+                moved += 1
+        if moved:
+            os.pwrite(fd, bytes(data), catalog * BLOCK)
+        return moved
+
+    def apply(self):
+        """Write all queued changes; returns a summary dict"""
+        started = time.time()
+        with IsoImage(self.iso) as image:
+            plan = self.plan(image)
+        delta = plan["new_volume_blocks"] - plan["volume_blocks"]
+        with open(self.iso, "r+b") as handle:
+            fd = handle.fileno()
+            if delta:
+                self._shift_tail(fd, plan["volume_blocks"] * BLOCK, delta * BLOCK)
+            for extent, data in plan["writes"]:
+                os.pwrite(fd, data + b"\0" * (_blocks(len(data)) * BLOCK - len(data)), extent * BLOCK)
+            for position, extent, size in plan["updates"]:
+                os.pwrite(fd, _both32(extent) + _both32(size), position + 2)
+            for (block, parent), (extent, size, records) in plan["added"].items():
+                # Re-read so records updated above are kept; the planned list only adds the new ones
+                tree = next(tree for tree in plan["trees"] if tree.block == block)
+                with IsoImage(self.iso) as image:
+                    _extent, _size, current = self._directory(image, tree, parent)
+                new = [record for record in records if record[33:33 + record[32]] not in
+                       {existing[33:33 + existing[32]] for existing in current}]
+                for record in new:
+                    ident = record[33:33 + record[32]]
+                    index = 2 + sum(1 for existing in current[2:] if existing[33:33 + existing[32]] < ident)
+                    current.insert(index, record)
+                os.pwrite(fd, self._pack(current, size), extent * BLOCK)
+            if delta:
+                for tree in plan["trees"]:
+                    os.pwrite(fd, _both32(plan["new_volume_blocks"] - tree.bias), tree.block * BLOCK + 80)
+                total_sectors = os.fstat(fd).st_size // SECTOR
+                self._fix_partitions(fd, plan["volume_blocks"] * (BLOCK // SECTOR), delta * (BLOCK // SECTOR),
+                                     total_sectors)
+                if plan["catalog"] is not None:
+                    self._fix_catalog(fd, plan["catalog"], plan["volume_blocks"], delta)
+        summary = {"changed": len(plan["writes"]), "in_place": plan["in_place"],
+                   "added": sum(1 for path in self.changes if path not in plan["trees"][0].records),
+                   "appended_bytes": delta * BLOCK, "seconds": time.time() - started}
+        self.log(f"Patched {self.iso.name}: {summary['changed']} files ({summary['in_place']} in place, "
+                 f"{summary['added']} added), {summary['appended_bytes']:,} bytes appended "
+                 f"in {summary['seconds']:.2f}s", "🩹")
+        return summary
+
+
+def patch_iso(base_iso, output_iso, files, log=None):
+    """Copy (reflink where possible) `base_iso` to `output_iso` and patch {iso path: bytes|str} into it"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    if Path(base_iso).resolve() != Path(output_iso).resolve():
+        method = place_file(base_iso, output_iso, hardlink=False)
+        log(f"{Path(output_iso).name}: {method} of {Path(base_iso).name}", "📋")
+    patcher = IsoPatcher(output_iso, log=log)
+    for path, data in files.items():
+        patcher.replace(path, data.encode() if isinstance(data, str) else data)
+    return patcher.apply()
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: iso_patch.py <base.iso> <output.iso> [--overlay=DIR] [--file=ISO_PATH:LOCAL]")
+        print("       output may be the base ISO itself to patch it in place")
+        return 1
+    options = [arg[2:].split("=", 1) for arg in sys.argv[3:] if arg.startswith("--") and "=" in arg]
+    files = {}
+    for name, value in options:
+        if name == "overlay":
+            overlay = Path(value)
+            files.update({path.relative_to(overlay).as_posix(): path.read_bytes()
+                          for path in sorted(overlay.rglob("*")) if path.is_file()})
+        elif name == "file":
+            iso_path, local = value.split(":", 1)
+            files[iso_path] = Path(local).read_bytes()
+    try:
+        patch_iso(sys.argv[1], sys.argv[2], files)
+    except IsoError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+ISO READER v1.0
+Reads ISO9660 images directly: volume descriptors, the primary directory
+tree with Rock Ridge names, modes and symlinks, and the El Torito boot
+catalog.  No mount, no 7z, no xorriso.
+
+Every file is reported with its extent (byte offset and size in the image),
+so other tools can copy file data straight out of the base ISO.
+"""
+
+import os
+import sys
+import stat
+import struct
+import calendar
+from pathlib import Path
+
+VERSION = "1.0"
+
+BLOCK = 2048
+FIRST_DESCRIPTOR = 16
+VD_BOOT, VD_PRIMARY, VD_SUPPLEMENTARY, VD_TERMINATOR = 0, 1, 2, 255
+EL_TORITO_ID = b"EL TORITO SPECIFICATION"
+PLATFORMS = {0x00: "bios", 0xEF: "efi"}
+
+FLAG_DIRECTORY = 0x02
+FLAG_MULTI_EXTENT = 0x80
+
+
+class IsoError(Exception):
+    pass
+
+
+def decode_datetime(raw):
+    """7-byte directory record date -> epoch seconds"""
+    if not any(raw[:6]):
+        return 0
+    offset = struct.unpack("b", raw[6:7])[0] * 15 * 60
+    return calendar.timegm((raw[0] + 1900, raw[1] or 1, raw[2] or 1, raw[3], raw[4], raw[5])) - offset
+
+
+class IsoEntry:
+    """One file, directory or symlink of the image"""
+
+    def __init__(self, path, mode, size, extent, mtime, target=None):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.extent = extent
+        self.mtime = mtime
+        self.target = target
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_symlink(self):
+        return stat.S_ISLNK(self.mode)
+
+    @property
+    def offset(self):
+        return self.extent * BLOCK
+
+    def __repr__(self):
+        return f"IsoEntry({self.path!r}, {stat.filemode(self.mode)}, {self.size})"
+
+
+class IsoImage:
+    """Random-access reader for an ISO9660 image file"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self.descriptors = self._read_descriptors()
+        primary = self.descriptors.get(VD_PRIMARY)
+        if primary is None:
+            raise IsoError(f"{self.path}: no ISO9660 primary volume descriptor")
+        self.volume_id = primary[40:72].decode("ascii", "replace").rstrip()
+        self.volume_blocks = struct.unpack_from("<I", primary, 80)[0]
+        self.root_record = primary[156:190]
+        self.rock_ridge = False
+        self._skip = 0
+        self._entries = None
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def pread(self, position, size):
+        return os.pread(self._file.fileno(), size, position)
+
+    def _read_descriptors(self, start=FIRST_DESCRIPTOR):
+        descriptors = {}
+        for block in range(start, start + 64):
+            data = self.pread(block * BLOCK, BLOCK)
+            if len(data) < BLOCK or data[1:6] != b"CD001":
+                break
+            if data[0] == VD_TERMINATOR:
+                break
+            descriptors.setdefault(data[0], data)
+        return descriptors
+
+    def has_partition_copy(self, offset=16):
+        """Whether a second descriptor set sits at `offset` blocks (xorriso -partition_offset)"""
+        data = self.pread((offset + FIRST_DESCRIPTOR) * BLOCK, BLOCK)
+        return len(data) == BLOCK and data[0] == VD_PRIMARY and data[1:6] == b"CD001"
+
+    # ------------------------------------------------------------------
+    # Directory records and Rock Ridge
+    # ------------------------------------------------------------------
+
+    def _records(self, extent, size):
+        for _position, record in self._positioned_records(extent, size):
+            yield record
+
+    def _positioned_records(self, extent, size):
+        """(byte position in the image, record) of one directory's records"""
+        data = self.pread(extent * BLOCK, size)
+        position = 0
+        while position < len(data):
+            length = data[position]
+            if length == 0:
+                # Records never cross a block boundary; the rest of the block is padding
+                position = (position // BLOCK + 1) * BLOCK
+                continue
+            yield extent * BLOCK + position, data[position:position + length]
+            position += length
+
+    def _susp_entries(self, area, bias=0):
+        position = 0
+        while position + 4 <= len(area):
+            signature, length = area[position:position + 2], area[position + 2]
+            if length < 4:
+                break
+            entry = area[position:position + length]
+            if signature == b"CE":
+                block, offset, size = (struct.unpack_from("<I", entry, index)[0] for index in (4, 12, 20))
+                yield from self._susp_entries(self.pread((block + bias) * BLOCK + offset, size), bias)
+            elif signature == b"ST":
+                break
+            else:
+                yield signature, entry
+            position += length
+
+    def _rock_ridge(self, record, bias=0):
+        name_length = record[32]
+        area = record[33 + name_length + (1 - name_length % 2):][self._skip:]
+        info = {}
+        name, link, link_part = b"", [], b""
+        for signature, entry in self._susp_entries(area, bias):
+            if signature == b"NM" and not entry[4] & 0x06:
+                name += entry[5:]
+            elif signature == b"PX":
+                info["mode"] = struct.unpack_from("<I", entry, 4)[0]
+            elif signature == b"SL":
+                position = 5
+                while position + 2 <= len(entry):
+                    flags, length = entry[position], entry[position + 1]
+                    content = entry[position + 2:position + 2 + length]
+                    if flags & 0x02:
+                        link.append(b".")
+                    elif flags & 0x04:
+                        link.append(b"..")
+                    elif flags & 0x08:
+                        link.append(b"")
+                    else:
+                        link_part += content
+                        if not flags & 0x01:
+                            link.append(link_part)
+                            link_part = b""
+                    position += 2 + length
+            elif signature == b"TF":
+                flags, position = entry[4], 5
+                size = 17 if flags & 0x80 else 7
+                for bit in (0x01, 0x02):
+                    if flags & bit:
+                        if bit == 0x02 and size == 7:
+                            info["mtime"] = decode_datetime(entry[position:position + 7])
+                        position += size
+        if name:
+            info["name"] = name.decode("utf-8", "surrogateescape")
+        if link:
+            info["target"] = "/".join(part.decode("utf-8", "surrogateescape") for part in link) or "/"
+        return info
+
+    def _detect_rock_ridge(self):
+        extent, size = struct.unpack_from("<I", self.root_record, 2)[0], struct.unpack_from("<I", self.root_record, 10)[0]
+        first = next(self._records(extent, size))
+        area = first[34:]
+        if area[:2] == b"SP" and area[4:6] == b"\xbe\xef":
+            self.rock_ridge = True
+            self._skip = area[6]
+
+    def entries(self):
+        """All entries below the root (paths without a leading slash), directories first"""
+        if self._entries is None:
+            self._detect_rock_ridge()
+            self._entries = []
+            self._walk(self.root_record, "")
+        return self._entries
+
+    def _walk(self, directory_record, prefix):
+        extent = struct.unpack_from("<I", directory_record, 2)[0]
+        size = struct.unpack_from("<I", directory_record, 10)[0]
+        pending = None
+        subdirectories = []
+        for record in self._records(extent, size):
+            name_length = record[32]
+            identifier = record[33:33 + name_length]
+            if identifier in (b"\x00", b"\x01"):
+                continue
+            flags = record[25]
+            entry_extent = struct.unpack_from("<I", record, 2)[0]
+            entry_size = struct.unpack_from("<I", record, 10)[0]
+            if pending is not None:
+                # Continuation of a multi-extent file: only contiguous extents are supported
+                if entry_extent * BLOCK != pending.offset + pending.size:
+                    raise IsoError(f"{pending.path}: non-contiguous multi-extent file")
+                pending.size += entry_size
+                if not flags & FLAG_MULTI_EXTENT:
+                    pending = None
+                continue
+            info = self._rock_ridge(record) if self.rock_ridge else {}
+            name = info.get("name")
+            if name is None:
+                name = identifier.decode("ascii", "replace").split(";")[0]
+                name = name[:-1] if name.endswith(".") else name
+            is_dir = bool(flags & FLAG_DIRECTORY)
+            default_mode = (stat.S_IFDIR | 0o555) if is_dir else (stat.S_IFREG | 0o444)
+            mode = info.get("mode", default_mode)
+            entry = IsoEntry(f"{prefix}{name}", mode, 0 if is_dir else entry_size, entry_extent,
+                             info.get("mtime", decode_datetime(record[18:25])), info.get("target"))
+            self._entries.append(entry)
+            if flags & FLAG_MULTI_EXTENT:
+                pending = entry
+            if is_dir:
+                subdirectories.append((record, f"{prefix}{name}/"))
+        for record, path in subdirectories:
+            self._walk(record, path)
+
+    def record_tree(self, descriptor, bias=0):
+        """{path: [(byte position, record), ...]} for every record under a volume descriptor
+
+        Works on any tree: the primary one (Rock Ridge names when present), Joliet
+        (UCS-2 names) and the copies behind -partition_offset, whose block numbers
+        are relative to `bias`.  Multi-extent files list all their records.
+        """
+        self.entries()
+        joliet = descriptor[0] == VD_SUPPLEMENTARY
+        tree = {"": [(None, descriptor[156:190])]}
+        pending = [("", descriptor[156:190])]
+        while pending:
+            prefix, directory = pending.pop(0)
+            extent = struct.unpack_from("<I", directory, 2)[0] + bias
+            size = struct.unpack_from("<I", directory, 10)[0]
+            for position, record in self._positioned_records(extent, size):
+                identifier = record[33:33 + record[32]]
+                if identifier in (b"\x00", b"\x01"):
+                    continue
+                if joliet:
+                    name = identifier.decode("utf-16-be", "replace").split(";")[0]
+                else:
+                    name = self._rock_ridge(record, bias).get("name") if self.rock_ridge else None
+                    if name is None:
+                        name = identifier.decode("ascii", "replace").split(";")[0]
+                        name = name[:-1] if name.endswith(".") else name
+                path = f"{prefix}{name}"
+                if path in tree and record[25] & FLAG_DIRECTORY == 0 and tree[path][-1][1][25] & FLAG_MULTI_EXTENT:
+                    tree[path].append((position, record))
+                    continue
+                tree[path] = [(position, record)]
+                if record[25] & FLAG_DIRECTORY:
+                    pending.append((f"{path}/", record))
+        return tree
+
+    def lookup(self, path):
+        path = str(path).strip("/")
+        return next((entry for entry in self.entries() if entry.path == path), None)
+
+    def read_file(self, entry):
+        return self.pread(entry.offset, entry.size)
+
+    # ------------------------------------------------------------------
+    # El Torito
+    # ------------------------------------------------------------------
+
+    def boot_catalog_extent(self):
+        record = self.descriptors.get(VD_BOOT)
+        if record is None or record[7:7 + len(EL_TORITO_ID)] != EL_TORITO_ID:
+            return None
+        return struct.unpack_from("<I", record, 71)[0]
+
+    def boot_entries(self):
+        """[{'platform', 'extent', 'sectors', 'bootable'}] from the El Torito catalog"""
+        extent = self.boot_catalog_extent()
+        if extent is None:
+            return []
+        catalog = self.pread(extent * BLOCK, BLOCK)
+        if catalog[0] != 0x01 or catalog[30:32] != b"\x55\xaa":
+            raise IsoError(f"{self.path}: bad El Torito validation entry")
+        platform = catalog[1]
+        entries = []
+        position = 32
+        while position + 32 <= len(catalog):
+            entry = catalog[position:position + 32]
+            if entry[0] in (0x90, 0x91):
+                platform = entry[1]
+                count = struct.unpack_from("<H", entry, 2)[0]
+                position += 32
+                for _ in range(count):
+                    entries.append(self._boot_entry(catalog[position:position + 32], platform))
+                    position += 32
+                if entry[0] == 0x91:
+                    break
+                continue
+            if position != 32:
+                break
+            entries.append(self._boot_entry(entry, platform))
+            position += 32
+        return entries
+
+    @staticmethod
+    def _boot_entry(entry, platform):
+        return {
+            "platform": PLATFORMS.get(platform, f"0x{platform:02x}"),
+            "bootable": entry[0] == 0x88,
+            "sectors": struct.unpack_from("<H", entry, 6)[0],
+            "extent": struct.unpack_from("<I", entry, 8)[0],
+        }
+
+    def entry_at(self, extent):
+        """The file whose data starts at `extent` (None when no file does)"""
+        return next((entry for entry in self.entries()
+                     if not entry.is_dir and entry.size and entry.extent == extent), None)
+
+    def describe(self):
+        files = [entry for entry in self.entries() if not entry.is_dir]
+        return (f"{self.path.name}: '{self.volume_id}', {self.volume_blocks * BLOCK:,} bytes, "
+                f"{len(files):,} files, Rock Ridge {'yes' if self.rock_ridge else 'no'}")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: iso_reader.py <image.iso> [path] [--boot]")
+        return 1
+    with IsoImage(sys.argv[1]) as image:
+        print(f"💿 {image.describe()}")
+        if "--boot" in sys.argv:
+            for entry in image.boot_entries():
+                target = image.entry_at(entry["extent"])
+                where = f"/{target.path}" if target else "outside the file tree"
+                print(f"🥾 {entry['platform']}: extent {entry['extent']}, {entry['sectors']} sectors ({where})")
+            return 0
+        args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+        if args:
+            entry = image.lookup(args[0])
+            if entry is None or entry.is_dir:
+                print(f"❌ Not a file: {args[0]}")
+                return 1
+            sys.stdout.buffer.write(image.read_file(entry))
+            return 0
+        for entry in image.entries():
+            link = f" -> {entry.target}" if entry.is_symlink else ""
+            print(f"{stat.filemode(entry.mode)} {entry.size:>12,} /{entry.path}{link}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+ISO REPLAY v1.0
+Builds a modified ISO straight from the original: no extraction, no
+hand-copied boot flags.
+
+xorriso loads the base ISO as input (-indev), replays its El Torito
+catalog, MBR, GPT and appended partitions exactly as found
+(-boot_image any replay), maps in only the changed or added files from an
+overlay directory, removes what was asked and writes the new ISO (-outdev).
+Unchanged files are copied extent by extent from the base ISO, so the build
+costs little more than writing the output, and the boot structure matches
+the base ISO by construction.
+
+md5sum.txt is refreshed for every replaced, added or removed file, so
+casper's integrity check still passes.
+
+run(sink) streams the image into a writable object instead of the output
+path (xorriso writes to a pipe); an output of "-" is standard output.
+"""
+
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+
+VERSION = "1.0"
+
+
+def _md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ReplayBuild:
+    """Base ISO + overlay files -> new ISO with the base's boot setup replayed"""
+
+    def __init__(self, base_iso, output_iso, volume_id=None, update_md5sums=True, log=None):
+        self.base_iso = Path(base_iso)
+        self.output_iso = Path(output_iso)
+        self.volume_id = volume_id
+        self.update_md5sums = update_md5sums
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}",
+                                                            file=sys.stderr if str(output_iso) == "-" else sys.stdout))
+        self.mapped = {}
+        self.removed = []
+        # {ISO path: weight}: heavier files are written first (boot_layout.py)
+        self.sort_weights = {}
+        self._staging = None
+
+    @property
+    def staging(self):
+        """Scratch directory for files created with add_text/add_bytes"""
+        if self._staging is None:
+            self._staging = Path(tempfile.mkdtemp(prefix="iso-replay-"))
+        return self._staging
+
+    def map_file(self, iso_path, local):
+        self.mapped["/" + str(iso_path).strip("/")] = Path(local)
+
+    def map_tree(self, overlay_dir, iso_root="/"):
+        """Map every file under `overlay_dir` to the same relative path under `iso_root`"""
+        overlay_dir = Path(overlay_dir)
+        for path in sorted(overlay_dir.rglob("*")):
+            if path.is_file():
+                self.map_file(f"{iso_root.rstrip('/')}/{path.relative_to(overlay_dir).as_posix()}", path)
+
+    def add_bytes(self, iso_path, data):
+        local = self.staging / "files" / str(iso_path).strip("/")
+        local.parent.mkdir(parents=True, exist_ok=True)
+        local.write_bytes(data)
+        self.map_file(iso_path, local)
+
+    def add_text(self, iso_path, text):
+        self.add_bytes(iso_path, text.encode())
+
+    def remove(self, iso_path):
+        self.removed.append("/" + str(iso_path).strip("/"))
+
+    def exists(self, iso_path):
+        """Whether the base ISO has `iso_path` (reads the directory tree only)"""
+        result = subprocess.run(["xorriso", "-indev", str(self.base_iso), "-lsd", "/" + str(iso_path).strip("/")],
+                                capture_output=True, text=True)
+        return result.returncode == 0 and bool(result.stdout.strip())
+
+    def extract(self, iso_path, local):
+        """Copy one file out of the base ISO; returns the local path or None"""
+        result = subprocess.run(["xorriso", "-osirrox", "on", "-indev", str(self.base_iso),
+                                 "-extract", "/" + str(iso_path).strip("/"), str(local)],
+                                capture_output=True, text=True)
+        return Path(local) if result.returncode == 0 and Path(local).exists() else None
+
+    def _refresh_md5sums(self):
+        if "/md5sum.txt" in self.mapped:
+            return
+        md5sums = self.extract("/md5sum.txt", self.staging / "md5sum.base")
+        if md5sums is None:
+            return
+        changed = {f".{path}": local for path, local in self.mapped.items()}
+        removed = {f".{path}" for path in self.removed}
+        lines, listed = [], set()
+        for line in md5sums.read_text(errors="surrogateescape").splitlines():
+            parts = line.split(None, 1)
+            name = parts[1].strip() if len(parts) == 2 else ""
+            if name in removed or any(name.startswith(f"{path}/") for path in removed):
+                continue
+            if name in changed:
+                line = f"{_md5(changed[name])}  {name}"
+                listed.add(name)
+            lines.append(line)
+        for name in sorted(set(changed) - listed):
+            lines.append(f"{_md5(changed[name])}  {name}")
+        self.add_text("/md5sum.txt", "\n".join(lines) + "\n")
+
+    def command(self, output=None):
+        cmd = ["xorriso", "-indev", str(self.base_iso), "-outdev", output or str(self.output_iso),
+               "-boot_image", "any", "replay"]
+        if self.volume_id:
+            cmd += ["-volid", self.volume_id]
+        for path in self.removed:
+            cmd += ["-rm_r", path, "--"]
+        for path, local in sorted(self.mapped.items()):
+            cmd += ["-map", str(local), path]
+        for path, weight in sorted(self.sort_weights.items(), key=lambda item: -item[1]):
+            cmd += ["-sort_weight", str(weight), path]
+        return cmd
+
+    def _stream(self, sink):
+        """Run xorriso with the image going to its stdout, and copy that into `sink`"""
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(self.command(output="stdio:/dev/fd/1"), stdout=subprocess.PIPE, stderr=errors)
+            try:
+                for chunk in iter(lambda: process.stdout.read(1 << 22), b""):
+                    sink.write(chunk)
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            errors.seek(0)
+            return returncode, errors.read().decode(errors="replace")
+
+    def run(self, sink=None):
+        """Write the new ISO (into `sink`, if given); returns True on success"""
+        if not self.base_iso.exists():
+            self.log(f"Base ISO not found: {self.base_iso}", "❌")
+            return False
+        if shutil.which("xorriso") is None:
+            self.log("xorriso not found (sudo apt install xorriso)", "❌")
+            return False
+        if sink is None and str(self.output_iso) == "-":
+            sink = sys.stdout.buffer
+        started = time.time()
+        try:
+            if self.update_md5sums:
+                self._refresh_md5sums()
+            if sink is None:
+                self.output_iso.unlink(missing_ok=True)
+            self.log(f"Replaying {self.base_iso.name} boot setup with {len(self.mapped)} mapped, "
+                     f"{len(self.removed)} removed", "⚙️")
+            if sink is None:
+                result = subprocess.run(self.command(), capture_output=True, text=True)
+                returncode, errors = result.returncode, result.stderr
+            else:
+                returncode, errors = self._stream(sink)
+            if returncode != 0:
+                self.log(f"xorriso failed: {errors.strip()[-500:]}", "❌")
+                return False
+            if sink is None:
+                size = self.output_iso.stat().st_size
+                self.log(f"{self.output_iso} written: {size:,} bytes in {time.time() - started:.1f}s", "✅")
+            return True
+        finally:
+            if self._staging is not None:
+                shutil.rmtree(self._staging, ignore_errors=True)
+                self._staging = None
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: iso_replay.py <base.iso> <output.iso> [--overlay=DIR] [--remove=/a,/b] [--volid=NAME]")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[3:] if arg.startswith("--") and "=" in arg)
+    build = ReplayBuild(sys.argv[1], sys.argv[2], volume_id=options.get("volid"))
+    if "overlay" in options:
+        build.map_tree(options["overlay"])
+    for path in filter(None, options.get("remove", "").split(",")):
+        build.remove(path)
+    return 0 if build.run() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
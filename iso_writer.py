@@ -0,0 +1,1057 @@
+#!/usr/bin/env python3
+"""
+ISO WRITER v1.0
+Writes hybrid ISO images in-process, in one sequential stream.
+
+The file list comes from a manifest: files of the base ISO are referenced
+by their extents (copied straight out of the base image), overlay files by
+their local paths.  The writer produces ISO9660 (level 2 names) with Rock
+Ridge and Joliet trees, El Torito BIOS and EFI boot entries, an isohybrid
+or grub2 MBR, GPT with an appended EFI system partition, and the
+`-partition_offset 16` layout (a second descriptor set and directory trees
+relative to the ISO9660 partition, so partition 1 mounts on its own).
+
+Everything is planned before the first byte is written, so the output never
+seeks: it can go to a file, a pipe, a socket or a block device as it is
+produced, with progress reported as it goes.  Files over 4 GiB and
+directory relocation (more than 8 levels) are not supported.
+"""
+
+import os
+import re
+import sys
+import json
+import stat
+import time
+import uuid
+import zlib
+import base64
+import struct
+import hashlib
+from pathlib import Path
+
+from boot_layout import BootLayout
+from iso_partitions import GPT_BASIC_DATA, GPT_ESP, MBR_PROTECTIVE, SECTOR, find_esp, read_gpt, read_mbr
+from iso_reader import BLOCK, IsoError, IsoImage
+from output_sinks import SinkError, open_sink
+
+VERSION = "1.0"
+
+SYSTEM_AREA_BLOCKS = 16
+GPT_ENTRIES = 128
+GPT_ENTRY_SIZE = 128
+GPT_TABLE_SECTORS = GPT_ENTRIES * GPT_ENTRY_SIZE // SECTOR
+# Backup GPT (table + header) at the very end, padded so the image is whole 2048-byte blocks
+GPT_TAIL_SECTORS = GPT_TABLE_SECTORS + 1 + (-(GPT_TABLE_SECTORS + 1)) % (BLOCK // SECTOR)
+MBR_BOOT_ADDRESS = 0x1B0
+GRUB2_BOOT_INFO = 2548
+BOOT_INFO_TABLE = 8
+MAX_FILE_SIZE = (1 << 32) - 1
+CHUNK = 1 << 20
+
+RRIP_ID = b"RRIP_1991A"
+RRIP_DESCRIPTION = b"THE ROCK RIDGE INTERCHANGE PROTOCOL PROVIDES SUPPORT FOR POSIX FILE SYSTEM SEMANTICS"
+RRIP_SOURCE = (b"PLEASE CONTACT DISC PUBLISHER FOR SPECIFICATION SOURCE.  SEE PUBLISHER IDENTIFIER IN "
+               b"PRIMARY VOLUME DESCRIPTOR FOR CONTACT INFORMATION.")
+CE_SIZE = 28
+NM_CHUNK = 250
+
+
+def _both16(value):
+    return struct.pack("<H", value) + struct.pack(">H", value)
+
+
+def _both32(value):
+    return struct.pack("<I", value) + struct.pack(">I", value)
+
+
+def _date7(epoch):
+    tm = time.gmtime(epoch)
+    return bytes([tm.tm_year - 1900, tm.tm_mon, tm.tm_mday, tm.tm_hour, tm.tm_min, tm.tm_sec, 0])
+
+
+def _date17(epoch):
+    tm = time.gmtime(epoch)
+    return time.strftime("%Y%m%d%H%M%S00", tm).encode() + b"\0"
+
+
+def _blocks(size):
+    return -(-size // BLOCK)
+
+
+def _text(value, length, joliet=False):
+    if joliet:
+        # UCS-2 big-endian, padded with UCS-2 spaces
+        return (value.encode("utf-16-be")[:length & ~1] + b"\x00\x20" * length)[:length]
+    return value.upper().encode("ascii", "replace")[:length].ljust(length, b" ")
+
+
+class ManifestEntry:
+    """A file, directory or symlink of the image to write and where its data comes from"""
+
+    def __init__(self, path, mode, size=0, mtime=0, source=None, offset=None, data=None, target=None):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.mtime = mtime
+        # Local file, or the base ISO when `offset` is set; `data` for small generated files
+        self.source = str(source) if source is not None else None
+        self.offset = offset
+        self.data = data
+        self.target = target
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_symlink(self):
+        return stat.S_ISLNK(self.mode)
+
+    @property
+    def is_file(self):
+        return stat.S_ISREG(self.mode)
+
+    def data_key(self):
+        """Entries with the same key share one copy of the data in the image"""
+        if self.data is not None:
+            return ("data", id(self))
+        if self.offset is not None:
+            return ("extent", self.source, self.offset, self.size)
+        st = os.stat(self.source)
+        return ("file", st.st_dev, st.st_ino)
+
+    def chunks(self, files):
+        """Yields the entry's data; `files` caches open descriptors by source"""
+        if self.data is not None:
+            yield self.data
+            return
+        if self.source not in files:
+            files[self.source] = os.open(self.source, os.O_RDONLY)
+        fd = files[self.source]
+        position = self.offset or 0
+        remaining = self.size
+        while remaining:
+            chunk = os.pread(fd, min(CHUNK, remaining), position)
+            if not chunk:
+                raise IsoError(f"{self.path}: source ended {remaining:,} bytes early")
+            yield chunk
+            position += len(chunk)
+            remaining -= len(chunk)
+
+    def to_json(self):
+        value = {"path": self.path, "mode": self.mode, "size": self.size, "mtime": self.mtime}
+        for field in ("source", "offset", "target"):
+            if getattr(self, field) is not None:
+                value[field] = getattr(self, field)
+        if self.data is not None:
+            value["data"] = base64.b64encode(self.data).decode()
+        return value
+
+    @classmethod
+    def from_json(cls, value):
+        value = dict(value)
+        if "data" in value:
+            value["data"] = base64.b64decode(value["data"])
+        return cls(**value)
+
+
+class Manifest:
+    """Paths (no leading slash) -> ManifestEntry; parents are created as needed"""
+
+    def __init__(self, base_iso=None):
+        self.base_iso = str(base_iso) if base_iso else None
+        self.entries = {}
+        # Paths added after the manifest was built (overlays, generated files)
+        self.changed = set()
+
+    @staticmethod
+    def _normalize(path):
+        return "/".join(part for part in str(path).split("/") if part not in ("", "."))
+
+    def _parents(self, path, mtime):
+        parts = path.split("/")[:-1]
+        for depth in range(1, len(parts) + 1):
+            parent = "/".join(parts[:depth])
+            existing = self.entries.get(parent)
+            if existing is None or not existing.is_dir:
+                self.entries[parent] = ManifestEntry(parent, stat.S_IFDIR | 0o555, mtime=mtime)
+
+    def add(self, entry):
+        entry.path = self._normalize(entry.path)
+        if entry.is_file and entry.size > MAX_FILE_SIZE:
+            raise IsoError(f"{entry.path}: files over 4 GiB need multi-extent support")
+        self._parents(entry.path, entry.mtime)
+        self.entries[entry.path] = entry
+        self.changed.add(entry.path)
+        return entry
+
+    def add_directory(self, path, mtime=0):
+        return self.add(ManifestEntry(path, stat.S_IFDIR | 0o555, mtime=mtime))
+
+    def add_file(self, path, source=None, data=None, mtime=None):
+        """Add a local file or bytes with -r semantics (read-only, executable kept)"""
+        if data is not None:
+            return self.add(ManifestEntry(path, stat.S_IFREG | 0o444, len(data),
+                                          int(time.time()) if mtime is None else mtime, data=data))
+        st = os.stat(source)
+        mode = stat.S_IFREG | (0o555 if st.st_mode & 0o111 else 0o444)
+        return self.add(ManifestEntry(path, mode, st.st_size, int(st.st_mtime) if mtime is None else mtime,
+                                      source=os.path.abspath(source)))
+
+    def add_symlink(self, path, target, mtime=0):
+        return self.add(ManifestEntry(path, stat.S_IFLNK | 0o777, mtime=mtime, target=target))
+
+    def add_tree(self, directory, dest=""):
+        """Add (or replace) everything under a local directory"""
+        directory = Path(directory)
+        for path in sorted(directory.rglob("*")):
+            target = f"{dest}/{path.relative_to(directory).as_posix()}"
+            if path.is_symlink():
+                self.add_symlink(target, os.readlink(path), int(path.lstat().st_mtime))
+            elif path.is_dir():
+                self.add_directory(target, int(path.stat().st_mtime))
+            elif path.is_file():
+                self.add_file(target, source=path)
+
+    def remove(self, path):
+        path = self._normalize(path)
+        for name in [name for name in self.entries if name == path or name.startswith(f"{path}/")]:
+            del self.entries[name]
+
+    @classmethod
+    def from_tree(cls, directory, base_iso=None):
+        manifest = cls(base_iso)
+        manifest.add_tree(directory)
+        manifest.changed.clear()
+        return manifest
+
+    @classmethod
+    def from_base_iso(cls, base_iso):
+        """Every file of the base ISO, by extent (its old boot catalog is left out)"""
+        manifest = cls(base_iso)
+        source = os.path.abspath(base_iso)
+        with IsoImage(base_iso) as image:
+            catalog = image.boot_catalog_extent()
+            for entry in image.entries():
+                if not entry.is_dir and catalog is not None and entry.extent == catalog and entry.size <= BLOCK:
+                    continue
+                if entry.is_dir:
+                    manifest.add(ManifestEntry(entry.path, entry.mode, mtime=entry.mtime))
+                elif entry.is_symlink:
+                    manifest.add(ManifestEntry(entry.path, entry.mode, mtime=entry.mtime, target=entry.target))
+                else:
+                    manifest.add(ManifestEntry(entry.path, entry.mode, entry.size, entry.mtime,
+                                               source=source, offset=entry.offset))
+        manifest.changed.clear()
+        return manifest
+
+    def _base_stats(self):
+        """{path: (size, mtime)} of the base ISO's files, to spot unchanged files of an extracted tree"""
+        if not self.base_iso or not os.path.exists(self.base_iso):
+            return {}
+        with IsoImage(self.base_iso) as image:
+            return {entry.path: (entry.size, int(entry.mtime)) for entry in image.entries()
+                    if not entry.is_dir and not entry.is_symlink}
+
+    def refresh_md5sums(self, name="md5sum.txt"):
+        """Re-hash md5sum.txt lines of entries whose data differs from the base ISO's
+
+        Files read from the base ISO's extents are unchanged by definition; a
+        file of an extracted tree counts as unchanged when it was not added
+        later (overlay) and its size and mtime still match the base ISO's.
+        """
+        entry = self.entries.get(name)
+        if entry is None or not entry.is_file:
+            return 0
+        base = self._base_stats() if any(target.offset is None for target in self.entries.values()) else {}
+
+        def stale(path, target):
+            if target.offset is not None:
+                return False
+            return path in self.changed or target.data is not None or base.get(path) != (target.size, target.mtime)
+
+        def md5(target):
+            digest = hashlib.md5()
+            for chunk in target.chunks({}):
+                digest.update(chunk)
+            return digest.hexdigest()
+
+        text = b"".join(entry.chunks({})).decode(errors="surrogateescape")
+        lines, touched, listed = [], 0, set()
+        for line in text.splitlines():
+            parts = line.split(None, 1)
+            path = self._normalize(parts[1].strip()) if len(parts) == 2 else ""
+            listed.add(path)
+            target = self.entries.get(path)
+            if len(parts) == 2 and (target is None or not target.is_file):
+                touched += 1
+                continue
+            if target is not None and target.is_file and stale(path, target):
+                line = f"{md5(target)}  ./{path}"
+                touched += 1
+            lines.append(line)
+        for path, target in sorted(self.entries.items()):
+            if target.is_file and path not in listed and path != name and stale(path, target):
+                lines.append(f"{md5(target)}  ./{path}")
+                touched += 1
+        if touched:
+            self.add_file(name, data=("\n".join(lines) + "\n").encode(errors="surrogateescape"), mtime=entry.mtime)
+        return touched
+
+    def save(self, path):
+        Path(path).write_text(json.dumps({"base_iso": self.base_iso,
+                                          "entries": [entry.to_json() for entry in self.entries.values()]}))
+
+    @classmethod
+    def load(cls, path):
+        spec = json.loads(Path(path).read_text())
+        manifest = cls(spec.get("base_iso"))
+        for value in spec["entries"]:
+            manifest.add(ManifestEntry.from_json(value))
+        return manifest
+
+
+class BootSpec:
+    """El Torito entries, system area and partition layout of the image"""
+
+    def __init__(self, bios_image=None, bios_load_size=4, boot_info_table=True, grub2_boot_info=True,
+                 efi_image=None, efi_partition=None, efi_load_size=None, catalog_path="boot.catalog", mbr_template=None,
+                 mbr_patch="grub2", partition_offset=16, mbr=True, gpt=True, protective_mbr=True,
+                 mbr_bootable=True):
+        self.bios_image = bios_image
+        self.bios_load_size = bios_load_size
+        self.boot_info_table = boot_info_table
+        self.grub2_boot_info = grub2_boot_info
+        # EFI boot image: a file of the tree, or the appended ESP (source, offset, size)
+        self.efi_image = efi_image
+        self.efi_partition = efi_partition
+        # Sectors in the El Torito EFI entry (default: the whole image)
+        self.efi_load_size = efi_load_size
+        self.catalog_path = catalog_path
+        self.mbr_template = mbr_template
+        self.mbr_patch = mbr_patch
+        self.partition_offset = partition_offset
+        # Partition tables: MBR (hybrid or protective) and GPT
+        self.mbr = mbr
+        self.gpt = gpt
+        self.protective_mbr = protective_mbr
+        self.mbr_bootable = mbr_bootable
+
+    @classmethod
+    def from_base_iso(cls, base_iso):
+        """The boot setup of an existing hybrid ISO, as found"""
+        spec = cls(catalog_path=None, mbr_patch=None, partition_offset=0, gpt=False, boot_info_table=False,
+                   grub2_boot_info=False)
+        source = os.path.abspath(base_iso)
+        esp = find_esp(base_iso)
+        with IsoImage(base_iso) as image:
+            catalog = image.boot_catalog_extent()
+            if catalog is not None:
+                entry = image.entry_at(catalog)
+                spec.catalog_path = entry.path if entry else "boot.catalog"
+            bios_extent = None
+            for boot in image.boot_entries():
+                target = image.entry_at(boot["extent"])
+                if boot["platform"] == "bios" and target:
+                    spec.bios_image, spec.bios_load_size, bios_extent = target.path, boot["sectors"], boot["extent"]
+                    head = image.pread(target.offset, GRUB2_BOOT_INFO + 8)
+                    spec.boot_info_table = struct.unpack_from("<II", head, BOOT_INFO_TABLE) == (16, target.extent)
+                    spec.grub2_boot_info = (len(head) >= GRUB2_BOOT_INFO + 8 and struct.unpack_from(
+                        "<Q", head, GRUB2_BOOT_INFO)[0] == target.extent * 4 + 5)
+                elif boot["platform"] == "efi":
+                    spec.efi_load_size = boot["sectors"]
+                    if target:
+                        spec.efi_image = target.path
+                    elif esp and esp.start == boot["extent"] * BLOCK:
+                        spec.efi_partition = (source, esp.start, esp.size)
+            if spec.efi_partition is None and esp and esp.start >= image.volume_blocks * BLOCK:
+                spec.efi_partition = (source, esp.start, esp.size)
+            spec.partition_offset = 16 if image.has_partition_copy(16) else 0
+            head = image.pread(0, SECTOR)
+        if any(head[:MBR_BOOT_ADDRESS]):
+            spec.mbr_template = head[:440]
+            address = struct.unpack_from("<Q", head, MBR_BOOT_ADDRESS)[0]
+            if bios_extent is not None and address == bios_extent * 4 + 4:
+                spec.mbr_patch = "grub2"
+            elif bios_extent is not None and address & 0xFFFFFFFF == bios_extent * 4:
+                spec.mbr_patch = "isohybrid"
+        spec.gpt = bool(read_gpt(base_iso))
+        mbr = read_mbr(base_iso)
+        spec.mbr = bool(mbr)
+        spec.protective_mbr = any(part.type_id == MBR_PROTECTIVE for part in mbr)
+        spec.mbr_bootable = head[446] == 0x80
+        return spec
+
+    def describe(self):
+        parts = [f"BIOS {self.bios_image}" if self.bios_image else "no BIOS entry",
+                 f"EFI {self.efi_image}" if self.efi_image else
+                 f"EFI appended ESP ({self.efi_partition[2]:,} bytes)" if self.efi_partition else "no EFI entry",
+                 f"MBR {self.mbr_patch or 'plain'}" if self.mbr else "no MBR", "GPT" if self.gpt else "no GPT",
+                 f"partition offset {self.partition_offset}"]
+        return ", ".join(parts)
+
+
+class _Node:
+    def __init__(self, name, entry, parent):
+        self.name = name
+        self.entry = entry
+        self.parent = parent
+        self.children = []
+        self.names = {}
+
+    @property
+    def is_dir(self):
+        return self.entry.is_dir
+
+
+def iso_identifier(name, is_dir, used):
+    """ISO9660 level 2 identifier (d-characters, <=31 chars, ';1' on files) not yet in `used`"""
+    clean = lambda text: re.sub(r"[^A-Z0-9_]", "_", text.upper())
+    if is_dir:
+        stem, ext = clean(name)[:31] or "_", None
+    else:
+        base, _dot, ext = name.rpartition(".") if "." in name[1:] else (name, "", "")
+        ext = clean(ext)[:8]
+        stem = clean(base)[:30 - len(ext)] or "_"
+    for number in range(1000000):
+        tail = f"_{number}" if number else ""
+        if ext is None:
+            ident = (stem[:31 - len(tail)] + tail).encode("ascii")
+        else:
+            ident = f"{stem[:30 - len(ext) - len(tail)]}{tail}.{ext};1".encode("ascii")
+        if ident not in used:
+            break
+    used.add(ident)
+    return ident
+
+
+def joliet_identifier(name, used):
+    """Joliet identifier (UCS-2, <=103 chars) not yet in `used`"""
+    name = name[:103]
+    for number in range(1000000):
+        tail = f"_{number}" if number else ""
+        ident = (name[:103 - len(tail)] + tail).encode("utf-16-be", "surrogatepass")
+        if ident not in used:
+            break
+    used.add(ident)
+    return ident
+
+
+def directory_record(extent, size, flags, ident, mtime, susp=b""):
+    pad = b"\0" if len(ident) % 2 == 0 else b""
+    body = _both32(extent) + _both32(size) + _date7(mtime) + bytes([flags, 0, 0]) + _both16(1) \
+        + bytes([len(ident)]) + ident + pad + susp
+    record = bytes([1 + 1 + len(body)]) + b"\0" + body
+    if len(record) % 2:
+        record += b"\0"
+        record = bytes([len(record)]) + record[1:]
+    return record
+
+
+def rock_ridge_entries(name, mode, mtime, nlink=1, target=None):
+    """RR, PX, TF, NM (when named) and SL (symlinks) entries of one record"""
+    flags = 0x81 | (0x08 if name is not None else 0) | (0x04 if target is not None else 0)
+    entries = [b"RR\x05\x01" + bytes([flags]),
+               b"PX\x24\x01" + _both32(mode) + _both32(nlink) + _both32(0) + _both32(0),
+               b"TF\x1a\x01\x0e" + _date7(mtime) * 3]
+    if name is not None:
+        raw = name.encode("utf-8", "surrogateescape")
+        chunks = [raw[index:index + NM_CHUNK] for index in range(0, len(raw), NM_CHUNK)] or [b""]
+        for index, chunk in enumerate(chunks):
+            more = 0x01 if index < len(chunks) - 1 else 0
+            entries.append(b"NM" + bytes([5 + len(chunk), 1, more]) + chunk)
+    if target is not None:
+        entries += _sl_entries(target)
+    return entries
+
+
+def _sl_entries(target):
+    components = []
+    if target.startswith("/"):
+        components.append(b"\x08\x00")
+    for part in [part for part in target.split("/") if part]:
+        if part == ".":
+            components.append(b"\x02\x00")
+        elif part == "..":
+            components.append(b"\x04\x00")
+        else:
+            raw = part.encode("utf-8", "surrogateescape")
+            pieces = [raw[index:index + 200] for index in range(0, len(raw), 200)]
+            for index, piece in enumerate(pieces):
+                components.append(bytes([0x01 if index < len(pieces) - 1 else 0, len(piece)]) + piece)
+    entries, current = [], b""
+    for component in components:
+        if len(current) + len(component) > 250:
+            entries.append(current)
+            current = b""
+        current += component
+    entries.append(current)
+    return [b"SL" + bytes([5 + len(body), 1, 0x01 if index < len(entries) - 1 else 0]) + body
+            for index, body in enumerate(entries)]
+
+
+class IsoWriter:
+    """Plans the whole image from a manifest and writes it in one pass"""
+
+    def __init__(self, manifest, boot=None, volume_id="CDROM", joliet=True, rock_ridge=True, epoch=None,
+                 system_id="LINUX", application_id=None, file_order=None, log=None):
+        self.manifest = manifest
+        self.boot = boot
+        self.volume_id = volume_id
+        self.joliet = joliet
+        self.rock_ridge = rock_ridge
+        self.epoch = epoch if epoch is not None else int(os.environ.get("SOURCE_DATE_EPOCH", time.time()))
+        self.system_id = system_id
+        self.application_id = application_id or f"INSTYAML ISO WRITER {VERSION}"
+        # Sort key over file paths for data placement (boot_layout.BootLayout.sort_key); default path order
+        self.file_order = file_order
+        # The image may be going to stdout: progress goes to stderr
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}", file=sys.stderr))
+        self.layout = None
+
+    # ------------------------------------------------------------------
+    # Tree
+    # ------------------------------------------------------------------
+
+    def _build_tree(self):
+        root = _Node("", ManifestEntry("", stat.S_IFDIR | 0o555, mtime=self.epoch), None)
+        nodes = {"": root}
+        entries = dict(self.manifest.entries)
+        if self.boot and self.boot.catalog_path:
+            catalog = Manifest._normalize(self.boot.catalog_path)
+            entries[catalog] = ManifestEntry(catalog, stat.S_IFREG | 0o444, BLOCK, self.epoch, data=b"")
+        for path in sorted(entries, key=lambda name: (name.count("/"), name)):
+            parent_path, _, name = path.rpartition("/")
+            parent = nodes.get(parent_path)
+            if parent is None or not parent.is_dir:
+                raise IsoError(f"{path}: parent directory missing from the manifest")
+            node = _Node(name, entries[path], parent)
+            parent.children.append(node)
+            nodes[path] = node
+        for node in nodes.values():
+            if node.is_dir:
+                used = {"iso": set(), "joliet": set()}
+                for child in sorted(node.children, key=lambda child: child.name):
+                    child.names["iso"] = iso_identifier(child.name, child.is_dir, used["iso"])
+                    if not child.entry.is_symlink:
+                        child.names["joliet"] = joliet_identifier(child.name, used["joliet"])
+        root.names = {"iso": b"\0", "joliet": b"\0"}
+        return root, nodes
+
+    def _trees(self):
+        return ["iso", "joliet"] if self.joliet else ["iso"]
+
+    def _children(self, node, tree):
+        children = [child for child in node.children if tree in child.names]
+        return sorted(children, key=lambda child: child.names[tree])
+
+    def _directories(self, root, tree):
+        """Breadth-first with sorted siblings: path table order"""
+        order, queue = [], [root]
+        while queue:
+            node = queue.pop(0)
+            order.append(node)
+            queue += [child for child in self._children(node, tree) if child.is_dir]
+        return order
+
+    # ------------------------------------------------------------------
+    # Rock Ridge
+    # ------------------------------------------------------------------
+
+    def _rr_entries(self, node, role):
+        entry = node.entry
+        nlink = 2 + sum(1 for child in node.children if child.is_dir) if node.is_dir else 1
+        root = role == "self" and node.parent is None
+        entries = [b"SP\x07\x01\xbe\xef\x00"] if root else []
+        entries += rock_ridge_entries(node.name if role == "child" else None, entry.mode, entry.mtime or self.epoch,
+                                      nlink, entry.target if role == "child" and entry.is_symlink else None)
+        if root:
+            entries.append(b"ER" + bytes([8 + len(RRIP_ID) + len(RRIP_DESCRIPTION) + len(RRIP_SOURCE), 1,
+                                          len(RRIP_ID), len(RRIP_DESCRIPTION), len(RRIP_SOURCE), 1])
+                           + RRIP_ID + RRIP_DESCRIPTION + RRIP_SOURCE)
+        return entries
+
+    # ------------------------------------------------------------------
+    # Directory records
+    # ------------------------------------------------------------------
+
+    def _slots(self, node, tree):
+        """(node described, role, identifier) for every record of a directory"""
+        slots = [(node, "self", b"\0"), (node.parent or node, "parent", b"\1")]
+        return slots + [(child, "child", child.names[tree]) for child in self._children(node, tree)]
+
+    def _plan_susp(self, directories):
+        """Split Rock Ridge entries between records and continuation areas; allocate the areas"""
+        split, areas, position = {}, [], 0
+        for node in directories:
+            for index, (target, role, ident) in enumerate(self._slots(node, "iso")):
+                entries = self._rr_entries(target, role)
+                room = 254 - (33 + len(ident) + (1 - len(ident) % 2))
+                if sum(map(len, entries)) <= room:
+                    split[(id(node), index)] = (b"".join(entries), None)
+                    continue
+                inline, used, cut = [], 0, 0
+                for cut, item in enumerate(entries):
+                    if used + len(item) + CE_SIZE > room:
+                        break
+                    inline.append(item)
+                    used += len(item)
+                rest = b"".join(entries[cut:])
+                if len(rest) > BLOCK:
+                    raise IsoError(f"{target.entry.path}: Rock Ridge data too large")
+                if position % BLOCK + len(rest) > BLOCK:
+                    position = _blocks(position) * BLOCK
+                areas.append(rest)
+                split[(id(node), index)] = (b"".join(inline), (position, rest))
+                position += len(rest)
+        return split, areas, _blocks(position)
+
+    def _dir_records(self, node, tree, lba, size, susp=None, ce_base=0, bias=0):
+        records = []
+        for index, (target, role, ident) in enumerate(self._slots(node, tree)):
+            entry = target.entry
+            area = b""
+            if susp is not None:
+                area, continuation = susp[(id(node), index)]
+                if continuation:
+                    position, data = continuation
+                    block, offset = divmod(position, BLOCK)
+                    area += b"CE\x1c\x01" + _both32(ce_base + block - bias) + _both32(offset) + _both32(len(data))
+            if target.is_dir:
+                extent, length, flags = lba[id(target)] - bias, size[id(target)], 0x02
+            elif entry.is_symlink or not entry.size:
+                extent, length, flags = 0, 0, 0
+            else:
+                extent, length, flags = self.layout["files"][id(entry)] - bias, entry.size, 0
+            records.append(directory_record(extent, length, flags, ident, entry.mtime or self.epoch, area))
+        return records
+
+    @staticmethod
+    def _pack(records):
+        out = bytearray()
+        for record in records:
+            if len(out) % BLOCK + len(record) > BLOCK:
+                out += b"\0" * (-len(out) % BLOCK)
+            out += record
+        out += b"\0" * (-len(out) % BLOCK)
+        return bytes(out)
+
+    def _path_table(self, directories, tree, lba, big_endian, bias=0):
+        number = {id(node): index for index, node in enumerate(directories, 1)}
+        order = ">" if big_endian else "<"
+        out = bytearray()
+        for node in directories:
+            ident = node.names[tree]
+            parent = number[id(node.parent)] if node.parent else 1
+            out += bytes([len(ident), 0]) + struct.pack(f"{order}IH", lba[id(node)] - bias, parent) + ident
+            if len(ident) % 2:
+                out += b"\0"
+        return bytes(out)
+
+    # ------------------------------------------------------------------
+    # Layout
+    # ------------------------------------------------------------------
+
+    def plan(self):
+        """Assign every structure and file its block; returns the layout dict"""
+        root, nodes = self._build_tree()
+        boot = self.boot
+        offset = boot.partition_offset if boot else 0
+        directories = {tree: self._directories(root, tree) for tree in self._trees()}
+        susp, areas, ce_blocks = self._plan_susp(directories["iso"]) if self.rock_ridge else (None, [], 0)
+
+        # Directory sizes do not depend on block numbers: measure with placeholders
+        size = {}
+        for tree in self._trees():
+            for node in directories[tree]:
+                zero = {id(n): 0 for n in directories[tree]}
+                self.layout = {"files": {id(n.entry): 0 for n in nodes.values()}}
+                records = self._dir_records(node, tree, zero, {id(n): 0 for n in directories[tree]},
+                                            susp if tree == "iso" else None)
+                size[(tree, id(node))] = len(self._pack(records))
+        path_table_size = {tree: len(self._path_table(directories[tree], tree, {id(n): 0 for n in directories[tree]},
+                                                      False)) for tree in self._trees()}
+
+        descriptors = 2 + (1 if boot else 0) + (1 if self.joliet else 0)
+        position = SYSTEM_AREA_BLOCKS + descriptors
+        variants = [0] + ([offset] if offset else [])
+        if offset:
+            position = max(position, offset + SYSTEM_AREA_BLOCKS + descriptors)
+        path_tables, dir_lba = {}, {}
+        for variant in variants:
+            for tree in self._trees():
+                blocks = _blocks(path_table_size[tree])
+                path_tables[(variant, tree)] = (position, position + blocks)
+                position += 2 * blocks
+        for variant in variants:
+            for tree in self._trees():
+                lba = dir_lba.setdefault((variant, tree), {})
+                for node in directories[tree]:
+                    lba[id(node)] = position
+                    position += size[(tree, id(node))] // BLOCK
+        ce_base = position
+        position += ce_blocks
+        catalog = None
+        if boot:
+            catalog = position
+            position += 1
+
+        files, data_lba = {}, {}
+        order = [node for node in nodes.values() if node.entry.is_file]
+        order.sort(key=lambda node: self.file_order(node.entry.path) if self.file_order else node.entry.path)
+        for node in order:
+            entry = node.entry
+            if boot and boot.catalog_path and entry.path == Manifest._normalize(boot.catalog_path):
+                files[id(entry)] = catalog
+                continue
+            if not entry.size:
+                continue
+            key = ("bios",) if boot and entry.path == boot.bios_image else entry.data_key()
+            if key not in data_lba:
+                data_lba[key] = (position, entry)
+                position += _blocks(entry.size)
+            files[id(entry)] = data_lba[key][0]
+        volume_blocks = position
+
+        esp_blocks = 0
+        if boot and boot.efi_partition:
+            esp_blocks = _blocks(boot.efi_partition[2])
+        total_sectors = (volume_blocks + esp_blocks) * (BLOCK // SECTOR)
+        if boot and boot.gpt:
+            total_sectors += GPT_TAIL_SECTORS
+        self.layout = {
+            "root": root, "nodes": nodes, "directories": directories, "dir_size": size, "dir_lba": dir_lba,
+            "path_tables": path_tables, "path_table_size": path_table_size, "susp": susp, "ce_areas": areas,
+            "ce_base": ce_base, "ce_blocks": ce_blocks, "catalog": catalog, "files": files,
+            "data": sorted(data_lba.values(), key=lambda item: item[0]), "volume_blocks": volume_blocks,
+            "variants": variants, "esp_block": volume_blocks if esp_blocks else None, "esp_blocks": esp_blocks,
+            "total_bytes": total_sectors * SECTOR,
+        }
+        return self.layout
+
+    # ------------------------------------------------------------------
+    # Structures
+    # ------------------------------------------------------------------
+
+    def _volume_descriptor(self, tree, variant):
+        layout = self.layout
+        joliet = tree == "joliet"
+        root = layout["root"]
+        descriptor = bytearray(BLOCK)
+        descriptor[0:7] = bytes([2 if joliet else 1]) + b"CD001\x01"
+        descriptor[8:40] = _text(self.system_id, 32, joliet)
+        descriptor[40:72] = _text(self.volume_id, 32, joliet) if joliet else \
+            self.volume_id.encode("ascii", "replace")[:32].ljust(32, b" ")
+        descriptor[80:88] = _both32(layout["volume_blocks"] - variant)
+        if joliet:
+            descriptor[88:91] = b"%/E"
+        descriptor[120:124] = _both16(1)
+        descriptor[124:128] = _both16(1)
+        descriptor[128:132] = _both16(BLOCK)
+        descriptor[132:140] = _both32(layout["path_table_size"][tree])
+        l_table, m_table = layout["path_tables"][(variant, tree)]
+        descriptor[140:144] = struct.pack("<I", l_table - variant)
+        descriptor[148:152] = struct.pack(">I", m_table - variant)
+        lba = layout["dir_lba"][(variant, tree)]
+        descriptor[156:190] = directory_record(lba[id(root)] - variant, layout["dir_size"][(tree, id(root))], 0x02,
+                                           b"\0", self.epoch)
+        for start, length, value in ((190, 128, ""), (318, 128, ""), (446, 128, ""),
+                                     (574, 128, self.application_id), (702, 37, ""), (739, 37, ""),
+                                     (776, 37, "")):
+            descriptor[start:start + length] = _text(value, length, joliet)
+        now = _date17(self.epoch)
+        descriptor[813:830] = now
+        descriptor[830:847] = now
+        descriptor[847:864] = b"0" * 16 + b"\0"
+        descriptor[864:881] = b"0" * 16 + b"\0"
+        descriptor[881] = 1
+        return bytes(descriptor)
+
+    def _descriptor_set(self, variant):
+        out = [self._volume_descriptor("iso", variant)]
+        if self.boot:
+            record = bytearray(BLOCK)
+            record[0:7] = b"\0CD001\x01"
+            record[7:39] = b"EL TORITO SPECIFICATION".ljust(32, b"\0")
+            record[71:75] = struct.pack("<I", self.layout["catalog"] - variant)
+            out.append(bytes(record))
+        if self.joliet:
+            out.append(self._volume_descriptor("joliet", variant))
+        out.append(b"\xffCD001\x01".ljust(BLOCK, b"\0"))
+        return out
+
+    def _boot_targets(self):
+        """[(platform, extent, sectors)] for the catalog"""
+        boot, layout = self.boot, self.layout
+        targets = []
+        if boot.bios_image:
+            node = layout["nodes"].get(Manifest._normalize(boot.bios_image))
+            if node is None:
+                raise IsoError(f"BIOS boot image {boot.bios_image} is not in the manifest")
+            targets.append((0x00, layout["files"][id(node.entry)], boot.bios_load_size))
+        if boot.efi_image:
+            node = layout["nodes"].get(Manifest._normalize(boot.efi_image))
+            if node is None:
+                raise IsoError(f"EFI boot image {boot.efi_image} is not in the manifest")
+            sectors = boot.efi_load_size or min(-(-node.entry.size // SECTOR), 0xFFFF)
+            targets.append((0xEF, layout["files"][id(node.entry)], sectors))
+        elif boot.efi_partition:
+            sectors = boot.efi_load_size or min(-(-boot.efi_partition[2] // SECTOR), 0xFFFF)
+            targets.append((0xEF, layout["esp_block"], sectors))
+        return targets
+
+    def _catalog(self):
+        targets = self._boot_targets()
+        if not targets:
+            raise IsoError("El Torito needs a BIOS or EFI boot image")
+        catalog = bytearray(BLOCK)
+        validation = bytearray(32)
+        validation[0], validation[1] = 1, targets[0][0]
+        validation[30:32] = b"\x55\xaa"
+        checksum = -sum(struct.unpack("<16H", bytes(validation))) & 0xFFFF
+        struct.pack_into("<H", validation, 28, checksum)
+        catalog[0:32] = validation
+
+        def entry(extent, sectors):
+            return bytes([0x88, 0]) + b"\0\0" + b"\0\0" + struct.pack("<HI", sectors, extent) + b"\0" * 20
+
+        catalog[32:64] = entry(targets[0][1], targets[0][2])
+        position = 64
+        for index, (platform, extent, sectors) in enumerate(targets[1:]):
+            final = 0x91 if index == len(targets) - 2 else 0x90
+            catalog[position:position + 32] = bytes([final, platform]) + struct.pack("<H", 1) + b"\0" * 28
+            catalog[position + 32:position + 64] = entry(extent, sectors)
+            position += 64
+        return bytes(catalog)
+
+    def _patch_bios_image(self, data, extent):
+        data = bytearray(data)
+        if self.boot.grub2_boot_info and len(data) >= GRUB2_BOOT_INFO + 8:
+            struct.pack_into("<Q", data, GRUB2_BOOT_INFO, extent * 4 + 5)
+        if self.boot.boot_info_table and len(data) >= 64:
+            body = bytes(data[64:]) + b"\0" * (-(len(data) - 64) % 4)
+            checksum = sum(struct.unpack(f"<{len(body) // 4}I", body)) & 0xFFFFFFFF
+            data[BOOT_INFO_TABLE:64] = struct.pack("<IIII", SYSTEM_AREA_BLOCKS, extent, len(data), checksum) \
+                + b"\0" * 40
+        return bytes(data)
+
+    def _guid(self, label):
+        digest = hashlib.sha256(f"{self.volume_id}:{self.epoch}:{self.layout['total_bytes']}:{label}".encode())
+        return uuid.UUID(bytes=digest.digest()[:16], version=4)
+
+    def _gpt(self):
+        """(primary header, table, backup header) as bytes"""
+        layout, boot = self.layout, self.boot
+        total = layout["total_bytes"] // SECTOR
+        last = total - 1
+        partitions = [(GPT_BASIC_DATA, max(boot.partition_offset * 4, 64), layout["volume_blocks"] * 4 - 1,
+                       "ISO9660")]
+        if layout["esp_block"] is not None:
+            start = layout["esp_block"] * 4
+            partitions.append((GPT_ESP, start, start + layout["esp_blocks"] * 4 - 1, "Appended2"))
+        table = bytearray(GPT_ENTRIES * GPT_ENTRY_SIZE)
+        for index, (type_id, first, end, name) in enumerate(partitions):
+            struct.pack_into("<16s16sQQQ72s", table, index * GPT_ENTRY_SIZE, type_id.bytes_le,
+                             self._guid(f"part{index}").bytes_le, first, end, 0, name.encode("utf-16-le"))
+        table_crc = zlib.crc32(table)
+
+        def header(current, backup, table_lba):
+            fields = [b"EFI PART", 0x00010000, 92, 0, 0, current, backup, 2 + GPT_TABLE_SECTORS,
+                      last - 1 - GPT_TABLE_SECTORS, self._guid("disk").bytes_le, table_lba, GPT_ENTRIES,
+                      GPT_ENTRY_SIZE, table_crc]
+            raw = struct.pack("<8sIIIIQQQQ16sQIII", *fields)
+            fields[3] = zlib.crc32(raw)
+            return struct.pack("<8sIIIIQQQQ16sQIII", *fields).ljust(SECTOR, b"\0")
+
+        return header(1, last, 2), bytes(table), header(last, 1, last - GPT_TABLE_SECTORS)
+
+    def _system_area(self, gpt):
+        boot, layout = self.boot, self.layout
+        area = bytearray(SYSTEM_AREA_BLOCKS * BLOCK)
+        if not boot:
+            return bytes(area)
+        total = layout["total_bytes"] // SECTOR
+        if boot.mbr_template:
+            area[:len(boot.mbr_template[:440])] = boot.mbr_template[:440]
+        bios = layout["nodes"].get(Manifest._normalize(boot.bios_image)) if boot.bios_image else None
+        if bios is not None and boot.mbr_patch == "grub2":
+            struct.pack_into("<Q", area, MBR_BOOT_ADDRESS, layout["files"][id(bios.entry)] * 4 + 4)
+        elif bios is not None and boot.mbr_patch == "isohybrid":
+            struct.pack_into("<I", area, MBR_BOOT_ADDRESS, layout["files"][id(bios.entry)] * 4)
+        if not (boot.mbr or boot.gpt):
+            return bytes(area)
+        if not any(area[440:444]):
+            area[440:444] = self._guid("mbr").bytes[:4]
+
+        def mbr_entry(bootable, type_id, first, count):
+            return bytes([0x80 if bootable else 0, 0xFE, 0xFF, 0xFF, type_id, 0xFE, 0xFF, 0xFF]) + \
+                struct.pack("<II", first, min(count, 0xFFFFFFFF))
+
+        if boot.gpt and boot.protective_mbr:
+            area[446:462] = mbr_entry(boot.mbr_bootable, MBR_PROTECTIVE, 1, total - 1)
+        else:
+            first = boot.partition_offset * 4
+            area[446:462] = mbr_entry(boot.mbr_bootable, 0x17, first, layout["volume_blocks"] * 4 - first)
+            if layout["esp_block"] is not None:
+                area[462:478] = mbr_entry(False, 0xEF, layout["esp_block"] * 4, layout["esp_blocks"] * 4)
+        area[510:512] = b"\x55\xaa"
+        if gpt:
+            primary, table, _backup = gpt
+            area[SECTOR:2 * SECTOR] = primary
+            area[2 * SECTOR:2 * SECTOR + len(table)] = table
+        return bytes(area)
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+
+    def write(self, stream, progress=None):
+        """Stream the image to a binary file object; returns the layout (plus 'bytes' and 'seconds')"""
+        started = time.time()
+        layout = self.plan()
+        total = layout["total_bytes"]
+        boot = self.boot
+        out = _Output(stream, total, progress)
+        gpt = self._gpt() if boot and boot.gpt else None
+
+        out.write(self._system_area(gpt))
+        for variant in layout["variants"]:
+            out.pad_to((variant + SYSTEM_AREA_BLOCKS) * BLOCK)
+            for descriptor in self._descriptor_set(variant):
+                out.write(descriptor)
+        for variant in layout["variants"]:
+            for tree in self._trees():
+                lba = layout["dir_lba"][(variant, tree)]
+                l_table, m_table = layout["path_tables"][(variant, tree)]
+                for position, big_endian in ((l_table, False), (m_table, True)):
+                    out.pad_to(position * BLOCK)
+                    out.write(self._path_table(layout["directories"][tree], tree, lba, big_endian, variant))
+        for variant in layout["variants"]:
+            for tree in self._trees():
+                lba = layout["dir_lba"][(variant, tree)]
+                sizes = {id(node): layout["dir_size"][(tree, id(node))] for node in layout["directories"][tree]}
+                for node in layout["directories"][tree]:
+                    out.pad_to(lba[id(node)] * BLOCK)
+                    records = self._dir_records(node, tree, lba, sizes, layout["susp"] if tree == "iso" else None,
+                                                layout["ce_base"], variant)
+                    out.write(self._pack(records))
+        position = layout["ce_base"] * BLOCK
+        for area in layout["ce_areas"]:
+            if position % BLOCK + len(area) > BLOCK:
+                position = _blocks(position) * BLOCK
+            out.pad_to(position)
+            out.write(area)
+            position += len(area)
+        if boot:
+            out.pad_to(layout["catalog"] * BLOCK)
+            out.write(self._catalog())
+
+        files = {}
+        try:
+            for extent, entry in layout["data"]:
+                out.pad_to(extent * BLOCK)
+                if boot and entry.path == boot.bios_image:
+                    out.write(self._patch_bios_image(b"".join(entry.chunks(files)), extent))
+                    continue
+                written = 0
+                for chunk in entry.chunks(files):
+                    out.write(chunk)
+                    written += len(chunk)
+                if written != entry.size:
+                    raise IsoError(f"{entry.path}: expected {entry.size:,} bytes, got {written:,}")
+            out.pad_to(layout["volume_blocks"] * BLOCK)
+            if layout["esp_block"] is not None:
+                source, offset, size = boot.efi_partition
+                esp = ManifestEntry("[ESP]", stat.S_IFREG, size, source=source, offset=offset)
+                for chunk in esp.chunks(files):
+                    out.write(chunk)
+                out.pad_to((layout["volume_blocks"] + layout["esp_blocks"]) * BLOCK)
+        finally:
+            for fd in files.values():
+                os.close(fd)
+        if gpt:
+            _primary, table, backup = gpt
+            out.pad_to(total - (GPT_TABLE_SECTORS + 1) * SECTOR)
+            out.write(table)
+            out.write(backup)
+        out.pad_to(total)
+        layout["bytes"] = out.position
+        layout["seconds"] = time.time() - started
+        return layout
+
+    def write_file(self, output, progress=None):
+        output = Path(output)
+        output.unlink(missing_ok=True)
+        with open(output, "wb") as handle:
+            layout = self.write(handle, progress)
+        self.log(f"{output.name}: {layout['bytes']:,} bytes, {len(layout['data']):,} extents "
+                 f"in {layout['seconds']:.1f}s", "💿")
+        return layout
+
+
+class _Output:
+    """Sequential writer with a position check and progress callback"""
+
+    def __init__(self, stream, total, progress=None):
+        self.stream = stream
+        self.total = total
+        self.progress = progress
+        self.position = 0
+        self._reported = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+        if self.progress and (self.position - self._reported >= 8 * CHUNK or self.position == self.total):
+            self._reported = self.position
+            self.progress(self.position, self.total)
+
+    def pad_to(self, position):
+        if position < self.position:
+            raise IsoError(f"layout overlap: at {self.position:,}, next structure starts at {position:,}")
+        while self.position < position:
+            self.write(b"\0" * min(CHUNK, position - self.position))
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: iso_writer.py <base.iso> <output.iso|/dev/sdX|-|http://…> [--overlay=DIR] [--remove=/a,/b]")
+        print("                     [--volid=NAME] [--manifest=FILE] [--save-manifest=FILE] [--no-joliet]")
+        print("                     [--verify] [--write-behind=N] [--layout=boot|FILE]")
+        print("       files come from the base ISO (by extent) plus the overlay; boot setup is the base ISO's")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[3:] if arg.startswith("--") and "=" in arg)
+    base_iso, output = sys.argv[1], sys.argv[2]
+    log = lambda message, emoji="📝": print(f"{emoji} {message}", file=sys.stderr)
+    manifest = Manifest.load(options["manifest"]) if "manifest" in options else Manifest.from_base_iso(base_iso)
+    if "overlay" in options:
+        manifest.add_tree(options["overlay"])
+    for path in filter(None, options.get("remove", "").split(",")):
+        manifest.remove(path)
+    manifest.refresh_md5sums()
+    if "save-manifest" in options:
+        manifest.save(options["save-manifest"])
+    with IsoImage(base_iso) as image:
+        volume_id = options.get("volid", image.volume_id)
+    boot = BootSpec.from_base_iso(base_iso)
+    layout = BootLayout.from_spec(options.get("layout", "default"))
+    writer = IsoWriter(manifest, boot, volume_id=volume_id, joliet="--no-joliet" not in sys.argv,
+                       file_order=layout.sort_key if layout else None, log=log)
+    writer.log(f"Boot setup: {boot.describe()}", "🥾")
+    try:
+        with open_sink(output, write_behind=int(options.get("write-behind", 4)), hashes=True, log=log) as sink:
+            layout = writer.write(sink)
+        writer.log(f"{sink.name}: {layout['bytes']:,} bytes in {layout['seconds']:.1f}s", "💿")
+        if "--verify" in sys.argv and sink.verify() is False:
+            return 1
+        # SHA256SUMS, MD5SUMS and the chunk manifest, from the hashes taken while writing
+        sink.publish()
+    except (IsoError, SinkError, OSError) as e:
+        writer.log(f"{e}", "❌")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
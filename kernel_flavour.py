@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+KERNEL FLAVOUR v1.0
+Boots one kernel flavour everywhere and drops the others from the ISO.
+
+Every boot menu entry is retargeted to the chosen kernel/initrd pair
+(entries that end up identical are merged), then casper kernel and initrd
+images no menu references any more are deleted, their md5sum.txt lines are
+dropped and the checksums of the rewritten configs are refreshed.
+"""
+
+import sys
+import hashlib
+from pathlib import Path
+
+from boot_config import BootConfigSet, DropDuplicates, RetargetKernel
+from slimming_profiles import FLASH_WRITE_MBPS
+
+VERSION = "1.0"
+
+# Kernel path and initrd names (first existing wins; the build renames initrd -> initrd.gz)
+FLAVOURS = {
+    "ga": ("/casper/vmlinuz", ["/casper/initrd.gz", "/casper/initrd"]),
+    "hwe": ("/casper/hwe-vmlinuz", ["/casper/hwe-initrd", "/casper/hwe-initrd.gz"]),
+}
+KERNEL_GLOBS = ("*vmlinuz*", "*initrd*")
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def update_md5sums(iso_root, removed=(), changed=()):
+    """Drop lines for removed files and re-hash changed ones; returns lines touched"""
+    md5sums = Path(iso_root) / "md5sum.txt"
+    if not md5sums.exists():
+        return 0
+    removed = {f"./{path.lstrip('/')}" for path in removed}
+    changed = {f"./{path.lstrip('/')}" for path in changed}
+    lines, touched = [], 0
+    for line in md5sums.read_text().splitlines():
+        parts = line.split(None, 1)
+        name = parts[1].strip() if len(parts) == 2 else ""
+        if name in removed:
+            touched += 1
+            continue
+        if name in changed:
+            line = f"{file_md5(Path(iso_root) / name)}  {name}"
+            touched += 1
+        lines.append(line)
+    md5sums.write_text("\n".join(lines) + "\n")
+    return touched
+
+
+class KernelSelection:
+    """Retarget every boot entry to one flavour and delete the unused images"""
+
+    def __init__(self, iso_root, flavour="ga", log=None):
+        if flavour not in FLAVOURS:
+            raise ValueError(f"Unknown kernel flavour '{flavour}' (known: {', '.join(FLAVOURS)})")
+        self.iso_root = Path(iso_root)
+        self.flavour = flavour
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        kernel, initrds = FLAVOURS[flavour]
+        self.kernel = kernel
+        self.initrd = next((path for path in initrds if (self.iso_root / path.lstrip("/")).exists()), None)
+        if not (self.iso_root / kernel.lstrip("/")).exists() or self.initrd is None:
+            raise FileNotFoundError(f"{flavour} kernel or initrd missing under {self.iso_root / 'casper'}")
+
+    def images(self):
+        """ISO paths of every casper kernel/initrd image"""
+        casper = self.iso_root / "casper"
+        return sorted({f"/casper/{path.name}" for pattern in KERNEL_GLOBS for path in casper.glob(pattern)
+                       if path.is_file()})
+
+    def apply(self, dry_run=False):
+        """Returns {'configs', 'removed', 'bytes_saved', 'flash_seconds_saved'}"""
+        configs = BootConfigSet(self.iso_root, log=self.log)
+        # Menus may also name images that no longer exist (initrd before the .gz rename)
+        named = {path for _path, entry in configs.entries() for path in [entry.kernel] + entry.initrds
+                 if path and path.startswith("/casper/")}
+        others = sorted((set(self.images()) | named) - {self.kernel, self.initrd})
+        kernels = {path: self.kernel for path in others if "vmlinuz" in path}
+        initrds = {path: self.initrd for path in others if "initrd" in path}
+        transforms = [RetargetKernel(kernels, initrds), DropDuplicates()]
+        changed = configs.variant(transforms)[1] if dry_run else configs.write(transforms)
+
+        # Whatever a menu still references (memtest, another flavour by choice) stays
+        referenced = set()
+        for _path, entry in configs.entries():
+            referenced.add(entry.kernel)
+            referenced.update(entry.initrds)
+        if dry_run:
+            referenced = {kernels.get(path, initrds.get(path, path)) for path in referenced}
+        removed = [path for path in self.images() if path in others and path not in referenced]
+
+        bytes_saved = sum((self.iso_root / path.lstrip("/")).stat().st_size for path in removed)
+        if not dry_run:
+            for path in removed:
+                (self.iso_root / path.lstrip("/")).unlink()
+            touched = update_md5sums(self.iso_root, removed, changed)
+            if touched:
+                self.log(f"md5sum.txt: {touched} entries updated", "🔏")
+        for path in removed:
+            self.log(f"{'Would remove' if dry_run else 'Removed'} unused {path}", "🗑️")
+        report = {
+            "configs": changed,
+            "removed": removed,
+            "bytes_saved": bytes_saved,
+            "flash_seconds_saved": bytes_saved / (FLASH_WRITE_MBPS * 1e6),
+        }
+        self.log(f"Kernel flavour '{self.flavour}' ({self.kernel}, {self.initrd}): "
+                 f"{bytes_saved / 1e6:,.1f} MB less to build and flash "
+                 f"(~{report['flash_seconds_saved']:.0f}s at {FLASH_WRITE_MBPS} MB/s)", "📉")
+        return report
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Usage: kernel_flavour.py <extracted_iso_dir> [{'|'.join(FLAVOURS)}] [--dry-run]")
+        return 1
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    selection = KernelSelection(args[0], args[1] if len(args) > 1 else "ga")
+    selection.apply(dry_run="--dry-run" in sys.argv)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+OUTPUT SINKS v1.0
+Where a build's bytes go: a file, a USB stick, stdout or a local HTTP endpoint.
+
+Builders write the image once, to a sink, instead of writing a file and
+reading it back to flash it.  Every sink hashes the stream in fixed-size
+chunks as it goes; verify() re-reads what was written (on a block device
+with O_DIRECT, so past the page cache) and compares chunk by chunk, so a
+finished build is already on the stick and checked.  A HashingTee adds the
+whole-image SHA-256/MD5 and publishes SHA256SUMS and a chunk manifest next
+to the image, so publishing a build never reads it again either.
+
+Block devices get O_DIRECT writes from page-aligned buffers (the unaligned
+tail goes through the page cache) and an fsync barrier at the end.  A
+write-behind thread lets the producer run while the device writes.
+
+    with open_sink("/dev/sdb", write_behind=4) as sink:
+        IsoWriter(manifest, boot).write(sink)
+    sink.verify()
+"""
+
+import os
+import sys
+import json
+import mmap
+import stat
+import fcntl
+import queue
+import hashlib
+import threading
+import http.client
+from pathlib import Path
+from urllib.parse import urlsplit
+
+VERSION = "1.0"
+
+VERIFY_CHUNK = 4 << 20
+DIRECT_BUFFER = 8 << 20
+ALIGN = 4096
+COALESCE = 1 << 20
+O_DIRECT = getattr(os, "O_DIRECT", 0)
+
+
+class SinkError(Exception):
+    pass
+
+
+class Sink:
+    """A write-only byte stream that remembers per-chunk SHA-256 hashes of what it was given"""
+
+    verifiable = True
+
+    def __init__(self, name, chunk_size=VERIFY_CHUNK, hash_chunks=True, log=None):
+        self.name = name
+        self.chunk_size = chunk_size
+        # hash_chunks=False when the expected hashes come from elsewhere (set chunk_hashes before verify)
+        self.hash_chunks = hash_chunks
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.position = 0
+        self.chunk_hashes = []
+        self.closed = False
+        self._digest = hashlib.sha256()
+        self._in_chunk = 0
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        if self.hash_chunks:
+            self._hash(data)
+        self._write(data)
+        self.position += len(data)
+        return len(data)
+
+    def _hash(self, data):
+        while len(data):
+            take = min(len(data), self.chunk_size - self._in_chunk)
+            self._digest.update(data[:take])
+            self._in_chunk += take
+            data = data[take:]
+            if self._in_chunk == self.chunk_size:
+                self.chunk_hashes.append(self._digest.hexdigest())
+                self._digest, self._in_chunk = hashlib.sha256(), 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._in_chunk:
+            self.chunk_hashes.append(self._digest.hexdigest())
+            self._in_chunk = 0
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, data):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def _read_chunks(self):
+        """Yields what was written, chunk_size bytes at a time"""
+        raise NotImplementedError
+
+    def verify(self):
+        """Re-read and compare chunk hashes; True, False, or None when the sink cannot be read back"""
+        if not self.verifiable:
+            self.log(f"{self.name}: written data cannot be read back, not verified", "⚠️")
+            return None
+        self.close()
+        bad, count = [], 0
+        for index, chunk in enumerate(self._read_chunks()):
+            count += 1
+            if index >= len(self.chunk_hashes) or hashlib.sha256(chunk).hexdigest() != self.chunk_hashes[index]:
+                bad.append(index)
+        if count != len(self.chunk_hashes):
+            bad += list(range(count, len(self.chunk_hashes)))
+        if bad:
+            self.log(f"{self.name}: {len(bad)} of {len(self.chunk_hashes)} chunks differ "
+                     f"(first at byte {bad[0] * self.chunk_size:,})", "❌")
+            return False
+        self.log(f"{self.name}: verified {self.position:,} bytes ({len(self.chunk_hashes)} chunks)", "✅")
+        return True
+
+
+class FileSink(Sink):
+    """A regular file, replaced (never written through an existing name)"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(str(path), **kwargs)
+        self.path = Path(path)
+        self.path.unlink(missing_ok=True)
+        self._file = open(self.path, "wb")
+
+    def _write(self, data):
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+    def _read_chunks(self):
+        with open(self.path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(self.chunk_size), b""):
+                yield chunk
+
+
+def _mounted(device):
+    """Mount points of `device` or any of its partitions"""
+    device = os.path.realpath(device)
+    mounts = []
+    try:
+        with open("/proc/mounts") as handle:
+            for line in handle:
+                source, target = line.split()[:2]
+                source = os.path.realpath(source) if source.startswith("/dev/") else source
+                if source == device or (source.startswith(device) and source[len(device):].lstrip("p").isdigit()):
+                    mounts.append(target)
+    except OSError:
+        pass
+    return mounts
+
+
+class BlockDeviceSink(Sink):
+    """A whole block device (USB stick): O_DIRECT aligned writes, fsync barrier, O_DIRECT read-back"""
+
+    def __init__(self, device, direct=True, buffer_size=DIRECT_BUFFER, **kwargs):
+        super().__init__(str(device), **kwargs)
+        self.device = str(device)
+        if not stat.S_ISBLK(os.stat(self.device).st_mode):
+            raise SinkError(f"{self.device} is not a block device")
+        mounts = _mounted(self.device)
+        if mounts:
+            raise SinkError(f"{self.device} is mounted ({', '.join(mounts)}); unmount it first")
+        self.direct = bool(direct and O_DIRECT)
+        self._fd = os.open(self.device, os.O_WRONLY | os.O_CLOEXEC | (O_DIRECT if self.direct else 0))
+        self.capacity = os.lseek(self._fd, 0, os.SEEK_END)
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        # mmap memory is page aligned, as O_DIRECT requires
+        self._buffer = mmap.mmap(-1, buffer_size)
+        self._fill = 0
+        self._offset = 0
+
+    def _write(self, data):
+        if self.position + len(data) > self.capacity:
+            raise SinkError(f"{self.device} holds {self.capacity:,} bytes; the image does not fit")
+        while len(data):
+            take = min(len(data), len(self._buffer) - self._fill)
+            self._buffer[self._fill:self._fill + take] = data[:take]
+            self._fill += take
+            data = data[take:]
+            if self._fill == len(self._buffer):
+                self._drain(self._fill)
+
+    def _drain(self, size):
+        """Write the first `size` (aligned) buffered bytes at the current device offset"""
+        view = memoryview(self._buffer)
+        written = 0
+        while written < size:
+            count = os.pwrite(self._fd, view[written:size], self._offset + written)
+            if count <= 0 or (self.direct and count % ALIGN):
+                raise SinkError(f"{self.device}: short write at {self._offset + written:,}")
+            written += count
+        view.release()
+        self._offset += size
+        remainder = self._fill - size
+        if remainder:
+            self._buffer.move(0, size, remainder)
+        self._fill = remainder
+
+    def _close(self):
+        try:
+            aligned = self._fill - self._fill % ALIGN
+            if aligned:
+                self._drain(aligned)
+            if self._fill:
+                # The unaligned tail goes through the page cache
+                if self.direct:
+                    fcntl.fcntl(self._fd, fcntl.F_SETFL, fcntl.fcntl(self._fd, fcntl.F_GETFL) & ~O_DIRECT)
+                os.pwrite(self._fd, self._buffer[:self._fill], self._offset)
+                self._offset += self._fill
+                self._fill = 0
+            os.fsync(self._fd)
+        finally:
+            os.close(self._fd)
+            self._buffer.close()
+
+    def _read_chunks(self):
+        fd = os.open(self.device, os.O_RDONLY | os.O_CLOEXEC | (O_DIRECT if self.direct else 0))
+        try:
+            if not self.direct:
+                os.posix_fadvise(fd, 0, self.position, os.POSIX_FADV_DONTNEED)
+            size = -(-self.chunk_size // ALIGN) * ALIGN
+            buffer = mmap.mmap(-1, size)
+            offset = 0
+            while offset < self.position:
+                want = min(self.chunk_size, self.position - offset)
+                count = os.preadv(fd, [memoryview(buffer)[:-(-want // ALIGN) * ALIGN]], offset)
+                if count < want:
+                    yield buffer[:count]
+                    return
+                yield buffer[:want]
+                offset += want
+            buffer.close()
+        finally:
+            os.close(fd)
+
+
+class StdoutSink(Sink):
+    """Standard output (a pipe into another tool); cannot be verified"""
+
+    verifiable = False
+
+    def __init__(self, **kwargs):
+        super().__init__("stdout", **kwargs)
+        self._stream = sys.stdout.buffer
+
+    def _write(self, data):
+        self._stream.write(data)
+
+    def _close(self):
+        self._stream.flush()
+
+
+class HttpSink(Sink):
+    """A chunked HTTP PUT to a local endpoint; verified by GETting the same URL back"""
+
+    def __init__(self, url, method="PUT", **kwargs):
+        super().__init__(url, **kwargs)
+        parts = urlsplit(url)
+        if parts.scheme != "http":
+            raise SinkError(f"{url}: only plain http:// endpoints are supported")
+        self.url = url
+        self._host, self._port = parts.hostname, parts.port or 80
+        self._path = parts.path or "/"
+        if parts.query:
+            self._path += f"?{parts.query}"
+        self._connection = http.client.HTTPConnection(self._host, self._port)
+        self._connection.putrequest(method, self._path)
+        self._connection.putheader("Content-Type", "application/octet-stream")
+        self._connection.putheader("Transfer-Encoding", "chunked")
+        self._connection.endheaders()
+
+    def _write(self, data):
+        if len(data):
+            self._connection.send(f"{len(data):x}\r\n".encode() + bytes(data) + b"\r\n")
+
+    def _close(self):
+        try:
+            self._connection.send(b"0\r\n\r\n")
+            response = self._connection.getresponse()
+            response.read()
+        finally:
+            self._connection.close()
+        if response.status >= 300:
+            raise SinkError(f"{self.url}: HTTP {response.status} {response.reason}")
+
+    def _read_chunks(self):
+        connection = http.client.HTTPConnection(self._host, self._port)
+        try:
+            connection.request("GET", self._path)
+            response = connection.getresponse()
+            if response.status != 200:
+                raise SinkError(f"{self.url}: read-back failed with HTTP {response.status}")
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            connection.close()
+
+
+class HashingTee:
+    """Hashes a sink's stream on its way through: SHA-256 and MD5 of the whole image plus per-chunk SHA-256
+
+    The chunk hashes are handed to the wrapped sink on close, so it can
+    still verify() without hashing a second time.  The first HEAD_SIZE
+    bytes are kept for boot-sector checks.  publish() writes the image's
+    SHA256SUMS/MD5SUMS entries and a chunk manifest next to it, so nothing
+    needs to read a finished build back.
+    """
+
+    HEAD_SIZE = 512
+
+    def __init__(self, sink, chunk_size=None):
+        self.sink = sink
+        self.chunk_size = chunk_size or getattr(sink, "chunk_size", VERIFY_CHUNK)
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5()
+        self.chunk_hashes = []
+        self.head = bytearray()
+        self.position = 0
+        self.closed = False
+        self._digest = hashlib.sha256()
+        self._in_chunk = 0
+        if isinstance(sink, Sink):
+            sink.hash_chunks = False
+            sink.chunk_size = self.chunk_size
+
+    @property
+    def name(self):
+        return self.sink.name
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        count = len(data)
+        self.sink.write(data)
+        self.sha256.update(data)
+        self.md5.update(data)
+        if len(self.head) < self.HEAD_SIZE:
+            self.head += data[:self.HEAD_SIZE - len(self.head)]
+        self.position += len(data)
+        while len(data):
+            take = min(len(data), self.chunk_size - self._in_chunk)
+            self._digest.update(data[:take])
+            self._in_chunk += take
+            data = data[take:]
+            if self._in_chunk == self.chunk_size:
+                self.chunk_hashes.append(self._digest.hexdigest())
+                self._digest, self._in_chunk = hashlib.sha256(), 0
+        return count
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._in_chunk:
+            self.chunk_hashes.append(self._digest.hexdigest())
+            self._in_chunk = 0
+        if isinstance(self.sink, Sink):
+            self.sink.chunk_hashes = list(self.chunk_hashes)
+        self.sink.close()
+
+    def verify(self):
+        self.close()
+        return self.sink.verify()
+
+    @property
+    def digests(self):
+        """Whole-image and chunk hashes, as stored in the chunk manifest"""
+        return {"size": self.position, "sha256": self.sha256.hexdigest(), "md5": self.md5.hexdigest(),
+                "chunk_size": self.chunk_size, "chunks": list(self.chunk_hashes)}
+
+    def publish(self, path=None):
+        """Write SHA256SUMS, MD5SUMS and <image>.chunks.json beside `path` (default: the file written)"""
+        self.close()
+        path = path or getattr(self.sink, "path", None)
+        if path is None:
+            self.sink.log(f"{self.name}: not a file, checksums not published "
+                          f"(sha256 {self.sha256.hexdigest()})", "⚠️")
+            return []
+        return publish_digests(path, self.digests, log=self.sink.log)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _update_sums(sums_file, name, digest):
+    """Set `name`'s line in a sha256sum-style file, keeping every other entry"""
+    lines = sums_file.read_text().splitlines() if sums_file.exists() else []
+    entries = [line for line in lines if line.split(maxsplit=1)[1:] not in ([name], [f"*{name}"])]
+    entries.append(f"{digest} *{name}")
+    temp = sums_file.with_name(f".{sums_file.name}.tmp")
+    temp.write_text("".join(f"{line}\n" for line in sorted(entries, key=lambda line: line.split()[-1])))
+    temp.replace(sums_file)
+
+
+def publish_digests(path, digests, log=None):
+    """SHA256SUMS/MD5SUMS entries and a chunk manifest for the image at `path`; returns the files written"""
+    path = Path(path)
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    _update_sums(path.with_name("SHA256SUMS"), path.name, digests["sha256"])
+    _update_sums(path.with_name("MD5SUMS"), path.name, digests["md5"])
+    manifest = path.with_name(f"{path.name}.chunks.json")
+    manifest.write_text(json.dumps({"image": path.name, **digests}, indent=1) + "\n")
+    log(f"{path.name}: sha256 {digests['sha256']} (SHA256SUMS, MD5SUMS, {manifest.name})", "🔏")
+    return [path.with_name("SHA256SUMS"), path.with_name("MD5SUMS"), manifest]
+
+
+def load_chunk_manifest(path):
+    """The digests publish_digests() wrote for the image at `path` (or from the .chunks.json itself)"""
+    path = Path(path)
+    if not path.name.endswith(".chunks.json"):
+        path = path.with_name(f"{path.name}.chunks.json")
+    return json.loads(path.read_text())
+
+
+class WriteBehind:
+    """Hands writes to a background thread so producing and writing overlap
+
+    Small writes are coalesced into ~1 MiB buffers; at most `depth` buffers
+    wait in the queue, which bounds memory and applies backpressure.  An
+    error in the writer thread is raised from the next write() or close(),
+    after the thread has stopped and the sink is closed.
+    """
+
+    def __init__(self, sink, depth=4):
+        self.sink = sink
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._pending = bytearray()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=f"write-behind {sink.name}", daemon=True)
+        self._thread.start()
+        self.closed = False
+        self.position = 0
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._error is None:
+                try:
+                    self.sink.write(data)
+                except Exception as e:
+                    self._error = e
+
+    def _check(self):
+        if self._error is not None:
+            raise SinkError(f"{self.sink.name}: {self._error}") from self._error
+
+    def write(self, data):
+        if self._error is not None:
+            # Stops the thread and closes the sink, then raises the writer's error
+            self.close()
+        self._pending += data
+        self.position += len(data)
+        if len(self._pending) >= COALESCE:
+            self._queue.put(bytes(self._pending))
+            self._pending.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._pending and self._error is None:
+                self._queue.put(bytes(self._pending))
+            self._pending.clear()
+            self._queue.put(None)
+            self._thread.join()
+            self._check()
+        finally:
+            self.sink.close()
+
+    def verify(self):
+        self.close()
+        return self.sink.verify()
+
+    def publish(self, path=None):
+        self.close()
+        return self.sink.publish(path)
+
+    @property
+    def chunk_hashes(self):
+        return self.sink.chunk_hashes
+
+    @property
+    def digests(self):
+        return self.sink.digests
+
+    @property
+    def head(self):
+        return self.sink.head
+
+    @property
+    def name(self):
+        return self.sink.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sink(target, write_behind=0, direct=True, hashes=False, log=None):
+    """'-' -> stdout, 'http://…' -> HTTP PUT, a block device -> BlockDeviceSink, anything else -> file
+
+    hashes=True puts a HashingTee in front of the sink (behind write-behind,
+    so hashing runs on the writer thread, not the producer's).
+    """
+    target = str(target)
+    if target == "-":
+        sink = StdoutSink(log=log)
+    elif target.startswith(("http://", "https://")):
+        sink = HttpSink(target, log=log)
+    elif os.path.exists(target) and stat.S_ISBLK(os.stat(target).st_mode):
+        sink = BlockDeviceSink(target, direct=direct, log=log)
+    else:
+        sink = FileSink(target, log=log)
+    if hashes:
+        sink = HashingTee(sink)
+    return WriteBehind(sink, write_behind) if write_behind else sink
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: output_sinks.py <image> <file|/dev/sdX|-|http://host:port/path> [--verify]")
+        print("                       [--write-behind=N] [--no-direct]")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[3:] if arg.startswith("--") and "=" in arg)
+    log = lambda message, emoji="📝": print(f"{emoji} {message}", file=sys.stderr)
+    try:
+        sink = open_sink(sys.argv[2], write_behind=int(options.get("write-behind", 4)),
+                         direct="--no-direct" not in sys.argv, log=log)
+        with open(sys.argv[1], "rb") as source, sink:
+            for chunk in iter(lambda: source.read(COALESCE * 4), b""):
+                sink.write(chunk)
+        log(f"{sink.name}: {sink.position:,} bytes written", "💾")
+        if "--verify" in sys.argv and sink.verify() is False:
+            return 1
+    except (SinkError, OSError) as e:
+        log(f"{e}", "❌")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+PARALLEL UNSQUASHFS v1.0
+Full squashfs extraction split across several unsquashfs workers.
+
+The directory tree is read from the image tables (squashfs_reader) and cut
+into subtrees of similar cost (file bytes plus a per-inode charge for the
+metadata work).  Subtrees are packed onto shards largest-first, each shard
+is extracted by its own `unsquashfs -ef` process, and several images can be
+extracted at once.  All workers share one budget: a number of CPUs split
+between the unsquashfs processes and a number of concurrent writers.
+"""
+
+import os
+import sys
+import time
+import heapq
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from squashfs_reader import SquashfsImage
+
+VERSION = "1.0"
+
+# Creating an inode costs about as much as writing this many bytes
+INODE_COST = 16384
+
+
+class ExtractionBudget:
+    """CPU and I/O limits shared by every worker of every image"""
+
+    def __init__(self, cpus=None, io_slots=None):
+        self.cpus = cpus or os.cpu_count() or 1
+        # More concurrent writers than this mostly adds seeking on one disk
+        self.io_slots = io_slots or min(self.cpus, 4)
+        self._slots = threading.BoundedSemaphore(self.io_slots)
+
+    def processors_per_worker(self, workers):
+        return max(1, self.cpus // max(1, workers))
+
+    def __enter__(self):
+        self._slots.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._slots.release()
+
+
+class ShardPlan:
+    """Extraction units of an image packed into balanced shards"""
+
+    def __init__(self, image_path, shards):
+        self.image_path = Path(image_path)
+        self.shard_count = shards
+        self.children = defaultdict(list)
+        self.cost = defaultdict(int)
+        self.hardlinks = defaultdict(list)
+        self.shards = []
+        self._scan()
+        self._pack()
+
+    def _scan(self):
+        """One pass over the tables: subtree costs, child lists and hard link groups"""
+        with SquashfsImage(self.image_path) as image:
+            for entry in image.entries(include_root=False):
+                inode = entry.inode
+                parent = entry.path.rpartition("/")[0]
+                self.children[parent].append((entry.path, inode.is_dir))
+                cost = INODE_COST + (inode.file_size if inode.is_file else 0)
+                self.cost[entry.path] += cost
+                ancestor = parent
+                while True:
+                    self.cost[ancestor] += cost
+                    if not ancestor:
+                        break
+                    ancestor = ancestor.rpartition("/")[0]
+                if inode.is_file and inode.nlink > 1:
+                    self.hardlinks[inode.inode_number].append(entry.path)
+
+    @property
+    def total_cost(self):
+        return self.cost[""]
+
+    def units(self):
+        """Split the largest directories until no unit exceeds a fraction of one shard"""
+        limit = self.total_cost / (self.shard_count * 4)
+        heap = [(-self.cost[path], path, is_dir) for path, is_dir in self.children[""]]
+        heapq.heapify(heap)
+        units = []
+        while heap:
+            cost, path, is_dir = heapq.heappop(heap)
+            if -cost > limit and is_dir and self.children[path]:
+                for child, child_is_dir in self.children[path]:
+                    heapq.heappush(heap, (-self.cost[child], child, child_is_dir))
+            else:
+                units.append((-cost, path))
+        return units
+
+    def _pack(self):
+        """Longest-processing-time-first packing onto the least loaded shard"""
+        loads = [(0, index) for index in range(self.shard_count)]
+        self.shards = [[] for _ in range(self.shard_count)]
+        self.loads = [0] * self.shard_count
+        for cost, path in sorted(self.units(), reverse=True):
+            load, index = heapq.heappop(loads)
+            self.shards[index].append(path)
+            self.loads[index] = load + cost
+            heapq.heappush(loads, (load + cost, index))
+        self.shards = [sorted(paths) for paths in self.shards if paths]
+
+    def describe(self):
+        spread = max(self.loads) / (sum(self.loads) / len(self.loads)) if any(self.loads) else 1
+        return (f"{len(self.shards)} shards, {sum(len(s) for s in self.shards):,} units, "
+                f"max/mean load {spread:.2f}")
+
+
+class ParallelUnsquashfs:
+    """Extracts one image with several unsquashfs workers"""
+
+    def __init__(self, image_path, dest, workers=None, budget=None, sudo=False, log=None):
+        self.image_path = Path(image_path)
+        self.dest = Path(dest)
+        self.budget = budget or ExtractionBudget()
+        self.workers = workers or self.budget.io_slots
+        self.sudo = sudo
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+
+    def _command(self, extract_file, processors):
+        # Shard lists hold literal paths: "usr/bin/[" must not be a wildcard
+        command = ["unsquashfs", "-f", "-no-progress", "-no-wildcards", "-p", str(processors),
+                   "-d", str(self.dest), "-ef", str(extract_file), str(self.image_path)]
+        return ["sudo"] + command if self.sudo else command
+
+    def _run_shard(self, index, paths, processors, work_dir):
+        extract_file = Path(work_dir) / f"shard-{index:02d}.txt"
+        extract_file.write_text("".join(f"/{path}\n" for path in paths))
+        with self.budget:
+            result = subprocess.run(self._command(extract_file, processors), capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"shard {index} failed: {result.stderr.strip()}")
+        return len(paths)
+
+    def _relink(self, plan):
+        """Shards extract hard links separately; link them back together"""
+        relinked = 0
+        for paths in plan.hardlinks.values():
+            first = self.dest / paths[0]
+            for path in paths[1:]:
+                target = self.dest / path
+                if target.exists() and not os.path.samefile(first, target):
+                    command = ["ln", "-f", str(first), str(target)]
+                    subprocess.run(["sudo"] + command if self.sudo else command, check=True)
+                    relinked += 1
+        return relinked
+
+    def extract(self):
+        started = time.time()
+        plan = ShardPlan(self.image_path, self.workers)
+        self.log(f"{self.image_path.name}: {plan.describe()}", "🧩")
+        processors = self.budget.processors_per_worker(min(self.workers, self.budget.io_slots))
+        self.dest.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="punsquashfs_") as work_dir:
+            with ThreadPoolExecutor(max_workers=max(1, len(plan.shards))) as pool:
+                futures = [pool.submit(self._run_shard, index, paths, processors, work_dir)
+                           for index, paths in enumerate(plan.shards)]
+                for future in futures:
+                    future.result()
+        relinked = self._relink(plan)
+        seconds = time.time() - started
+        self.log(f"Extracted {self.image_path.name} in {seconds:.1f}s"
+                 + (f" ({relinked} hard links restored)" if relinked else ""), "✅")
+        return seconds
+
+
+def extract_images(jobs, workers=None, budget=None, sudo=False, log=None):
+    """Extract several (image, dest) pairs concurrently under one budget.
+
+    Returns True when every image extracted.
+    """
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    if not jobs:
+        return True
+    budget = budget or ExtractionBudget()
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = {pool.submit(ParallelUnsquashfs(image, dest, workers, budget, sudo, log).extract): image
+                   for image, dest in jobs}
+        ok = True
+        for future, image in futures.items():
+            try:
+                future.result()
+            except (RuntimeError, subprocess.CalledProcessError, OSError) as e:
+                log(f"{Path(image).name}: {e}", "❌")
+                ok = False
+    return ok
+
+
+def benchmark(image_path, scratch_dir, workers=None, sudo=False):
+    """Time a single unsquashfs against the sharded extraction"""
+    scratch_dir = Path(scratch_dir)
+    single_dest = scratch_dir / "single"
+    parallel_dest = scratch_dir / "parallel"
+    for path in (single_dest, parallel_dest):
+        shutil.rmtree(path, ignore_errors=True)
+
+    print(f"⏱️  Single unsquashfs: {image_path}")
+    command = ["unsquashfs", "-f", "-no-progress", "-d", str(single_dest), str(image_path)]
+    started = time.time()
+    subprocess.run(["sudo"] + command if sudo else command, check=True, capture_output=True)
+    single = time.time() - started
+    print(f"   {single:.1f}s")
+
+    print(f"⏱️  Sharded unsquashfs ({workers or ExtractionBudget().io_slots} workers)")
+    parallel = ParallelUnsquashfs(image_path, parallel_dest, workers, sudo=sudo).extract()
+    print(f"   {parallel:.1f}s")
+    print(f"🚀 Speedup: {single / parallel:.2f}x")
+
+    for path in (single_dest, parallel_dest):
+        command = ["rm", "-rf", str(path)]
+        subprocess.run(["sudo"] + command if sudo else command)
+    return single, parallel
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    sudo = "--sudo" in sys.argv
+    workers = int(options["workers"]) if "workers" in options else None
+    budget = ExtractionBudget(int(options.get("cpus", 0)) or None, int(options.get("io", 0)) or None)
+    if len(args) >= 2 and args[0] == "benchmark":
+        benchmark(args[1], args[2] if len(args) > 2 else tempfile.mkdtemp(prefix="unsquashfs_bench_"),
+                  workers, sudo)
+        return 0
+    if len(args) < 2 or len(args) % 2:
+        print("Usage: parallel_unsquashfs.py <image> <dest> [<image> <dest> ...] "
+              "[--workers=N] [--cpus=N] [--io=N] [--sudo]")
+        print("       parallel_unsquashfs.py benchmark <image> [scratch_dir] [--workers=N] [--sudo]")
+        return 1
+    jobs = list(zip(args[0::2], args[1::2]))
+    return 0 if extract_images(jobs, workers, budget, sudo) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,12 @@
 SIMPLE CUBIC MODIFIER v1.0
 Uses your working cubic_custom.iso as base and adds custom content
 Avoids complex squashfs extraction that requires sudo
+
+By default the ISO is never extracted: the new files are mapped onto the
+Cubic ISO and its boot setup is replayed (iso_replay.py).  --rebuild uses
+the old extract-and-rebuild path.  --patch edits a reflink copy of the
+Cubic ISO in place (iso_patch.py), falling back to the replay when an edit
+does not fit.
 """
 
 import os
@@ -12,6 +18,11 @@ import shutil
 from pathlib import Path
 from datetime import datetime
 
+from build_recipe import BuildRecipe
+from iso_patch import patch_iso
+from iso_reader import IsoError, IsoImage
+from iso_replay import ReplayBuild
+
 class SimpleCubicModifier:
     def __init__(self):
         self.version = "1.0"
@@ -19,6 +30,8 @@ class SimpleCubicModifier:
         self.work_dir = Path("simple_modifier_work")
         self.cubic_iso = "cubic_custom.iso"
         self.output_iso = f"simple_custom_{datetime.now().strftime('%Y%m%d_%H%M')}.iso"
+        self.rebuild = "--rebuild" in sys.argv
+        self.patch = "--patch" in sys.argv
         
     def log(self, message, emoji="📝"):
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -59,11 +72,9 @@ class SimpleCubicModifier:
         self.log("Cubic ISO extraction completed", "✅")
         return True
         
-    def add_simple_customization(self):
-        self.log("ADDING SIMPLE CUSTOMIZATIONS", "📝")
-        print("-" * 40)
-        
-        extract_dir = self.work_dir / "extracted"
+    def customization_files(self):
+        """{iso path: text} of everything this tool adds or replaces"""
+        files = {}
         
         # Add HelloWorld.txt to ISO root (simple method)
         custom_content = f"""Hello from Simple Cubic Modifier v{self.version}!
@@ -79,43 +90,68 @@ This proves:
 Based on your working cubic_custom.iso that boots successfully!
 """
         
-        hello_file = extract_dir / "HelloWorld.txt"
-        hello_file.write_text(custom_content)
-        self.log("Added HelloWorld.txt to ISO root", "✅")
+        files["HelloWorld.txt"] = custom_content
         
         # Update disk info
-        disk_info = extract_dir / ".disk" / "info"
-        if disk_info.exists():
-            disk_info.write_text(f"Simple Cubic Modifier v{self.version} - {datetime.now().strftime('%Y%m%d')}")
-            self.log("Updated disk info", "✅")
+        files[".disk/info"] = f"Simple Cubic Modifier v{self.version} - {datetime.now().strftime('%Y%m%d')}"
+        return files
+        
+    def add_simple_customization(self):
+        self.log("ADDING SIMPLE CUSTOMIZATIONS", "📝")
+        print("-" * 40)
+        
+        extract_dir = self.work_dir / "extracted"
+        
+        for name, text in self.customization_files().items():
+            target = extract_dir / name
+            # Only existing disk info is replaced
+            if name.startswith(".disk/") and not target.exists():
+                continue
+            target.write_text(text)
+            self.log(f"Added {name}", "✅")
             
         return True
         
+    def create_replayed_iso(self):
+        self.log("CREATING MODIFIED ISO (boot setup replayed, no extraction)", "🔧")
+        print("-" * 40)
+        
+        build = ReplayBuild(self.cubic_iso, self.output_iso, volume_id=f"Simple-Cubic-Mod-v{self.version}",
+                            log=self.log)
+        for name, text in self.customization_files().items():
+            # Only existing disk info is replaced
+            if name.startswith(".disk/") and not build.exists(name):
+                continue
+            build.add_text(name, text)
+            self.log(f"Mapped {name}", "✅")
+            
+        return build.run()
+        
+    def create_patched_iso(self):
+        self.log("PATCHING COPY OF CUBIC ISO (no rebuild)", "🩹")
+        print("-" * 40)
+        
+        try:
+            with IsoImage(self.cubic_iso) as image:
+                files = {name: text for name, text in self.customization_files().items()
+                         # Only existing disk info is replaced
+                         if not name.startswith(".disk/") or image.lookup(name) is not None}
+            patch_iso(self.cubic_iso, self.output_iso, files, log=self.log)
+        except IsoError as e:
+            self.log(f"Patch not possible ({e}); replaying instead", "⚠️")
+            return self.create_replayed_iso()
+            
+        self.log(f"Modified ISO created: {self.output_iso}", "✅")
+        return True
+        
     def create_modified_iso(self):
         self.log("CREATING MODIFIED ISO", "🔧")
         print("-" * 40)
         
         extract_dir = self.work_dir / "extracted"
         
-        # Use same xorriso command that works
-        xorriso_cmd = [
-            "xorriso", "-as", "mkisofs",
-            "-r",
-            "-V", f"Simple-Cubic-Mod-v{self.version}",
-            "-J", "-joliet-long",
-            "-isohybrid-mbr", "/usr/lib/ISOLINUX/isohdpfx.bin",
-            "-c", "boot.catalog",
-            "-b", "boot/grub/i386-pc/eltorito.img",
-            "-no-emul-boot",
-            "-boot-load-size", "4",
-            "-boot-info-table",
-            "-eltorito-alt-boot",
-            "-e", "EFI/boot/bootx64.efi",
-            "-no-emul-boot",
-            "-isohybrid-gpt-basdat",
-            "-o", self.output_iso,
-            str(extract_dir)
-        ]
+        xorriso_cmd = BuildRecipe(self.cubic_iso, self.output_iso, source_dir=extract_dir,
+                                  volume_id=f"Simple-Cubic-Mod-v{self.version}", log=self.log).compile()
         
         self.log("Building modified EFI-bootable ISO...", "⚙️")
         result = subprocess.run(xorriso_cmd, capture_output=True, text=True)
@@ -157,13 +193,19 @@ Based on your working cubic_custom.iso that boots successfully!
             if not self.check_cubic_iso():
                 return False
                 
-            if not self.extract_cubic_iso():
-                return False
-                
-            if not self.add_simple_customization():
-                return False
-                
-            if not self.create_modified_iso():
+            if self.rebuild:
+                if not self.extract_cubic_iso():
+                    return False
+                    
+                if not self.add_simple_customization():
+                    return False
+                    
+                if not self.create_modified_iso():
+                    return False
+            elif self.patch:
+                if not self.create_patched_iso():
+                    return False
+            elif not self.create_replayed_iso():
                 return False
                 
             duration = datetime.now() - self.start_time
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+SLIMMING PROFILES v1.0
+Declarative root filesystem slimming applied during the squashfs rebuild.
+
+A profile lists path-exclude globs (with path-include exceptions, like
+dpkg's own path-exclude/path-include) and packages to remove.  Package
+removal follows dpkg's bookkeeping: the package's files from its .list, its
+var/lib/dpkg/info/* files and its status stanza all go, and packages that
+still depend on it block the removal.  Excluded paths are also written to
+/etc/dpkg/dpkg.cfg.d/ so later apt installs inside the image stay slim.
+
+Everything is computed from the image tables and applied as SquashfsEdits,
+then reported as bytes saved, build-time delta and projected flash/boot gain.
+"""
+
+import re
+import sys
+import json
+from pathlib import Path
+
+from squashfs_reader import SquashfsImage
+from squashfs_stream import SquashfsEdits
+
+VERSION = "1.0"
+
+DPKG_STATUS = "var/lib/dpkg/status"
+DPKG_INFO = "var/lib/dpkg/info"
+DPKG_CFG = "etc/dpkg/dpkg.cfg.d/instyaml-slimming"
+
+# Typical USB 2.0 stick rates, used for the projections
+FLASH_WRITE_MBPS = 15
+USB_READ_MBPS = 30
+
+PROFILES = {
+    "docs": {
+        "exclude": ["usr/share/doc/**", "usr/share/man/**", "usr/share/info/**", "usr/share/lintian/**",
+                    "usr/share/doc-base/**", "usr/share/help/**"],
+        "include": ["usr/share/doc/*/copyright"],
+    },
+    "locales": {
+        "exclude": ["usr/share/locale/**", "usr/share/i18n/locales/**"],
+        "include": ["usr/share/locale/locale.alias", "usr/share/locale/en/**", "usr/share/locale/en_US/**",
+                    "usr/share/i18n/locales/en_US", "usr/share/i18n/locales/en_GB",
+                    "usr/share/i18n/locales/i18n*", "usr/share/i18n/locales/iso14651_t1*",
+                    "usr/share/i18n/locales/translit_*"],
+    },
+    "firmware": {
+        "exclude": ["lib/firmware/**", "usr/lib/firmware/**"],
+        "include": ["lib/firmware/intel-ucode/**", "usr/lib/firmware/intel-ucode/**",
+                    "lib/firmware/amd-ucode/**", "usr/lib/firmware/amd-ucode/**", "lib/firmware/regulatory.db*",
+                    "usr/lib/firmware/regulatory.db*"],
+    },
+}
+PROFILES["appliance"] = {
+    "exclude": sum((p["exclude"] for p in PROFILES.values()), []),
+    "include": sum((p["include"] for p in PROFILES.values()), []),
+}
+
+
+def glob_regex(patterns):
+    """One compiled regex for all globs ('**' crosses directories, '*' does not)"""
+    if not patterns:
+        return None
+    parts = []
+    for pattern in patterns:
+        regex = re.escape(pattern.strip("/"))
+        regex = regex.replace(r"\*\*", "\0").replace(r"\*", "[^/]*").replace(r"\?", "[^/]").replace("\0", ".*")
+        parts.append(regex)
+    return re.compile(rf"(?:{'|'.join(parts)})\Z")
+
+
+class SlimmingProfile:
+    """Exclude/include globs plus packages to remove"""
+
+    def __init__(self, name, exclude=(), include=(), packages=(), force=False):
+        self.name = name
+        self.exclude = list(exclude)
+        self.include = list(include)
+        self.packages = list(packages)
+        self.force = force
+
+    @classmethod
+    def load(cls, spec):
+        """Built-in profile name(s) joined by '+', or a JSON file"""
+        if Path(spec).is_file():
+            data = json.loads(Path(spec).read_text())
+            return cls(data.get("name", Path(spec).stem), data.get("exclude", ()), data.get("include", ()),
+                       data.get("packages", ()), data.get("force", False))
+        profile = cls(spec)
+        for name in spec.split("+"):
+            if name not in PROFILES:
+                raise ValueError(f"Unknown slimming profile '{name}' (known: {', '.join(PROFILES)})")
+            profile.exclude += PROFILES[name]["exclude"]
+            profile.include += PROFILES[name]["include"]
+            profile.packages += PROFILES[name].get("packages", [])
+        return profile
+
+    def dpkg_config(self):
+        """dpkg.cfg.d snippet keeping future package installs slim"""
+        lines = [f"# Generated by slimming_profiles.py (profile: {self.name})"]
+        lines += [f"path-exclude=/{pattern.replace('**', '*')}" for pattern in self.exclude]
+        lines += [f"path-include=/{pattern.replace('**', '*')}" for pattern in self.include]
+        return "\n".join(lines) + "\n"
+
+
+def parse_status(text):
+    """[(package, stanza text, fields)] in file order"""
+    stanzas = []
+    for stanza in text.strip("\n").split("\n\n"):
+        fields = {}
+        for line in stanza.splitlines():
+            if line and not line[0].isspace() and ":" in line:
+                key, value = line.split(":", 1)
+                fields[key] = value.strip()
+        if "Package" in fields:
+            stanzas.append((fields["Package"], stanza, fields))
+    return stanzas
+
+
+def depends_on(fields, removed):
+    """True when a Depends/Pre-Depends group can only be satisfied by removed packages"""
+    for key in ("Depends", "Pre-Depends"):
+        for group in fields.get(key, "").split(","):
+            names = {alternative.split()[0].split(":")[0] for alternative in group.split("|") if alternative.strip()}
+            if names and names <= removed:
+                return True
+    return False
+
+
+class SlimmingPlan:
+    """What a profile removes from one image, and what that saves"""
+
+    def __init__(self, image_path, profile, log=None):
+        self.image_path = Path(image_path)
+        self.profile = profile
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.deleted = set()
+        self.removed_packages = []
+        self.blocked_packages = {}
+        self.new_status = None
+        self.stats = {"files": 0, "bytes": 0, "compressed_bytes": 0, "inodes": 0}
+        self._compute()
+
+    def _compute(self):
+        exclude, include = glob_regex(self.profile.exclude), glob_regex(self.profile.include)
+        with SquashfsImage(self.image_path) as image:
+            entries = {entry.path: entry.inode for entry in image.entries(include_root=False)}
+            total_file_bytes = sum(inode.file_size for inode in entries.values() if inode.is_file) or 1
+            self.tail_ratio = image.bytes_used / total_file_bytes
+            self.metadata_per_inode = (image.bytes_used - image.inode_table_start) / max(1, image.inode_count)
+            for path, inode in entries.items():
+                if inode.is_dir or not exclude or not exclude.match(path):
+                    continue
+                if include and include.match(path):
+                    continue
+                self.deleted.add(path)
+            if self.profile.packages and DPKG_STATUS in entries:
+                self._remove_packages(image, entries)
+            for path in self.deleted:
+                inode = entries[path]
+                self.stats["inodes"] += 1
+                if inode.is_file:
+                    self.stats["files"] += 1
+                    self.stats["bytes"] += inode.file_size
+                    tail = inode.file_size % image.block_size if inode.has_fragment else 0
+                    self.stats["compressed_bytes"] += inode.compressed_size + int(tail * self.tail_ratio)
+
+    def _remove_packages(self, image, entries):
+        status = image.read_file(entries[DPKG_STATUS]).decode("utf-8", "replace")
+        stanzas = parse_status(status)
+        installed = {name for name, _stanza, _fields in stanzas}
+        removed = {name for name in self.profile.packages if name in installed}
+        if not self.profile.force:
+            for name, _stanza, fields in stanzas:
+                if name not in removed and depends_on(fields, removed):
+                    for dependency in removed:
+                        if depends_on(fields, {dependency}):
+                            self.blocked_packages.setdefault(dependency, []).append(name)
+            removed -= set(self.blocked_packages)
+        info_files = [path for path in entries if path.startswith(DPKG_INFO + "/")]
+        for name in sorted(removed):
+            for info_path in info_files:
+                base = info_path.rpartition("/")[2].rsplit(".", 1)[0]
+                if base == name or base.startswith(name + ":"):
+                    self.deleted.add(info_path)
+                    if info_path.endswith(".list"):
+                        listing = image.read_file(entries[info_path]).decode("utf-8", "replace")
+                        for line in listing.splitlines():
+                            path = line.strip().lstrip("/")
+                            # Directories are shared between packages; leave them
+                            if path in entries and not entries[path].is_dir:
+                                self.deleted.add(path)
+        self.removed_packages = sorted(removed)
+        if removed:
+            kept = [stanza for name, stanza, _fields in stanzas if name not in removed]
+            self.new_status = "\n\n".join(kept) + "\n"
+
+    def apply(self, edits=None):
+        """Add this plan's deletions and dpkg bookkeeping to SquashfsEdits"""
+        edits = edits or SquashfsEdits()
+        for path in sorted(self.deleted):
+            edits.delete(path)
+        if self.new_status is not None:
+            edits.add_file(DPKG_STATUS, self.new_status)
+        if self.profile.exclude:
+            edits.add_file(DPKG_CFG, self.profile.dpkg_config())
+        return edits
+
+    def report(self, estimate=None, flash_mbps=FLASH_WRITE_MBPS, read_mbps=USB_READ_MBPS):
+        """Savings dict; `estimate` (CompressionEstimate for the build) refines size and time"""
+        compressed = self.stats["compressed_bytes"]
+        build_seconds = 0.0
+        if estimate and estimate.raw_bytes:
+            share = self.stats["bytes"] / estimate.raw_bytes
+            compressed = int(self.stats["bytes"] * estimate.ratio)
+            build_seconds = estimate.predicted_seconds * share
+        metadata = self.stats["inodes"] * self.metadata_per_inode
+        report = {
+            "profile": self.profile.name,
+            "files": self.stats["files"],
+            "packages": self.removed_packages,
+            "blocked": self.blocked_packages,
+            "bytes_saved": self.stats["bytes"],
+            "image_bytes_saved": compressed,
+            "build_seconds_saved": build_seconds,
+            "flash_seconds_saved": compressed / (flash_mbps * 1e6),
+            # Boot reads the inode/directory tables it walks, not the removed data
+            "boot_seconds_saved": metadata / (read_mbps * 1e6),
+        }
+        self.log(f"Slimming '{report['profile']}': {report['files']:,} files, "
+                 f"{len(report['packages'])} packages removed", "✂️")
+        self.log(f"Saves {report['bytes_saved'] / 1e6:,.1f} MB content, "
+                 f"~{report['image_bytes_saved'] / 1e6:,.1f} MB of image", "📉")
+        self.log(f"Build ~{report['build_seconds_saved']:.0f}s faster, flashing ~{report['flash_seconds_saved']:.0f}s "
+                 f"faster at {flash_mbps} MB/s, boot ~{report['boot_seconds_saved']:.2f}s less metadata reading", "⏱️")
+        for package, dependents in self.blocked_packages.items():
+            self.log(f"Kept {package}: still needed by {', '.join(sorted(dependents)[:5])}", "⚠️")
+        return report
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: slimming_profiles.py <image.squashfs> <profile[+profile]|profile.json> [--estimate] [--list]")
+        print(f"       built-in profiles: {', '.join(PROFILES)}")
+        return 1
+    plan = SlimmingPlan(sys.argv[1], SlimmingProfile.load(sys.argv[2]))
+    estimate = None
+    if "--estimate" in sys.argv:
+        from squashfs_estimator import SquashfsEstimator
+        estimate = SquashfsEstimator(sys.argv[1], codecs=["xz"]).estimate().get("xz")
+    plan.report(estimate)
+    if "--list" in sys.argv:
+        for path in sorted(plan.deleted):
+            print(f"   - /{path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
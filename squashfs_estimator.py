@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+SQUASHFS SIZE/TIME ESTIMATOR v1.0
+Predicts mksquashfs output size and build time before running it.
+
+Samples blocks across an extracted tree (or straight out of an existing
+squashfs image via squashfs_reader), compresses the samples with each
+candidate codec and extrapolates with a stated error band.  Samples whose
+byte entropy shows they are already compressed (.deb, .gz, firmware, ...)
+are not compressed at all - mksquashfs stores those blocks uncompressed too.
+"""
+
+import os
+import sys
+import lzma
+import math
+import random
+import shutil
+import stat
+import subprocess
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from squashfs_reader import SquashfsImage, SquashfsError
+
+VERSION = "1.0"
+
+# Bits per byte above which a sample is treated as incompressible
+ENTROPY_THRESHOLD = 7.9
+# 95% confidence band
+Z_SCORE = 1.96
+# Allowance for what sampling cannot see (fragment packing, metadata layout)
+MODEL_ERROR = 0.02
+
+
+def byte_entropy(data):
+    """Shannon entropy of a byte string in bits per byte"""
+    if not data:
+        return 0.0
+    if np is not None:
+        counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+        probabilities = counts[counts > 0] / len(data)
+        return float(-(probabilities * np.log2(probabilities)).sum())
+    # Without NumPy, a strided 64 KiB subsample keeps the prefilter cheap
+    stride = max(1, len(data) // 65536)
+    subsample = data[::stride]
+    total = len(subsample)
+    entropy = 0.0
+    for count in Counter(subsample).values():
+        probability = count / total
+        entropy -= probability * math.log2(probability)
+    return entropy
+
+
+def _cli_codec(command):
+    """Build a compressor from a CLI tool, correcting for container overhead"""
+    tick = time.perf_counter()
+    empty = subprocess.run(command, input=b"", capture_output=True).stdout
+    spawn_seconds = time.perf_counter() - tick
+
+    def compress(data):
+        output = subprocess.run(command, input=data, capture_output=True).stdout
+        return output[len(empty):] if len(output) > len(empty) else output
+    compress.overhead_seconds = spawn_seconds
+    return compress
+
+
+def get_codec(name, block_size=1048576, xz_bcj=None):
+    """Return a compressor approximating mksquashfs's default settings for a codec.
+
+    Returns None when neither a Python module nor a CLI tool is available.
+    """
+    if name == "gzip":
+        return lambda data: zlib.compress(data, 9)
+    if name == "xz":
+        lzma2 = {"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": max(block_size, 8192)}
+        chains = [[lzma2]]
+        if xz_bcj == "x86":
+            chains.append([{"id": lzma.FILTER_X86}, lzma2])
+        return lambda data: min((lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32,
+                                               filters=chain) for chain in chains), key=len)
+    if name == "lzma":
+        return lambda data: lzma.compress(data, format=lzma.FORMAT_ALONE)
+    if name == "zstd":
+        try:
+            import zstandard
+            return lambda data: zstandard.ZstdCompressor(level=15).compress(data)
+        except ImportError:
+            if shutil.which("zstd"):
+                return _cli_codec(["zstd", "-15", "-q", "-c", "--no-check"])
+    if name == "lzo":
+        try:
+            import lzo
+            return lambda data: lzo.compress(data, 9, False)
+        except ImportError:
+            if shutil.which("lzop"):
+                return _cli_codec(["lzop", "-9", "-c"])
+    if name == "lz4":
+        try:
+            import lz4.block
+            return lambda data: lz4.block.compress(data, store_size=False)
+        except ImportError:
+            if shutil.which("lz4"):
+                return _cli_codec(["lz4", "-q", "-c"])
+    return None
+
+
+class CompressionEstimate:
+    """Predicted output size and build time for one codec"""
+
+    def __init__(self, codec, raw_bytes):
+        self.codec = codec
+        self.raw_bytes = raw_bytes
+        self.predicted_bytes = 0
+        self.size_margin = 0
+        self.predicted_seconds = 0.0
+        self.time_margin = 0.0
+        self.samples = 0
+        self.incompressible_samples = 0
+
+    @property
+    def size_band(self):
+        return max(0, self.predicted_bytes - self.size_margin), self.predicted_bytes + self.size_margin
+
+    @property
+    def time_band(self):
+        return max(0.0, self.predicted_seconds - self.time_margin), self.predicted_seconds + self.time_margin
+
+    @property
+    def ratio(self):
+        return self.predicted_bytes / self.raw_bytes if self.raw_bytes else 0.0
+
+    def summary(self):
+        low, high = self.size_band
+        error = 100 * self.size_margin / self.predicted_bytes if self.predicted_bytes else 0
+        return (f"{self.codec}: ~{self.predicted_bytes:,} bytes (±{error:.1f}%, {low:,}-{high:,}), "
+                f"ratio {self.ratio:.3f}, ~{self.predicted_seconds:.0f}s (±{self.time_margin:.0f}s), "
+                f"{self.incompressible_samples}/{self.samples} samples skipped as incompressible")
+
+
+class _Stratum:
+    """Population of sampling units (full data blocks, or packed fragments)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = []       # (handle, size) in packing order
+        self.total = 0
+
+    def add(self, handle, size):
+        self.items.append((handle, size))
+        self.total += size
+
+
+class SquashfsEstimator:
+    """Sampling compressibility estimator for a tree or a squashfs image"""
+
+    def __init__(self, source, codecs=("xz",), block_size=1048576, samples=192, xz_bcj=None,
+                 workers=None, entropy_threshold=ENTROPY_THRESHOLD, seed=0, log=None):
+        self.source = Path(source)
+        self.codecs = list(codecs)
+        self.block_size = block_size
+        self.sample_count = samples
+        self.xz_bcj = xz_bcj
+        self.workers = workers or os.cpu_count() or 1
+        self.entropy_threshold = entropy_threshold
+        self.random = random.Random(seed)
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.image = None
+        self.file_count = 0
+        self.name_bytes = 0
+        self.unreadable = 0
+
+    # ------------------------------------------------------------------
+    # Inventory
+    # ------------------------------------------------------------------
+
+    def _inventory(self):
+        """Split content into full-block and fragment strata like mksquashfs does"""
+        blocks = _Stratum("blocks")
+        fragments = _Stratum("fragments")
+        for handle, size in self._files():
+            self.file_count += 1
+            full = size // self.block_size
+            for index in range(full):
+                blocks.add((handle, index), self.block_size)
+            tail = size % self.block_size
+            if tail:
+                fragments.add((handle, full), tail)
+        return blocks, fragments
+
+    def _files(self):
+        if self.source.is_dir():
+            for directory, dirnames, filenames in os.walk(self.source):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    path = os.path.join(directory, name)
+                    self.name_bytes += len(name) + 8
+                    try:
+                        st = os.lstat(path)
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(st.st_mode) and st.st_size:
+                        yield path, st.st_size
+            return
+        self.image = SquashfsImage(self.source)
+        for entry in self.image.entries(include_root=False):
+            self.name_bytes += len(entry.name) + 8
+            if entry.inode.is_file and entry.inode.file_size:
+                yield entry.inode, entry.inode.file_size
+
+    def _read_unit(self, handle, index):
+        """Read block `index` of a file (tree path or squashfs inode)"""
+        if self.image is not None:
+            return self.image.read_file_block(handle, index)
+        try:
+            with open(handle, "rb") as f:
+                f.seek(index * self.block_size)
+                return f.read(self.block_size)
+        except OSError:
+            self.unreadable += 1
+            return None
+
+    def _draw(self, stratum, count):
+        """Systematic byte-weighted sample of `count` units from a stratum"""
+        if not stratum.items or count <= 0:
+            return []
+        if stratum.name == "blocks":
+            step = len(stratum.items) / count
+            start = self.random.random() * step
+            picks = sorted({int(start + i * step) for i in range(count)})
+            samples = []
+            for pick in picks:
+                data = self._read_unit(*stratum.items[pick][0])
+                if data:
+                    samples.append(data)
+            return samples
+        # Fragments: pack consecutive tails into a block-sized buffer, as mksquashfs does
+        samples = []
+        step = len(stratum.items) / count
+        start = self.random.random() * step
+        for i in range(count):
+            position = int(start + i * step)
+            packed = bytearray()
+            while position < len(stratum.items) and len(packed) < self.block_size:
+                data = self._read_unit(*stratum.items[position][0])
+                position += 1
+                if data and len(packed) + len(data) <= self.block_size:
+                    packed += data
+                elif data:
+                    break
+            if packed:
+                samples.append(bytes(packed))
+        return samples
+
+    # ------------------------------------------------------------------
+    # Estimation
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _ratio_estimate(observations, population_bytes, population_units):
+        """Ratio estimator total and its 95% margin from (raw, value) pairs"""
+        n = len(observations)
+        raw_total = sum(raw for raw, _ in observations)
+        if not n or not raw_total:
+            return 0.0, 0.0
+        ratio = sum(value for _, value in observations) / raw_total
+        estimate = ratio * population_bytes
+        if n < 2:
+            return estimate, estimate
+        mean_raw = raw_total / n
+        residual = sum((value - ratio * raw) ** 2 for raw, value in observations) / (n - 1)
+        correction = max(0.0, 1 - n / population_units) if population_units else 1.0
+        standard_error = math.sqrt(correction * residual / n) / mean_raw
+        return estimate, Z_SCORE * standard_error * population_bytes
+
+    def estimate(self):
+        """Return {codec: CompressionEstimate} (codecs without a compressor are skipped)"""
+        started = time.perf_counter()
+        compressors = {}
+        for codec in self.codecs:
+            compressor = get_codec(codec, self.block_size, self.xz_bcj)
+            if compressor is None:
+                self.log(f"No {codec} compressor available here - skipping", "⚠️")
+            else:
+                compressors[codec] = compressor
+        if not compressors:
+            return {}
+
+        try:
+            strata = self._inventory()
+        except (OSError, SquashfsError) as e:
+            self.log(f"Could not scan {self.source}: {e}", "❌")
+            return {}
+        total = sum(s.total for s in strata)
+        if not total:
+            return {}
+
+        results = {codec: CompressionEstimate(codec, total) for codec in compressors}
+        for stratum in strata:
+            share = max(8, round(self.sample_count * stratum.total / total)) if stratum.total else 0
+            samples = self._draw(stratum, min(share, len(stratum.items)))
+            units = max(1, math.ceil(stratum.total / self.block_size))
+            for codec, compressor in compressors.items():
+                sizes, times = [], []
+                skipped = 0
+                for sample in samples:
+                    if byte_entropy(sample) >= self.entropy_threshold:
+                        # Stored uncompressed by mksquashfs; costs only a trial compression
+                        sizes.append((len(sample), len(sample)))
+                        times.append((len(sample), 0.0))
+                        skipped += 1
+                        continue
+                    tick = time.perf_counter()
+                    compressed = len(compressor(sample))
+                    elapsed = max(0.0, time.perf_counter() - tick - getattr(compressor, "overhead_seconds", 0.0))
+                    sizes.append((len(sample), min(compressed, len(sample))))
+                    times.append((len(sample), elapsed))
+                size, size_margin = self._ratio_estimate(sizes, stratum.total, units)
+                seconds, time_margin = self._ratio_estimate(times, stratum.total, units)
+                result = results[codec]
+                result.predicted_bytes += int(size)
+                result.size_margin = int(math.hypot(result.size_margin, size_margin))
+                result.predicted_seconds += seconds / self.workers
+                result.time_margin = math.hypot(result.time_margin, time_margin / self.workers)
+                result.samples += len(samples)
+                result.incompressible_samples += skipped
+
+        # Inode and directory tables: ~32 bytes per inode plus names, compressed
+        metadata = self.file_count * 32 + self.name_bytes
+        for codec, compressor in compressors.items():
+            probe = (b"usr/share/doc/package-name/changelog.Debian.gz\0" * 200)[:8192]
+            metadata_ratio = len(compressor(probe)) / len(probe)
+            result = results[codec]
+            result.predicted_bytes += int(metadata * max(metadata_ratio, 0.25))
+            result.size_margin = int(math.hypot(result.size_margin, MODEL_ERROR * result.predicted_bytes))
+            result.time_margin = math.hypot(result.time_margin, 5 * MODEL_ERROR * result.predicted_seconds)
+
+        if self.image is not None:
+            self.image.close()
+            self.image = None
+        if self.unreadable:
+            self.log(f"{self.unreadable} sampled files were unreadable and left out", "⚠️")
+        self.log(f"Estimated from {total:,} bytes in {self.file_count:,} files "
+                 f"in {time.perf_counter() - started:.1f}s", "🔮")
+        return results
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: squashfs_estimator.py <tree-or-image.squashfs> [codec,codec,...] [block_size]")
+        return 1
+    codecs = sys.argv[2].split(",") if len(sys.argv) > 2 else ["gzip", "xz", "lzo", "zstd", "lz4"]
+    block_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1048576
+    print(f"🔮 SQUASHFS SIZE/TIME ESTIMATOR v{VERSION}")
+    print("=" * 50)
+    if np is None:
+        print("⚠️ NumPy not installed - using slower pure-Python entropy prefilter")
+    estimator = SquashfsEstimator(sys.argv[1], codecs=codecs, block_size=block_size, xz_bcj="x86")
+    results = estimator.estimate()
+    for estimate in sorted(results.values(), key=lambda e: e.predicted_bytes):
+        print(f"📊 {estimate.summary()}")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+SQUASHFS INCREMENTAL REBUILD v1.0
+Rebuilds a squashfs image from a modified tree (or a set of edits) while
+copying the compressed blocks of unchanged files from the base image.
+
+A tree file is "unchanged" when the base image has a regular file at the same
+path with the same size and either the same mtime or the same SHA-256.  Its
+data blocks and fragment are copied without decompressing; only new or
+changed content goes through the compressor, so the rebuild time follows the
+size of the change rather than the size of the image.
+"""
+
+import os
+import sys
+import stat
+import time
+import hashlib
+from pathlib import Path
+
+from squashfs_reader import SquashfsImage
+from squashfs_stream import SquashfsEdits
+from squashfs_writer import SquashfsWriter, WriterNode, node_from_stat
+
+VERSION = "1.0"
+
+
+def _tree_xattrs(path):
+    try:
+        return {name: os.getxattr(path, name, follow_symlinks=False)
+                for name in os.listxattr(path, follow_symlinks=False)}
+    except OSError:
+        return {}
+
+
+class IncrementalSquashfsBuilder:
+    """Builds a new image on top of a base image, reusing unchanged file data"""
+
+    def __init__(self, base_image, output, compressor=None, block_size=None, trust_mtime=True,
+                 workers=None, log=None):
+        self.base_path = Path(base_image)
+        self.output = Path(output)
+        self.trust_mtime = trust_mtime
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.image = SquashfsImage(self.base_path)
+        try:
+            self.writer = SquashfsWriter(self.output, compressor or self.image.compressor,
+                                         block_size or self.image.block_size, workers=workers, log=self.log)
+        except BaseException:
+            self.image.close()
+            raise
+        self.stats = {"unchanged": 0, "hashed": 0, "changed": 0, "new": 0}
+        self._base_entries = None
+        self.nodes = {}
+
+    def close(self):
+        self.image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def reusable(self):
+        """True when base blocks can be copied without recompressing"""
+        return self.writer.can_copy_from(self.image)
+
+    @property
+    def base_entries(self):
+        if self._base_entries is None:
+            self._base_entries = {entry.path: entry for entry in self.image.entries(include_root=False)}
+        return self._base_entries
+
+    def _base_hash(self, inode):
+        digest = hashlib.sha256()
+        for block in self.image.iter_file(inode):
+            digest.update(block)
+        return digest.digest()
+
+    @staticmethod
+    def _file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            for block in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(block)
+        return digest.digest()
+
+    def _match_base(self, node, rel_path, st):
+        """Point a tree file at base data when path, size and mtime/hash agree"""
+        entry = self.base_entries.get(rel_path)
+        if entry is None:
+            self.stats["new"] += 1
+            return
+        inode = entry.inode
+        if not inode.is_file or inode.file_size != st.st_size:
+            self.stats["changed"] += 1
+            return
+        if not (self.trust_mtime and inode.mtime == int(st.st_mtime)):
+            self.stats["hashed"] += 1
+            if self._file_hash(node.source_path) != self._base_hash(inode):
+                self.stats["changed"] += 1
+                return
+        node.reuse = (self.image, inode)
+        node.source_path = None
+        self.stats["unchanged"] += 1
+
+    def _base_xattrs(self, rel_path):
+        entry = self.base_entries.get(rel_path)
+        return self.image.read_xattrs(entry.inode.xattr_index) if entry else {}
+
+    def _node_from_tree(self, name, path, rel_path, st):
+        node = node_from_stat(name, path, st)
+        # Unprivileged extractions drop xattrs; carry them over from the base
+        node.xattrs = _tree_xattrs(path) or self._base_xattrs(rel_path)
+        if node.is_file:
+            self._match_base(node, rel_path, st)
+        return node
+
+    def root_from_tree(self, tree):
+        """WriterNode tree for a modified root filesystem directory"""
+        tree = Path(tree)
+        st = tree.stat()
+        root = WriterNode("", st.st_mode, st.st_uid, st.st_gid, int(st.st_mtime))
+        stack = [(root, str(tree), "")]
+        while stack:
+            parent, directory, rel_dir = stack.pop()
+            with os.scandir(directory) as scan:
+                for item in scan:
+                    rel_path = f"{rel_dir}/{item.name}" if rel_dir else item.name
+                    child = parent.add(self._node_from_tree(item.name, item.path, rel_path,
+                                                            item.stat(follow_symlinks=False)))
+                    self.nodes[rel_path] = child
+                    if child.is_dir:
+                        stack.append((child, item.path, rel_path))
+        return root
+
+    def _node_from_base(self, entry):
+        inode = entry.inode
+        node = WriterNode(entry.name, inode.mode, inode.uid, inode.gid, inode.mtime)
+        node.xattrs = self.image.read_xattrs(inode.xattr_index)
+        if inode.is_file:
+            node.reuse = (self.image, inode)
+            node.file_size = inode.file_size
+            if inode.nlink > 1:
+                node.link_key = ("base", inode.inode_number)
+            self.stats["unchanged"] += 1
+        elif inode.is_symlink:
+            node.symlink_target = inode.symlink_target
+        else:
+            node.rdev = inode.rdev
+        return node
+
+    def root_from_edits(self, edits):
+        """WriterNode tree for the base image with SquashfsEdits applied"""
+        root_inode = self.image.root.inode
+        root = WriterNode("", root_inode.mode, root_inode.uid, root_inode.gid, root_inode.mtime)
+        root.xattrs = self.image.read_xattrs(root_inode.xattr_index)
+        nodes = self.nodes = {"": root}
+        for entry in self.image.entries(include_root=False):
+            if edits.is_deleted(entry.path) or entry.path in edits.files:
+                continue
+            parent = nodes.get(entry.path.rpartition("/")[0])
+            if parent is None:
+                continue
+            nodes[entry.path] = parent.add(self._node_from_base(entry))
+        for path, (mode, uid, gid, mtime) in sorted(edits.directories.items()):
+            directory = self._ensure_directory(nodes, path, mtime)
+            directory.mode, directory.uid, directory.gid = stat.S_IFDIR | mode, uid, gid
+            directory.mtime = mtime
+        for path, stream_file in sorted(edits.files.items()):
+            parent_path, _, name = path.rpartition("/")
+            parent = self._ensure_directory(nodes, parent_path, stream_file.mtime)
+            node = WriterNode(name, stat.S_IFREG | stream_file.mode, stream_file.uid, stream_file.gid,
+                              stream_file.mtime)
+            if stream_file.content is not None:
+                node.data = stream_file.content
+            else:
+                node.source_path = stream_file.source
+            self.stats["changed" if self.image.lookup(path) else "new"] += 1
+            nodes[path] = parent.add(node)
+        return root
+
+    @staticmethod
+    def _ensure_directory(nodes, path, mtime):
+        if path in nodes:
+            return nodes[path]
+        parent_path, _, name = path.rpartition("/")
+        parent = IncrementalSquashfsBuilder._ensure_directory(nodes, parent_path, mtime)
+        nodes[path] = parent.add(WriterNode(name, stat.S_IFDIR | 0o755, 0, 0, mtime))
+        return nodes[path]
+
+    def build(self, source, order=None):
+        """Write the output from a modified tree (path) or SquashfsEdits.
+
+        `order` lists paths whose data should be placed first (e.g. a boot trace).
+        """
+        if not self.reusable:
+            self.log(f"Base is {self.image.compressor}/{self.image.block_size // 1024}K, output is "
+                     f"{self.writer.compressor}/{self.writer.block_size // 1024}K: "
+                     "unchanged files will be recompressed", "⚠️")
+        started = time.time()
+        if isinstance(source, SquashfsEdits):
+            root = self.root_from_edits(source)
+        else:
+            root = self.root_from_tree(source)
+        data_order = [self.nodes[path] for path in order or () if path in self.nodes]
+        size = self.writer.write(root, data_order or None)
+        writer_stats = self.writer.stats
+        self.log(f"Incremental rebuild: {self.stats['unchanged']:,} unchanged "
+                 f"({self.stats['hashed']:,} hashed), {self.stats['changed']:,} changed, "
+                 f"{self.stats['new']:,} new", "📊")
+        self.log(f"Copied {writer_stats['reused_bytes']:,} bytes, compressed "
+                 f"{writer_stats['compressed_bytes']:,} bytes in {time.time() - started:.1f}s", "✅")
+        return size
+
+
+def main():
+    if len(sys.argv) < 4:
+        print("Usage: squashfs_incremental.py <base.squashfs> <modified_tree> <output.squashfs> [--hash]")
+        print("       --hash  compare every same-size file by SHA-256 instead of trusting mtime")
+        return 1
+    with IncrementalSquashfsBuilder(sys.argv[1], sys.argv[3], trust_mtime="--hash" not in sys.argv[4:]) as builder:
+        size = builder.build(sys.argv[2])
+    print(f"✅ Written: {sys.argv[3]} ({size:,} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+SQUASHFS FILE INJECTION v1.0
+Declarative file injection into squashfs images without root extraction.
+
+Each injected file is described by path, mode, uid/gid and a content source
+(inline text, a local file, or a command's output).  Injections are applied
+one of three ways, none of which needs sudo:
+
+  1. as tar entries in the streaming repack (squashfs_stream)
+  2. by appending to the existing image (new top-level files only)
+  3. as mksquashfs pseudo-file definitions on top of an unprivileged
+     extraction, together with definitions that restore the ownership,
+     device nodes and xattrs an unprivileged unsquashfs cannot create
+"""
+
+import json
+import os
+import sys
+import shlex
+import stat
+import subprocess
+import tempfile
+from pathlib import Path
+
+from squashfs_reader import SquashfsImage, decode_device
+from squashfs_stream import SquashfsEdits, normalize
+
+VERSION = "1.0"
+
+
+class FileInjection:
+    """One file to place into the live filesystem"""
+
+    def __init__(self, path, mode=0o644, uid=0, gid=0, content=None, source=None, command=None, mtime=None):
+        if sum(x is not None for x in (content, source, command)) != 1:
+            raise ValueError(f"{path}: give exactly one of content, source or command")
+        self.path = normalize(path)
+        self.mode = int(mode, 8) if isinstance(mode, str) else mode
+        self.uid = uid
+        self.gid = gid
+        self.content = content
+        self.source = Path(source) if source is not None else None
+        self.command = command
+        self.mtime = mtime
+
+    @classmethod
+    def from_dict(cls, spec, base_dir=None):
+        source = spec.get("source")
+        if source is not None and base_dir is not None:
+            source = Path(base_dir) / source
+        return cls(spec["path"], spec.get("mode", 0o644), spec.get("uid", 0), spec.get("gid", 0),
+                   spec.get("content"), source, spec.get("command"), spec.get("mtime"))
+
+    def read(self):
+        """Resolve the content source to bytes"""
+        if self.content is not None:
+            return self.content.encode() if isinstance(self.content, str) else self.content
+        if self.source is not None:
+            return self.source.read_bytes()
+        return subprocess.run(self.command, shell=True, check=True, capture_output=True).stdout
+
+    def describe(self):
+        origin = "inline" if self.content is not None else (str(self.source) if self.source else f"$({self.command})")
+        return f"/{self.path} {self.mode:04o} {self.uid}:{self.gid} <- {origin}"
+
+
+def load_injections(spec_file):
+    """Read a JSON list of injection specs; relative sources resolve next to the spec"""
+    spec_file = Path(spec_file)
+    specs = json.loads(spec_file.read_text())
+    return [FileInjection.from_dict(spec, spec_file.parent) for spec in specs]
+
+
+def add_to_edits(injections, edits=None):
+    """Turn injections into streaming-repack edits (tar entries keep uid/gid/mode)"""
+    edits = edits or SquashfsEdits()
+    for injection in injections:
+        edits.add_file(injection.path, content=injection.read(), mode=injection.mode,
+                       uid=injection.uid, gid=injection.gid, mtime=injection.mtime)
+    return edits
+
+
+def injections_from_edits(edits):
+    """Inverse of add_to_edits: the files of SquashfsEdits as injections"""
+    return [FileInjection(f.path, mode=f.mode, uid=f.uid, gid=f.gid, content=f.content, source=f.source,
+                          mtime=f.mtime) for f in edits.files.values()]
+
+
+def _under(path, roots):
+    """True if `path` is one of `roots` or lies below one"""
+    parts = path.split("/")
+    return any("/".join(parts[:i]) in roots for i in range(1, len(parts) + 1))
+
+
+def _quote(path):
+    """Pseudo-file paths use shell-like quoting for spaces and specials"""
+    return shlex.quote(path) if any(c in path for c in " \t\"'\\") else path
+
+
+class PseudoFileBuilder:
+    """Collects mksquashfs pseudo-file definitions (-pf)"""
+
+    def __init__(self, staging_dir):
+        self.staging_dir = Path(staging_dir)
+        self.lines = []
+        self.root_mode = None
+
+    def add_injection(self, injection):
+        if injection.command is not None:
+            command = injection.command
+        else:
+            # Inline content is staged once so the definition is a plain cat
+            staged = self.staging_dir / f"inject-{len(self.lines):04d}"
+            staged.write_bytes(injection.read())
+            command = f"cat {shlex.quote(str(staged.resolve()))}"
+        self.lines.append(f"{_quote(injection.path)} f {injection.mode:o} {injection.uid} {injection.gid} {command}")
+
+    def add_directory(self, path, mode=0o755, uid=0, gid=0):
+        self.lines.append(f"{_quote(normalize(path))} d {mode:o} {uid} {gid}")
+
+    def restore_from_image(self, image_path, skip=(), deleted=()):
+        """Definitions that recreate what an unprivileged unsquashfs drops.
+
+        mksquashfs runs with -all-root, so 'm' (modify) lines bring back every
+        owner other than root:root, setuid/setgid/sticky bits and the modes
+        of directories widened to u+rwx for the extraction.  Device nodes
+        come back through 'b'/'c' lines, fifos/sockets through 'i' lines and
+        xattrs through 'x' lines.  Returns the device/IPC paths that should
+        be excluded from the unprivileged extraction; the root directory's
+        mode is left in root_mode.  Paths in `deleted` (and below) are left out.
+        """
+        special = []
+        skip, deleted = set(skip), set(deleted)
+        with SquashfsImage(image_path) as image:
+            self.root_mode = image.root.inode.permissions
+            for entry in image.entries(include_root=False):
+                if entry.path in skip or _under(entry.path, deleted):
+                    continue
+                inode = entry.inode
+                path = _quote(entry.path)
+                kind = stat.S_IFMT(inode.mode)
+                if kind in (stat.S_IFBLK, stat.S_IFCHR):
+                    major, minor = decode_device(inode.rdev)
+                    letter = "b" if kind == stat.S_IFBLK else "c"
+                    self.lines.append(f"{path} {letter} {inode.permissions:o} {inode.uid} {inode.gid} {major} {minor}")
+                    special.append(entry.path)
+                elif kind in (stat.S_IFIFO, stat.S_IFSOCK):
+                    letter = "f" if kind == stat.S_IFIFO else "s"
+                    self.lines.append(f"{path} i {inode.permissions:o} {inode.uid} {inode.gid} {letter}")
+                    special.append(entry.path)
+                elif kind != stat.S_IFLNK and (inode.uid or inode.gid or inode.permissions & 0o7000 or
+                                               (kind == stat.S_IFDIR and inode.permissions & 0o700 != 0o700)):
+                    self.lines.append(f"{path} m {inode.permissions:o} {inode.uid} {inode.gid}")
+                for name, value in image.read_xattrs(inode.xattr_index).items():
+                    plain = all(0x21 <= byte < 0x7f for byte in value)
+                    encoded = value.decode() if plain else "0t" + value.hex()
+                    self.lines.append(f"{path} x {name}={encoded}")
+        return special
+
+    def write(self, path):
+        Path(path).write_text("\n".join(self.lines) + "\n")
+        return Path(path)
+
+
+def inject_by_append(image_path, injections, log=None):
+    """Append injections to an existing image in place.
+
+    mksquashfs merges appended entries into the root directory only, so this
+    is limited to new top-level files; anything else returns False and the
+    caller should use the streaming repack instead.
+    """
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    with SquashfsImage(image_path) as image:
+        existing = {name for name, _ref, _type in image.list_directory(image.root.inode)}
+    if any("/" in i.path or i.path in existing for i in injections):
+        log("Append mode only handles new top-level files", "⚠️")
+        return False
+    with tempfile.TemporaryDirectory(prefix="inject_") as staging:
+        builder = PseudoFileBuilder(staging)
+        for injection in injections:
+            builder.add_injection(injection)
+        pseudo_file = builder.write(Path(staging) / "pseudo.txt")
+        empty = Path(staging) / "empty"
+        empty.mkdir()
+        result = subprocess.run(["mksquashfs", str(empty), str(image_path), "-pf", str(pseudo_file),
+                                 "-no-recovery", "-quiet"], capture_output=True, text=True)
+    if result.returncode != 0:
+        log(f"mksquashfs append failed: {result.stderr.strip()}", "❌")
+        return False
+    for injection in injections:
+        log(f"Appended {injection.describe()}", "✅")
+    return True
+
+
+def rebuild_unprivileged(image_path, output, injections, work_dir, compressor="xz", block_size=1048576,
+                         extra_args=(), log=None, order=None, deletions=()):
+    """Extract without sudo, then rebuild with pseudo definitions restoring root-owned state
+
+    `deletions` (paths, removed with everything below them) and the paths
+    being replaced by injections are excluded from the extraction.
+    """
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    work_dir = Path(work_dir)
+    tree = work_dir / "squashfs_tree"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    builder = PseudoFileBuilder(work_dir)
+    replaced = {i.path for i in injections}
+    special = builder.restore_from_image(image_path, skip=replaced, deleted=deletions)
+    for injection in injections:
+        builder.add_injection(injection)
+    pseudo_file = builder.write(work_dir / "pseudo.txt")
+    # mksquashfs ignores a pseudo file whose path exists in the tree, so replaced files are not extracted
+    exclude_file = work_dir / "exclude.txt"
+    exclude_file.write_text("".join(f"{path}\n" for path in [*special, *sorted(deletions), *sorted(replaced)]))
+
+    log(f"Extracting without sudo ({len(special)} special files restored via pseudo definitions)", "⚙️")
+    result = subprocess.run(["unsquashfs", "-f", "-no-xattrs", "-exclude-file", str(exclude_file),
+                             "-d", str(tree), str(image_path)], capture_output=True, text=True)
+    if result.returncode != 0:
+        log(f"Unprivileged extraction failed: {result.stderr.strip()}", "❌")
+        return False
+    # An unprivileged extraction leaves some directories unwritable; make the tree ours
+    # (the pseudo definitions put the original directory modes back)
+    for directory, _dirs, _files in os.walk(tree):
+        os.chmod(directory, os.stat(directory).st_mode | stat.S_IWUSR | stat.S_IXUSR | stat.S_IRUSR)
+    # Pseudo definitions cannot name the root; it is only read from here on, so restore it directly
+    os.chmod(tree, builder.root_mode)
+
+    extra_args = list(extra_args)
+    if order:
+        # mksquashfs places higher priorities first; paths are given as it sees them
+        sort_file = work_dir / "boot.sort"
+        sort_file.write_text("".join(f"{tree}/{path} {max(1, 32767 - rank)}\n" for rank, path in enumerate(order)))
+        extra_args += ["-sort", str(sort_file)]
+    # Everything extracted is owned by the build user: root:root by default, the rest via 'm' lines
+    result = subprocess.run(["mksquashfs", str(tree), str(output), "-pf", str(pseudo_file), "-all-root",
+                             "-comp", compressor, "-b", str(block_size), "-noappend", "-no-recovery",
+                             *extra_args], capture_output=True, text=True)
+    subprocess.run(["rm", "-rf", str(tree)])
+    if result.returncode != 0:
+        log(f"mksquashfs failed: {result.stderr.strip()}", "❌")
+        return False
+    return True
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: squashfs_inject.py <image.squashfs> <injections.json> [--append]")
+        print('  injections.json: [{"path": "etc/motd", "mode": "0644", "uid": 0, "gid": 0,')
+        print('                     "content": "..." | "source": "file" | "command": "..."}]')
+        return 1
+    injections = load_injections(sys.argv[2])
+    for injection in injections:
+        print(f"📄 {injection.describe()}")
+    if "--append" in sys.argv[3:]:
+        return 0 if inject_by_append(sys.argv[1], injections) else 1
+    from squashfs_stream import stream_repack
+    output = Path(sys.argv[1]).with_suffix(".injected.squashfs")
+    with SquashfsImage(sys.argv[1]) as image:
+        compressor, block_size = image.compressor, image.block_size
+    stats = stream_repack(sys.argv[1], output, add_to_edits(injections), compressor, block_size)
+    if stats:
+        print(f"✅ Written: {output}")
+    return 0 if stats else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
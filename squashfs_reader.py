@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""
+SQUASHFS READER v1.0
+Reads squashfs 4.0 images directly (superblock, inode/directory tables,
+fragments, ids, xattrs and data blocks) without unsquashfs or sudo.
+
+Used by the estimator, analyzers and streaming repack tools to look inside
+ubuntu-server-minimal.squashfs without extracting it to disk.
+"""
+
+import os
+import sys
+import lzma
+import hashlib
+import stat
+import struct
+import zlib
+from pathlib import Path
+
+SQUASHFS_MAGIC = 0x73717368
+SUPERBLOCK_FORMAT = "<IIIIIHHHHHHQQQQQQQQ"
+SUPERBLOCK_SIZE = struct.calcsize(SUPERBLOCK_FORMAT)
+METADATA_SIZE = 8192
+INVALID_TABLE = 0xFFFFFFFFFFFFFFFF
+NO_FRAGMENT = 0xFFFFFFFF
+NO_XATTR = 0xFFFFFFFF
+
+# Superblock flags
+FLAG_UNCOMPRESSED_INODES = 0x0001
+FLAG_UNCOMPRESSED_DATA = 0x0002
+FLAG_UNCOMPRESSED_FRAGMENTS = 0x0008
+FLAG_NO_FRAGMENTS = 0x0010
+FLAG_ALWAYS_FRAGMENTS = 0x0020
+FLAG_DUPLICATES = 0x0040
+FLAG_EXPORTABLE = 0x0080
+FLAG_UNCOMPRESSED_XATTRS = 0x0100
+FLAG_NO_XATTRS = 0x0200
+FLAG_COMPRESSOR_OPTIONS = 0x0400
+FLAG_UNCOMPRESSED_IDS = 0x0800
+
+# Inode types (basic and extended)
+DIR_TYPE, FILE_TYPE, SYMLINK_TYPE, BLKDEV_TYPE, CHRDEV_TYPE, FIFO_TYPE, SOCKET_TYPE = range(1, 8)
+LDIR_TYPE, LREG_TYPE, LSYMLINK_TYPE, LBLKDEV_TYPE, LCHRDEV_TYPE, LFIFO_TYPE, LSOCKET_TYPE = range(8, 15)
+
+# Data block / fragment size words
+BLOCK_UNCOMPRESSED = 1 << 24
+BLOCK_SIZE_MASK = BLOCK_UNCOMPRESSED - 1
+
+COMPRESSORS = {1: "gzip", 2: "lzma", 3: "lzo", 4: "xz", 5: "lz4", 6: "zstd"}
+
+MODE_BITS = {
+    DIR_TYPE: stat.S_IFDIR, FILE_TYPE: stat.S_IFREG, SYMLINK_TYPE: stat.S_IFLNK,
+    BLKDEV_TYPE: stat.S_IFBLK, CHRDEV_TYPE: stat.S_IFCHR, FIFO_TYPE: stat.S_IFIFO,
+    SOCKET_TYPE: stat.S_IFSOCK,
+}
+
+XATTR_PREFIXES = {0: "user.", 1: "trusted.", 2: "security."}
+XATTR_VALUE_OOL = 0x100
+
+
+class SquashfsError(Exception):
+    """Raised when an image is not a readable squashfs 4.0 filesystem"""
+
+
+def get_decompressor(name):
+    """Return a bytes -> bytes decompressor for a squashfs compressor name"""
+    if name == "gzip":
+        return zlib.decompress
+    if name == "xz":
+        return lambda data: lzma.decompress(data, format=lzma.FORMAT_XZ)
+    if name == "lzma":
+        return lambda data: lzma.decompress(data, format=lzma.FORMAT_ALONE)
+    if name == "zstd":
+        try:
+            from compression import zstd
+            return zstd.decompress
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            raise SquashfsError("zstd image needs the 'zstandard' package (pip install zstandard)")
+        # Data blocks never decompress beyond the 1 MiB maximum block size
+        return lambda data: zstandard.ZstdDecompressor().decompress(data, max_output_size=1 << 20)
+    if name == "lzo":
+        try:
+            import lzo
+        except ImportError:
+            raise SquashfsError("lzo image needs the 'python-lzo' package (pip install python-lzo)")
+        return lambda data: lzo.decompress(data, False, 1 << 20)
+    if name == "lz4":
+        try:
+            import lz4.block
+        except ImportError:
+            raise SquashfsError("lz4 image needs the 'lz4' package (pip install lz4)")
+        return lambda data: lz4.block.decompress(data, uncompressed_size=1 << 20)
+    raise SquashfsError(f"Unsupported squashfs compressor: {name}")
+
+
+def decode_device(device):
+    """Split a squashfs (old huge_encode_dev) device number into (major, minor)"""
+    major = (device >> 8) & 0xFFF
+    minor = (device & 0xFF) | ((device >> 12) & 0xFFF00)
+    return major, minor
+
+
+def encode_device(major, minor):
+    """Inverse of decode_device"""
+    return (minor & 0xFF) | (major << 8) | ((minor & ~0xFF) << 12)
+
+
+class SquashfsInode:
+    """One decoded inode from the inode table"""
+
+    def __init__(self, inode_type, permissions, uid, gid, mtime, inode_number):
+        self.inode_type = inode_type
+        self.basic_type = inode_type if inode_type < LDIR_TYPE else inode_type - 7
+        self.permissions = permissions
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.inode_number = inode_number
+        self.nlink = 1
+        self.file_size = 0
+        self.xattr_index = NO_XATTR
+        # Directories
+        self.dir_block = 0
+        self.dir_offset = 0
+        self.dir_size = 0
+        self.parent_inode = 0
+        # Regular files
+        self.blocks_start = 0
+        self.block_sizes = []
+        self.fragment_index = NO_FRAGMENT
+        self.fragment_offset = 0
+        self.sparse = 0
+        # Symlinks and devices
+        self.symlink_target = ""
+        self.rdev = 0
+
+    @property
+    def mode(self):
+        return MODE_BITS[self.basic_type] | self.permissions
+
+    @property
+    def is_dir(self):
+        return self.basic_type == DIR_TYPE
+
+    @property
+    def is_file(self):
+        return self.basic_type == FILE_TYPE
+
+    @property
+    def is_symlink(self):
+        return self.basic_type == SYMLINK_TYPE
+
+    @property
+    def has_fragment(self):
+        return self.basic_type == FILE_TYPE and self.fragment_index != NO_FRAGMENT
+
+    @property
+    def compressed_size(self):
+        """On-disk size of the file's own data blocks (fragments excluded)"""
+        return sum(size & BLOCK_SIZE_MASK for size in self.block_sizes)
+
+
+class SquashfsEntry:
+    """A path in the image paired with its inode and inode reference"""
+
+    def __init__(self, path, name, inode, inode_ref):
+        self.path = path
+        self.name = name
+        self.inode = inode
+        self.inode_ref = inode_ref
+
+    def __repr__(self):
+        return f"SquashfsEntry({self.path!r})"
+
+
+class SquashfsImage:
+    """Random-access reader for a squashfs 4.0 image file"""
+
+    def __init__(self, path, offset=0):
+        self.path = Path(path)
+        self.offset = offset
+        self._file = open(self.path, "rb")
+        self._read_superblock()
+        self.decompress = get_decompressor(self.compressor)
+        self._inode_table = None
+        self._inode_index = None
+        self._dir_table = None
+        self._dir_index = None
+        self._fragments = None
+        self._ids = None
+        self._xattr_ids = None
+        self._xattr_table_start = 0
+        self._fragment_cache = (None, b"")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # Low level reads
+    # ------------------------------------------------------------------
+
+    def pread(self, position, size):
+        """Read raw bytes at an image-relative position"""
+        return os.pread(self._file.fileno(), size, self.offset + position)
+
+    def _read_superblock(self):
+        raw = self.pread(0, SUPERBLOCK_SIZE)
+        if len(raw) < SUPERBLOCK_SIZE:
+            raise SquashfsError(f"{self.path}: too small for a squashfs superblock")
+        fields = struct.unpack(SUPERBLOCK_FORMAT, raw)
+        (magic, self.inode_count, self.mkfs_time, self.block_size,
+         self.fragment_count, compression_id, self.block_log, self.flags,
+         self.id_count, major, minor, self.root_inode_ref, self.bytes_used,
+         self.id_table_start, self.xattr_id_table_start, self.inode_table_start,
+         self.directory_table_start, self.fragment_table_start,
+         self.export_table_start) = fields
+        if magic != SQUASHFS_MAGIC:
+            raise SquashfsError(f"{self.path}: not a squashfs image (bad magic)")
+        if (major, minor) != (4, 0):
+            raise SquashfsError(f"{self.path}: unsupported squashfs version {major}.{minor}")
+        self.superblock_bytes = raw
+        self.compression_id = compression_id
+        self.compressor = COMPRESSORS.get(compression_id, f"unknown-{compression_id}")
+
+    def read_metadata_block(self, position):
+        """Decompress one metadata block; returns (data, position of next block)"""
+        header, = struct.unpack("<H", self.pread(position, 2))
+        size = header & 0x7FFF
+        raw = self.pread(position + 2, size)
+        data = raw if header & 0x8000 else self.decompress(raw)
+        return data, position + 2 + size
+
+    def _read_metadata_area(self, start, end):
+        """Decompress every metadata block in [start, end) into one buffer.
+
+        Returns the buffer and a map of block position (relative to start)
+        to its offset inside the buffer, which is how inode and directory
+        references address metadata.
+        """
+        chunks = []
+        index = {}
+        uncompressed = 0
+        position = start
+        while position < end:
+            index[position - start] = uncompressed
+            data, position = self.read_metadata_block(position)
+            chunks.append(data)
+            uncompressed += len(data)
+        return b"".join(chunks), index
+
+    def _read_lookup_table(self, table_start, entry_count, entry_size):
+        """Read a table of fixed-size entries addressed through a u64 block index"""
+        if table_start == INVALID_TABLE or entry_count == 0:
+            return b""
+        total = entry_count * entry_size
+        blocks = (total + METADATA_SIZE - 1) // METADATA_SIZE
+        pointers = struct.unpack(f"<{blocks}Q", self.pread(table_start, 8 * blocks))
+        data = b"".join(self.read_metadata_block(pointer)[0] for pointer in pointers)
+        return data[:total]
+
+    def metadata_end(self):
+        """First byte after the directory table (start of the trailing tables)"""
+        candidates = [self.bytes_used]
+        for table_start in (self.fragment_table_start, self.export_table_start, self.id_table_start):
+            if table_start != INVALID_TABLE and table_start > self.directory_table_start:
+                pointer, = struct.unpack("<Q", self.pread(table_start, 8))
+                candidates.append(min(pointer, table_start))
+        if self.xattr_id_table_start != INVALID_TABLE:
+            xattr_start, = struct.unpack("<Q", self.pread(self.xattr_id_table_start, 8))
+            candidates.append(xattr_start)
+        return min(c for c in candidates if c > self.directory_table_start)
+
+    # ------------------------------------------------------------------
+    # Tables
+    # ------------------------------------------------------------------
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            raw = self._read_lookup_table(self.id_table_start, self.id_count, 4)
+            self._ids = list(struct.unpack(f"<{self.id_count}I", raw))
+        return self._ids
+
+    @property
+    def fragments(self):
+        """List of (start, size word) for every fragment block"""
+        if self._fragments is None:
+            raw = self._read_lookup_table(self.fragment_table_start, self.fragment_count, 16)
+            self._fragments = [struct.unpack_from("<QI", raw, i * 16) for i in range(self.fragment_count)]
+        return self._fragments
+
+    def _load_tables(self):
+        if self._inode_table is None:
+            self._inode_table, self._inode_index = self._read_metadata_area(
+                self.inode_table_start, self.directory_table_start)
+            self._dir_table, self._dir_index = self._read_metadata_area(
+                self.directory_table_start, self.metadata_end())
+
+    @property
+    def inode_table(self):
+        self._load_tables()
+        return self._inode_table
+
+    @property
+    def directory_table(self):
+        self._load_tables()
+        return self._dir_table
+
+    # ------------------------------------------------------------------
+    # Inodes and directories
+    # ------------------------------------------------------------------
+
+    def read_inode(self, inode_ref):
+        """Decode the inode at a (block << 16 | offset) reference"""
+        self._load_tables()
+        block, offset = inode_ref >> 16, inode_ref & 0xFFFF
+        pos = self._inode_index[block] + offset
+        table = self._inode_table
+        inode_type, permissions, uid_idx, gid_idx, mtime, number = struct.unpack_from("<HHHHII", table, pos)
+        inode = SquashfsInode(inode_type, permissions, self.ids[uid_idx], self.ids[gid_idx], mtime, number)
+        pos += 16
+
+        if inode_type == DIR_TYPE:
+            (inode.dir_block, inode.nlink, inode.dir_size, inode.dir_offset,
+             inode.parent_inode) = struct.unpack_from("<IIHHI", table, pos)
+        elif inode_type == LDIR_TYPE:
+            (inode.nlink, inode.dir_size, inode.dir_block, inode.parent_inode, _index_count,
+             inode.dir_offset, inode.xattr_index) = struct.unpack_from("<IIIIHHI", table, pos)
+        elif inode_type in (FILE_TYPE, LREG_TYPE):
+            if inode_type == FILE_TYPE:
+                (inode.blocks_start, inode.fragment_index, inode.fragment_offset,
+                 inode.file_size) = struct.unpack_from("<IIII", table, pos)
+                pos += 16
+            else:
+                (inode.blocks_start, inode.file_size, inode.sparse, inode.nlink,
+                 inode.fragment_index, inode.fragment_offset,
+                 inode.xattr_index) = struct.unpack_from("<QQQIIII", table, pos)
+                pos += 40
+            count = inode.file_size // self.block_size
+            if inode.fragment_index == NO_FRAGMENT and inode.file_size % self.block_size:
+                count += 1
+            inode.block_sizes = list(struct.unpack_from(f"<{count}I", table, pos))
+        elif inode_type in (SYMLINK_TYPE, LSYMLINK_TYPE):
+            inode.nlink, target_size = struct.unpack_from("<II", table, pos)
+            inode.symlink_target = table[pos + 8:pos + 8 + target_size].decode("utf-8", "surrogateescape")
+            inode.file_size = target_size
+            if inode_type == LSYMLINK_TYPE:
+                inode.xattr_index, = struct.unpack_from("<I", table, pos + 8 + target_size)
+        elif inode_type in (BLKDEV_TYPE, CHRDEV_TYPE):
+            inode.nlink, inode.rdev = struct.unpack_from("<II", table, pos)
+        elif inode_type in (LBLKDEV_TYPE, LCHRDEV_TYPE):
+            inode.nlink, inode.rdev, inode.xattr_index = struct.unpack_from("<III", table, pos)
+        elif inode_type in (FIFO_TYPE, SOCKET_TYPE):
+            inode.nlink, = struct.unpack_from("<I", table, pos)
+        elif inode_type in (LFIFO_TYPE, LSOCKET_TYPE):
+            inode.nlink, inode.xattr_index = struct.unpack_from("<II", table, pos)
+        else:
+            raise SquashfsError(f"Unknown inode type {inode_type} at reference {inode_ref:#x}")
+        return inode
+
+    def list_directory(self, inode):
+        """Return [(name, inode_ref, basic_type)] for a directory inode"""
+        self._load_tables()
+        listing = []
+        remaining = inode.dir_size - 3
+        if remaining <= 0:
+            return listing
+        pos = self._dir_index[inode.dir_block] + inode.dir_offset
+        table = self._dir_table
+        while remaining > 0:
+            count, start_block, _base_inode = struct.unpack_from("<III", table, pos)
+            pos += 12
+            remaining -= 12
+            for _ in range(count + 1):
+                offset, _inode_delta, entry_type, name_size = struct.unpack_from("<HhHH", table, pos)
+                name = table[pos + 8:pos + 9 + name_size].decode("utf-8", "surrogateescape")
+                pos += 9 + name_size
+                remaining -= 9 + name_size
+                listing.append((name, (start_block << 16) | offset, entry_type))
+        return listing
+
+    @property
+    def root(self):
+        return SquashfsEntry("", "", self.read_inode(self.root_inode_ref), self.root_inode_ref)
+
+    def entries(self, include_root=True):
+        """Walk the whole image depth-first in directory (sorted) order"""
+        root = self.root
+        if include_root:
+            yield root
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            children = []
+            for name, inode_ref, _entry_type in self.list_directory(directory.inode):
+                path = f"{directory.path}/{name}" if directory.path else name
+                entry = SquashfsEntry(path, name, self.read_inode(inode_ref), inode_ref)
+                children.append(entry)
+            for entry in children:
+                yield entry
+            stack.extend(reversed([e for e in children if e.inode.is_dir]))
+
+    def lookup(self, path):
+        """Find the entry for a slash separated path (None if missing)"""
+        entry = self.root
+        for part in [p for p in str(path).strip("/").split("/") if p]:
+            if not entry.inode.is_dir:
+                return None
+            for name, inode_ref, _entry_type in self.list_directory(entry.inode):
+                if name == part:
+                    child_path = f"{entry.path}/{name}" if entry.path else name
+                    entry = SquashfsEntry(child_path, name, self.read_inode(inode_ref), inode_ref)
+                    break
+            else:
+                return None
+        return entry
+
+    # ------------------------------------------------------------------
+    # File data
+    # ------------------------------------------------------------------
+
+    def read_data_block(self, position, size_word, expected_size):
+        """Read one data or fragment block given its size word"""
+        size = size_word & BLOCK_SIZE_MASK
+        if size == 0:
+            return bytes(expected_size)
+        raw = self.pread(position, size)
+        if size_word & BLOCK_UNCOMPRESSED:
+            return raw
+        return self.decompress(raw)
+
+    def block_positions(self, inode):
+        """Yield (position, size word) for each data block of a file"""
+        position = inode.blocks_start
+        for size_word in inode.block_sizes:
+            yield position, size_word
+            position += size_word & BLOCK_SIZE_MASK
+
+    def read_file_block(self, inode, index):
+        """Return the uncompressed contents of block `index` of a file"""
+        block_count = len(inode.block_sizes)
+        if index < block_count:
+            position = inode.blocks_start + sum(s & BLOCK_SIZE_MASK for s in inode.block_sizes[:index])
+            expected = min(self.block_size, inode.file_size - index * self.block_size)
+            return self.read_data_block(position, inode.block_sizes[index], expected)
+        if index == block_count and inode.has_fragment:
+            return self.read_fragment_tail(inode)
+        raise IndexError(f"block {index} out of range")
+
+    def read_fragment_tail(self, inode):
+        start, size_word = self.fragments[inode.fragment_index]
+        block = self._fragment_cache_get(inode.fragment_index, start, size_word)
+        tail = inode.file_size % self.block_size
+        return block[inode.fragment_offset:inode.fragment_offset + tail]
+
+    def _fragment_cache_get(self, index, start, size_word):
+        if self._fragment_cache[0] != index:
+            self._fragment_cache = (index, self.read_data_block(start, size_word, self.block_size))
+        return self._fragment_cache[1]
+
+    def iter_file(self, inode):
+        """Yield the uncompressed contents of a regular file block by block"""
+        remaining = inode.file_size
+        for position, size_word in self.block_positions(inode):
+            data = self.read_data_block(position, size_word, min(self.block_size, remaining))
+            remaining -= len(data)
+            yield data
+        if inode.has_fragment:
+            yield self.read_fragment_tail(inode)
+
+    def read_file(self, inode):
+        return b"".join(self.iter_file(inode))
+
+    # ------------------------------------------------------------------
+    # Extended attributes
+    # ------------------------------------------------------------------
+
+    def read_xattrs(self, xattr_index):
+        """Return {name: value} for an inode's xattr index"""
+        if xattr_index == NO_XATTR or self.xattr_id_table_start == INVALID_TABLE:
+            return {}
+        if self._xattr_ids is None:
+            header = self.pread(self.xattr_id_table_start, 16)
+            self._xattr_table_start, xattr_count, _unused = struct.unpack("<QII", header)
+            raw = self._read_xattr_id_entries(xattr_count)
+            self._xattr_ids = [struct.unpack_from("<QII", raw, i * 16) for i in range(xattr_count)]
+        ref, count, _size = self._xattr_ids[xattr_index]
+        stream = _MetadataCursor(self, self._xattr_table_start, ref)
+        values = {}
+        for _ in range(count):
+            key_type, name_size = struct.unpack("<HH", stream.read(4))
+            name = XATTR_PREFIXES.get(key_type & 0xFF, "") + stream.read(name_size).decode("utf-8", "surrogateescape")
+            value_size, = struct.unpack("<I", stream.read(4))
+            value = stream.read(value_size)
+            if key_type & XATTR_VALUE_OOL:
+                value_ref, = struct.unpack("<Q", value)
+                ool = _MetadataCursor(self, self._xattr_table_start, value_ref)
+                ool_size, = struct.unpack("<I", ool.read(4))
+                value = ool.read(ool_size)
+            values[name] = value
+        return values
+
+    def _read_xattr_id_entries(self, xattr_count):
+        blocks = (xattr_count * 16 + METADATA_SIZE - 1) // METADATA_SIZE
+        pointers = struct.unpack(f"<{blocks}Q", self.pread(self.xattr_id_table_start + 16, 8 * blocks))
+        data = b"".join(self.read_metadata_block(pointer)[0] for pointer in pointers)
+        return data[:xattr_count * 16]
+
+    # ------------------------------------------------------------------
+    # Summaries
+    # ------------------------------------------------------------------
+
+    def fingerprint(self):
+        """SHA-256 over the superblock and all metadata (inode table onwards).
+
+        Every data block is referenced from the metadata by position and size,
+        so this identifies the image without hashing hundreds of megabytes.
+        """
+        digest = hashlib.sha256(self.superblock_bytes)
+        position = self.inode_table_start
+        while position < self.bytes_used:
+            chunk = self.pread(position, min(self.bytes_used - position, 8 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            position += len(chunk)
+        return digest.hexdigest()
+
+    def describe(self):
+        """One line summary used in log output"""
+        return (f"squashfs 4.0 {self.compressor}, {self.block_size // 1024} KiB blocks, "
+                f"{self.inode_count:,} inodes, {self.bytes_used:,} bytes")
+
+
+class _MetadataCursor:
+    """Sequential reader over a metadata stream starting at a reference"""
+
+    def __init__(self, image, table_start, ref):
+        self.image = image
+        self.position = table_start + (ref >> 16)
+        self.buffer, self.position = image.read_metadata_block(self.position)
+        self.offset = ref & 0xFFFF
+
+    def read(self, size):
+        out = b""
+        while len(out) < size:
+            if self.offset >= len(self.buffer):
+                self.buffer, self.position = self.image.read_metadata_block(self.position)
+                self.offset = 0
+            take = min(size - len(out), len(self.buffer) - self.offset)
+            out += self.buffer[self.offset:self.offset + take]
+            self.offset += take
+        return out
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: squashfs_reader.py <image.squashfs> [path]")
+        return 1
+    with SquashfsImage(sys.argv[1]) as image:
+        print(f"📦 {image.describe()}")
+        if len(sys.argv) > 2:
+            entry = image.lookup(sys.argv[2])
+            if entry is None:
+                print(f"❌ Not found: {sys.argv[2]}")
+                return 1
+            if entry.inode.is_file:
+                sys.stdout.buffer.write(image.read_file(entry.inode))
+            else:
+                for name, _ref, _type in image.list_directory(entry.inode):
+                    print(name)
+            return 0
+        for entry in image.entries():
+            inode = entry.inode
+            print(f"{stat.filemode(inode.mode)} {inode.uid}/{inode.gid} {inode.file_size:>12,} /{entry.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+SQUASHFS SPACE ANALYZER v1.0
+Explains where the bytes of a squashfs image (or an extracted tree) go.
+
+One pass over the inode/directory tables gives, per directory and per file
+type, the uncompressed bytes and the compressed bytes they occupy in the
+image (fragment blocks are shared out by tail size).  Duplicate files are
+found by content hash, only among files of equal size.  Image reports are
+cached by image fingerprint, so comparing two known images is instant.
+"""
+
+import os
+import sys
+import hashlib
+from collections import defaultdict
+from pathlib import Path
+
+from build_cache import BuildCache, cache_key
+from squashfs_reader import SquashfsImage, BLOCK_SIZE_MASK
+
+VERSION = "1.0"
+
+MIN_DUPLICATE_SIZE = 4096
+LARGEST_KEPT = 100
+
+
+def file_type(name):
+    """Extension used for grouping; versioned shared objects count as .so"""
+    if ".so." in name or name.endswith(".so"):
+        return ".so"
+    suffix = Path(name).suffix.lower()
+    return suffix if suffix and len(suffix) <= 10 else "(none)"
+
+
+def _ancestors(path):
+    """'a/b/c' -> '', 'a', 'a/b'"""
+    parts = path.split("/")[:-1]
+    yield ""
+    for depth in range(1, len(parts) + 1):
+        yield "/".join(parts[:depth])
+
+
+class SpaceAnalyzer:
+    """Single-pass space accounting for one image or tree"""
+
+    def __init__(self, source, min_duplicate_size=MIN_DUPLICATE_SIZE, use_cache=True, log=None):
+        self.source = Path(source)
+        self.min_duplicate_size = min_duplicate_size
+        self.use_cache = use_cache
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+
+    def analyze(self):
+        """Return the report dict (from cache for a known image)"""
+        if self.source.is_dir():
+            return self._analyze_tree()
+        with SquashfsImage(self.source) as image:
+            cache = BuildCache("space-analysis") if self.use_cache else None
+            key = cache_key("space", VERSION, image.fingerprint(), self.min_duplicate_size)
+            report = cache.get_json(key) if cache else None
+            if report is not None:
+                self.log(f"Space report for {self.source.name} loaded from cache", "⚡")
+                report["source"] = str(self.source)
+                return report
+            report = self._analyze_image(image)
+            if cache:
+                cache.put_json(key, report)
+            return report
+
+    # ------------------------------------------------------------------
+    # Passes
+    # ------------------------------------------------------------------
+
+    def _new_report(self, kind):
+        return {
+            "version": VERSION, "source": str(self.source), "kind": kind, "image_bytes": None,
+            "totals": {"files": 0, "directories": 0, "symlinks": 0, "other": 0,
+                       "uncompressed": 0, "compressed": 0},
+            "directories": defaultdict(lambda: [0, 0, 0]),
+            "types": defaultdict(lambda: [0, 0, 0]),
+            "files": {},
+        }
+
+    def _account(self, report, path, size, compressed):
+        report["files"][path] = [size, compressed]
+        totals = report["totals"]
+        totals["files"] += 1
+        totals["uncompressed"] += size
+        totals["compressed"] += compressed
+        for directory in _ancestors(path):
+            row = report["directories"][directory]
+            row[0] += size
+            row[1] += compressed
+            row[2] += 1
+        row = report["types"][file_type(path.rpartition("/")[2])]
+        row[0] += 1
+        row[1] += size
+        row[2] += compressed
+
+    def _analyze_image(self, image):
+        self.log(f"Analyzing {self.source.name}: {image.describe()}", "🔍")
+        report = self._new_report("image")
+        report["image_bytes"] = image.bytes_used
+        records = []
+        fragment_tails = defaultdict(list)
+        stored = {}
+        seen_inodes = set()
+        for entry in image.entries(include_root=False):
+            inode = entry.inode
+            if inode.is_dir:
+                report["totals"]["directories"] += 1
+                continue
+            if inode.is_symlink:
+                report["totals"]["symlinks"] += 1
+                continue
+            if not inode.is_file:
+                report["totals"]["other"] += 1
+                continue
+            # Hard links and mksquashfs-deduplicated files share their data;
+            # only the first path is charged for it
+            storage = (inode.blocks_start, inode.file_size, inode.fragment_index, inode.fragment_offset)
+            shared = inode.inode_number in seen_inodes or (inode.file_size and storage in stored)
+            seen_inodes.add(inode.inode_number)
+            stored.setdefault(storage, entry)
+            compressed = 0 if shared else inode.compressed_size
+            records.append([entry.path, inode.file_size, compressed, entry])
+            if inode.has_fragment and not shared:
+                fragment_tails[inode.fragment_index].append((len(records) - 1, inode.file_size % image.block_size))
+
+        # Share each fragment block's compressed size out by tail length
+        fragments = image.fragments
+        for index, members in fragment_tails.items():
+            block_bytes = fragments[index][1] & BLOCK_SIZE_MASK
+            tail_total = sum(tail for _record, tail in members) or 1
+            for record, tail in members:
+                records[record][2] += block_bytes * tail // tail_total
+
+        for path, size, compressed, _entry in records:
+            self._account(report, path, size, compressed)
+        report["duplicates"] = self._duplicates(
+            records, lambda entry: image.iter_file(entry.inode),
+            lambda entry: (entry.inode.blocks_start, entry.inode.file_size,
+                           entry.inode.fragment_index, entry.inode.fragment_offset))
+        report["totals"]["metadata"] = image.bytes_used - report["totals"]["compressed"]
+        return self._finish(report)
+
+    def _analyze_tree(self):
+        self.log(f"Analyzing tree {self.source}", "🔍")
+        report = self._new_report("tree")
+        records = []
+        stack = [(str(self.source), "")]
+        while stack:
+            directory, rel_dir = stack.pop()
+            with os.scandir(directory) as scan:
+                for item in scan:
+                    rel_path = f"{rel_dir}/{item.name}" if rel_dir else item.name
+                    if item.is_dir(follow_symlinks=False):
+                        report["totals"]["directories"] += 1
+                        stack.append((item.path, rel_path))
+                    elif item.is_symlink():
+                        report["totals"]["symlinks"] += 1
+                    elif item.is_file(follow_symlinks=False):
+                        # Every path of a hard link keeps its size, as in image mode
+                        records.append([rel_path, item.stat(follow_symlinks=False).st_size, 0, item.path])
+                    else:
+                        report["totals"]["other"] += 1
+        for path, size, compressed, _source in records:
+            self._account(report, path, size, compressed)
+        report["duplicates"] = self._duplicates(records, self._read_chunks, lambda source: source)
+        return self._finish(report)
+
+    @staticmethod
+    def _read_chunks(path):
+        with open(path, "rb") as handle:
+            yield from iter(lambda: handle.read(1 << 20), b"")
+
+    def _duplicates(self, records, read, storage_key):
+        """Hash only files whose size collides with another file's size"""
+        by_size = defaultdict(list)
+        for record in records:
+            if record[1] >= self.min_duplicate_size:
+                by_size[record[1]].append(record)
+        groups = defaultdict(list)
+        hashed = {}
+        for size, candidates in by_size.items():
+            if len(candidates) < 2:
+                continue
+            for path, _size, compressed, source in candidates:
+                key = storage_key(source)
+                if key not in hashed:
+                    digest = hashlib.sha256()
+                    for chunk in read(source):
+                        digest.update(chunk)
+                    hashed[key] = digest.hexdigest()
+                groups[(hashed[key], size)].append((path, compressed))
+        duplicates = []
+        for (digest, size), members in groups.items():
+            if len(members) > 1:
+                members.sort()
+                duplicates.append({
+                    "sha256": digest, "size": size, "paths": [path for path, _c in members],
+                    "wasted": size * (len(members) - 1),
+                    "wasted_compressed": sum(c for _p, c in members) - max(c for _p, c in members),
+                })
+        duplicates.sort(key=lambda d: (d["wasted_compressed"], d["wasted"]), reverse=True)
+        return duplicates
+
+    def _finish(self, report):
+        report["directories"] = dict(report["directories"])
+        report["types"] = dict(report["types"])
+        ranked = sorted(report["files"].items(), key=lambda item: (item[1][1], item[1][0]), reverse=True)
+        report["largest"] = [[path, size, compressed] for path, (size, compressed) in ranked[:LARGEST_KEPT]]
+        return report
+
+
+def analyze(source, **options):
+    return SpaceAnalyzer(source, **options).analyze()
+
+
+def _mb(value):
+    return f"{value / 1e6:,.1f} MB"
+
+
+def _ratio(uncompressed, compressed):
+    return f"{compressed / uncompressed:.3f}" if uncompressed and compressed else "  -  "
+
+
+def print_report(report, top=20, depth=2):
+    totals = report["totals"]
+    print(f"📦 {report['source']} ({report['kind']})")
+    print(f"   {totals['files']:,} files, {totals['directories']:,} dirs, {totals['symlinks']:,} symlinks, "
+          f"{totals['other']:,} other")
+    print(f"   Uncompressed {_mb(totals['uncompressed'])}", end="")
+    if report["kind"] == "image":
+        print(f", data {_mb(totals['compressed'])}, metadata {_mb(totals['metadata'])}, "
+              f"image {_mb(report['image_bytes'])}")
+    else:
+        print()
+
+    key = 1 if report["kind"] == "image" else 0
+    print(f"\n📂 Directories (depth ≤ {depth}):")
+    rows = [(path, row) for path, row in report["directories"].items() if path.count("/") < depth]
+    for path, (size, compressed, files) in sorted(rows, key=lambda item: item[1][key], reverse=True)[:top]:
+        print(f"   {_mb(size):>12} {_mb(compressed):>12} {_ratio(size, compressed)} {files:>7,}  /{path}")
+
+    print("\n🗂️ File types:")
+    for name, (count, size, compressed) in sorted(report["types"].items(),
+                                                  key=lambda item: item[1][key + 1], reverse=True)[:top]:
+        print(f"   {name:<10} {count:>7,} {_mb(size):>12} {_mb(compressed):>12} {_ratio(size, compressed)}")
+
+    print("\n🐘 Largest contributors:")
+    for path, size, compressed in report["largest"][:top]:
+        print(f"   {_mb(size):>12} {_mb(compressed):>12}  /{path}")
+
+    duplicates = report["duplicates"]
+    if duplicates:
+        wasted = sum(d["wasted"] for d in duplicates)
+        wasted_compressed = sum(d["wasted_compressed"] for d in duplicates)
+        print(f"\n👯 Duplicates: {len(duplicates):,} groups, {_mb(wasted)} uncompressed, "
+              f"{_mb(wasted_compressed)} in the image")
+        for duplicate in duplicates[:min(top, 10)]:
+            print(f"   {len(duplicate['paths'])} × {duplicate['size']:,} bytes: /{duplicate['paths'][0]} ...")
+
+
+def compare(base, other, depth=3):
+    """Differences between two reports: totals, directories, types and file sets"""
+    key = 1 if base["kind"] == other["kind"] == "image" else 0
+    directories = []
+    for path in set(base["directories"]) | set(other["directories"]):
+        if path.count("/") >= depth:
+            continue
+        a = base["directories"].get(path, [0, 0, 0])
+        b = other["directories"].get(path, [0, 0, 0])
+        if a[key] != b[key]:
+            directories.append((path, b[key] - a[key], a[key], b[key]))
+    directories.sort(key=lambda row: abs(row[1]), reverse=True)
+    types = []
+    for name in set(base["types"]) | set(other["types"]):
+        a = base["types"].get(name, [0, 0, 0])
+        b = other["types"].get(name, [0, 0, 0])
+        if a[key + 1] != b[key + 1]:
+            types.append((name, b[key + 1] - a[key + 1]))
+    types.sort(key=lambda row: abs(row[1]), reverse=True)
+    base_files, other_files = set(base["files"]), set(other["files"])
+    changed = [path for path in base_files & other_files if base["files"][path][0] != other["files"][path][0]]
+    return {
+        "size_delta": (other["image_bytes"] or other["totals"]["uncompressed"])
+                      - (base["image_bytes"] or base["totals"]["uncompressed"]),
+        "directories": directories, "types": types,
+        "added": sorted(other_files - base_files, key=lambda p: -other["files"][p][key]),
+        "removed": sorted(base_files - other_files, key=lambda p: -base["files"][p][key]),
+        "changed": sorted(changed),
+    }
+
+
+def print_comparison(base, other, top=20, depth=3):
+    diff = compare(base, other, depth)
+    print(f"\n⚖️  {Path(base['source']).name} → {Path(other['source']).name}: {diff['size_delta']:+,} bytes")
+    for label, report in (("base", base), ("other", other)):
+        totals = report["totals"]
+        print(f"   {label:<5} {_mb(totals['uncompressed'])} content, {_mb(totals['compressed'])} data, "
+              f"ratio {_ratio(totals['uncompressed'], totals['compressed'])}, "
+              f"{sum(d['wasted_compressed'] for d in report['duplicates']) / 1e6:,.1f} MB duplicated")
+    print("\n📂 Largest directory deltas:")
+    for path, delta, a, b in diff["directories"][:top]:
+        print(f"   {delta / 1e6:+12,.1f} MB  ({_mb(a)} → {_mb(b)})  /{path}")
+    print("\n🗂️ File type deltas:")
+    for name, delta in diff["types"][:top]:
+        print(f"   {delta / 1e6:+12,.1f} MB  {name}")
+    print(f"\n📄 Files: +{len(diff['added']):,} added, -{len(diff['removed']):,} removed, "
+          f"~{len(diff['changed']):,} resized")
+    for path in diff["added"][:top]:
+        print(f"   + /{path}")
+    for path in diff["removed"][:top]:
+        print(f"   - /{path}")
+    return diff
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if not args:
+        print("Usage: squashfs_space_analyzer.py <image.squashfs|tree> [other.squashfs|tree] [--top=N] [--no-cache]")
+        return 1
+    top = next((int(arg.split("=", 1)[1]) for arg in sys.argv[1:] if arg.startswith("--top=")), 20)
+    use_cache = "--no-cache" not in sys.argv
+    reports = [analyze(source, use_cache=use_cache) for source in args[:2]]
+    if len(reports) == 1:
+        print_report(reports[0], top)
+    else:
+        print_comparison(reports[0], reports[1], top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
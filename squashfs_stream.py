@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+SQUASHFS STREAMING REPACK v1.0
+Rebuilds a squashfs image without an extracted tree on disk.
+
+The source image is read entry by entry (squashfs_reader), additions,
+replacements and deletions are applied on the fly, and the result is fed as
+a PAX tar stream into sqfstar (or mksquashfs -tar).  Ownership, device nodes,
+hard links and xattrs travel inside the tar headers, so nothing root-owned is
+ever written to the work directory and no sudo is needed.
+"""
+
+import io
+import re
+import sys
+import stat
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+from squashfs_reader import SquashfsImage, SquashfsError, decode_device
+
+VERSION = "1.0"
+
+TAR_TYPES = {
+    stat.S_IFDIR: tarfile.DIRTYPE, stat.S_IFREG: tarfile.REGTYPE, stat.S_IFLNK: tarfile.SYMTYPE,
+    stat.S_IFBLK: tarfile.BLKTYPE, stat.S_IFCHR: tarfile.CHRTYPE, stat.S_IFIFO: tarfile.FIFOTYPE,
+}
+
+
+def normalize(path):
+    """Image paths are relative, slash separated, without ./ or trailing /"""
+    return "/".join(part for part in str(path).split("/") if part not in ("", "."))
+
+
+class StreamFile:
+    """A file to add or replace: content from bytes or from a file on disk"""
+
+    def __init__(self, path, content=None, source=None, mode=0o644, uid=0, gid=0, mtime=None):
+        if (content is None) == (source is None):
+            raise ValueError("give exactly one of content or source")
+        self.path = normalize(path)
+        self.content = content.encode() if isinstance(content, str) else content
+        self.source = Path(source) if source is not None else None
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.mtime = int(time.time()) if mtime is None else mtime
+
+    @property
+    def size(self):
+        return len(self.content) if self.content is not None else self.source.stat().st_size
+
+    def open(self):
+        return io.BytesIO(self.content) if self.content is not None else open(self.source, "rb")
+
+
+class SquashfsEdits:
+    """Additions, replacements and deletions applied while streaming an image"""
+
+    def __init__(self):
+        self.files = {}
+        self.directories = {}
+        self.deletions = set()
+
+    def add_file(self, path, content=None, source=None, mode=0o644, uid=0, gid=0, mtime=None):
+        entry = StreamFile(path, content, source, mode, uid, gid, mtime)
+        self.files[entry.path] = entry
+        self.deletions.discard(entry.path)
+        return entry
+
+    def add_directory(self, path, mode=0o755, uid=0, gid=0, mtime=None):
+        self.directories[normalize(path)] = (mode, uid, gid, int(time.time()) if mtime is None else mtime)
+
+    def add_tree(self, local_dir, prefix=""):
+        """Add every file below a local overlay directory (owned by root)"""
+        local_dir = Path(local_dir)
+        for path in sorted(local_dir.rglob("*")):
+            target = normalize(f"{prefix}/{path.relative_to(local_dir).as_posix()}")
+            st = path.lstat()
+            if path.is_dir() and not path.is_symlink():
+                self.add_directory(target, stat.S_IMODE(st.st_mode), mtime=int(st.st_mtime))
+            elif path.is_file() and not path.is_symlink():
+                self.add_file(target, source=path, mode=stat.S_IMODE(st.st_mode), mtime=int(st.st_mtime))
+
+    def delete(self, path):
+        """Delete a path (and everything below it when it is a directory)"""
+        path = normalize(path)
+        self.deletions.add(path)
+        self.files.pop(path, None)
+
+    def is_deleted(self, path):
+        parts = path.split("/")
+        return any("/".join(parts[:i]) in self.deletions for i in range(1, len(parts) + 1))
+
+    def __len__(self):
+        return len(self.files) + len(self.directories) + len(self.deletions)
+
+
+class _InodeStream(io.RawIOBase):
+    """File-like view over a squashfs file's blocks for tarfile.addfile"""
+
+    def __init__(self, image, inode):
+        self._blocks = image.iter_file(inode)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            block = next(self._blocks, None)
+            if block is None:
+                break
+            self._buffer += block
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class SquashfsTarStream:
+    """Turns a squashfs image plus edits into a PAX tar stream"""
+
+    def __init__(self, image_path, edits=None, log=None, order=None):
+        self.image_path = Path(image_path)
+        self.edits = edits or SquashfsEdits()
+        self.order = order
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.stats = {"entries": 0, "bytes": 0, "added": 0, "replaced": 0, "deleted": 0}
+        self.root_attributes = None
+
+    def _tarinfo(self, image, entry):
+        inode = entry.inode
+        info = tarfile.TarInfo(entry.path)
+        info.type = TAR_TYPES.get(stat.S_IFMT(inode.mode), tarfile.REGTYPE)
+        info.mode = inode.permissions
+        info.uid, info.gid = inode.uid, inode.gid
+        info.uname = info.gname = ""
+        info.mtime = inode.mtime
+        if inode.is_file:
+            info.size = inode.file_size
+        elif inode.is_symlink:
+            info.linkname = inode.symlink_target
+        elif info.type in (tarfile.BLKTYPE, tarfile.CHRTYPE):
+            info.devmajor, info.devminor = decode_device(inode.rdev)
+        xattrs = image.read_xattrs(inode.xattr_index)
+        if xattrs:
+            info.pax_headers = {f"SCHILY.xattr.{name}": value.decode("utf-8", "surrogateescape")
+                                for name, value in xattrs.items()}
+        return info
+
+    def _add_stream_file(self, tar, stream_file):
+        info = tarfile.TarInfo(stream_file.path)
+        info.size = stream_file.size
+        info.mode = stream_file.mode
+        info.uid, info.gid = stream_file.uid, stream_file.gid
+        info.uname = info.gname = ""
+        info.mtime = stream_file.mtime
+        with stream_file.open() as handle:
+            tar.addfile(info, handle)
+        self.stats["bytes"] += info.size
+        self.stats["entries"] += 1
+
+    def entries(self, image):
+        """Source entries with deletions applied.
+
+        With an `order` (e.g. a boot trace) all directories come first, then
+        the listed paths in that order, then everything else, so the writer
+        stores the listed files' data together at the front of the image.
+        """
+        rank = {path: index for index, path in enumerate(self.order or ())}
+        ranked = []
+        rest = []
+        for entry in image.entries(include_root=False):
+            if self.edits.is_deleted(entry.path):
+                self.stats["deleted"] += 1
+                continue
+            if not rank or entry.inode.is_dir:
+                yield entry
+            elif entry.path in rank:
+                ranked.append(entry)
+            else:
+                rest.append(entry)
+        ranked.sort(key=lambda entry: rank[entry.path])
+        yield from ranked
+        yield from rest
+
+    def write(self, fileobj):
+        """Write the whole tar stream to a binary file object (pipe, file, socket)"""
+        pending = dict(self.edits.files)
+        pending_dirs = dict(self.edits.directories)
+        hardlinks = {}
+        directories = {""}
+        with SquashfsImage(self.image_path) as image:
+            root = image.root.inode
+            self.root_attributes = (root.permissions, root.uid, root.gid, root.mtime)
+            with tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT,
+                              encoding="utf-8", errors="surrogateescape") as tar:
+                for entry in self.entries(image):
+                    if entry.path in pending:
+                        if entry.inode.is_dir:
+                            raise SquashfsError(f"Cannot replace directory {entry.path} with a file")
+                        self._add_stream_file(tar, pending.pop(entry.path))
+                        self.stats["replaced"] += 1
+                        continue
+                    info = self._tarinfo(image, entry)
+                    if entry.path in pending_dirs and entry.inode.is_dir:
+                        info.mode, info.uid, info.gid, info.mtime = pending_dirs.pop(entry.path)
+                    inode = entry.inode
+                    if inode.is_dir:
+                        directories.add(entry.path)
+                    if inode.is_file and inode.nlink > 1:
+                        first = hardlinks.setdefault(inode.inode_number, entry.path)
+                        if first != entry.path:
+                            info.type, info.linkname, info.size = tarfile.LNKTYPE, first, 0
+                    if info.type == tarfile.REGTYPE:
+                        tar.addfile(info, _InodeStream(image, inode))
+                        self.stats["bytes"] += info.size
+                    else:
+                        tar.addfile(info)
+                    self.stats["entries"] += 1
+                # Additions that did not replace anything go last, parents first
+                for path in sorted(pending):
+                    parts = path.split("/")
+                    for depth in range(1, len(parts)):
+                        parent = "/".join(parts[:depth])
+                        if parent not in directories and parent not in pending_dirs:
+                            pending_dirs[parent] = (0o755, 0, 0, pending[path].mtime)
+                for path, (mode, uid, gid, mtime) in sorted(pending_dirs.items()):
+                    info = tarfile.TarInfo(path)
+                    info.type, info.mode, info.uid, info.gid, info.mtime = tarfile.DIRTYPE, mode, uid, gid, mtime
+                    tar.addfile(info)
+                    directories.add(path)
+                    self.stats["entries"] += 1
+                for path in sorted(pending):
+                    self._add_stream_file(tar, pending[path])
+                    self.stats["added"] += 1
+        return self.stats
+
+
+def tar_writer_command(output, compressor="xz", block_size=1048576, extra_args=(), root_attributes=None):
+    """Command that reads a tar stream on stdin and writes a squashfs image.
+
+    Prefers sqfstar; falls back to mksquashfs -tar (squashfs-tools 4.6+).
+    Returns None when neither is available.
+    """
+    options = ["-comp", compressor, "-b", str(block_size), *extra_args]
+    if root_attributes is not None:
+        mode, uid, gid, mtime = root_attributes
+        options += ["-root-mode", f"{mode:o}", "-root-uid", str(uid), "-root-gid", str(gid),
+                    "-root-time", str(mtime)]
+    if shutil.which("sqfstar"):
+        return ["sqfstar", "-force", *options, str(output)]
+    if shutil.which("mksquashfs"):
+        help_text = subprocess.run(["mksquashfs", "-help"], capture_output=True, text=True)
+        if re.search(r"^\s*-tar\b", help_text.stdout + help_text.stderr, re.MULTILINE):
+            return ["mksquashfs", "-", str(output), "-tar", "-noappend", "-no-recovery", *options]
+    return None
+
+
+def stream_repack(source, output, edits=None, compressor="xz", block_size=1048576, extra_args=(), log=None,
+                  order=None):
+    """Repack `source` into `output` through a tar pipe; returns stats or None"""
+    log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+    stream = SquashfsTarStream(source, edits, log, order)
+    with SquashfsImage(source) as image:
+        root = image.root.inode
+        root_attributes = (root.permissions, root.uid, root.gid, root.mtime)
+    command = tar_writer_command(output, compressor, block_size, extra_args, root_attributes)
+    if command is None:
+        log("Neither sqfstar nor a tar-capable mksquashfs (4.6+) found", "❌")
+        return None
+
+    log(f"Streaming {Path(source).name} -> {command[0]} ({len(stream.edits)} edits)", "🌊")
+    started = time.time()
+    # stderr goes to a file: a full stderr pipe would stall the writer while we block on stdin
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors)
+        try:
+            stream.write(process.stdin)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+        if process.wait() != 0:
+            errors.seek(0)
+            log(f"{command[0]} failed: {errors.read().decode(errors='replace').strip()}", "❌")
+            return None
+    stats = stream.stats
+    stats["seconds"] = time.time() - started
+    log(f"Streamed {stats['entries']:,} entries, {stats['bytes']:,} bytes "
+        f"(+{stats['added']} ~{stats['replaced']} -{stats['deleted']}) in {stats['seconds']:.1f}s", "✅")
+    return stats
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: squashfs_stream.py <source.squashfs> <output.squashfs|-> [overlay_dir] [compressor]")
+        print("       output '-' writes the tar stream to stdout")
+        return 1
+    edits = SquashfsEdits()
+    if len(sys.argv) > 3:
+        edits.add_tree(sys.argv[3])
+    if sys.argv[2] == "-":
+        SquashfsTarStream(sys.argv[1], edits, log=lambda m, e="": None).write(sys.stdout.buffer)
+        return 0
+    compressor = sys.argv[4] if len(sys.argv) > 4 else "xz"
+    return 0 if stream_repack(sys.argv[1], sys.argv[2], edits, compressor) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+SQUASHFS WRITER v1.0
+Pure-Python squashfs 4.0 writer that can copy already-compressed data
+blocks and fragments straight from a base image.
+
+New or changed file content is compressed (in parallel threads); unchanged
+content is copied byte for byte, so writing cost follows the size of the
+change instead of the size of the image.
+"""
+
+import os
+import lzma
+import stat
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from squashfs_reader import (
+    SQUASHFS_MAGIC, SUPERBLOCK_FORMAT, SUPERBLOCK_SIZE, METADATA_SIZE, INVALID_TABLE,
+    NO_FRAGMENT, NO_XATTR, BLOCK_UNCOMPRESSED, BLOCK_SIZE_MASK, COMPRESSORS,
+    DIR_TYPE, FILE_TYPE, SYMLINK_TYPE, BLKDEV_TYPE, CHRDEV_TYPE, FIFO_TYPE, SOCKET_TYPE,
+    LDIR_TYPE, LREG_TYPE, XATTR_PREFIXES, SquashfsError,
+)
+
+COMPRESSION_IDS = {name: number for number, name in COMPRESSORS.items()}
+
+BASIC_TYPES = {
+    stat.S_IFDIR: DIR_TYPE, stat.S_IFREG: FILE_TYPE, stat.S_IFLNK: SYMLINK_TYPE,
+    stat.S_IFBLK: BLKDEV_TYPE, stat.S_IFCHR: CHRDEV_TYPE, stat.S_IFIFO: FIFO_TYPE,
+    stat.S_IFSOCK: SOCKET_TYPE,
+}
+
+XATTR_TYPES = {prefix: number for number, prefix in XATTR_PREFIXES.items()}
+
+
+def get_compressor(name, block_size, xz_bcj=None):
+    """Return a bytes -> bytes compressor matching mksquashfs defaults"""
+    if name == "gzip":
+        return lambda data: zlib.compress(data, 9)
+    if name == "xz":
+        lzma2 = {"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": max(block_size, 8192)}
+        chains = [[lzma2]]
+        if xz_bcj == "x86":
+            chains.append([{"id": lzma.FILTER_X86}, lzma2])
+
+        def compress_xz(data):
+            # Like mksquashfs -Xbcj: try each filter chain and keep the smallest
+            results = [lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC32, filters=chain)
+                       for chain in chains]
+            return min(results, key=len)
+        return compress_xz
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise SquashfsError("zstd output needs the 'zstandard' package (pip install zstandard)")
+        return lambda data: zstandard.ZstdCompressor(level=15).compress(data)
+    if name == "lzo":
+        try:
+            import lzo
+        except ImportError:
+            raise SquashfsError("lzo output needs the 'python-lzo' package (pip install python-lzo)")
+        return lambda data: lzo.compress(data, 9, False)
+    if name == "lz4":
+        try:
+            import lz4.block
+        except ImportError:
+            raise SquashfsError("lz4 output needs the 'lz4' package (pip install lz4)")
+        return lambda data: lz4.block.compress(data, store_size=False)
+    raise SquashfsError(f"Unsupported squashfs compressor: {name}")
+
+
+class WriterNode:
+    """One filesystem object to be written.
+
+    Regular file content comes from exactly one of:
+      source_path  - file on disk to read and compress
+      data         - bytes in memory to compress
+      reuse        - (base image, base inode) whose compressed blocks are copied
+                     (recompressed instead when codec or block size differ)
+    """
+
+    def __init__(self, name, mode, uid=0, gid=0, mtime=0):
+        self.name = name
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.children = {}
+        self.source_path = None
+        self.data = None
+        self.reuse = None
+        self.file_size = 0
+        self.symlink_target = ""
+        self.rdev = 0
+        self.xattrs = {}
+        self.link_key = None
+        # Filled in while writing
+        self.inode_number = 0
+        self.inode_ref = None
+        self.blocks_start = 0
+        self.block_sizes = []
+        self.fragment_index = NO_FRAGMENT
+        self.fragment_offset = 0
+        self.listing = None
+
+    @property
+    def basic_type(self):
+        return BASIC_TYPES[stat.S_IFMT(self.mode)]
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self):
+        return stat.S_ISREG(self.mode)
+
+    def add(self, child):
+        self.children[child.name] = child
+        return child
+
+
+class _MetadataWriter:
+    """Accumulates a metadata stream and hands out (block << 16 | offset) refs"""
+
+    def __init__(self, compress):
+        self.compress = compress
+        self.flushed = bytearray()
+        self.pending = bytearray()
+
+    def ref(self):
+        return (len(self.flushed) << 16) | len(self.pending)
+
+    def position(self):
+        """(compressed block start, offset) of the next byte to be written"""
+        return len(self.flushed), len(self.pending)
+
+    def write(self, data):
+        self.pending += data
+        while len(self.pending) >= METADATA_SIZE:
+            self._flush_block(bytes(self.pending[:METADATA_SIZE]))
+            del self.pending[:METADATA_SIZE]
+
+    def _flush_block(self, block):
+        compressed = self.compress(block)
+        if len(compressed) < len(block):
+            self.flushed += struct.pack("<H", len(compressed)) + compressed
+        else:
+            self.flushed += struct.pack("<H", len(block) | 0x8000) + block
+
+    def finish(self):
+        if self.pending:
+            self._flush_block(bytes(self.pending))
+            self.pending = bytearray()
+        return bytes(self.flushed)
+
+
+class SquashfsWriter:
+    """Writes a WriterNode tree to a squashfs 4.0 image"""
+
+    def __init__(self, output, compressor="xz", block_size=1048576, xz_bcj=None,
+                 mkfs_time=None, workers=None, log=None):
+        if block_size & (block_size - 1) or not 4096 <= block_size <= 1048576:
+            raise SquashfsError("block size must be a power of two between 4 KiB and 1 MiB")
+        self.output = output
+        self.compressor = compressor
+        self.block_size = block_size
+        self.block_log = block_size.bit_length() - 1
+        self.compress = get_compressor(compressor, block_size, xz_bcj)
+        self.mkfs_time = int(time.time()) if mkfs_time is None else mkfs_time
+        self.workers = workers or os.cpu_count() or 1
+        self.log = log or (lambda message, emoji="📝": None)
+        self.stats = {"reused_bytes": 0, "compressed_bytes": 0, "reused_files": 0, "compressed_files": 0}
+
+    # ------------------------------------------------------------------
+    # Data section
+    # ------------------------------------------------------------------
+
+    def _compress_block(self, block):
+        if not block.strip(b"\0"):
+            return None  # sparse block
+        compressed = self.compress(block)
+        if len(compressed) < len(block):
+            return compressed, len(compressed)
+        return block, len(block) | BLOCK_UNCOMPRESSED
+
+    def can_copy_from(self, image):
+        """Compressed blocks can only be copied between matching codecs and block sizes"""
+        return image.compressor == self.compressor and image.block_size == self.block_size
+
+    def _read_blocks(self, node):
+        if node.reuse is not None:
+            # Base content that cannot be copied as-is: re-chunk to our block size
+            image, inode = node.reuse
+            buffer = b""
+            for data in image.iter_file(inode):
+                buffer += data
+                while len(buffer) >= self.block_size:
+                    yield buffer[:self.block_size]
+                    buffer = buffer[self.block_size:]
+            if buffer:
+                yield buffer
+            return
+        if node.data is not None:
+            data = node.data
+            for offset in range(0, len(data), self.block_size):
+                yield data[offset:offset + self.block_size]
+            return
+        with open(node.source_path, "rb") as handle:
+            while True:
+                block = handle.read(self.block_size)
+                if not block:
+                    break
+                yield block
+
+    def _write_new_file(self, out, node, pool):
+        node.blocks_start = out.tell()
+        node.block_sizes = []
+        size = 0
+        batch = []
+        tail = b""
+        for block in self._read_blocks(node):
+            size += len(block)
+            if len(block) < self.block_size:
+                tail = block
+                continue
+            batch.append(block)
+            if len(batch) >= self.workers * 4:
+                self._write_blocks(out, node, pool, batch)
+                batch = []
+        self._write_blocks(out, node, pool, batch)
+        node.file_size = size
+        if tail:
+            node.fragment_index, node.fragment_offset = self._add_fragment(out, tail)
+        self.stats["compressed_bytes"] += size
+        self.stats["compressed_files"] += 1
+
+    def _write_blocks(self, out, node, pool, blocks):
+        for result in pool.map(self._compress_block, blocks):
+            if result is None:
+                node.block_sizes.append(0)
+                continue
+            payload, size_word = result
+            out.write(payload)
+            node.block_sizes.append(size_word)
+
+    def _copy_reused_file(self, out, node):
+        image, inode = node.reuse
+        node.file_size = inode.file_size
+        node.blocks_start = out.tell()
+        node.block_sizes = list(inode.block_sizes)
+        length = inode.compressed_size
+        position = inode.blocks_start
+        while length:
+            chunk = image.pread(position, min(length, 8 << 20))
+            out.write(chunk)
+            position += len(chunk)
+            length -= len(chunk)
+        if inode.has_fragment:
+            key = (id(image), inode.fragment_index)
+            if key not in self._copied_fragments:
+                start, size_word = image.fragments[inode.fragment_index]
+                self._flush_fragment(out)
+                new_start = out.tell()
+                out.write(image.pread(start, size_word & BLOCK_SIZE_MASK))
+                self._fragment_table.append((new_start, size_word))
+                self._copied_fragments[key] = len(self._fragment_table) - 1
+            node.fragment_index = self._copied_fragments[key]
+            node.fragment_offset = inode.fragment_offset
+        self.stats["reused_bytes"] += inode.file_size
+        self.stats["reused_files"] += 1
+
+    def _add_fragment(self, out, tail):
+        if len(self._fragment_buffer) + len(tail) > self.block_size:
+            self._flush_fragment(out)
+        offset = len(self._fragment_buffer)
+        self._fragment_buffer += tail
+        return len(self._fragment_table), offset
+
+    def _flush_fragment(self, out):
+        if not self._fragment_buffer:
+            return
+        result = self._compress_block(bytes(self._fragment_buffer))
+        if result is None:
+            payload, size_word = bytes(self._fragment_buffer), len(self._fragment_buffer) | BLOCK_UNCOMPRESSED
+        else:
+            payload, size_word = result
+        self._fragment_table.append((out.tell(), size_word))
+        out.write(payload)
+        self._fragment_buffer = bytearray()
+
+    # ------------------------------------------------------------------
+    # Metadata section
+    # ------------------------------------------------------------------
+
+    def _id_index(self, value):
+        if value not in self._id_map:
+            self._id_map[value] = len(self._ids)
+            self._ids.append(value)
+        return self._id_map[value]
+
+    def _xattr_index(self, xattrs):
+        if not xattrs:
+            return NO_XATTR
+        key = tuple(sorted(xattrs.items()))
+        if key in self._xattr_map:
+            return self._xattr_map[key]
+        ref = self._xattr_kv.ref()
+        size = 0
+        for name, value in key:
+            for prefix, type_id in XATTR_TYPES.items():
+                if name.startswith(prefix):
+                    short = name[len(prefix):].encode("utf-8", "surrogateescape")
+                    break
+            else:
+                raise SquashfsError(f"Unsupported xattr namespace: {name}")
+            entry = struct.pack("<HH", type_id, len(short)) + short + struct.pack("<I", len(value)) + value
+            self._xattr_kv.write(entry)
+            size += len(entry)
+        self._xattr_ids.append((ref, len(key), size))
+        self._xattr_map[key] = len(self._xattr_ids) - 1
+        return self._xattr_map[key]
+
+    def _inode_header(self, node, inode_type):
+        return struct.pack("<HHHHII", inode_type, stat.S_IMODE(node.mode), self._id_index(node.uid),
+                           self._id_index(node.gid), node.mtime & 0xFFFFFFFF, node.inode_number)
+
+    def _write_inode(self, node, nlink, parent_number=0):
+        if node.link_key is not None and node.link_key in self._link_refs:
+            node.inode_ref = self._link_refs[node.link_key]  # hard link already written
+            return node.inode_ref
+        node.inode_ref = self._inodes.ref()
+        if node.link_key is not None:
+            self._link_refs[node.link_key] = node.inode_ref
+        xattr = self._xattr_index(node.xattrs)
+        basic = node.basic_type
+        if basic == DIR_TYPE:
+            listing_block, listing_offset, listing_size = node.listing
+            if listing_size + 3 < 0x10000 and xattr == NO_XATTR:
+                body = self._inode_header(node, DIR_TYPE) + struct.pack(
+                    "<IIHHI", listing_block, nlink, listing_size + 3, listing_offset, parent_number)
+            else:
+                body = self._inode_header(node, LDIR_TYPE) + struct.pack(
+                    "<IIIIHHI", nlink, listing_size + 3, listing_block, parent_number, 0, listing_offset, xattr)
+        elif basic == FILE_TYPE:
+            sizes = struct.pack(f"<{len(node.block_sizes)}I", *node.block_sizes)
+            if node.blocks_start < 1 << 32 and node.file_size < 1 << 32 and nlink == 1 and xattr == NO_XATTR:
+                body = self._inode_header(node, FILE_TYPE) + struct.pack(
+                    "<IIII", node.blocks_start, node.fragment_index, node.fragment_offset, node.file_size) + sizes
+            else:
+                body = self._inode_header(node, LREG_TYPE) + struct.pack(
+                    "<QQQIIII", node.blocks_start, node.file_size, 0, nlink, node.fragment_index,
+                    node.fragment_offset, xattr) + sizes
+        elif basic == SYMLINK_TYPE:
+            target = node.symlink_target.encode("utf-8", "surrogateescape")
+            inode_type = SYMLINK_TYPE if xattr == NO_XATTR else SYMLINK_TYPE + 7
+            body = self._inode_header(node, inode_type) + struct.pack("<II", nlink, len(target)) + target
+            if xattr != NO_XATTR:
+                body += struct.pack("<I", xattr)
+        elif basic in (BLKDEV_TYPE, CHRDEV_TYPE):
+            if xattr == NO_XATTR:
+                body = self._inode_header(node, basic) + struct.pack("<II", nlink, node.rdev)
+            else:
+                body = self._inode_header(node, basic + 7) + struct.pack("<III", nlink, node.rdev, xattr)
+        else:
+            if xattr == NO_XATTR:
+                body = self._inode_header(node, basic) + struct.pack("<I", nlink)
+            else:
+                body = self._inode_header(node, basic + 7) + struct.pack("<II", nlink, xattr)
+        self._inodes.write(body)
+        return node.inode_ref
+
+    def _write_directory(self, node, parent_number):
+        """Post-order: children inodes, then this listing, then this inode"""
+        children = sorted(node.children.values(), key=lambda child: child.name.encode("utf-8", "surrogateescape"))
+        for child in children:
+            if child.is_dir:
+                self._write_directory(child, node.inode_number)
+            else:
+                self._write_inode(child, self._link_counts.get(child.link_key, 1))
+
+        listing_block, listing_offset = self._dirs.position()
+        listing = bytearray()
+        index = 0
+        while index < len(children):
+            start_block = children[index].inode_ref >> 16
+            base = children[index].inode_number
+            run = []
+            while (index < len(children) and len(run) < 256
+                   and children[index].inode_ref >> 16 == start_block
+                   and -32768 <= children[index].inode_number - base <= 32767):
+                run.append(children[index])
+                index += 1
+            listing += struct.pack("<III", len(run) - 1, start_block, base)
+            for child in run:
+                name = child.name.encode("utf-8", "surrogateescape")
+                listing += struct.pack("<HhHH", child.inode_ref & 0xFFFF, child.inode_number - base,
+                                       child.basic_type, len(name) - 1) + name
+        self._dirs.write(bytes(listing))
+        node.listing = (listing_block, listing_offset, len(listing))
+        subdirs = sum(1 for child in children if child.is_dir)
+        return self._write_inode(node, 2 + subdirs, parent_number)
+
+    def _write_lookup_table(self, out, entries):
+        """Write fixed-size entries as metadata blocks followed by their u64 index"""
+        blocks = []
+        for offset in range(0, len(entries), METADATA_SIZE):
+            blocks.append(out.tell())
+            writer = _MetadataWriter(self.compress)
+            writer.write(entries[offset:offset + METADATA_SIZE])
+            out.write(writer.finish())
+        table_start = out.tell()
+        out.write(struct.pack(f"<{len(blocks)}Q", *blocks))
+        return table_start
+
+    # ------------------------------------------------------------------
+    # Driver
+    # ------------------------------------------------------------------
+
+    def _assign_inode_numbers(self, root, order):
+        """Number every inode once; hard links share their first node's number"""
+        number = 1
+        seen = {}
+        for node in order:
+            if node.link_key is not None and node.link_key in seen:
+                node.inode_number = seen[node.link_key].inode_number
+                continue
+            node.inode_number = number
+            number += 1
+            if node.link_key is not None:
+                seen[node.link_key] = node
+        root.inode_number = number
+        return number
+
+    def write(self, root, data_order=None):
+        """Write the image; data_order optionally lists file nodes in placement order"""
+        self._fragment_table = []
+        self._fragment_buffer = bytearray()
+        self._copied_fragments = {}
+        self._ids, self._id_map = [], {}
+        self._xattr_kv = _MetadataWriter(self.compress)
+        self._xattr_ids, self._xattr_map = [], {}
+        self._inodes = _MetadataWriter(self.compress)
+        self._dirs = _MetadataWriter(self.compress)
+
+        nodes = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for child in sorted(node.children.values(), key=lambda c: c.name, reverse=True):
+                nodes.append(child)
+                if child.is_dir:
+                    stack.append(child)
+        inode_count = self._assign_inode_numbers(root, nodes)
+
+        self._link_counts = {}
+        self._link_refs = {}
+        for node in nodes:
+            if node.link_key is not None:
+                self._link_counts[node.link_key] = self._link_counts.get(node.link_key, 0) + 1
+
+        files = [node for node in nodes if node.is_file]
+        if data_order is not None:
+            ranked = {id(node): rank for rank, node in enumerate(data_order)}
+            files.sort(key=lambda node: ranked.get(id(node), len(ranked)))
+
+        with open(self.output, "wb") as out:
+            out.write(bytes(SUPERBLOCK_SIZE))
+            written = {}
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for node in files:
+                    if node.link_key is not None and node.link_key in written:
+                        source = written[node.link_key]
+                        node.file_size, node.blocks_start = source.file_size, source.blocks_start
+                        node.block_sizes = source.block_sizes
+                        node.fragment_index, node.fragment_offset = source.fragment_index, source.fragment_offset
+                        continue
+                    if node.reuse is not None and self.can_copy_from(node.reuse[0]):
+                        self._copy_reused_file(out, node)
+                    else:
+                        self._write_new_file(out, node, pool)
+                    if node.link_key is not None:
+                        written[node.link_key] = node
+            self._flush_fragment(out)
+
+            root_ref = self._write_directory(root, inode_count + 1)
+
+            inode_table_start = out.tell()
+            out.write(self._inodes.finish())
+            directory_table_start = out.tell()
+            out.write(self._dirs.finish())
+
+            fragment_table_start = INVALID_TABLE
+            if self._fragment_table:
+                entries = b"".join(struct.pack("<QII", start, size_word, 0)
+                                   for start, size_word in self._fragment_table)
+                fragment_table_start = self._write_lookup_table(out, entries)
+
+            id_table_start = self._write_lookup_table(
+                out, struct.pack(f"<{len(self._ids)}I", *self._ids))
+
+            xattr_id_table_start = INVALID_TABLE
+            if self._xattr_ids:
+                xattr_table_start = out.tell()
+                out.write(self._xattr_kv.finish())
+                entries = b"".join(struct.pack("<QII", *entry) for entry in self._xattr_ids)
+                blocks = []
+                for offset in range(0, len(entries), METADATA_SIZE):
+                    blocks.append(out.tell())
+                    writer = _MetadataWriter(self.compress)
+                    writer.write(entries[offset:offset + METADATA_SIZE])
+                    out.write(writer.finish())
+                xattr_id_table_start = out.tell()
+                out.write(struct.pack("<QII", xattr_table_start, len(self._xattr_ids), 0))
+                out.write(struct.pack(f"<{len(blocks)}Q", *blocks))
+
+            bytes_used = out.tell()
+            padding = -bytes_used % 4096
+            out.write(bytes(padding))
+
+            out.seek(0)
+            out.write(struct.pack(
+                SUPERBLOCK_FORMAT, SQUASHFS_MAGIC, inode_count, self.mkfs_time, self.block_size,
+                len(self._fragment_table), COMPRESSION_IDS[self.compressor], self.block_log,
+                0, len(self._ids), 4, 0, root_ref, bytes_used, id_table_start,
+                xattr_id_table_start, inode_table_start, directory_table_start,
+                fragment_table_start, INVALID_TABLE))
+        return bytes_used
+
+
+def node_from_stat(name, path, st):
+    """Build a WriterNode for an on-disk path from its lstat result"""
+    node = WriterNode(name, st.st_mode, st.st_uid, st.st_gid, int(st.st_mtime))
+    kind = stat.S_IFMT(st.st_mode)
+    if kind == stat.S_IFREG:
+        node.source_path = path
+        node.file_size = st.st_size
+        if st.st_nlink > 1:
+            node.link_key = (st.st_dev, st.st_ino)
+    elif kind == stat.S_IFLNK:
+        node.symlink_target = os.readlink(path)
+    elif kind in (stat.S_IFBLK, stat.S_IFCHR):
+        from squashfs_reader import encode_device
+        node.rdev = encode_device(os.major(st.st_rdev), os.minor(st.st_rdev))
+    return node
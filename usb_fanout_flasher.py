@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+USB FANOUT FLASHER v1.0
+Writes one built ISO to many USB sticks at once, reading the image once.
+
+A reader thread fills a shared window of fixed-size chunks and hashes each
+chunk as it goes.  Every target has its own writer thread (output_sinks:
+O_DIRECT on block devices, plain files otherwise) that takes chunks from
+the window at its own pace.  The reader only runs ahead of the fastest
+target, so a slow stick never holds the others back: when it falls out of
+the window it re-reads its chunks from the image with pread (usually from
+the page cache) instead.  A failing target is dropped without stopping the
+rest.
+
+Afterwards each target is read back and compared with the image's chunk
+hashes, and throughput, fallback reads and the verify result are reported
+per device.  Targets can be block devices, loop devices or plain (sparse)
+files, so the whole flow can be tried locally.
+"""
+
+import os
+import sys
+import glob
+import stat
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+from output_sinks import VERIFY_CHUNK, BlockDeviceSink, FileSink, SinkError
+
+VERSION = "1.0"
+
+DEFAULT_DEPTH = 16
+PROGRESS_INTERVAL = 5.0
+
+
+class FlashTarget:
+    """One device (or file) being flashed, with its own progress and result"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.sink = None
+        self.next_chunk = 0
+        self.fallback_reads = 0
+        self.write_seconds = 0.0
+        self.verify_seconds = 0.0
+        self.verified = None
+        self.error = None
+        self.done = False
+
+    @property
+    def active(self):
+        return not self.done and self.error is None
+
+    @property
+    def written(self):
+        return self.sink.position if self.sink else 0
+
+    def describe(self):
+        if self.error is not None:
+            return f"{self.path}: FAILED after {self.written:,} bytes - {self.error}"
+        rate = self.written / self.write_seconds / 1e6 if self.write_seconds else 0.0
+        check = {True: "verified", False: "VERIFY FAILED", None: "not verified"}[self.verified]
+        return (f"{self.path}: {self.written:,} bytes in {self.write_seconds:.1f}s ({rate:.1f} MB/s), "
+                f"{self.fallback_reads} chunks re-read, {check}"
+                f"{f' in {self.verify_seconds:.1f}s' if self.verified is not None else ''}")
+
+
+class FanoutFlasher:
+    """Image -> many targets through one shared read window"""
+
+    def __init__(self, image, targets, depth=DEFAULT_DEPTH, chunk_size=VERIFY_CHUNK, verify=True, direct=True,
+                 log=None):
+        self.image = Path(image)
+        self.depth = max(2, depth)
+        self.chunk_size = chunk_size
+        self.verify = verify
+        self.direct = direct
+        self.log = log or (lambda message, emoji="📝": print(f"{emoji} {message}"))
+        self.targets = self._unique(targets)
+        self.size = self.image.stat().st_size
+        self.hashes = []
+        self._window = {}
+        self._produced = 0
+        self._eof = False
+        self._cond = threading.Condition()
+        self._fd = None
+
+    # ------------------------------------------------------------------
+    # Targets
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _identity(path):
+        """What a path really writes to: the device number, the file's inode, or its resolved path"""
+        try:
+            info = os.stat(path)
+        except OSError:
+            return ("path", os.path.realpath(path))
+        if stat.S_ISBLK(info.st_mode):
+            return ("device", info.st_rdev)
+        return ("file", info.st_dev, info.st_ino)
+
+    def _unique(self, paths):
+        """One FlashTarget per device: /dev/sdX and its /dev/disk/by-id link are the same stick"""
+        targets, seen = [], {}
+        for path in map(str, paths):
+            identity = self._identity(path)
+            if identity in seen:
+                self.log(f"{path}: same target as {seen[identity]}, skipped", "⚠️")
+                continue
+            seen[identity] = path
+            targets.append(FlashTarget(path))
+        return targets
+
+    def _same_as_image(self, path):
+        image, target = os.stat(self.image), os.stat(path)
+        if stat.S_ISBLK(target.st_mode):
+            return image.st_dev == target.st_rdev
+        return (image.st_dev, image.st_ino) == (target.st_dev, target.st_ino)
+
+    def _open(self, target):
+        if os.path.exists(target.path) and self._same_as_image(target.path):
+            raise SinkError("this is the image being flashed")
+        if os.path.exists(target.path) and stat.S_ISBLK(os.stat(target.path).st_mode):
+            sink = BlockDeviceSink(target.path, direct=self.direct, buffer_size=self.chunk_size,
+                                   chunk_size=self.chunk_size, hash_chunks=False, log=self.log)
+            if sink.capacity < self.size:
+                sink.close()
+                raise SinkError(f"holds {sink.capacity:,} bytes, the image needs {self.size:,}")
+            return sink
+        return FileSink(target.path, chunk_size=self.chunk_size, hash_chunks=False, log=self.log)
+
+    # ------------------------------------------------------------------
+    # Shared read window
+    # ------------------------------------------------------------------
+
+    def _lead(self):
+        """Chunk index of the fastest target still writing (None when none is)"""
+        positions = [target.next_chunk for target in self.targets if target.active]
+        return max(positions) if positions else None
+
+    def _reader(self):
+        with open(self.image, "rb", buffering=0) as handle:
+            os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            index = 0
+            while True:
+                with self._cond:
+                    # Backpressure from the fastest target only; slower ones fall back to pread
+                    while self._lead() is not None and index - self._lead() >= self.depth:
+                        self._cond.wait()
+                    if self._lead() is None:
+                        break
+                data = handle.read(self.chunk_size)
+                if not data:
+                    break
+                self.hashes.append(hashlib.sha256(data).hexdigest())
+                with self._cond:
+                    self._window[index] = data
+                    self._window.pop(index - self.depth, None)
+                    self._produced = index + 1
+                    self._cond.notify_all()
+                index += 1
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    def _chunk(self, target, index):
+        """Chunk `index` from the window, or re-read from the image when it has left it; None at the end"""
+        with self._cond:
+            while index >= self._produced and not self._eof:
+                self._cond.wait()
+            if index >= self._produced:
+                return None
+            data = self._window.get(index)
+        if data is None:
+            data = os.pread(self._fd, self.chunk_size, index * self.chunk_size)
+            target.fallback_reads += 1
+        return data
+
+    def _writer(self, target):
+        started = time.time()
+        try:
+            while True:
+                data = self._chunk(target, target.next_chunk)
+                if data is None:
+                    break
+                target.sink.write(data)
+                with self._cond:
+                    target.next_chunk += 1
+                    self._cond.notify_all()
+            target.sink.close()
+            target.write_seconds = time.time() - started
+            if target.written != self.size:
+                raise SinkError(f"wrote {target.written:,} of {self.size:,} bytes")
+            if self.verify:
+                started = time.time()
+                # All hashes are known once the writer has seen the last chunk
+                target.sink.chunk_hashes = list(self.hashes)
+                target.verified = target.sink.verify()
+                target.verify_seconds = time.time() - started
+        except (OSError, SinkError) as e:
+            target.write_seconds = target.write_seconds or time.time() - started
+            target.error = e
+            self.log(f"{target.path}: {e}", "❌")
+        finally:
+            if not target.sink.closed:
+                # A failed target still releases its fd (and O_DIRECT buffer)
+                try:
+                    target.sink.close()
+                except (OSError, SinkError):
+                    pass
+            with self._cond:
+                target.done = True
+                self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------------
+
+    def _progress(self):
+        writing = [target for target in self.targets if target.active]
+        if not writing:
+            return
+        done = [target.written / self.size for target in writing]
+        self.log(f"{len(writing)} writing: slowest {min(done):.0%}, fastest {max(done):.0%}, "
+                 f"{sum(target.fallback_reads for target in writing)} chunks re-read", "⏳")
+
+    def run(self):
+        """Flash every target; returns the FlashTarget list"""
+        for target in self.targets:
+            try:
+                target.sink = self._open(target)
+            except (OSError, SinkError) as e:
+                target.error = e
+                target.done = True
+                self.log(f"{target.path}: {e}", "❌")
+        usable = [target for target in self.targets if target.sink is not None]
+        self.log(f"Flashing {self.image.name} ({self.size:,} bytes) to {len(usable)} targets, "
+                 f"window {self.depth} x {self.chunk_size >> 20} MiB", "🔌")
+        started = time.time()
+        self._fd = os.open(self.image, os.O_RDONLY)
+        try:
+            threads = [threading.Thread(target=self._reader, name="fanout reader", daemon=True)]
+            threads += [threading.Thread(target=self._writer, args=(target,), name=f"fanout {target.path}",
+                                         daemon=True) for target in usable]
+            for thread in threads:
+                thread.start()
+            last = time.time()
+            with self._cond:
+                while not all(target.done for target in usable):
+                    self._cond.wait(PROGRESS_INTERVAL)
+                    if time.time() - last >= PROGRESS_INTERVAL:
+                        self._progress()
+                        last = time.time()
+            threads[0].join()
+        finally:
+            os.close(self._fd)
+        for target in self.targets:
+            emoji = "✅" if target.error is None and target.verified is not False else "❌"
+            self.log(target.describe(), emoji)
+        good = sum(1 for target in self.targets if target.error is None and target.verified is not False)
+        self.log(f"{good} of {len(self.targets)} targets good in {time.time() - started:.1f}s", "🏁")
+        return self.targets
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: usb_fanout_flasher.py <image.iso> <device|file> [...] [--devices=GLOB] [--depth=N]")
+        print("                             [--no-verify] [--no-direct]")
+        print("       e.g. --devices='/dev/disk/by-id/usb-*-0:0' or plain files for a local trial")
+        return 1
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    targets = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    if "devices" in options:
+        targets += sorted(glob.glob(options["devices"]))
+    if not targets:
+        print("❌ No targets")
+        return 1
+    flasher = FanoutFlasher(sys.argv[1], targets, depth=int(options.get("depth", DEFAULT_DEPTH)),
+                            verify="--no-verify" not in sys.argv, direct="--no-direct" not in sys.argv)
+    results = flasher.run()
+    return 0 if all(target.error is None and target.verified is not False for target in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,12 +20,15 @@ import os
 import sys
 import subprocess
 import shutil
-import tempfile
 import requests
 import time
 from datetime import datetime
 from pathlib import Path
 
+from fat_image import FatImageBuilder
+from build_recipe import BuildRecipe
+from iso_partitions import extract_esp
+
 class WorkingCustomISO:
     def __init__(self):
         self.version = "1.0.0"
@@ -55,7 +58,7 @@ class WorkingCustomISO:
         print("🔍 CHECKING DEPENDENCIES")
         print("-" * 30)
         
-        required_tools = ['xorriso', '7z', 'wget', 'dd', 'mkfs.fat']
+        required_tools = ['xorriso', '7z', 'wget']
         missing_tools = []
         
         for tool in required_tools:
@@ -74,7 +77,7 @@ class WorkingCustomISO:
             print(f"\n🔧 Installing missing tools: {', '.join(missing_tools)}")
             try:
                 subprocess.run(['sudo', 'apt', 'update'], check=True)
-                subprocess.run(['sudo', 'apt', 'install', '-y', 'xorriso', 'p7zip-full', 'wget', 'dosfstools'], check=True)
+                subprocess.run(['sudo', 'apt', 'install', '-y', 'xorriso', 'p7zip-full', 'wget'], check=True)
                 print("✅ Dependencies installed successfully")
             except subprocess.CalledProcessError as e:
                 print(f"❌ Failed to install dependencies: {e}")
@@ -246,45 +249,29 @@ Technical notes:
         extract_dir = self.work_dir / "extracted"
         efi_img = self.work_dir / "efiboot.img"
         
-        # Create 10MB FAT16 EFI boot image (Ubuntu's approach)
-        try:
-            print("📦 Creating 10MB FAT16 EFI boot image...")
-            subprocess.run([
-                'dd', 'if=/dev/zero', f'of={efi_img}', 
-                'bs=1M', 'count=10'
-            ], check=True, capture_output=True)
+        efi_source = extract_dir / "EFI"
+        if not efi_source.exists():
+            print("❌ EFI source directory not found")
+            return False
             
-            print("💾 Formatting as FAT16...")
-            subprocess.run([
-                'mkfs.fat', '-F', '16', '-n', 'EFISYSTEM', str(efi_img)
-            ], check=True, capture_output=True)
+        # The base ISO's own ESP is known good and costs nothing to build
+        try:
+            if extract_esp(self.ubuntu_iso, efi_img):
+                return True
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not reuse the base ISO's ESP: {e}")
             
-            # Mount and populate EFI boot image
-            with tempfile.TemporaryDirectory() as mount_point:
-                print("📁 Mounting EFI image...")
-                subprocess.run([
-                    'sudo', 'mount', '-o', 'loop', str(efi_img), mount_point
-                ], check=True)
-                
-                try:
-                    # Copy EFI directory structure
-                    efi_source = extract_dir / "EFI"
-                    if efi_source.exists():
-                        print("📂 Copying EFI directory structure...")
-                        subprocess.run([
-                            'sudo', 'cp', '-r', str(efi_source), mount_point
-                        ], check=True)
-                        print("✅ EFI boot image created successfully")
-                    else:
-                        print("❌ EFI source directory not found")
-                        return False
-                        
-                finally:
-                    subprocess.run(['sudo', 'umount', mount_point], check=True)
-                    
+        # Otherwise a FAT image sized to the EFI tree, written in-process (no mkfs, mount or sudo)
+        try:
+            print("📦 Creating EFI boot image from EFI/ ...")
+            builder = FatImageBuilder(label="EFISYSTEM")
+            builder.add_tree(efi_source, "EFI", exclude={"efiboot.img"})
+            layout = builder.build_cached(efi_img)
+            print(f"✅ EFI boot image created: FAT{layout['fat_type']}, {layout['bytes']:,} bytes "
+                  f"{'from cache (' + layout['cached'] + ') ' if layout['cached'] else ''}in {layout['seconds'] * 1000:.0f} ms")
             return True
             
-        except subprocess.CalledProcessError as e:
+        except (OSError, ValueError) as e:
             print(f"❌ EFI boot image creation failed: {e}")
             return False
             
@@ -297,37 +284,10 @@ Technical notes:
         output_iso = "custom_ubuntu_working.iso"
         efi_img = self.work_dir / "efiboot.img"
         
-        # Ubuntu's complex xorriso command (from deadclaude7.txt findings)
-        xorriso_cmd = [
-            'xorriso', '-as', 'mkisofs',
-            '-r',
-            '-checksum_algorithm_iso', 'md5,sha1',
-            '-V', 'Custom-Ubuntu-24.04.2-Working',
-            '-o', output_iso,
-            '-J', '-joliet-long',
-            '-cache-inodes',
-            # BIOS boot
-            '-b', 'boot/grub/i386-pc/eltorito.img',
-            '-c', 'boot.catalog',
-            '-no-emul-boot',
-            '-boot-load-size', '4',
-            '-boot-info-table',
-            # EFI boot (key fix from deadclaude7.txt)
-            '-eltorito-alt-boot',
-            '-e', str(efi_img.name) if efi_img.exists() else 'EFI/boot/bootx64.efi',
-            '-no-emul-boot',
-            # Hybrid compatibility (critical for EFI)
-            '-isohybrid-gpt-basdat',
-            '-isohybrid-apm-hfsplus',
-            str(extract_dir)
-        ]
-        
-        # If we have custom EFI image, add it as appended partition
-        if efi_img.exists():
-            xorriso_cmd.extend([
-                '-appended_part_as_gpt',
-                f'-append_partition', '2', 'EFI', str(efi_img)
-            ])
+        # Our efiboot.img is only used by the generic fallback
+        xorriso_cmd = BuildRecipe(self.ubuntu_iso, output_iso, source_dir=extract_dir,
+                                  volume_id='Custom-Ubuntu-24.04.2-Working', checksums=['md5', 'sha1'],
+                                  esp_image=efi_img).compile()
             
         print("🔨 Running Ubuntu's complex xorriso command...")
         print(f"Command: {' '.join(xorriso_cmd[:10])}... ({len(xorriso_cmd)} parameters)")